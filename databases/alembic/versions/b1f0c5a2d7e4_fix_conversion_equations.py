@@ -0,0 +1,38 @@
+"""Fix conversion equations
+
+Revision ID: b1f0c5a2d7e4
+Revises: e0cbc8ddcb68
+Create Date: 2026-10-19 13:41:08.527310
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1f0c5a2d7e4'
+down_revision = 'e0cbc8ddcb68'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Equations of the default conversions that couldn't be evaluated
+    op.execute(
+        '''
+        UPDATE conversion
+        SET equation='x*1000'
+        WHERE convert_unit_from='GB' AND convert_unit_to='MB' AND equation='X*1000'
+        '''
+    )
+
+    op.execute(
+        '''
+        UPDATE conversion
+        SET equation='(x*9/5)-459.67'
+        WHERE convert_unit_from='K' AND convert_unit_to='F' AND equation='(x*9/5)−459.67'
+        '''
+    )
+
+
+def downgrade():
+    pass
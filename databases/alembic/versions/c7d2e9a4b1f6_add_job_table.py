@@ -0,0 +1,43 @@
+"""Add job table
+
+Revision ID: c7d2e9a4b1f6
+Revises: b1f0c5a2d7e4
+Create Date: 2026-10-19 16:02:45.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2e9a4b1f6'
+down_revision = 'b1f0c5a2d7e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'job',
+        sa.Column('id', sa.Integer, nullable=False, unique=True),
+        sa.Column('unique_id', sa.String, nullable=False, unique=True),
+        sa.Column('task', sa.Text),
+        sa.Column('name', sa.Text),
+        sa.Column('kwargs', sa.Text),
+        sa.Column('status', sa.Text),
+        sa.Column('progress_done', sa.Float),
+        sa.Column('progress_total', sa.Float),
+        sa.Column('message', sa.Text),
+        sa.Column('result', sa.Text),
+        sa.Column('error', sa.Text),
+        sa.Column('cancel_requested', sa.Boolean),
+        sa.Column('time_created', sa.Float),
+        sa.Column('time_started', sa.Float),
+        sa.Column('time_finished', sa.Float),
+        sa.Column('time_eta', sa.Float),
+        sa.PrimaryKeyConstraint('id'),
+        keep_existing=True)
+
+
+def downgrade():
+    op.drop_table('job')
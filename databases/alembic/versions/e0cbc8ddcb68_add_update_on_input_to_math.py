@@ -0,0 +1,33 @@
+"""Add update_on_input to math
+
+Revision ID: e0cbc8ddcb68
+Revises: 706a32b64ba2
+Create Date: 2026-10-19 10:12:31.402917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e0cbc8ddcb68'
+down_revision = '706a32b64ba2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("math") as batch_op:
+        batch_op.add_column(sa.Column('update_on_input', sa.Boolean))
+
+    op.execute(
+        '''
+        UPDATE math
+        SET update_on_input=0
+        '''
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("math") as batch_op:
+        batch_op.drop_column('update_on_input')
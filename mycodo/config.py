@@ -14,7 +14,7 @@ sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 from config_translations import TRANSLATIONS
 
 MYCODO_VERSION = '8.8.8'
-ALEMBIC_VERSION = '706a32b64ba2'
+ALEMBIC_VERSION = 'c7d2e9a4b1f6'
 
 #  FORCE_UPGRADE_MASTER
 #  Set True to enable upgrading to the master branch of the Mycodo repository.
@@ -879,6 +879,9 @@ USAGE_REPORTS_PATH = os.path.join(INSTALL_DIRECTORY, 'output_usage_reports')
 DEPENDENCY_INIT_FILE = os.path.join(INSTALL_DIRECTORY, '.dependency')
 UPGRADE_INIT_FILE = os.path.join(INSTALL_DIRECTORY, '.upgrade')
 BACKUP_PATH = '/var/Mycodo-backups'  # Where Mycodo backups are stored
+# Files and directories of the install directory not included in backups
+BACKUP_EXCLUDE = ['cameras', 'env']
+BACKUP_CHUNK_SIZE = 1048576  # Bytes of files stored (and deduplicated) together in backups
 
 # Log files
 LOG_PATH = '/var/log/mycodo'  # Where generated logs are stored
@@ -912,6 +915,15 @@ PATH_CAMERAS = os.path.join(INSTALL_DIRECTORY, 'cameras')
 # Notes
 PATH_NOTE_ATTACHMENTS = os.path.join(INSTALL_DIRECTORY, 'note_attachments')
 
+# Progress of Math and Conversion backfills
+PATH_BACKFILL = os.path.join(DATABASE_PATH, 'backfill')
+
+# Progress of measurement database imports
+PATH_INFLUXDB_IMPORT = os.path.join(DATABASE_PATH, 'influxdb_import.json')
+
+# Full and incremental backups of the measurement database
+PATH_INFLUXDB_BACKUPS = os.path.join(INSTALL_DIRECTORY, 'influx_backups')
+
 # Determine if running in a Docker container
 if os.environ.get('DOCKER_CONTAINER', False) == 'TRUE':
     DOCKER_CONTAINER = True
@@ -945,6 +957,92 @@ ID_FILE = os.path.join(DATABASE_PATH, 'statistics.id')
 LOGIN_ATTEMPTS = 5
 LOGIN_BAN_SECONDS = 600  # 10 minutes
 
+# Web UI user/API key authentication cache (per web server worker)
+AUTH_CACHE_SIZE = 256
+AUTH_CACHE_TTL = 300  # 5 minutes
+
+# Web UI cache of device measurement units/channels (per web server worker)
+MEASUREMENT_RESOLVER_TTL = 300  # 5 minutes
+
+# Batched writing of measurements received by the API (per web server worker)
+INFLUX_WRITE_BATCH_SIZE = 5000
+INFLUX_WRITE_INTERVAL = 1.0  # Seconds
+INFLUX_WRITE_QUEUE_MAX = 100000  # Points waiting to be written
+# Maximum number of measurements in one bulk API request
+API_BULK_MEASUREMENTS_MAX = 10000
+# Maximum number of measurements in one page of historical measurements
+API_HISTORICAL_LIMIT_MAX = 100000
+# Rows per chunk of streamed influxdb query responses
+INFLUXDB_CHUNK_SIZE = 10000
+# Seconds of measurements recalculated (and checkpointed) at a time by backfills
+BACKFILL_CHUNK_SECONDS = 21600
+# Seconds of measurements copied per query, and queries run at once, by InfluxDB imports
+INFLUXDB_IMPORT_CHUNK_SECONDS = 86400
+INFLUXDB_IMPORT_WORKERS = 2
+# Seconds between full measurement backups (incremental backups in between), and
+# seconds a chain of backups is kept after its last backup (the latest is always kept)
+INFLUXDB_BACKUP_FULL_INTERVAL = 604800  # 7 days
+INFLUXDB_BACKUP_RETENTION = 2419200  # 28 days
+
+# Background jobs of the web interface: jobs run at once, seconds between checks
+# for queued jobs, seconds between saves of progress, and finished jobs kept
+JOB_WORKERS = 2
+JOB_POLL_INTERVAL = 5
+JOB_PROGRESS_INTERVAL = 1.0
+JOB_HISTORY = 50
+
+# Log viewer: bytes read at a time, records of a log matching a filter kept in its
+# index, the most bytes returned when following a log (more restarts at the end),
+# and the most lines that may be requested
+LOG_READ_CHUNK_SIZE = 65536
+LOG_INDEX_RECORDS = 10000
+LOG_FOLLOW_MAX_BYTES = 1048576
+LOG_LINES_MAX = 10000
+
+# Maximum number of thermal camera frames returned for animation
+THERMAL_MAX_FRAMES = 3600
+
+# Seconds between duty cycle updates of Output PWM ramps
+OUTPUT_RAMP_PERIOD = 0.1
+
+# Function Action executor: worker threads per category of slow action
+ACTION_EXECUTOR_WORKERS = {
+    'camera': 1,
+    'default': 4
+}
+# Seconds to collect email notifications before sending them together
+EMAIL_BATCH_SECONDS = 2
+# Seconds an idle SMTP connection is kept open for reuse
+SMTP_IDLE_TIMEOUT = 60
+# Seconds to wait for an SMTP server to respond
+SMTP_TIMEOUT = 30
+
+# Number of pulse times kept by each GPIO pulse counter
+PULSE_RING_SIZE = 1024
+
+# Maximum seconds to wait for a 1-Wire bus temperature conversion
+W1_CONVERSION_TIMEOUT = 2
+
+# Seconds each Bluetooth adapter scans for advertisements between queued connections
+BLE_SCAN_WINDOW = 1.0
+# Maximum seconds an Input waits for its queued Bluetooth connection, and the connection may take
+BLE_GATT_TIMEOUT = 300
+# The same, for a connection that downloads the stored history of a device
+BLE_HISTORY_DOWNLOAD_TIMEOUT = 3600
+# Seconds an adapter waits for a connection that took too long to end once aborted
+BLE_GATT_ABORT_WAIT = 10
+
+# Seconds between the measurements of Inputs on the same I2C bus with the same period
+I2C_STAGGER_SECONDS = 0.5
+# Seconds a measurement of an I2C device may be shared with Inputs of the same device
+I2C_COALESCE_SECONDS = 1.0
+# Maximum seconds an Input waits for its turn on an I2C bus
+I2C_BUS_TIMEOUT = 60
+# Seconds a Math that updates on input waits for its other inputs to update
+MATH_UPDATE_DEBOUNCE = 0.1
+# Seconds a measurement statistics window is kept after it was last queried
+STATS_STREAM_IDLE = 3600
+
 # Check for upgrade every 2 days (if enabled)
 UPGRADE_CHECK_INTERVAL = 172800
 
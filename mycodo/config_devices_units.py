@@ -474,7 +474,7 @@ UNIT_CONVERSIONS = [
     ('F', 'C', '(x-32)*5/9'),
     ('F', 'K', '(x+459.67)*5/9'),
     ('K', 'C', 'x-273.15'),
-    ('K', 'F', '(x*9/5)−459.67'),
+    ('K', 'F', '(x*9/5)-459.67'),
 
     # Frequency
     ('Hz', 'kHz', 'x/1000'),
@@ -500,7 +500,7 @@ UNIT_CONVERSIONS = [
     ('MB', 'kB', 'x*1000'),
     ('MB', 'GB', 'x/1000'),
     ('GB', 'kB', 'x*1000000'),
-    ('GB', 'MB', 'X*1000'),
+    ('GB', 'MB', 'x*1000'),
 
     # Concentration
     ('ppm', 'ppb', 'x*1000'),
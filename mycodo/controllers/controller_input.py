@@ -36,6 +36,8 @@ from mycodo.databases.models import SMTP
 from mycodo.databases.models import Trigger
 from mycodo.mycodo_client import DaemonControl
 from mycodo.utils.database import db_retrieve_table_daemon
+from mycodo.utils.i2c_arbiter import I2CDevice
+from mycodo.utils.i2c_arbiter import i2c_arbiter
 from mycodo.utils.influx import add_measurements_influxdb
 from mycodo.utils.influx import parse_measurement
 from mycodo.utils.influx import write_influxdb_value
@@ -121,6 +123,7 @@ class InputController(AbstractController, threading.Thread):
         self.allowed_to_send_notice = None
 
         self.i2c_address = None
+        self.i2c_device = None
         self.switch_edge_gpio = None
         self.measure_input = None
         self.device_recognized = None
@@ -237,6 +240,9 @@ class InputController(AbstractController, threading.Thread):
         self.trigger_cond = False
 
     def run_finally(self):
+        if self.i2c_device:
+            i2c_arbiter.unregister(self.i2c_device, self.unique_id)
+
         if self.device == 'EDGE':
             try:
                 import RPi.GPIO as GPIO
@@ -309,6 +315,14 @@ class InputController(AbstractController, threading.Thread):
         # Convert string I2C address to base-16 int
         if self.interface == 'I2C':
             self.i2c_address = int(str(self.input_dev.i2c_location), 16)
+            # Share the bus with other Inputs, offsetting measurements from theirs
+            self.i2c_device = I2CDevice(
+                self.input_dev.i2c_bus,
+                self.i2c_address,
+                self.device,
+                tuple(sorted(each.channel for each in self.device_measurements.all() if each.is_enabled)))
+            self.next_measurement += i2c_arbiter.register(
+                self.i2c_device, self.unique_id, self.period)
 
         # Set up edge detection of a GPIO pin
         if self.device == 'EDGE':
@@ -388,7 +402,10 @@ class InputController(AbstractController, threading.Thread):
 
         try:
             # Get measurement from input
-            measurements = self.measure_input.next()
+            if self.i2c_device:
+                measurements = i2c_arbiter.measure(self.i2c_device, self.measure_input.next)
+            else:
+                measurements = self.measure_input.next()
             # Reset StopIteration counter on successful read
             if self.stop_iteration_counter:
                 self.stop_iteration_counter = 0
@@ -25,11 +25,11 @@
 import threading
 import time
 from statistics import median
-from statistics import stdev
 
 import urllib3
 
 import mycodo.utils.psypy as SI
+from mycodo.config import MATH_UPDATE_DEBOUNCE
 from mycodo.controllers.base_controller import AbstractController
 from mycodo.databases.models import Conversion
 from mycodo.databases.models import DeviceMeasurements
@@ -39,10 +39,18 @@ from mycodo.inputs.sensorutils import calculate_vapor_pressure_deficit
 from mycodo.inputs.sensorutils import convert_units
 from mycodo.mycodo_client import DaemonControl
 from mycodo.utils.database import db_retrieve_table_daemon
+from mycodo.utils.expression import ExpressionError
+from mycodo.utils.expression import compile_expression
+from mycodo.utils.expression import math_equation_variables
 from mycodo.utils.influx import add_measurements_influxdb
 from mycodo.utils.influx import average_past_seconds
 from mycodo.utils.influx import read_last_influxdb
 from mycodo.utils.influx import sum_past_seconds
+from mycodo.utils.stream_stats import RunningStats
+from mycodo.utils.stream_stats import epoch_to_influx_time
+from mycodo.utils.stream_stats import influx_time_to_epoch
+from mycodo.utils.stream_stats import latest_values
+from mycodo.utils.stream_stats import stream_key
 from mycodo.utils.system_pi import get_measurement
 from mycodo.utils.system_pi import return_measurement_info
 
@@ -93,8 +101,13 @@ class MathController(AbstractController, threading.Thread):
         self.period = None
         self.start_offset = None
         self.max_measure_age = None
+        self.update_on_input = None
         self.log_level_debug = None
 
+        # Measurement streams of the inputs, by measurement ID
+        self.input_streams = {}
+        self.input_updated = None
+
         # Inputs to calculate with
         self.inputs = None
 
@@ -141,8 +154,24 @@ class MathController(AbstractController, threading.Thread):
             # Ensure the next timer ends in the future
             while time.time() > self.timer:
                 self.timer += self.period
+            self.input_updated = None
+            self.attempt_execute(self.calculate_math)
+
+        elif (self.is_activated and self.input_updated and
+                time.time() - self.input_updated >= MATH_UPDATE_DEBOUNCE):
+            # Calculate once for inputs measured together
+            self.input_updated = None
             self.attempt_execute(self.calculate_math)
 
+    def run_finally(self):
+        if self.update_on_input:
+            latest_values.unsubscribe(self.input_streams.values(), self.input_measured)
+
+    def input_measured(self, key):
+        """ Called when an input is measured, if updating on input """
+        if self.input_updated is None:
+            self.input_updated = time.time()
+
     def initialize_variables(self):
         self.sample_rate = db_retrieve_table_daemon(
             Misc, entry='first').sample_rate_controller_math
@@ -161,6 +190,7 @@ class MathController(AbstractController, threading.Thread):
         self.period = math.period
         self.start_offset = math.start_offset
         self.max_measure_age = math.max_measure_age
+        self.update_on_input = math.update_on_input
         self.log_level_debug = math.log_level_debug
 
         self.set_log_level_debug(self.log_level_debug)
@@ -200,6 +230,83 @@ class MathController(AbstractController, threading.Thread):
 
         self.set_log_level_debug(self.log_level_debug)
 
+        # Math outputs are also written to the store, so Maths using other
+        # Maths update as soon as those are calculated
+        for device_id, measurement_id in self.input_measurement_ids():
+            key = self.input_stream(device_id, measurement_id)
+            if key:
+                self.input_streams[measurement_id] = key
+        if self.update_on_input:
+            latest_values.subscribe(self.input_streams.values(), self.input_measured)
+
+    def input_measurement_ids(self):
+        """ Return the (device ID, measurement ID) of each measurement the Math uses """
+        ids = []
+        for each_str in [self.inputs, self.equation_input, self.order_of_use]:
+            for each_set in (each_str or '').split(';'):
+                if ',' in each_set:
+                    ids.append(tuple(each_set.split(',')[:2]))
+        for device_id, measurement_id in [
+                (self.dry_bulb_t_id, self.dry_bulb_t_measure_id),
+                (self.wet_bulb_t_id, self.wet_bulb_t_measure_id),
+                (self.pressure_pa_id, self.pressure_pa_measure_id),
+                (self.unique_id_1, self.unique_measurement_id_1),
+                (self.unique_id_2, self.unique_measurement_id_2)]:
+            if device_id and measurement_id:
+                ids.append((device_id, measurement_id))
+        return ids
+
+    def input_stream(self, device_id, measurement_id):
+        """ Return the stream key of an input measurement, or None if it doesn't exist """
+        if measurement_id in self.input_streams:
+            return self.input_streams[measurement_id]
+        device_measurement = get_measurement(measurement_id)
+        if not device_measurement:
+            return
+        conversion = db_retrieve_table_daemon(
+            Conversion, unique_id=device_measurement.conversion_id)
+        channel, unit, measurement = return_measurement_info(
+            device_measurement, conversion)
+        return stream_key(device_id, unit, channel, measurement)
+
+    def latest_measurements(self, id_sets):
+        """
+        Return the latest [time, value] of each (device ID, measurement ID) within
+        Max Age, or None if not found. Maths updated on input read the values
+        from the store of the latest measurements. Only measurements written
+        by the daemon are stored, not e.g. those written with the API, so
+        values older than a period are read from influxdb, as are all values
+        of other Maths.
+        """
+        keys = [self.input_stream(device_id, measurement_id)
+                for device_id, measurement_id in id_sets]
+        found = [None] * len(keys)
+        if self.update_on_input:
+            max_ages = [each for each in (self.period, self.max_measure_age) if each]
+            stored = latest_values.get(
+                [each for each in keys if each], min(max_ages) if max_ages else None)
+        else:
+            stored = [None] * len([each for each in keys if each])
+        for index, each_key in enumerate(keys):
+            if not each_key:
+                continue
+            latest = stored.pop(0)
+            if latest is None:
+                device_id, unit, channel, measurement = each_key
+                last_measurement = read_last_influxdb(
+                    device_id,
+                    unit,
+                    channel,
+                    measure=measurement,
+                    duration_sec=self.max_measure_age)
+                epoch = influx_time_to_epoch(last_measurement[0]) if last_measurement else None
+                if epoch is None:
+                    continue
+                latest = (epoch, last_measurement[1])
+                latest_values.set(each_key, *latest)
+            found[index] = [epoch_to_influx_time(latest[0]), latest[1]]
+        return found
+
     def calculate_math(self):
         measurement_dict = {}
 
@@ -393,14 +500,28 @@ class MathController(AbstractController, threading.Thread):
     def math_equation(self, measurement_dict):
         channel, unit, measurement = self.return_single_conversion_info()
 
-        success, measure = self.get_measurements_from_str(
-            self.equation_input)
+        variables = math_equation_variables(self.equation_input, self.inputs)
+        try:
+            expression = compile_expression(
+                self.equation, tuple(variable for variable, _ in variables))
+        except ExpressionError as err:
+            self.logger.error(err)
+            return measurement_dict
+
+        used = [(variable, id_set) for variable, id_set in variables
+                if variable in expression.variables]
+        if used:
+            success, measure = self.get_measurements_from_str(
+                ';'.join(id_set for _, id_set in used))
+        else:
+            success, measure = True, []
         if success:
-            if 'x' in self.equation:
-                replaced_str = self.equation.replace('x', str(measure[0]))
-            else:
-                replaced_str = self.equation
-            equation_output = eval(replaced_str)
+            try:
+                equation_output = expression(
+                    **{variable: value for (variable, _), value in zip(used, measure)})
+            except (ArithmeticError, ValueError) as err:
+                self.logger.error("Equation '{eq}': {err}".format(eq=self.equation, err=err))
+                return measurement_dict
 
             measurement_dict = {
                 channel: {
@@ -461,13 +582,17 @@ class MathController(AbstractController, threading.Thread):
         success, measure = self.get_measurements_from_str(self.inputs)
         if success:
             # Perform some math
-            stat_mean = float(sum(measure) / float(len(measure)))
+            stats = RunningStats(measure)
+            stat_mean = stats.mean
             stat_median = median(measure)
             stat_minimum = min(measure)
             stat_maximum = max(measure)
-            stdev_ = stdev(measure)
-            stdev_mean_upper = stat_mean + stdev_
-            stdev_mean_lower = stat_mean - stdev_
+            stdev_ = stats.stdev()
+            if stdev_ is None:  # Fewer than 2 measurements
+                stdev_mean_upper = stdev_mean_lower = None
+            else:
+                stdev_mean_upper = stat_mean + stdev_
+                stdev_mean_lower = stat_mean - stdev_
 
             list_measurement = [
                 stat_mean,
@@ -754,55 +879,18 @@ class MathController(AbstractController, threading.Thread):
 
     def get_measurements_from_str(self, device):
         try:
-            measurements = []
-            device_list = device.split(';')
-            for each_device_set in device_list:
-                device_id = each_device_set.split(',')[0]
-                device_measure_id = each_device_set.split(',')[1]
-
-                device_measurement = get_measurement(
-                    device_measure_id)
-                if not device_measurement:
-                    return False, None
-
-                conversion = db_retrieve_table_daemon(
-                    Conversion, unique_id=device_measurement.conversion_id)
-                channel, unit, measurement = return_measurement_info(
-                    device_measurement, conversion)
-
-                last_measurement = read_last_influxdb(
-                    device_id,
-                    unit,
-                    channel,
-                    measure=measurement,
-                    duration_sec=self.max_measure_age)
-
-                if not last_measurement:
-                    return False, None
-                else:
-                    measurements.append(last_measurement[1])
-            return True, measurements
+            id_sets = [each_set.split(',')[:2] for each_set in device.split(';')]
+            measurements = self.latest_measurements(id_sets)
+            if None in measurements:
+                return False, None
+            return True, [each_measurement[1] for each_measurement in measurements]
         except urllib3.exceptions.NewConnectionError:
             return False, "Influxdb: urllib3.exceptions.NewConnectionError"
         except Exception as msg:
             return False, "Influxdb: Unknown Error: {err}".format(err=msg)
 
     def get_measurements_from_id(self, device_id, measure_id):
-        device_measurement = get_measurement(measure_id)
-        if not device_measurement:
-            return False, None
-
-        conversion = db_retrieve_table_daemon(
-            Conversion, unique_id=device_measurement.conversion_id)
-        channel, unit, measurement = return_measurement_info(
-            device_measurement, conversion)
-
-        measure = read_last_influxdb(
-            device_id,
-            unit,
-            channel,
-            measure=measurement,
-            duration_sec=self.max_measure_age)
+        measure = self.latest_measurements([(device_id, measure_id)])[0]
         if not measure:
             return False, None
         return True, measure
@@ -33,6 +33,8 @@ from mycodo.databases.models import SMTP
 from mycodo.mycodo_client import DaemonControl
 from mycodo.utils.database import db_retrieve_table_daemon
 from mycodo.utils.modules import load_module_from_file
+from mycodo.utils.output_ramp import PWMRamp
+from mycodo.utils.output_ramp import RampScheduler
 from mycodo.utils.outputs import output_types
 from mycodo.utils.outputs import parse_output_information
 
@@ -66,9 +68,12 @@ class OutputController(AbstractController, threading.Thread):
         self.output_type = {}
         self.output_types = {}
 
+        self.ramps = RampScheduler(self.set_ramp_duty_cycle)
+
     def initialize_variables(self):
         """ Begin initializing output parameters """
         self.sample_rate = db_retrieve_table_daemon(Misc, entry='first').sample_rate_controller_output
+        self.ramps.start()
 
         self.logger.debug("Initializing Outputs")
         try:
@@ -115,6 +120,8 @@ class OutputController(AbstractController, threading.Thread):
 
     def run_finally(self):
         """ Run when the controller is shutting down """
+        self.ramps.stop()
+
         # Turn all outputs to their shutdown state
         for each_output_id in self.output_unique_id:
             shutdown_timer = timeit.default_timer()
@@ -204,6 +211,8 @@ class OutputController(AbstractController, threading.Thread):
         try:
             self.logger.debug("Output {id} Deleted.".format(id=output_id))
 
+            self.ramps.cancel(output_id)
+
             # instruct output to shutdown
             shutdown_timer = timeit.default_timer()
             self.output[output_id].shutdown(shutdown_timer)
@@ -277,6 +286,10 @@ class OutputController(AbstractController, threading.Thread):
         #         self.logger.warning(msg)
         #         return 1, msg
 
+        # A direct command supersedes a ramp in progress on the channel
+        if self.ramps.cancel(output_id, output_channel):
+            self.logger.debug("Output {} CH{} ramp cancelled".format(output_id, output_channel))
+
         return self.output[output_id].output_on_off(
             state,
             output_channel=output_channel,
@@ -285,6 +298,72 @@ class OutputController(AbstractController, threading.Thread):
             min_off=min_off,
             trigger_conditionals=trigger_conditionals)
 
+    def output_ramp(self,
+                    output_id,
+                    output_channel,
+                    start_duty_cycle,
+                    end_duty_cycle,
+                    duration,
+                    curve='linear',
+                    points=None,
+                    increment=None):
+        """
+        Ramp the duty cycle of a PWM output channel. The ramp supersedes any ramp
+        already running on the channel and runs until it completes, is
+        cancelled, or the channel is commanded directly.
+
+        :param output_id: ID for output
+        :type output_id: str
+        :param output_channel: The output channel
+        :type output_channel: int
+        :param start_duty_cycle: Duty cycle to start at (0 - 100)
+        :type start_duty_cycle: float
+        :param end_duty_cycle: Duty cycle to end at (0 - 100)
+        :type end_duty_cycle: float
+        :param duration: Seconds to ramp over
+        :type duration: float
+        :param curve: 'linear' or 'exponential'
+        :type curve: str
+        :param points: Arbitrary curve, as a list of [fraction of duration, fraction of change]
+        :type points: list
+        :param increment: Round duty cycles to multiples of this (None to not round)
+        :type increment: float
+        """
+        if output_id not in self.output:
+            msg = "Output {} not found".format(output_id)
+            self.logger.error(msg)
+            return 1, msg
+
+        try:
+            ramp = PWMRamp(
+                output_id, output_channel, start_duty_cycle, end_duty_cycle, duration,
+                curve=curve, points=points, increment=increment)
+        except ValueError as err:
+            return 1, "Could not ramp output: {}".format(err)
+
+        if self.ramps.add(ramp):
+            self.logger.debug("Output {} CH{} ramp superseded".format(output_id, output_channel))
+        return 0, "Ramping output {} CH{} duty cycle from {}% to {}% over {} seconds".format(
+            output_id, output_channel, start_duty_cycle, end_duty_cycle, duration)
+
+    def output_ramp_cancel(self, output_id, output_channel=None):
+        """ Cancel the ramp of an output channel, leaving the duty cycle where it is """
+        cancelled = self.ramps.cancel(output_id, output_channel)
+        return 0, "Cancelled {} ramp(s)".format(len(cancelled))
+
+    def output_ramps(self):
+        """ Return the status of all running ramps """
+        return self.ramps.status()
+
+    def set_ramp_duty_cycle(self, output_id, output_channel, duty_cycle, finished):
+        """ Set the duty cycle of a ramp step, only triggering conditionals on the last step """
+        self.output[output_id].output_on_off(
+            'on',
+            output_channel=output_channel,
+            output_type='pwm',
+            amount=duty_cycle,
+            trigger_conditionals=finished)
+
     def output_setup(self, action, output_id):
         """ Add, delete, or modify a specific output """
         if action in ['Add', 'Modify']:
@@ -46,6 +46,7 @@ from mycodo.utils.method import calculate_method_setpoint
 from mycodo.utils.sunriseset import calculate_sunrise_sunset_epoch
 from mycodo.utils.system_pi import epoch_of_next_time
 from mycodo.utils.system_pi import time_between_range
+from mycodo.utils.trigger_dispatch import output_triggers
 
 MYCODO_DB_PATH = 'sqlite:///' + SQL_DATABASE_MYCODO
 
@@ -98,6 +99,8 @@ class TriggerController(AbstractController, threading.Thread):
         self.method_start_time = None
         self.method_end_time = None
         self.method_start_act = None
+        self.device = None
+        self.device_type = None
 
         # Infrared remote input
         self.lirc = None
@@ -162,7 +165,7 @@ class TriggerController(AbstractController, threading.Thread):
                 self.attempt_execute(self.check_triggers)
 
     def run_finally(self):
-        pass
+        output_triggers.invalidate()
 
     def refresh_settings(self):
         """ Signal to pause the main loop and wait for verification, the refresh settings """
@@ -197,6 +200,12 @@ class TriggerController(AbstractController, threading.Thread):
 
         self.set_log_level_debug(self.log_level_debug)
 
+        # Resolve the device the trigger measures once, rather than each time it fires
+        self.device_type, self.device = self.find_device(self.trigger.measurement)
+
+        # Output Triggers are dispatched by the Output controller
+        output_triggers.invalidate()
+
         now = time.time()
         self.smtp_wait_timer = now + 3600
         self.timer_period = None
@@ -266,6 +275,26 @@ class TriggerController(AbstractController, threading.Thread):
             # Set the next trigger at the specified sunrise/sunset time (+-offsets)
             self.timer_period = calculate_sunrise_sunset_epoch(self.trigger)
 
+    @staticmethod
+    def find_device(measurement):
+        """
+        Find the Input, Math, Output, or PID a trigger measurement belongs to
+
+        :return: (device type, device), or (None, None) if not found
+        """
+        if not measurement:
+            return None, None
+        device_id = measurement.split(',')[0]
+        for device_type, table in [('Input', Input),
+                                   ('Math', Math),
+                                   ('Output', Output),
+                                   ('PID', PID)]:
+            device = db_retrieve_table_daemon(
+                table, unique_id=device_id, entry='first')
+            if device:
+                return device_type, device
+        return None, None
+
     def start_method(self, method_id):
         """ Instruct a method to start running """
         if method_id:
@@ -361,39 +390,9 @@ class TriggerController(AbstractController, threading.Thread):
             name=self.trigger_name,
             id=self.unique_id)
 
-        trigger = db_retrieve_table_daemon(
-            Trigger, unique_id=self.unique_id, entry='first')
-
-        device_id = trigger.measurement.split(',')[0]
-
-        # if len(trigger.measurement.split(',')) > 1:
-        #     device_measurement = trigger.measurement.split(',')[1]
-        # else:
-        #     device_measurement = None
-
-        device = None
-
-        input_dev = db_retrieve_table_daemon(
-            Input, unique_id=device_id, entry='first')
-        if input_dev:
-            device = input_dev
-
-        math = db_retrieve_table_daemon(
-            Math, unique_id=device_id, entry='first')
-        if math:
-            device = math
-
-        output = db_retrieve_table_daemon(
-            Output, unique_id=device_id, entry='first')
-        if output:
-            device = output
-
-        pid = db_retrieve_table_daemon(
-            PID, unique_id=device_id, entry='first')
-        if pid:
-            device = pid
+        trigger = self.trigger
 
-        if not device:
+        if trigger.measurement and not self.device:
             message += " Error: Controller not Input, Math, Output, or PID"
             self.logger.error(message)
             return
@@ -401,12 +400,12 @@ class TriggerController(AbstractController, threading.Thread):
         # If the edge detection variable is set, calling this function will
         # trigger an edge detection event. This will merely produce the correct
         # message based on the edge detection settings.
-        elif trigger.trigger_type == 'trigger_edge':
+        if trigger.trigger_type == 'trigger_edge':
             try:
                 import RPi.GPIO as GPIO
                 GPIO.setmode(GPIO.BCM)
-                GPIO.setup(int(input_dev.pin), GPIO.IN)
-                gpio_state = GPIO.input(int(input_dev.pin))
+                GPIO.setup(int(self.device.pin), GPIO.IN)
+                gpio_state = GPIO.input(int(self.device.pin))
             except Exception as e:
                 gpio_state = None
                 self.logger.error("Exception reading the GPIO pin: {}".format(e))
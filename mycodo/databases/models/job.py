@@ -0,0 +1,29 @@
+# coding=utf-8
+from mycodo.databases import CRUDMixin
+from mycodo.databases import set_uuid
+from mycodo.mycodo_flask.extensions import db
+
+
+class Job(CRUDMixin, db.Model):
+    __tablename__ = "job"
+    __table_args__ = {'extend_existing': True}
+
+    id = db.Column(db.Integer, unique=True, primary_key=True)
+    unique_id = db.Column(db.String, nullable=False, unique=True, default=set_uuid)
+    task = db.Column(db.Text, default=None)  # Name of the registered task the job runs
+    name = db.Column(db.Text, default=None)
+    kwargs = db.Column(db.Text, default='{}')  # JSON arguments of the task
+    status = db.Column(db.Text, default='queued')
+    progress_done = db.Column(db.Float, default=0)
+    progress_total = db.Column(db.Float, default=None)
+    message = db.Column(db.Text, default=None)
+    result = db.Column(db.Text, default=None)  # JSON value returned by the task
+    error = db.Column(db.Text, default=None)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    time_created = db.Column(db.Float, default=None)
+    time_started = db.Column(db.Float, default=None)
+    time_finished = db.Column(db.Float, default=None)
+    time_eta = db.Column(db.Float, default=None)  # Estimated epoch the job finishes
+
+    def __repr__(self):
+        return "<{cls}(id={s.id})>".format(s=self, cls=self.__class__.__name__)
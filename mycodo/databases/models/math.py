@@ -19,6 +19,7 @@ class Math(CRUDMixin, db.Model):
     period = db.Column(db.Float, default=15.0)  # Duration between readings
     start_offset = db.Column(db.Float, default=10.0)
     max_measure_age = db.Column(db.Integer, default=60)
+    update_on_input = db.Column(db.Boolean, default=False)  # Calculate when an input is measured
 
     # Backup options
     order_of_use = db.Column(db.Text, default='')
@@ -5,6 +5,9 @@ import copy
 from flask_babel import lazy_gettext
 
 from mycodo.inputs.base_input import AbstractInput
+from mycodo.utils.adc_acquisition import ADCAcquisition
+from mycodo.utils.adc_acquisition import ADC_FILTER_OPTIONS
+from mycodo.utils.adc_acquisition import ADC_SAMPLES_OPTION
 
 # Measurements
 measurements_dict = OrderedDict()
@@ -36,6 +39,7 @@ INPUT_INFORMATION = {
     'options_disabled': ['interface'],
 
     'dependencies_module': [
+        ('apt', 'python3-numpy', 'python3-numpy'),
         ('pip-pypi', 'wiringpi', 'wiringpi'),
         ('pip-pypi', 'pipyadc_py3', 'git+https://github.com/kizniche/PiPyADC-py3.git')  # PiPyADC ported to Python3
     ],
@@ -84,8 +88,9 @@ INPUT_INFORMATION = {
             ],
             'name': lazy_gettext('Calibration'),
             'phrase': lazy_gettext('Set the calibration method to perform during Input activation')
-        }
-    ],
+        },
+        ADC_SAMPLES_OPTION
+    ] + ADC_FILTER_OPTIONS,
 }
 
 
@@ -99,7 +104,12 @@ class InputModule(AbstractInput):
         self.adc_gain = None
         self.adc_sample_speed = None
 
+        self.acquisition = None
         self.adc_calibration = None
+        self.adc_samples = None
+        self.adc_sample_rate = None
+        self.adc_filter = None
+        self.adc_filter_window = None
         self.setup_custom_options(
             INPUT_INFORMATION['custom_options'], input_dev)
 
@@ -141,11 +151,13 @@ class InputModule(AbstractInput):
         }
 
         # Generate the channel sequence for enabled channels
-        self.CH_SEQUENCE = []
-        for channel in self.channels_measurement:
-            if self.is_enabled(channel):
-                self.CH_SEQUENCE.append(channels[channel])
-        self.CH_SEQUENCE = tuple(self.CH_SEQUENCE)
+        self.acquisition = ADCAcquisition(
+            [channel for channel in self.channels_measurement if self.is_enabled(channel)],
+            samples=self.adc_samples,
+            rate=self.adc_sample_rate,
+            filter_type=self.adc_filter,
+            window=self.adc_filter_window)
+        self.CH_SEQUENCE = tuple(channels[channel] for channel in self.acquisition.channels)
 
         self.adc_gain = self.input_dev.adc_gain
         self.adc_sample_speed = self.input_dev.adc_sample_speed
@@ -169,6 +181,15 @@ class InputModule(AbstractInput):
             raise Exception(
                 "SPI device /dev/spi* not found. Ensure SPI is enabled and the device is recognized/setup by linux.")
 
+    def read_channels(self):
+        """ Read all enabled channels (2 attempts to get valid measurements) """
+        for _ in range(2):
+            raw_channels = self.sensor.read_sequence(self.CH_SEQUENCE)
+            voltages_list = [i * self.sensor.v_per_digit for i in raw_channels]
+            if 0 not in voltages_list:
+                return voltages_list
+        raise ValueError("ADC returned measurement of 0 (indicating something is wrong).")
+
     def get_measurement(self):
         if not self.sensor:
             self.logger.error("Input not set up")
@@ -176,22 +197,13 @@ class InputModule(AbstractInput):
 
         self.return_dict = copy.deepcopy(measurements_dict)
 
-        # 2 attempts to get valid measurement
-        voltages_list = []
-        for _ in range(2):
-            raw_channels = self.sensor.read_sequence(self.CH_SEQUENCE)
-            voltages_list = [i * self.sensor.v_per_digit for i in raw_channels]
-            if 0 not in voltages_list:
-                break
-
-        if not voltages_list or 0 in voltages_list:
-            self.logger.error("ADC returned measurement of 0 (indicating something is wrong).")
+        try:
+            values = self.acquisition.acquire(self.read_channels)
+        except ValueError as err:
+            self.logger.error(err)
             return
 
-        index = 0
-        for channel in self.channels_measurement:
-            if self.is_enabled(channel):
-                self.value_set(channel, voltages_list[index])
-                index += 1
+        for channel, value in values.items():
+            self.value_set(channel, value)
 
         return self.return_dict
@@ -6,6 +6,8 @@ import copy
 from flask_babel import lazy_gettext
 
 from mycodo.inputs.base_input import AbstractInput
+from mycodo.utils.adc_acquisition import ADCAcquisition
+from mycodo.utils.adc_acquisition import ADC_FILTER_OPTIONS
 
 
 def constraints_pass_measurement_repetitions(mod_input, value):
@@ -58,6 +60,7 @@ INPUT_INFORMATION = {
     'options_disabled': ['interface'],
 
     'dependencies_module': [
+        ('apt', 'python3-numpy', 'python3-numpy'),
         ('pip-pypi', 'Adafruit_GPIO', 'Adafruit_GPIO'),
         ('pip-pypi', 'Adafruit_ADS1x15', 'Adafruit_ADS1x15')
     ],
@@ -80,9 +83,9 @@ INPUT_INFORMATION = {
             'constraints_pass': constraints_pass_measurement_repetitions,
             'name': lazy_gettext('Measurements to Average'),
             'phrase': lazy_gettext(
-                'The number of times to measure each channel. An average of the measurements will be stored.')
+                'The number of times to measure each channel. The filtered measurements will be stored.')
         },
-    ]
+    ] + ADC_FILTER_OPTIONS
 }
 
 
@@ -114,7 +117,11 @@ class InputModule(AbstractInput):
             16: 0.0078125,
         }
 
+        self.acquisition = None
         self.measurements_for_average = None
+        self.adc_sample_rate = None
+        self.adc_filter = None
+        self.adc_filter_window = None
         self.setup_custom_options(
             INPUT_INFORMATION['custom_options'], input_dev)
 
@@ -133,32 +140,30 @@ class InputModule(AbstractInput):
             address=int(str(self.input_dev.i2c_location), 16),
             busnum=self.input_dev.i2c_bus)
 
+        self.acquisition = ADCAcquisition(
+            [channel for channel in self.channels_measurement if self.is_enabled(channel)],
+            samples=self.measurements_for_average,
+            rate=self.adc_sample_rate,
+            filter_type=self.adc_filter,
+            window=self.adc_filter_window)
+
     def get_measurement(self):
+        if not self.acquisition:
+            self.logger.error("Input not set up")
+            return
+
         self.return_dict = copy.deepcopy(measurements_dict)
 
-        measurement_range = 1
-        if self.measurements_for_average:
-            measurement_range = self.measurements_for_average
+        def read_channels():
+            return [self.adc.read_adc(channel, gain=self.adc_gain) * self.dict_gains[self.adc_gain] / 1000.0
+                    for channel in self.acquisition.channels]
 
-        # Conduct multiple measurements for averaging
-        measurement_totals = {}
         time_start = timeit.default_timer()
-        for _ in range(measurement_range):
-            for channel in self.channels_measurement:
-                if self.is_enabled(channel):
-                    if channel not in measurement_totals:
-                        measurement_totals[channel] = 0
-                    measurement_totals[channel] += (
-                        self.adc.read_adc(channel, gain=self.adc_gain) * self.dict_gains[self.adc_gain] / 1000.0)
-
+        values = self.acquisition.acquire(read_channels)
         self.logger.debug("All measurements completed in {:.3f} seconds".format(
             timeit.default_timer() - time_start))
 
-        # Store average measurement for each channel
-        for channel in self.channels_measurement:
-            if self.is_enabled(channel):
-                self.value_set(
-                    channel,
-                    measurement_totals[channel] / measurement_range)
+        for channel, value in values.items():
+            self.value_set(channel, value)
 
         return self.return_dict
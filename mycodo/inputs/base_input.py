@@ -20,6 +20,7 @@ from mycodo.databases.models import DeviceMeasurements
 from mycodo.databases.models import Input
 from mycodo.databases.utils import session_scope
 from mycodo.utils.database import db_retrieve_table_daemon
+from mycodo.utils.stream_stats import WindowStats
 
 MYCODO_DB_PATH = 'sqlite:///' + SQL_DATABASE_MYCODO
 
@@ -199,6 +200,10 @@ class AbstractInput(AbstractBaseController):
         """ Not used yet """
         self.running = True
 
+    def status(self):
+        """ Runtime status of the Input, for Inputs that report one """
+        return {}
+
     def stop_input(self):
         """ Called when Input is deactivated """
         self.running = False
@@ -260,32 +265,19 @@ class AbstractInput(AbstractBaseController):
         :param name: name of the measurement
         :param init_max: initialize_measurements variables for this name
         :param measurement: add measurement to pool and return average of past init_max measurements
-        :return: int or float, whichever measurements come in as
+        :return: float
         """
         if name not in self.filter_avg:
-            self.filter_avg[name] = {}
             if init_max < 2:
                 self.logger.error("init_max must be greater than 1")
-            else:
-                self.filter_avg[name]['max'] = init_max
-                self.filter_avg[name]['meas'] = []
-                self.filter_avg[name]['index'] = 0
+                return
+            self.filter_avg[name] = WindowStats(size=init_max)
 
         if measurement is None:
             return
 
-        if 0 <= self.filter_avg[name]['index'] < len(self.filter_avg[name]['meas']):
-            self.filter_avg[name]['meas'][self.filter_avg[name]['index']] = measurement
-        else:
-            self.filter_avg[name]['meas'].append(measurement)
-        average = sum(self.filter_avg[name]['meas']) / float(len(self.filter_avg[name]['meas']))
-
-        if self.filter_avg[name]['index'] >= self.filter_avg[name]['max'] - 1:
-            self.filter_avg[name]['index'] = 0
-        else:
-            self.filter_avg[name]['index'] += 1
-
-        return average
+        self.filter_avg[name].add(measurement)
+        return self.filter_avg[name].mean()
 
     def is_acquiring_measurement(self):
         return self.acquiring_measurement
@@ -4,6 +4,7 @@ import time
 import copy
 
 from mycodo.inputs.base_input import AbstractInput
+from mycodo.utils.w1_bus import w1_buses
 
 # Measurements
 measurements_dict = {
@@ -77,7 +78,8 @@ class InputModule(AbstractInput):
         n = 2
         for i in range(n):
             try:
-                temperature = self.sensor.get_temperature()
+                temperature = w1_buses.read(
+                    'DS1825', self.input_dev.location, max_age=self.input_dev.period / 2)
                 break
             except Exception as e:
                 if i == n:
@@ -5,6 +5,7 @@ import time
 import copy
 
 from mycodo.inputs.base_input import AbstractInput
+from mycodo.utils.w1_bus import w1_buses
 
 
 def constraints_pass_measure_range(mod_input, value):
@@ -84,7 +85,8 @@ class InputModule(AbstractInput):
         n = 2
         for i in range(n):
             try:
-                self.value_set(0, self.sensor.get_temperature())
+                self.value_set(0, w1_buses.read(
+                    'DS18S20', self.input_dev.location, max_age=self.input_dev.period / 2))
                 break
             except Exception as e:
                 if i == n:
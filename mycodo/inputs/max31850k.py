@@ -4,6 +4,7 @@ import time
 import copy
 
 from mycodo.inputs.base_input import AbstractInput
+from mycodo.utils.w1_bus import w1_buses
 
 # Measurements
 measurements_dict = {
@@ -67,7 +68,8 @@ class InputModule(AbstractInput):
         n = 2
         for i in range(n):
             try:
-                self.value_set(0, self.sensor.get_temperature())
+                self.value_set(0, w1_buses.read(
+                    'MAX31850K', self.input_dev.location, max_age=self.input_dev.period / 2))
                 return self.return_dict
             except Exception as e:
                 if i == n:
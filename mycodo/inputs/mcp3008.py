@@ -5,6 +5,9 @@ from collections import OrderedDict
 import copy
 
 from mycodo.inputs.base_input import AbstractInput
+from mycodo.utils.adc_acquisition import ADCAcquisition
+from mycodo.utils.adc_acquisition import ADC_FILTER_OPTIONS
+from mycodo.utils.adc_acquisition import ADC_SAMPLES_OPTION
 
 
 def constraints_pass_positive_value(mod_input, value):
@@ -59,6 +62,7 @@ INPUT_INFORMATION = {
     'options_disabled': ['interface'],
 
     'dependencies_module': [
+        ('apt', 'python3-numpy', 'python3-numpy'),
         ('pip-pypi', 'Adafruit_MCP3008', 'Adafruit_MCP3008')
     ],
 
@@ -76,8 +80,9 @@ INPUT_INFORMATION = {
             'constraints_pass': constraints_pass_positive_value,
             'name': 'VREF (volts)',
             'phrase': 'Set the VREF voltage'
-        }
-    ]
+        },
+        ADC_SAMPLES_OPTION
+    ] + ADC_FILTER_OPTIONS
 }
 
 
@@ -87,7 +92,12 @@ class InputModule(AbstractInput):
         super(InputModule, self).__init__(input_dev, testing=testing, name=__name__)
 
         self.sensor = None
+        self.acquisition = None
         self.vref = None
+        self.adc_samples = None
+        self.adc_sample_rate = None
+        self.adc_filter = None
+        self.adc_filter_window = None
 
         self.setup_custom_options(
             INPUT_INFORMATION['custom_options'], input_dev)
@@ -104,6 +114,13 @@ class InputModule(AbstractInput):
             miso=self.input_dev.pin_miso,
             mosi=self.input_dev.pin_mosi)
 
+        self.acquisition = ADCAcquisition(
+            [channel for channel in self.channels_measurement if self.is_enabled(channel)],
+            samples=self.adc_samples,
+            rate=self.adc_sample_rate,
+            filter_type=self.adc_filter,
+            window=self.adc_filter_window)
+
     def get_measurement(self):
         if not self.sensor:
             self.logger.error("Input not set up")
@@ -111,8 +128,10 @@ class InputModule(AbstractInput):
 
         self.return_dict = copy.deepcopy(measurements_dict)
 
-        for channel in self.channels_measurement:
-            if self.is_enabled(channel):
-                self.value_set(channel, ((self.sensor.read_adc(channel) / 1024.0) * self.vref))
+        values = self.acquisition.acquire(
+            lambda: [(self.sensor.read_adc(channel) / 1024.0) * self.vref
+                     for channel in self.acquisition.channels])
+        for channel, value in values.items():
+            self.value_set(channel, value)
 
         return self.return_dict
@@ -4,6 +4,9 @@ from collections import OrderedDict
 import copy
 
 from mycodo.inputs.base_input import AbstractInput
+from mycodo.utils.adc_acquisition import ADCAcquisition
+from mycodo.utils.adc_acquisition import ADC_FILTER_OPTIONS
+from mycodo.utils.adc_acquisition import ADC_SAMPLES_OPTION
 
 # Measurements
 measurements_dict = OrderedDict()
@@ -49,6 +52,7 @@ INPUT_INFORMATION = {
     'options_disabled': ['interface'],
 
     'dependencies_module': [
+        ('apt', 'python3-numpy', 'python3-numpy'),
         ('pip-pypi', 'smbus2', 'smbus2'),
         ('pip-pypi', 'MCP342x', 'MCP342x==0.3.4')
     ],
@@ -68,7 +72,9 @@ INPUT_INFORMATION = {
         (14, '14'),
         (16, '16'),
         (18, '18')
-    ]
+    ],
+
+    'custom_options': [ADC_SAMPLES_OPTION] + ADC_FILTER_OPTIONS
 }
 
 
@@ -77,12 +83,20 @@ class InputModule(AbstractInput):
     def __init__(self, input_dev, testing=False):
         super(InputModule, self).__init__(input_dev, testing=testing, name=__name__)
 
-        self.sensor = None
+        self.adcs = None
+        self.acquisition = None
         self.bus = None
         self.i2c_address = None
         self.adc_gain = None
         self.adc_resolution = None
 
+        self.adc_samples = None
+        self.adc_sample_rate = None
+        self.adc_filter = None
+        self.adc_filter_window = None
+        self.setup_custom_options(
+            INPUT_INFORMATION['custom_options'], input_dev)
+
         if not testing:
             self.initialize_input()
 
@@ -90,23 +104,37 @@ class InputModule(AbstractInput):
         from smbus2 import SMBus
         from MCP342x import MCP342x
 
-        self.sensor = MCP342x
         self.bus = SMBus(self.input_dev.i2c_bus)
 
         self.i2c_address = int(str(self.input_dev.i2c_location), 16)
         self.adc_gain = self.input_dev.adc_gain
         self.adc_resolution = self.input_dev.adc_resolution
 
+        self.acquisition = ADCAcquisition(
+            [channel for channel in self.channels_measurement if self.is_enabled(channel)],
+            samples=self.adc_samples,
+            rate=self.adc_sample_rate,
+            filter_type=self.adc_filter,
+            window=self.adc_filter_window)
+        self.adcs = [
+            MCP342x(self.bus,
+                    self.i2c_address,
+                    channel=channel,
+                    gain=self.adc_gain,
+                    resolution=self.adc_resolution)
+            for channel in self.acquisition.channels
+        ]
+
     def get_measurement(self):
+        if not self.acquisition:
+            self.logger.error("Input not set up")
+            return
+
         self.return_dict = copy.deepcopy(measurements_dict)
 
-        for channel in self.channels_measurement:
-            if self.is_enabled(channel):
-                adc = self.sensor(self.bus,
-                                  self.i2c_address,
-                                  channel=channel,
-                                  gain=self.adc_gain,
-                                  resolution=self.adc_resolution)
-                self.value_set(channel, adc.convert_and_read())
+        values = self.acquisition.acquire(
+            lambda: [adc.convert_and_read() for adc in self.adcs])
+        for channel, value in values.items():
+            self.value_set(channel, value)
 
         return self.return_dict
@@ -1,7 +1,9 @@
 # coding=utf-8
 import copy
 
+from mycodo.config import BLE_GATT_TIMEOUT
 from mycodo.inputs.base_input import AbstractInput
+from mycodo.utils.ble_broker import ble_brokers
 
 # Measurements
 measurements_dict = {
@@ -66,6 +68,7 @@ class InputModule(AbstractInput):
         super(InputModule, self).__init__(input_dev, testing=testing, name=__name__)
 
         self.sensor = None
+        self.broker = None
 
         if not testing:
             self.initialize_input()
@@ -74,18 +77,34 @@ class InputModule(AbstractInput):
         from miflora.miflora_poller import MiFloraPoller
         from btlewrap import BluepyBackend
 
-        self.lock_file = '/var/lock/bluetooth_dev_hci{}'.format(self.input_dev.bt_adapter)
-        
+        self.broker = ble_brokers.get(self.input_dev.bt_adapter)
+
         try:
             self.sensor = MiFloraPoller(
                 self.input_dev.location,
                 BluepyBackend,
                 adapter='hci{}'.format(self.input_dev.bt_adapter))
-            self.logger.info("Miflora: Name: {}, FW: {}".format(
-                self.sensor.name(), self.sensor.firmware_version()))
+            name, firmware_version = self.broker.gatt(
+                self.input_dev.location,
+                lambda: (self.sensor.name(), self.sensor.firmware_version())).result(BLE_GATT_TIMEOUT)
+            self.logger.info("Miflora: Name: {}, FW: {}".format(name, firmware_version))
         except:
             self.logger.exception("Setting up sensor")
 
+    def read_parameters(self):
+        """ Read the enabled parameters (connects to the sensor, unless cached by the poller) """
+        from miflora.miflora_poller import MI_CONDUCTIVITY
+        from miflora.miflora_poller import MI_MOISTURE
+        from miflora.miflora_poller import MI_LIGHT
+        from miflora.miflora_poller import MI_TEMPERATURE
+        from miflora.miflora_poller import MI_BATTERY
+
+        parameters = [MI_BATTERY, MI_CONDUCTIVITY, MI_LIGHT, MI_MOISTURE, MI_TEMPERATURE]
+        return {
+            channel: self.sensor.parameter_value(parameter)
+            for channel, parameter in enumerate(parameters) if self.is_enabled(channel)
+        }
+
     def get_measurement(self):
         """ Gets the light, moisture, and temperature """
         if not self.sensor:
@@ -94,31 +113,11 @@ class InputModule(AbstractInput):
 
         self.return_dict = copy.deepcopy(measurements_dict)
 
-        if self.lock_acquire(self.lock_file, timeout=3600):
-            try:
-                from miflora.miflora_poller import MI_CONDUCTIVITY
-                from miflora.miflora_poller import MI_MOISTURE
-                from miflora.miflora_poller import MI_LIGHT
-                from miflora.miflora_poller import MI_TEMPERATURE
-                from miflora.miflora_poller import MI_BATTERY
-
-                if self.is_enabled(0):
-                    self.value_set(0, self.sensor.parameter_value(MI_BATTERY))
-
-                if self.is_enabled(1):
-                    self.value_set(1, self.sensor.parameter_value(MI_CONDUCTIVITY))
-
-                if self.is_enabled(2):
-                    self.value_set(2, self.sensor.parameter_value(MI_LIGHT))
-
-                if self.is_enabled(3):
-                    self.value_set(3, self.sensor.parameter_value(MI_MOISTURE))
-
-                if self.is_enabled(4):
-                    self.value_set(4, self.sensor.parameter_value(MI_TEMPERATURE))
-
-                return self.return_dict
-            except:
-                self.logger.exception("acquiring measurements")
-            finally:
-                self.lock_release(self.lock_file)
+        future = self.broker.gatt(self.input_dev.location, self.read_parameters)
+        try:
+            for channel, value in future.result(BLE_GATT_TIMEOUT).items():
+                self.value_set(channel, value)
+            return self.return_dict
+        except:
+            future.cancel()
+            self.logger.exception("acquiring measurements")
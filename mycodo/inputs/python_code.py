@@ -1,6 +1,7 @@
 # coding=utf-8
 import importlib.util
 import textwrap
+import time
 
 import copy
 import os
@@ -20,9 +21,12 @@ def generate_code(new_input):
     error = []
     pre_statement_run = """import os
 import sys
+import threading
 sys.path.append(os.path.abspath('/var/mycodo-root'))
 from mycodo.mycodo_client import DaemonControl
 from mycodo.utils.influx import add_measurements_influxdb
+from mycodo.utils.influx import format_influxdb_data
+from mycodo.utils.influx import write_influxdb_list
 control = DaemonControl()
 
 class PythonInputRun:
@@ -40,7 +44,30 @@ class PythonInputRun:
         measure[channel]['value'] = measurement
         if timestamp:
             measure[channel]['timestamp_utc'] = timestamp
-        add_measurements_influxdb(self.input_id, measure)
+        add_measurements_influxdb(self.input_id, measure, use_same_timestamp=not timestamp)
+
+    def store_measurements(self, measurements):
+        # Store several measurements with one database write
+        # measurements: dict of channel: measurement, or list of
+        # (channel, measurement) or (channel, measurement, timestamp)
+        if isinstance(measurements, dict):
+            measurements = measurements.items()
+        data = []
+        for each_measurement in measurements:
+            channel, measurement = each_measurement[0], each_measurement[1]
+            if None in [channel, measurement]:
+                continue
+            data.append(format_influxdb_data(
+                self.input_id,
+                self.measurement_info[channel]['unit'],
+                measurement,
+                channel=channel,
+                measure=self.measurement_info[channel]['measurement'],
+                timestamp=each_measurement[2] if len(each_measurement) > 2 else None))
+        write_db = threading.Thread(
+            target=write_influxdb_list,
+            args=(data, self.input_id,))
+        write_db.start()
 
     def python_code_run(self):
 """
@@ -157,7 +184,12 @@ INPUT_INFORMATION = {
 random_value_channel_0 = random.uniform(10.0, 100.0)
 
 # Store measurements in database (must specify the channel and measurement)
-self.store_measurement(channel=0, measurement=random_value_channel_0)"""
+self.store_measurement(channel=0, measurement=random_value_channel_0)
+
+# Multiple measurements may be stored at once with
+# self.store_measurements({0: value_0, 1: value_1})
+# or with timestamps (datetime, UTC) with
+# self.store_measurements([(0, value_0, timestamp_0), (0, value_1, timestamp_1)])"""
 }
 
 
@@ -168,6 +200,18 @@ class InputModule(AbstractInput):
         super(InputModule, self).__init__(input_dev, testing=testing, name=__name__)
 
         self.python_code = None
+        self.file_run = None
+        self.code_mtime = None
+        self.run = None
+        self.timing = {
+            'compilations': 0,
+            'compiled': None,
+            'runs': 0,
+            'errors': 0,
+            'last_sec': None,
+            'total_sec': 0.0,
+            'max_sec': 0.0
+        }
 
         if not testing:
             self.initialize_input()
@@ -185,30 +229,58 @@ class InputModule(AbstractInput):
             self.measure_info[each_measure.channel]['measurement'] = each_measure.measurement
 
         self.python_code = self.input_dev.cmd_command
+        self.file_run = '{}/input_python_code_{}.py'.format(PATH_PYTHON_CODE_USER, self.unique_id)
+        self.load_code()
+
+    def load_code(self):
+        """ Compile and instantiate the code, unless already done since the file was last modified """
+        # If the file to execute doesn't exist, generate it
+        if not os.path.exists(self.file_run):
+            generate_code(self.input_dev)
+
+        mtime = os.path.getmtime(self.file_run)
+        if self.run is not None and mtime == self.code_mtime:
+            return
+
+        with open(self.file_run, 'r') as file:
+            self.logger.debug("Python Code:\n{}".format(file.read()))
+
+        module_name = "mycodo.input.python_code_exec_{}".format(os.path.basename(self.file_run).split('.')[0])
+        spec = importlib.util.spec_from_file_location(module_name, self.file_run)
+        input_run = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(input_run)
+        self.run = input_run.PythonInputRun(self.logger, self.unique_id, self.measure_info)
+        self.code_mtime = mtime
+        self.timing['compilations'] += 1
+        self.timing['compiled'] = time.time()
 
     def get_measurement(self):
-        """ Determine if the return value of the command is a number """
+        """ Run the code, which stores its own measurements """
         if not self.python_code:
             self.logger.error("Input not set up")
             return
 
         self.return_dict = copy.deepcopy(measurements_dict)
 
-        file_run = '{}/input_python_code_{}.py'.format(PATH_PYTHON_CODE_USER, self.unique_id)
-
-        # If the file to execute doesn't exist, generate it
-        if not os.path.exists(file_run):
-            execute_at_creation(self.unique_id, self.python_code, None)
-
-        with open(file_run, 'r') as file:
-            self.logger.debug("Python Code:\n{}".format(file.read()))
+        self.load_code()
 
-        module_name = "mycodo.input.python_code_exec_{}".format(os.path.basename(file_run).split('.')[0])
-        spec = importlib.util.spec_from_file_location(module_name, file_run)
-        conditional_run = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(conditional_run)
-        run = conditional_run.PythonInputRun(self.logger, self.unique_id, self.measure_info)
+        timer = time.monotonic()
         try:
-            run.python_code_run()
+            self.run.python_code_run()
         except Exception:
+            self.timing['errors'] += 1
             self.logger.exception(1)
+        run_sec = time.monotonic() - timer
+
+        self.timing['runs'] += 1
+        self.timing['last_sec'] = run_sec
+        self.timing['total_sec'] += run_sec
+        self.timing['max_sec'] = max(self.timing['max_sec'], run_sec)
+        self.logger.debug("Code executed in {:.3f} seconds".format(run_sec))
+
+    def status(self):
+        """ Return the compilation and execution times of the code """
+        status = dict(self.timing)
+        if status['runs']:
+            status['mean_sec'] = status['total_sec'] / status['runs']
+        return status
@@ -1,9 +1,8 @@
 # coding=utf-8
-import time
-
 import copy
 
 from mycodo.inputs.base_input import AbstractInput
+from mycodo.utils.pulse_counter import pulse_counters
 
 # Measurements
 measurements_dict = {
@@ -49,8 +48,8 @@ class InputModule(AbstractInput):
     def __init__(self, input_dev, testing=False):
         super(InputModule, self).__init__(input_dev, testing=testing, name=__name__)
 
-        self.pigpio = None
         self.gpio = None
+        self.reader = None
         self.weighting = None
         self.rpm_pulses_per_rev = None
         self.sample_time = None
@@ -59,107 +58,34 @@ class InputModule(AbstractInput):
             self.initialize_input()
 
     def initialize_input(self):
-        import pigpio
-
-        self.pigpio = pigpio
-
         self.gpio = int(self.input_dev.gpio_location)
         self.weighting = self.input_dev.weighting
         self.rpm_pulses_per_rev = self.input_dev.rpm_pulses_per_rev
         self.sample_time = self.input_dev.sample_time
+        self.subscribe()
+
+    def subscribe(self):
+        try:
+            self.reader = pulse_counters.subscribe(self.gpio, self.weighting)
+        except Exception as err:
+            self.logger.error("Could not count pulses on GPIO {}: {}".format(self.gpio, err))
 
     def get_measurement(self):
-        """ Gets the revolutions """
-        pi = self.pigpio.pi()
-        if not pi.connected:  # Check if pigpiod is running
-            self.logger.error("Could not connect to pigpiod. Ensure it is running and try again.")
-            return None
+        """ Gets the revolutions (over the last sample time) """
+        if not self.reader:
+            self.subscribe()
+            if not self.reader:
+                return None
 
         self.return_dict = copy.deepcopy(measurements_dict)
 
-        read_revolutions = ReadRPM(pi, self.gpio, self.pigpio, self.rpm_pulses_per_rev, self.weighting)
-        time.sleep(self.sample_time)
-
-        rpm = read_revolutions.RPM()
-        if rpm:
-            rpm = int(rpm + 0.5)
-
-        read_revolutions.cancel()
-        pi.stop()
-
-        if rpm or rpm == 0:
-            self.value_set(0, rpm)
-            return self.return_dict
-
-
-class ReadRPM:
-    """
-    A class to read pulses and calculate the RPM
-    """
-
-    def __init__(self, pi, gpio, pigpio, pulses_per_rev=1.0, weighting=0.0):
-        """
-        Instantiate with the Pi and gpio of the RPM signal
-        to monitor.
-
-        Optionally the number of pulses for a complete revolution
-        may be specified. It defaults to 1.
-
-        Optionally a weighting may be specified. This is a number
-        between 0 and 1 and indicates how much the old reading
-        affects the new reading. It defaults to 0 which means
-        the old reading has no effect. This may be used to
-        smooth the data.
-        """
-        self.pigpio = pigpio
-        self.pi = pi
-        self.gpio = gpio
-        self.pulses_per_rev = pulses_per_rev
-
-        self._watchdog = 200  # Milliseconds.
-
-        if weighting < 0.0:
-            weighting = 0.0
-        elif weighting > 0.99:
-            weighting = 0.99
-
-        self._new = 1.0 - weighting  # Weighting for new reading.
-        self._old = weighting  # Weighting for old reading.
-
-        self._high_tick = None
-        self._period = None
-
-        pi.set_mode(self.gpio, self.pigpio.INPUT)
-
-        self._cb = pi.callback(self.gpio, self.pigpio.RISING_EDGE, self._cbf)
-        pi.set_watchdog(self.gpio, self._watchdog)
-
-    def _cbf(self, gpio, level, tick):
-        if level == 1:  # Rising edge.
-            if self._high_tick is not None:
-                t = self.pigpio.tickDiff(self._high_tick, tick)
-                if self._period is not None:
-                    self._period = (self._old * self._period) + (self._new * t)
-                else:
-                    self._period = t
-            self._high_tick = tick
-        elif level == 2:  # Watchdog timeout.
-            if self._period is not None:
-                if self._period < 2000000000:
-                    self._period += (self._watchdog * 1000)
-
-    def RPM(self):
-        """
-        Returns the RPM.
-        """
-        RPM = 0
-        if self._period is not None:
-            RPM = 60000000.0 / (self._period * self.pulses_per_rev)
-        return RPM
-
-    def cancel(self):
-        """
-        Cancels the reader and releases resources.
-        """
-        self.pi.set_watchdog(self.gpio, 0)  # cancel watchdog
-        self._cb.cancel()
+        rpm = self.reader.rate(self.sample_time) * 60.0 / self.rpm_pulses_per_rev
+        self.value_set(0, int(rpm + 0.5))
+
+        return self.return_dict
+
+    def stop_input(self):
+        if self.reader:
+            pulse_counters.unsubscribe(self.reader)
+            self.reader = None
+        super(InputModule, self).stop_input()
@@ -1,13 +1,10 @@
 # coding=utf-8
-import subprocess
-import time
-
 import copy
 
 from mycodo.inputs.base_input import AbstractInput
 from mycodo.inputs.sensorutils import calculate_dewpoint
 from mycodo.inputs.sensorutils import calculate_vapor_pressure_deficit
-from mycodo.utils.system_pi import str_is_float
+from mycodo.utils.ble_broker import ble_brokers
 
 # Measurements
 measurements_dict = {
@@ -76,7 +73,8 @@ INPUT_INFORMATION = {
         ('apt', 'python3-dev', 'python3-dev'),
         ('apt', 'python3-psutil', 'python3-psutil'),
         ('apt', 'bluez', 'bluez'),
-        ('apt', 'bluez-hcidump', 'bluez-hcidump'),
+        ('apt', 'libglib2.0-dev', 'libglib2.0-dev'),
+        ('pip-pypi', 'bluepy', 'bluepy'),
         ('pip-pypi', 'ruuvitag_sensor', 'ruuvitag_sensor')
     ],
 
@@ -93,118 +91,92 @@ class InputModule(AbstractInput):
     def __init__(self, input_dev, testing=False):
         super(InputModule, self).__init__(input_dev, testing=testing, name=__name__)
 
-        self.sensor = None
-        self.ruuvitag = None
-        self.download_stored_data = None
-        self.logging_interval_ms = None
-        self.gadget = None
-        self.connected = False
-        self.connect_error = None
-        self.device_information = {}
-        self.initialized = False
-        self.last_downloaded_timestamp = None
+        self.broker = None
+        self.get_decoder = None
+        self.location = None
 
         if not testing:
             self.initialize_input()
 
     def initialize_input(self):
-        from ruuvitag_sensor.ruuvitag import RuuviTag
-
-        self.ruuvitag = RuuviTag
+        from ruuvitag_sensor.decoder import get_decoder
 
-        self.lock_file = '/var/lock/bluetooth_dev_hci{}'.format(self.input_dev.bt_adapter)
+        self.get_decoder = get_decoder
         self.location = self.input_dev.location
-        self.bt_adapter = self.input_dev.bt_adapter
-        self.sensor = self.ruuvitag(
-            self.location,
-            bt_device='hci{}'.format(self.bt_adapter))
+        self.broker = ble_brokers.get(self.input_dev.bt_adapter)
+        self.broker.subscribe(self.location, self.decode_advertisement)
+
+    def decode_advertisement(self, data):
+        """ Decode the RAWv1 (3) or RAWv2 (5) data format from the Ruuvi manufacturer data """
+        manufacturer_data = data.get(255)
+        if not manufacturer_data or not manufacturer_data.startswith('9904'):
+            return
+        payload = manufacturer_data[4:]
+        data_format = int(payload[:2], 16)
+        if data_format not in [3, 5]:
+            return
+        return self.get_decoder(data_format).decode_data(payload)
 
     def get_measurement(self):
         """ Obtain and return the measurements """
-        if not self.sensor:
+        if not self.broker:
             self.logger.error("Input not set up")
             return
 
         self.return_dict = copy.deepcopy(measurements_dict)
 
-        if self.lock_acquire(self.lock_file, timeout=3600):
-            self.logger.debug("Starting measurement")
-            try:
-                cmd = 'timeout -k 11 10 /var/mycodo-root/env/bin/python ' \
-                      '/var/mycodo-root/mycodo/inputs/scripts/ruuvitag_values.py ' \
-                      '--mac_address {mac} --bt_adapter {bta}'.format(
-                          mac=self.location, bta=self.bt_adapter)
-                cmd = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True)
-                cmd_return, _ = cmd.communicate()
-                cmd.wait()
-
-                if not cmd_return:
-                    self.logger.debug("Measurement command returned no data")
-                    return
-
-                values = cmd_return.decode('ascii').split(',')
-
-                if not str_is_float(values[0]):
-                    self.logger.debug("Error: Could not convert string to float: string '{}'".format(str(values[0])))
-                    return
-
-                temperature = float(str(values[0]))
-                humidity = float(values[1])
-                pressure = float(values[2])
-                battery = float(values[3]) / 1000
-                acceleration_g_force = float(values[4]) / 1000
-                acceleration_x_g_force = float(values[5]) / 1000
-                acceleration_y_g_force = float(values[6]) / 1000
-                acceleration_z_g_force = float(values[7]) / 1000
-
-                if battery < 1 or battery > 4:
-                    self.logger.debug(
-                        "Not recording measurements: "
-                        "Battery outside expected range (1 < battery volts < 4): {bat}".format(bat=battery))
-                    return
-
-                if self.is_enabled(0):
-                    self.value_set(0, temperature)
-
-                if self.is_enabled(1):
-                    self.value_set(1, humidity)
-
-                if self.is_enabled(2):
-                    self.value_set(2, pressure)
-
-                if self.is_enabled(3):
-                    self.value_set(3, battery)
-
-                if self.is_enabled(4):
-                    self.value_set(4, acceleration_g_force)
-
-                if self.is_enabled(5):
-                    self.value_set(5, acceleration_x_g_force)
-
-                if self.is_enabled(6):
-                    self.value_set(6, acceleration_y_g_force)
-
-                if self.is_enabled(7):
-                    self.value_set(7, acceleration_z_g_force)
-
-                if (self.is_enabled(8) and
-                        self.is_enabled(0) and
-                        self.is_enabled(1)):
-                    self.value_set(8, calculate_dewpoint(
-                        self.value_get(0), self.value_get(1)))
-
-                if (self.is_enabled(9) and
-                        self.is_enabled(0) and
-                        self.is_enabled(1)):
-                    self.value_set(9, calculate_vapor_pressure_deficit(
-                        self.value_get(0), self.value_get(1)))
-
-                self.logger.debug("Completed measurement")
-                return self.return_dict
-
-            except Exception as msg:
-                self.logger.debug("Error: {}".format(msg))
-
-            finally:
-                self.lock_release(self.lock_file)
-                time.sleep(1)
+        state = self.broker.latest(self.location, max_age=self.input_dev.period)
+        if not state:
+            self.logger.debug("No advertisement received since the last measurement")
+            return
+
+        battery = state['battery'] / 1000
+        if battery < 1 or battery > 4:
+            self.logger.debug(
+                "Not recording measurements: "
+                "Battery outside expected range (1 < battery volts < 4): {bat}".format(bat=battery))
+            return
+
+        if self.is_enabled(0):
+            self.value_set(0, float(state['temperature']))
+
+        if self.is_enabled(1):
+            self.value_set(1, float(state['humidity']))
+
+        if self.is_enabled(2):
+            self.value_set(2, float(state['pressure']))
+
+        if self.is_enabled(3):
+            self.value_set(3, battery)
+
+        if self.is_enabled(4):
+            self.value_set(4, state['acceleration'] / 1000)
+
+        if self.is_enabled(5):
+            self.value_set(5, state['acceleration_x'] / 1000)
+
+        if self.is_enabled(6):
+            self.value_set(6, state['acceleration_y'] / 1000)
+
+        if self.is_enabled(7):
+            self.value_set(7, state['acceleration_z'] / 1000)
+
+        if (self.is_enabled(8) and
+                self.is_enabled(0) and
+                self.is_enabled(1)):
+            self.value_set(8, calculate_dewpoint(
+                self.value_get(0), self.value_get(1)))
+
+        if (self.is_enabled(9) and
+                self.is_enabled(0) and
+                self.is_enabled(1)):
+            self.value_set(9, calculate_vapor_pressure_deficit(
+                self.value_get(0), self.value_get(1)))
+
+        self.logger.debug("Completed measurement")
+        return self.return_dict
+
+    def stop_input(self):
+        if self.broker:
+            self.broker.unsubscribe(self.location)
+        super(InputModule, self).stop_input()
@@ -10,6 +10,7 @@ import os
 
 from mycodo.databases.models import Conversion
 from mycodo.utils.database import db_retrieve_table_daemon
+from mycodo.utils.expression import compile_expression
 
 logger = logging.getLogger(__name__)
 
@@ -39,8 +40,7 @@ def convert_units(conversion_id, measure_value):
     :return: converted value
     """
     conversion = db_retrieve_table_daemon(Conversion, unique_id=conversion_id)
-    replaced_str = conversion.equation.replace('x', str(measure_value))
-    return float('{0:.5f}'.format(eval(replaced_str)))
+    return float('{0:.5f}'.format(compile_expression(conversion.equation)(x=float(measure_value))))
 
 
 def convert_from_x_to_y_unit(unit_from, unit_to, in_value):
@@ -60,8 +60,7 @@ def convert_from_x_to_y_unit(unit_from, unit_to, in_value):
     conversion = conversion.filter(Conversion.convert_unit_from == unit_from)
     conversion = conversion.filter(Conversion.convert_unit_to == unit_to).first()
     if conversion:
-        replaced_str = conversion.equation.replace('x', str(in_value))
-        return float('{0:.5f}'.format(eval(replaced_str)))
+        return float('{0:.5f}'.format(compile_expression(conversion.equation)(x=float(in_value))))
     else:
         logger.error("Conversion not found for '{uf}' to '{ut}'.".format(
             uf=unit_to, ut=unit_from))
@@ -5,9 +5,12 @@ import time
 import copy
 from flask_babel import lazy_gettext
 
+from mycodo.config import BLE_GATT_TIMEOUT
+from mycodo.config import BLE_HISTORY_DOWNLOAD_TIMEOUT
 from mycodo.inputs.base_input import AbstractInput
 from mycodo.inputs.sensorutils import calculate_dewpoint
 from mycodo.inputs.sensorutils import calculate_vapor_pressure_deficit
+from mycodo.utils.ble_broker import ble_brokers
 from mycodo.utils.influx import parse_measurement
 from mycodo.utils.influx import write_influxdb_value
 
@@ -128,6 +131,7 @@ class InputModule(AbstractInput):
         super(InputModule, self).__init__(input_dev, testing=testing, name=__name__)
 
         self.gadget = None
+        self.broker = None
         self.connected = False
         self.connect_error = None
         self.device_information = {}
@@ -154,7 +158,7 @@ class InputModule(AbstractInput):
         self.log_level_debug = self.input_dev.log_level_debug
         self.location = self.input_dev.location
         self.bt_adapter = self.input_dev.bt_adapter
-        self.lock_file = '/var/lock/bluetooth_dev_hci{}'.format(self.bt_adapter)
+        self.broker = ble_brokers.get(self.bt_adapter)
 
     def initialize(self):
         """Initialize the device by obtaining sensor information"""
@@ -388,7 +392,7 @@ class InputModule(AbstractInput):
 
     def get_device_information(self):
         if not self.initialized:
-            self.initialize()
+            self.broker.gatt(self.location, self.initialize).result(BLE_GATT_TIMEOUT)
 
         if 'info_timestamp' in self.device_information:
             return self.device_information
@@ -397,75 +401,93 @@ class InputModule(AbstractInput):
         """ Obtain and return the measurements """
         self.return_dict = copy.deepcopy(measurements_dict)
 
-        if self.lock_acquire(self.lock_file, timeout=3600):
-            self.logger.debug("Starting measurement")
+        self.logger.debug("Queuing measurement")
+        # Downloading the stored history of a gadget can take far longer than a measurement
+        timeout = BLE_HISTORY_DOWNLOAD_TIMEOUT if self.download_stored_data else BLE_GATT_TIMEOUT
+        future = self.broker.gatt(self.location, self.measure, timeout=timeout, abort=self.disconnect)
+        try:
+            self.return_dict = future.result(timeout)
+            return self.return_dict
+        except Exception:
+            future.cancel()
+            self.logger.exception("Measurement")
+
+    def measure(self):
+        """
+        Connect, download stored data and acquire the present measurements.
+        Runs in the Bluetooth broker, so the measurements are returned rather
+        than set in self.return_dict, which the next measurement may be using.
+        """
+        self.logger.debug("Starting measurement")
+        measurements = copy.deepcopy(measurements_dict)
+
+        def set_value(channel, value):
+            if value is not None and self.is_enabled(channel):
+                measurements[channel]['value'] = float(value)
+                measurements[channel]['timestamp_utc'] = datetime.datetime.utcnow()
+        if not self.initialized:
+            self.initialize()
+
+        if not self.initialized:
+            self.logger.error("Count not initialize sensor.")
+
+        if self.initialized and not self.connected:
+            self.connect()
+
+        if not self.connected:
+            self.logger.error("Count not connect to sensor.")
+
+        if self.connected:
             try:
-                if not self.initialized:
-                    self.initialize()
-
-                if not self.initialized:
-                    self.logger.error("Count not initialize sensor.")
-
-                if self.initialized and not self.connected:
-                    self.connect()
-
-                if not self.connected:
-                    self.logger.error("Count not connect to sensor.")
-
-                if self.connected:
-                    try:
-                        # Download stored data
-                        if self.download_stored_data:
-                            self.download_data()
-                            if not self.running:
-                                return
-
-                        # Set logging interval if not already set
-                        if ('logger_interval_ms' in self.device_information
-                                and self.logging_interval_ms != self.device_information['logger_interval_ms']):
-                            self.set_logging_interval()
-
-                        self.logger.debug("Acquiring present measurements")
-                        # Get battery percent charge
-                        if self.is_enabled(2):
-                            self.value_set(2, self.gadget.readBattery())
-
-                        # Get temperature and humidity last so their timestamp in the
-                        # database will be the most accurate
-                        if self.is_enabled(0):
-                            self.value_set(0, self.gadget.readTemperature())
-
-                        if self.is_enabled(1):
-                            self.value_set(1, self.gadget.readHumidity())
-                        self.logger.debug("Acquired present measurements")
-                    except self.btle.BTLEDisconnectError:
-                        self.logger.error("Disconnected")
-                        return
-                    except Exception:
-                        self.logger.exception("Unknown Error")
+                # Download stored data
+                if self.download_stored_data:
+                    self.download_data()
+                    if not self.running:
                         return
-                    finally:
-                        self.disconnect()
-
-                    if (self.is_enabled(3) and
-                            self.is_enabled(0) and
-                            self.is_enabled(1)):
-                        self.value_set(3, calculate_dewpoint(
-                            self.value_get(0), self.value_get(1)))
-
-                    if (self.is_enabled(4) and
-                            self.is_enabled(0) and
-                            self.is_enabled(1)):
-                        self.value_set(4, calculate_vapor_pressure_deficit(
-                            self.value_get(0), self.value_get(1)))
-
-                    self.logger.debug("Completed measurement")
-                    return self.return_dict
-                else:
-                    self.logger.debug("Not connected: Not measuring")
+
+                # Set logging interval if not already set
+                if ('logger_interval_ms' in self.device_information
+                        and self.logging_interval_ms != self.device_information['logger_interval_ms']):
+                    self.set_logging_interval()
+
+                self.logger.debug("Acquiring present measurements")
+                # Get battery percent charge
+                if self.is_enabled(2):
+                    set_value(2, self.gadget.readBattery())
+
+                # Get temperature and humidity last so their timestamp in the
+                # database will be the most accurate
+                if self.is_enabled(0):
+                    set_value(0, self.gadget.readTemperature())
+
+                if self.is_enabled(1):
+                    set_value(1, self.gadget.readHumidity())
+                self.logger.debug("Acquired present measurements")
+            except self.btle.BTLEDisconnectError:
+                self.logger.error("Disconnected")
+                return
+            except Exception:
+                self.logger.exception("Unknown Error")
+                return
             finally:
-                self.lock_release(self.lock_file)
-                time.sleep(1)
+                self.disconnect()
+
+            if (self.is_enabled(3) and
+                    self.is_enabled(0) and
+                    self.is_enabled(1)):
+                set_value(3, calculate_dewpoint(
+                    measurements[0]['value'], measurements[1]['value']))
+
+            if (self.is_enabled(4) and
+                    self.is_enabled(0) and
+                    self.is_enabled(1)):
+                set_value(4, calculate_vapor_pressure_deficit(
+                    measurements[0]['value'], measurements[1]['value']))
+
+            self.logger.debug("Completed measurement")
+            return measurements
+        else:
+            self.logger.debug("Not connected: Not measuring")
 
     def set_logging_interval(self):
         """Set logging interval (resets memory; set after downloading data)"""
@@ -159,6 +159,24 @@ class DaemonControl:
     # Function Actions
     #
 
+    def action_executor_status(self):
+        return self.proxy().action_executor_status()
+
+    def bluetooth_status(self):
+        return self.proxy().bluetooth_status()
+
+    def i2c_status(self):
+        return self.proxy().i2c_status()
+
+    def backfill_start(self, kind, unique_id, start, end, options=None):
+        return self.proxy().backfill_start(kind, unique_id, start, end, options=options)
+
+    def backfill_status(self, backfill_id=None):
+        return self.proxy().backfill_status(backfill_id)
+
+    def backfill_cancel(self, backfill_id):
+        return self.proxy().backfill_cancel(backfill_id)
+
     def trigger_action(
             self, action_id, message='', single_action=True, debug=False):
         return self.proxy().trigger_action(
@@ -179,6 +197,9 @@ class DaemonControl:
         except Exception:
             return 0, traceback.format_exc()
 
+    def input_status(self, input_id):
+        return self.proxy().input_status(input_id)
+
     #
     # LCD Controller
     #
@@ -238,6 +259,26 @@ class DaemonControl:
         """ Return the amount an output is currently on for (e.g. number fo seconds) """
         return self.proxy().output_sec_currently_on(output_id)
 
+    def output_ramp(self,
+                    output_id,
+                    output_channel,
+                    start_duty_cycle,
+                    end_duty_cycle,
+                    duration,
+                    curve='linear',
+                    points=None,
+                    increment=None):
+        """ Ramp the duty cycle of a PWM output channel over a duration """
+        return self.proxy().output_ramp(
+            output_id, output_channel, start_duty_cycle, end_duty_cycle, duration,
+            curve=curve, points=points, increment=increment)
+
+    def output_ramp_cancel(self, output_id, output_channel=None):
+        return self.proxy().output_ramp_cancel(output_id, output_channel=output_channel)
+
+    def output_ramps(self):
+        return self.proxy().output_ramps()
+
     def output_setup(self, action, output_id):
         return self.proxy().output_setup(action, output_id)
 
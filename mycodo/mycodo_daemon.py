@@ -70,19 +70,25 @@ from mycodo.databases.models import Trigger
 from mycodo.databases.utils import session_scope
 from mycodo.devices.camera import camera_record
 from mycodo.utils.functions import parse_function_information
+from mycodo.utils.action_executor import action_executor
+from mycodo.utils.backfill import backfills
+from mycodo.utils.ble_broker import ble_brokers
 from mycodo.utils.database import db_retrieve_table_daemon
 from mycodo.utils.function_actions import get_condition_value
 from mycodo.utils.function_actions import get_condition_value_dict
 from mycodo.utils.function_actions import trigger_action
 from mycodo.utils.function_actions import trigger_function_actions
 from mycodo.utils.github_release_info import MycodoRelease
+from mycodo.utils.i2c_arbiter import i2c_arbiter
+from mycodo.utils.jobs import JobError
+from mycodo.utils.jobs import job_runner
 from mycodo.utils.modules import load_module_from_file
 from mycodo.utils.statistics import add_update_csv
 from mycodo.utils.statistics import recreate_stat_file
 from mycodo.utils.statistics import return_stat_file_dict
 from mycodo.utils.statistics import send_anonymous_stats
-from mycodo.utils.tools import generate_output_usage_report
 from mycodo.utils.tools import next_schedule
+from mycodo.utils.trigger_dispatch import output_triggers
 
 MYCODO_DB_PATH = 'sqlite:///' + SQL_DATABASE_MYCODO
 
@@ -157,6 +163,7 @@ class DaemonController:
 
     def run(self):
         self.start_all_controllers(self.debug)
+        backfills.resume()
         self.daemon_startup_time = timeit.default_timer() - self.startup_timer
         self.logger.info("Mycodo daemon started in {sec:.3f} seconds".format(sec=self.daemon_startup_time))
         self.startup_stats()
@@ -175,11 +182,14 @@ class DaemonController:
                 # Capture time-lapse image (if enabled)
                 self.check_all_timelapses(now)
 
-                # Generate output usage report (if enabled)
+                # Queue generating the output usage report (if enabled), run by the frontend
                 if (self.output_usage_report_gen and
                         self.output_usage_report_next_gen and
                         now > self.output_usage_report_next_gen):
-                    generate_output_usage_report()
+                    try:
+                        job_runner.submit('output_usage_report', 'Output Usage Report')
+                    except JobError as err:
+                        self.logger.error("Could not queue output usage report: {}".format(err))
                     self.refresh_daemon_misc_settings()  # Update timer
 
                 # Collect and send anonymous statistics (if enabled)
@@ -477,6 +487,24 @@ class DaemonController:
             self.logger.exception(message)
             return 1, message
 
+    def input_status(self, input_id):
+        """
+        Return the runtime status of an active Input (e.g. execution times)
+
+        :return: success (0) and status dict, or error (1) and message
+        :rtype: tuple
+
+        :param input_id: Which Input controller ID is to be queried?
+        :type input_id: str
+
+        """
+        try:
+            return 0, self.controller['Input'][input_id].measure_input.status()
+        except Exception as except_msg:
+            message = "Cannot get Input status: {err}".format(err=except_msg)
+            self.logger.exception(message)
+            return 1, message
+
     def lcd_reset(self, lcd_id):
         """
         Resets an LCD
@@ -699,6 +727,7 @@ class DaemonController:
             self.logger.exception(message)
 
     def refresh_daemon_trigger_settings(self, unique_id):
+        output_triggers.invalidate()
         try:
             return self.controller['Trigger'][unique_id].refresh_settings()
         except Exception as except_msg:
@@ -768,6 +797,68 @@ class DaemonController:
             self.logger.exception(message)
             return 1, message
 
+    def output_ramp(self,
+                    output_id,
+                    output_channel,
+                    start_duty_cycle,
+                    end_duty_cycle,
+                    duration,
+                    curve='linear',
+                    points=None,
+                    increment=None):
+        """
+        Ramp the duty cycle of a PWM output channel using the output controller
+
+        :param output_id: Unique ID for output
+        :type output_id: str
+        :param output_channel: channel of output
+        :type output_channel: int
+        :param start_duty_cycle: Duty cycle to start at
+        :type start_duty_cycle: float
+        :param end_duty_cycle: Duty cycle to end at
+        :type end_duty_cycle: float
+        :param duration: Seconds to ramp over
+        :type duration: float
+        :param curve: 'linear' or 'exponential'
+        :type curve: str
+        :param points: Arbitrary curve, as a list of [fraction of duration, fraction of change]
+        :type points: list
+        :param increment: Round duty cycles to multiples of this
+        :type increment: float
+        """
+        try:
+            return self.controller['Output'].output_ramp(
+                output_id,
+                output_channel,
+                start_duty_cycle,
+                end_duty_cycle,
+                duration,
+                curve=curve,
+                points=points,
+                increment=increment)
+        except Exception as except_msg:
+            message = "Could not ramp output: {e}".format(e=except_msg)
+            self.logger.exception(message)
+            return 1, message
+
+    def output_ramp_cancel(self, output_id, output_channel=None):
+        """Cancel the ramp of an output channel (or all channels if None)"""
+        try:
+            return self.controller['Output'].output_ramp_cancel(
+                output_id, output_channel=output_channel)
+        except Exception as except_msg:
+            message = "Could not cancel output ramp: {e}".format(e=except_msg)
+            self.logger.exception(message)
+            return 1, message
+
+    def output_ramps(self):
+        """Return the status of all running output ramps"""
+        try:
+            return self.controller['Output'].output_ramps()
+        except Exception as except_msg:
+            self.logger.exception(
+                "Could not query output ramps: {e}".format(e=except_msg))
+
     def output_setup(self, action, output_id):
         """
         Setup output in running output controller
@@ -780,6 +871,7 @@ class DaemonController:
         :param output_id: Unique ID for output
         :type output_id: str
         """
+        output_triggers.invalidate()  # Output channels may have changed
         try:
             return self.controller['Output'].output_setup(action, output_id)
         except Exception as except_msg:
@@ -935,13 +1027,60 @@ class DaemonController:
                     args=(code,))
                 broadcast_ir.start()
 
+    def action_executor_status(self):
+        """Return the queue and latency metrics of the action executor"""
+        return action_executor.status()
+
+    def bluetooth_status(self):
+        """Return the advertisement and connection metrics of each Bluetooth adapter"""
+        return ble_brokers.status()
+
+    def i2c_status(self):
+        """Return the Inputs of each I2C bus and the latencies and errors of each device"""
+        return i2c_arbiter.status()
+
+    def backfill_start(self, kind, unique_id, start, end, options=None):
+        """
+        Start recalculating the measurements of a Math or Conversion from start to end
+
+        :return: 0 and the backfill ID for success, 1 and an error message for fail
+        """
+        try:
+            return 0, backfills.start(kind, unique_id, start, end, **(options or {}))
+        except Exception as except_msg:
+            self.logger.exception("Could not start backfill")
+            return 1, "Could not start backfill: {e}".format(e=except_msg)
+
+    def backfill_status(self, backfill_id=None):
+        """Return the progress of a backfill, or of all backfills"""
+        try:
+            return 0, backfills.status(backfill_id)
+        except Exception as except_msg:
+            return 1, str(except_msg)
+
+    def backfill_cancel(self, backfill_id):
+        try:
+            backfills.cancel(backfill_id)
+            return 0, "Backfill {} cancelled".format(backfill_id)
+        except Exception as except_msg:
+            return 1, str(except_msg)
+
     def trigger_action(self, action_id, message='', single_action=False, debug=False):
         try:
-            return trigger_action(
+            return_values = trigger_action(
                 action_id,
                 message=message,
                 single_action=single_action,
                 debug=debug)
+            if single_action:
+                return return_values
+            # A photo/video attachment is captured in the background and can't be returned
+            (message, note_tags, email_recipients,
+             attachment_file, attachment_type) = return_values
+            if not isinstance(attachment_file, str):
+                attachment_file = None
+            return (message, note_tags, email_recipients,
+                    attachment_file, attachment_type)
         except Exception as except_msg:
             message = "Could not trigger Conditional Actions: {err}".format(err=except_msg)
             self.logger.exception(message)
@@ -1128,6 +1267,10 @@ class PyroServer(object):
         """Updates all input information"""
         return self.mycodo.input_force_measurements(input_id)
 
+    def input_status(self, input_id):
+        """Return the runtime status of an active Input"""
+        return self.mycodo.input_status(input_id)
+
     def pid_hold(self, pid_id):
         """Hold PID Controller operation"""
         return self.mycodo.pid_hold(pid_id)
@@ -1202,6 +1345,28 @@ class PyroServer(object):
         return self.mycodo.controller['Output'].output_sec_currently_on(
             output_id, output_channel=output_channel)
 
+    def output_ramp(self,
+                    output_id,
+                    output_channel,
+                    start_duty_cycle,
+                    end_duty_cycle,
+                    duration,
+                    curve='linear',
+                    points=None,
+                    increment=None):
+        """Ramp the duty cycle of a PWM output channel"""
+        return self.mycodo.output_ramp(
+            output_id, output_channel, start_duty_cycle, end_duty_cycle, duration,
+            curve=curve, points=points, increment=increment)
+
+    def output_ramp_cancel(self, output_id, output_channel=None):
+        """Cancel the ramp of an output channel"""
+        return self.mycodo.output_ramp_cancel(output_id, output_channel=output_channel)
+
+    def output_ramps(self):
+        """Return the status of all running output ramps"""
+        return self.mycodo.output_ramps()
+
     def output_setup(self, action, output_id):
         """Add, delete, or modify a output in the running output controller"""
         return self.mycodo.output_setup(action, output_id)
@@ -1210,6 +1375,30 @@ class PyroServer(object):
         """Broadcast infrared code to all IR Triggers"""
         return self.mycodo.send_infrared_code_broadcast(code)
 
+    def action_executor_status(self):
+        """Return the queue and latency metrics of the action executor"""
+        return self.mycodo.action_executor_status()
+
+    def bluetooth_status(self):
+        """Return the advertisement and connection metrics of each Bluetooth adapter"""
+        return self.mycodo.bluetooth_status()
+
+    def i2c_status(self):
+        """Return the Inputs of each I2C bus and the latencies and errors of each device"""
+        return self.mycodo.i2c_status()
+
+    def backfill_start(self, kind, unique_id, start, end, options=None):
+        """Start recalculating the measurements of a Math or Conversion"""
+        return self.mycodo.backfill_start(kind, unique_id, start, end, options=options)
+
+    def backfill_status(self, backfill_id=None):
+        """Return the progress of a backfill, or of all backfills"""
+        return self.mycodo.backfill_status(backfill_id)
+
+    def backfill_cancel(self, backfill_id):
+        """Cancel a backfill"""
+        return self.mycodo.backfill_cancel(backfill_id)
+
     def trigger_action(self, action_id, message='', single_action=False, debug=False):
         """Trigger action"""
         return self.mycodo.trigger_action(
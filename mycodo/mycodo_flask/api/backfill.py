@@ -0,0 +1,186 @@
+# coding=utf-8
+import logging
+import traceback
+
+import flask_login
+from flask_accept import accept
+from flask_restx import Resource
+from flask_restx import abort
+from flask_restx import fields
+
+from mycodo.mycodo_client import DaemonControl
+from mycodo.mycodo_flask.api import api
+from mycodo.mycodo_flask.api import default_responses
+from mycodo.mycodo_flask.utils import utils_general
+
+logger = logging.getLogger(__name__)
+
+ns_backfill = api.namespace(
+    'backfill', description='Recalculate Math and Conversion measurements from past measurements')
+
+backfill_range_fields = ns_backfill.model('Backfill Range Fields', {
+    'start': fields.Float(
+        description='The start of the time range, in epoch seconds', required=True),
+    'end': fields.Float(
+        description='The end of the time range, in epoch seconds', required=True)
+})
+
+backfill_conversion_fields = ns_backfill.inherit('Backfill Conversion Fields', backfill_range_fields, {
+    'device_id': fields.String(
+        description='The unique ID of the device whose measurements are converted', required=True),
+    'channel': fields.Integer(
+        description='The channel of the measurements', required=True),
+    'measurement': fields.String(
+        description='The measurement (e.g. temperature). (Optional)', required=False)
+})
+
+backfill_started_fields = ns_backfill.model('Backfill Started Fields', {
+    'id': fields.String(description='The ID of the backfill')
+})
+
+backfill_fields = ns_backfill.model('Backfill Fields', {
+    'id': fields.String,
+    'kind': fields.String(description='math or conversion'),
+    'unique_id': fields.String(description='The unique ID of the Math or Conversion'),
+    'start': fields.Float,
+    'end': fields.Float,
+    'position': fields.Float(description='The time calculated up to, in epoch seconds'),
+    'progress': fields.Float(description='Percent of the time range calculated'),
+    'written': fields.Integer(description='The number of measurements written'),
+    'status': fields.String(description='queued, running, finished, failed or cancelled'),
+    'error': fields.String,
+    'updated': fields.Float
+})
+
+backfill_list_fields = ns_backfill.model('Backfill List Fields', {
+    'backfills': fields.List(fields.Nested(backfill_fields))
+})
+
+
+def start_backfill(kind, unique_id, payload, options=None):
+    """ Start a backfill with the daemon, aborting if it can't be started """
+    if not payload or payload.get('start') is None or payload.get('end') is None:
+        abort(422, custom='start and end are required')
+    try:
+        status, result = DaemonControl().backfill_start(
+            kind, unique_id, payload['start'], payload['end'], options=options)
+    except Exception:
+        abort(500,
+              message='An exception occurred',
+              error=traceback.format_exc())
+    if status:
+        abort(422, custom=result)
+    return {'id': result}, 202
+
+
+@ns_backfill.route('/')
+@ns_backfill.doc(security='apikey', responses=default_responses)
+class Backfills(Resource):
+    """Backfills of the daemon"""
+
+    @accept('application/vnd.mycodo.v1+json')
+    @ns_backfill.marshal_with(backfill_list_fields)
+    @flask_login.login_required
+    def get(self):
+        """Show the progress of all backfills since the daemon started"""
+        if not utils_general.user_has_permission('view_settings'):
+            abort(403)
+        try:
+            status, result = DaemonControl().backfill_status()
+        except Exception:
+            abort(500,
+                  message='An exception occurred',
+                  error=traceback.format_exc())
+        if status:
+            abort(500, custom=result)
+        return {'backfills': result}, 200
+
+
+@ns_backfill.route('/<string:backfill_id>')
+@ns_backfill.doc(
+    security='apikey',
+    responses=default_responses,
+    params={'backfill_id': 'The ID of the backfill'}
+)
+class BackfillID(Resource):
+    """Progress of a backfill"""
+
+    @accept('application/vnd.mycodo.v1+json')
+    @ns_backfill.marshal_with(backfill_fields)
+    @flask_login.login_required
+    def get(self, backfill_id):
+        """Show the progress of a backfill"""
+        if not utils_general.user_has_permission('view_settings'):
+            abort(403)
+        try:
+            status, result = DaemonControl().backfill_status(backfill_id)
+        except Exception:
+            abort(500,
+                  message='An exception occurred',
+                  error=traceback.format_exc())
+        if status:
+            abort(404, custom=result)
+        return result, 200
+
+    @accept('application/vnd.mycodo.v1+json')
+    @flask_login.login_required
+    def delete(self, backfill_id):
+        """Cancel a backfill"""
+        if not utils_general.user_has_permission('edit_controllers'):
+            abort(403)
+        try:
+            status, result = DaemonControl().backfill_cancel(backfill_id)
+        except Exception:
+            abort(500,
+                  message='An exception occurred',
+                  error=traceback.format_exc())
+        if status:
+            abort(404, custom=result)
+        return {'message': result}, 200
+
+
+@ns_backfill.route('/math/<string:unique_id>')
+@ns_backfill.doc(
+    security='apikey',
+    responses={**default_responses, 202: 'Backfill Started'},
+    params={'unique_id': 'The unique ID of the Math'}
+)
+class BackfillMath(Resource):
+    """Recalculates the measurements of a Math"""
+
+    @accept('application/vnd.mycodo.v1+json')
+    @ns_backfill.expect(backfill_range_fields)
+    @ns_backfill.marshal_with(backfill_started_fields, code=202)
+    @flask_login.login_required
+    def post(self, unique_id):
+        """Calculate the measurements of a Math every Period over a past time range"""
+        if not utils_general.user_has_permission('edit_controllers'):
+            abort(403)
+        return start_backfill('math', unique_id, ns_backfill.payload)
+
+
+@ns_backfill.route('/conversion/<string:unique_id>')
+@ns_backfill.doc(
+    security='apikey',
+    responses={**default_responses, 202: 'Backfill Started'},
+    params={'unique_id': 'The unique ID of the Conversion'}
+)
+class BackfillConversion(Resource):
+    """Converts past measurements of a device"""
+
+    @accept('application/vnd.mycodo.v1+json')
+    @ns_backfill.expect(backfill_conversion_fields)
+    @ns_backfill.marshal_with(backfill_started_fields, code=202)
+    @flask_login.login_required
+    def post(self, unique_id):
+        """Convert the measurements of a device stored in the unit the Conversion converts from"""
+        if not utils_general.user_has_permission('edit_controllers'):
+            abort(403)
+        payload = ns_backfill.payload or {}
+        if not payload.get('device_id') or payload.get('channel') is None:
+            abort(422, custom='device_id and channel are required')
+        return start_backfill('conversion', unique_id, payload, options={
+            'device_id': payload['device_id'],
+            'channel': payload['channel'],
+            'measurement': payload.get('measurement')
+        })
@@ -1,24 +1,39 @@
 # coding=utf-8
 import datetime
 import logging
+import math
 import traceback
 
 import flask_login
+from flask import request
 from flask_accept import accept
 from flask_restx import Resource
 from flask_restx import abort
 from flask_restx import fields
 
-from mycodo.databases.models import Unit
+from mycodo.config import API_BULK_MEASUREMENTS_MAX
+from mycodo.config import API_HISTORICAL_LIMIT_MAX
 from mycodo.mycodo_flask.api import api
 from mycodo.mycodo_flask.api import default_responses
 from mycodo.mycodo_flask.utils import utils_general
+from mycodo.mycodo_flask.utils.utils_measurement import unit_cache
+from mycodo.mycodo_flask.utils.utils_series import SERIES_MIMETYPE
+from mycodo.mycodo_flask.utils.utils_series import STREAM_MIMETYPES
+from mycodo.mycodo_flask.utils.utils_series import series_response
+from mycodo.mycodo_flask.utils.utils_series import stream_response
+from mycodo.utils.influx import AGGREGATE_FUNCTIONS
+from mycodo.utils.influx import format_influxdb_data
+from mycodo.utils.influx import INFLUXDB_TIME_MAX
+from mycodo.utils.influx import INFLUXDB_TIME_MIN
+from mycodo.utils.influx import next_page_cursor
+from mycodo.utils.influx import parse_line_protocol
 from mycodo.utils.influx import read_influxdb_function
 from mycodo.utils.influx import read_influxdb_list
+from mycodo.utils.influx import read_influxdb_page
 from mycodo.utils.influx import read_influxdb_single
 from mycodo.utils.influx import valid_date_str
 from mycodo.utils.influx import write_influxdb_value
-from mycodo.utils.system_pi import add_custom_units
+from mycodo.utils.influx_writer import influx_writer
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +49,28 @@ measurement_create_fields = ns_measurement.model('Measurement Create Fields', {
         required=False)
 })
 
+measurement_bulk_item_fields = ns_measurement.model('Measurement Bulk Item Fields', {
+    'unique_id': fields.String(
+        description='The unique ID of the measurement', required=True),
+    'unit': fields.String(
+        description='The unit of the measurement', required=True),
+    'channel': fields.Integer(
+        description='The channel of the measurement', required=True),
+    'measure': fields.String(
+        description='The measurement (e.g. temperature). (Optional)', required=False),
+    'value': fields.Float(
+        description='The value of the measurement', required=True),
+    'timestamp': fields.String(
+        description='The timestamp of the measurement, in %Y-%m-%dT%H:%M:%S.%fZ format '
+                    'or as epoch seconds. (Optional; exclude to create a measurement '
+                    'with a timestamp of the current time)',
+        required=False)
+})
+
+measurement_bulk_fields = ns_measurement.model('Measurement Bulk Fields', {
+    'measurements': fields.List(fields.Nested(measurement_bulk_item_fields)),
+})
+
 measurement_fields = ns_measurement.model('Measurement Fields', {
     'time': fields.DateTime(dt_format='iso8601'),
     'value': fields.Float,
@@ -43,6 +80,12 @@ measurement_list_fields = ns_measurement.model('Measurement Fields List', {
     'measurements': fields.List(fields.Nested(measurement_fields)),
 })
 
+measurement_page_fields = ns_measurement.model('Measurement Fields Page', {
+    'measurements': fields.List(fields.Nested(measurement_fields)),
+    'next_cursor': fields.Integer(
+        description='The cursor of the next page, or null if this is the last page'),
+})
+
 measurement_function_fields = ns_measurement.model('Measurement Function Fields', {
     'value': fields.Float,
 })
@@ -70,7 +113,7 @@ class MeasurementsCreate(Resource):
         if not utils_general.user_has_permission('edit_controllers'):
             abort(403)
 
-        if unit not in add_custom_units(Unit.query.all()):
+        if unit not in unit_cache:
             abort(422, custom='Unit ID not found')
         if channel < 0:
             abort(422, custom='channel must be >= 0')
@@ -104,6 +147,158 @@ class MeasurementsCreate(Resource):
                   error=traceback.format_exc())
 
 
+def bulk_measurement_point(measurement):
+    """Validate a measurement of a bulk request, returning its influxdb data point"""
+    if not isinstance(measurement, dict):
+        raise ValueError('measurement must be an object')
+
+    unique_id = measurement.get('unique_id')
+    if not unique_id or not isinstance(unique_id, str):
+        raise ValueError('unique_id must be a string')
+    unit = measurement.get('unit')
+    if not isinstance(unit, str) or unit not in unit_cache:
+        raise ValueError('Unit ID not found')
+
+    try:
+        channel = int(measurement.get('channel'))
+    except (TypeError, ValueError):
+        raise ValueError('channel must be an integer')
+    if channel < 0:
+        raise ValueError('channel must be >= 0')
+
+    try:
+        value = float(measurement.get('value'))
+    except (TypeError, ValueError):
+        raise ValueError('value does not represent a float')
+    if not math.isfinite(value):
+        raise ValueError('value must be finite')
+
+    timestamp = measurement.get('timestamp')
+    if isinstance(timestamp, str):
+        try:
+            timestamp = datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%fZ')
+        except ValueError:
+            raise ValueError('Invalid timestamp format. Must be formatted as '
+                             '%Y-%m-%dT%H:%M:%S.%fZ or epoch seconds')
+    elif isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        try:
+            timestamp = datetime.datetime.utcfromtimestamp(timestamp)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError('Invalid timestamp: epoch seconds out of range')
+    elif timestamp is not None and not isinstance(timestamp, datetime.datetime):
+        raise ValueError('Invalid timestamp format. Must be formatted as '
+                         '%Y-%m-%dT%H:%M:%S.%fZ or epoch seconds')
+    if timestamp is not None and not INFLUXDB_TIME_MIN <= timestamp <= INFLUXDB_TIME_MAX:
+        raise ValueError('Invalid timestamp: must be between 1677 and 2262')
+
+    return format_influxdb_data(
+        unique_id, unit, value,
+        channel=channel,
+        measure=measurement.get('measure') or None,
+        timestamp=timestamp)
+
+
+@ns_measurement.route('/bulk')
+@ns_measurement.doc(
+    security='apikey',
+    responses={
+        **default_responses,
+        202: 'Measurements Queued',
+        413: 'Too Many Measurements',
+        503: 'Write Queue Full'
+    },
+    params={
+        'precision': 'The precision of line protocol timestamps: ns (default), u, ms or s'
+    }
+)
+class MeasurementsBulk(Resource):
+    """Creates many measurements with one request"""
+
+    @accept('application/vnd.mycodo.v1+json')
+    @ns_measurement.expect(measurement_bulk_fields)
+    @flask_login.login_required
+    def post(self):
+        """
+        Create measurements from a list of measurements or, with a Content-Type of
+        text/plain, from influxdb line protocol (e.g. C,device_id=ID,channel=0,measure=temperature value=23.5).
+        Valid measurements are queued and written in batches. The status of each
+        measurement (queued, invalid or rejected) is returned in the order received.
+        """
+        if not utils_general.user_has_permission('edit_controllers'):
+            abort(403)
+
+        line_protocol = request.mimetype == 'text/plain'
+        if line_protocol:
+            precision = request.args.get('precision', 'ns')
+            entries = [each_line for each_line in request.get_data(as_text=True).splitlines()
+                       if each_line.strip() and not each_line.lstrip().startswith('#')]
+        else:
+            payload = request.get_json(silent=True)
+            entries = payload.get('measurements') if isinstance(payload, dict) else None
+            if not isinstance(entries, list):
+                abort(422, custom='measurements must be a list')
+
+        if len(entries) > API_BULK_MEASUREMENTS_MAX:
+            abort(413, custom='A maximum of {} measurements may be created per request'.format(
+                API_BULK_MEASUREMENTS_MAX))
+
+        points = []
+        results = []
+        for index, each_entry in enumerate(entries):
+            try:
+                if line_protocol:
+                    each_entry = parse_line_protocol(each_entry, precision)
+                points.append(bulk_measurement_point(each_entry))
+                results.append({'index': index, 'status': 'queued'})
+            except ValueError as err:
+                results.append({'index': index, 'status': 'invalid', 'error': str(err)})
+
+        try:
+            queued = influx_writer.submit(points) if points else 0
+        except Exception:
+            abort(500,
+                  message='An exception occurred',
+                  error=traceback.format_exc())
+
+        # The queue may not have had room for all valid measurements
+        rejected = [each for each in results if each['status'] == 'queued'][queued:]
+        for each_result in rejected:
+            each_result['status'] = 'rejected'
+            each_result['error'] = 'Write queue full, try again later'
+
+        if queued:
+            status_code = 202
+        elif points:
+            status_code = 503
+        else:
+            status_code = 422
+        return {
+            'queued': queued,
+            'invalid': len(results) - len(points),
+            'rejected': len(rejected),
+            'measurements': results
+        }, status_code
+
+
+historical_parser = ns_measurement.parser()
+historical_parser.add_argument(
+    'limit', type=int, location='args',
+    help='The maximum number of measurements to return (max {}). The response '
+         'includes a next_cursor to request the following page with.'.format(
+            API_HISTORICAL_LIMIT_MAX))
+historical_parser.add_argument(
+    'cursor', type=int, location='args',
+    help='The next_cursor of the previous page')
+historical_parser.add_argument(
+    'function', type=str, location='args',
+    help='Aggregate the measurements with an InfluxDB function: {}'.format(
+        ', '.join(AGGREGATE_FUNCTIONS)))
+historical_parser.add_argument(
+    'group_sec', type=int, location='args',
+    help='Aggregate the measurements of each group_sec seconds (requires epoch_start; '
+         'the function defaults to MEAN)')
+
+
 @ns_measurement.route('/historical/<string:unique_id>/<string:unit>/<int:channel>/<int:epoch_start>/<int:epoch_end>')
 @ns_measurement.doc(
     security='apikey',
@@ -119,23 +314,34 @@ class MeasurementsCreate(Resource):
 class MeasurementsHistorical(Resource):
     """Interacts with Measurement settings in the SQL database"""
 
-    @accept('application/vnd.mycodo.v1+json')
-    @ns_measurement.marshal_with(measurement_list_fields)
-    @flask_login.login_required
-    def get(self, unique_id, unit, channel, epoch_start, epoch_end):
-        """
-        Return a list of measurements found within a time range
-        """
+    @staticmethod
+    def validate(unit, channel, epoch_start, epoch_end):
+        """Check permissions and arguments, return the arguments of the query"""
         if not utils_general.user_has_permission('view_settings'):
             abort(403)
 
-        if unit not in add_custom_units(Unit.query.all()):
+        if unit not in unit_cache:
             abort(422, custom='Unit ID not found')
         if channel < 0:
             abort(422, custom='channel must be >= 0')
         if epoch_start < 0 or epoch_end < 0:
             abort(422, custom='epoch_start and epoch_end must be >= 0')
 
+        args = historical_parser.parse_args()
+        if args['limit'] is not None and not 0 < args['limit'] <= API_HISTORICAL_LIMIT_MAX:
+            abort(422, custom='limit must be between 1 and {}'.format(API_HISTORICAL_LIMIT_MAX))
+        if args['cursor'] is not None and args['cursor'] < 0:
+            abort(422, custom='cursor must be >= 0')
+        function = args['function'].upper() if args['function'] else None
+        if function and function not in AGGREGATE_FUNCTIONS:
+            abort(422, custom='function must be one of {}'.format(', '.join(AGGREGATE_FUNCTIONS)))
+        if args['group_sec'] is not None:
+            if args['group_sec'] < 1:
+                abort(422, custom='group_sec must be >= 1')
+            if not epoch_start:
+                abort(422, custom='group_sec requires epoch_start')
+            function = function or 'MEAN'
+
         utc_offset_timedelta = datetime.datetime.utcnow() - datetime.datetime.now()
 
         if epoch_start:
@@ -152,17 +358,68 @@ class MeasurementsHistorical(Resource):
         else:
             end_str = None
 
+        return {
+            'start_str': start_str,
+            'end_str': end_str,
+            'cursor_ns': args['cursor'],
+            'function': function,
+            'group_sec': args['group_sec'],
+            'limit': args['limit']
+        }
+
+    @accept('application/vnd.mycodo.v1+json')
+    @ns_measurement.expect(historical_parser)
+    @ns_measurement.marshal_with(measurement_page_fields)
+    @flask_login.login_required
+    def get(self, unique_id, unit, channel, epoch_start, epoch_end):
+        """
+        Return a list of measurements found within a time range.
+        Also available as NDJSON (Accept: application/x-ndjson) and CSV (Accept: text/csv),
+        streamed as the measurements are read.
+        """
+        query = self.validate(unit, channel, epoch_start, epoch_end)
+
         try:
-            return_ = read_influxdb_list(
-                unique_id, unit, channel, start_str=start_str, end_str=end_str)
-            if return_ and len(return_) > 0:
-                dict_return = {'measurements': []}
-                for each_set in return_:
-                    dict_return['measurements'].append(
-                        {'time': each_set[0], 'value': each_set[1]})
-                return dict_return, 200
-            else:
-                return return_, 200
+            return_ = read_influxdb_page(unique_id, unit, channel, epoch='ns', **query)
+            return {
+                'measurements': [
+                    {'time': datetime.datetime.fromtimestamp(
+                        each_set[0] / 1000000000, datetime.timezone.utc),
+                     'value': each_set[1]} for each_set in return_],
+                'next_cursor': next_page_cursor(return_, query['limit'], query['group_sec'])
+            }, 200
+        except Exception:
+            abort(500,
+                  message='An exception occurred',
+                  error=traceback.format_exc())
+
+    @get.support(SERIES_MIMETYPE)
+    @flask_login.login_required
+    def get_series(self, unique_id, unit, channel, epoch_start, epoch_end):
+        """
+        Return measurements found within a time range in the compact columnar series format
+        """
+        query = self.validate(unit, channel, epoch_start, epoch_end)
+
+        try:
+            return_ = read_influxdb_page(unique_id, unit, channel, epoch='ms', **query)
+            return series_response(return_, compact=True)
+        except Exception:
+            abort(500,
+                  message='An exception occurred',
+                  error=traceback.format_exc())
+
+    @get.support(*STREAM_MIMETYPES)
+    @flask_login.login_required
+    def get_stream(self, unique_id, unit, channel, epoch_start, epoch_end):
+        """
+        Stream measurements found within a time range as NDJSON or CSV
+        """
+        query = self.validate(unit, channel, epoch_start, epoch_end)
+
+        try:
+            chunks = read_influxdb_page(unique_id, unit, channel, epoch=None, chunked=True, **query)
+            return stream_response(chunks, request.accept_mimetypes.best_match(STREAM_MIMETYPES))
         except Exception:
             abort(500,
                   message='An exception occurred',
@@ -197,7 +454,7 @@ class MeasurementsHistoricalFunction(Resource):
         if not utils_general.user_has_permission('view_settings'):
             abort(403)
 
-        if unit not in add_custom_units(Unit.query.all()):
+        if unit not in unit_cache:
             abort(422, custom='Unit ID not found')
         if channel < 0:
             abort(422, custom='channel must be >= 0')
@@ -257,7 +514,7 @@ class MeasurementsLast(Resource):
         if not utils_general.user_has_permission('view_settings'):
             abort(403)
 
-        if unit not in add_custom_units(Unit.query.all()):
+        if unit not in unit_cache:
             abort(422, custom='Unit ID not found')
         if channel < 0:
             abort(422, custom='channel must be >= 0')
@@ -291,23 +548,28 @@ class MeasurementsLast(Resource):
 class MeasurementsPast(Resource):
     """Interacts with Measurement settings in the SQL database"""
 
-    @accept('application/vnd.mycodo.v1+json')
-    @ns_measurement.marshal_with(measurement_list_fields)
-    @flask_login.login_required
-    def get(self, unique_id, unit, channel, past_seconds):
-        """
-        Return a list of measurements found within a duration from the past to the present
-        """
+    @staticmethod
+    def validate(unit, channel, past_seconds):
+        """Check permissions and arguments"""
         if not utils_general.user_has_permission('view_settings'):
             abort(403)
 
-        if unit not in add_custom_units(Unit.query.all()):
+        if unit not in unit_cache:
             abort(422, custom='Unit ID not found')
         if channel < 0:
             abort(422, custom='channel must be >= 0')
         if past_seconds < 1:
             abort(422, custom='past_seconds must be >= 1')
 
+    @accept('application/vnd.mycodo.v1+json')
+    @ns_measurement.marshal_with(measurement_list_fields)
+    @flask_login.login_required
+    def get(self, unique_id, unit, channel, past_seconds):
+        """
+        Return a list of measurements found within a duration from the past to the present
+        """
+        self.validate(unit, channel, past_seconds)
+
         try:
             return_ = read_influxdb_list(
                 unique_id, unit, channel, duration_sec=past_seconds)
@@ -323,3 +585,23 @@ class MeasurementsPast(Resource):
             abort(500,
                   message='An exception occurred',
                   error=traceback.format_exc())
+
+    @get.support(SERIES_MIMETYPE)
+    @flask_login.login_required
+    def get_series(self, unique_id, unit, channel, past_seconds):
+        """
+        Return measurements found within a duration from the past to the present
+        in the compact columnar series format
+        """
+        self.validate(unit, channel, past_seconds)
+
+        try:
+            return_ = read_influxdb_list(
+                unique_id, unit, channel, duration_sec=past_seconds, epoch='ms')
+            if return_ is None or return_ == ('', 204):
+                return_ = []  # No measurements, or the query couldn't be built
+            return series_response(return_, compact=True)
+        except Exception:
+            abort(500,
+                  message='An exception occurred',
+                  error=traceback.format_exc())
@@ -86,6 +86,7 @@ math_fields = api.model('Math Settings Fields', {
     'period': fields.Float,
     'start_offset': fields.Float,
     'max_measure_age': fields.Integer,
+    'update_on_input': fields.Boolean,
     'order_of_use': fields.String,
     'difference_reverse_order': fields.Boolean,
     'difference_absolute': fields.Boolean,
@@ -2,7 +2,6 @@
 #
 #  app.py - Flask web server for Mycodo
 #
-import base64
 import logging
 
 import flask_login
@@ -37,7 +36,12 @@ from mycodo.mycodo_flask import routes_static
 from mycodo.mycodo_flask.api import api_blueprint
 from mycodo.mycodo_flask.api import init_api
 from mycodo.mycodo_flask.extensions import db
+from mycodo.mycodo_flask.utils.utils_authentication import add_auth_timing_header
+from mycodo.mycodo_flask.utils.utils_authentication import api_keys_from_request
+from mycodo.mycodo_flask.utils.utils_authentication import get_user_by_api_key
+from mycodo.mycodo_flask.utils.utils_authentication import get_user_by_id
 from mycodo.mycodo_flask.utils.utils_general import get_ip_address
+from mycodo.utils.jobs import job_runner
 
 logger = logging.getLogger(__name__)
 
@@ -90,6 +94,9 @@ def register_extensions(app):
                 csp = {'default-src': ['*', '\'unsafe-inline\'']}
                 Talisman(app, content_security_policy=csp)
 
+        # Run the background jobs of long operations (export, import, install)
+        job_runner.start(app)
+
 
 def register_blueprints(app):
     """ register blueprints to the app """
@@ -156,44 +163,21 @@ def extension_login_manager(app):
 
     @login_manager.user_loader
     def user_loader(user_id):
-        user = User.query.filter(User.id == user_id).first()
-        if not user:
-            return
-        return user
+        return get_user_by_id(user_id)
 
     @login_manager.request_loader
     def load_user_from_request(req):
-        try:  # first, try to login using the api_key url arg
-            api_key = req.args.get('api_key').replace(' ', '+')
-            api_key = base64.b64decode(api_key)
-            user = User.query.filter_by(api_key=api_key).first()
-            if user:
-                return user
-        except:
-            pass
-
-        try:  # next, try to login using Basic Auth
-            api_key = req.headers.get('Authorization')
-            api_key = api_key.replace('Basic ', '', 1)
-            api_key = base64.b64decode(api_key)
-            user = User.query.filter_by(api_key=api_key).first()
-            if user:
-                return user
-        except:
-            pass
-
-        try:  # next, try to login using X-API-KEY
-            api_key = req.headers.get('X-API-KEY')
-            api_key = base64.b64decode(api_key)
-            user = User.query.filter_by(api_key=api_key).first()
+        # Try the api_key url arg, then Basic Auth, then X-API-KEY
+        for api_key in api_keys_from_request(req):
+            user = get_user_by_api_key(api_key)
             if user:
                 return user
-        except:
-            pass
 
         # User unable to be logged in
         return
 
+    app.after_request(add_auth_timing_header)
+
     @login_manager.unauthorized_handler
     def unauthorized():
         try:
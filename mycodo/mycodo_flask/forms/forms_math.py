@@ -46,6 +46,7 @@ class MathMod(FlaskForm):
     start_offset = DecimalField(
         lazy_gettext('Start Offset (seconds)'),
         widget=NumberInput(step='any'))
+    update_on_input = BooleanField(lazy_gettext('Update on Input'))
     inputs = SelectMultipleField(lazy_gettext('Inputs'))
     select_measurement_unit = StringField(TRANSLATIONS['select_measurement_unit']['title'])
     measurements_enabled = SelectMultipleField(TRANSLATIONS['measurements_enabled']['title'])
@@ -39,6 +39,10 @@ class EnergyUsageMod(FlaskForm):
     energy_usage_delete = SubmitField(TRANSLATIONS['delete']['title'])
 
 
+class UsageReport(FlaskForm):
+    usage_report_generate = SubmitField(lazy_gettext('Generate Report'))
+
+
 #
 # Daemon Control
 #
@@ -75,6 +79,7 @@ class ExportInfluxdb(FlaskForm):
 class ImportInfluxdb(FlaskForm):
     influxdb_import_file = FileField(TRANSLATIONS['upload']['title'])
     influxdb_import_upload = SubmitField(lazy_gettext('Import Influxdb'))
+    influxdb_import_resume = SubmitField(lazy_gettext('Resume Import'))
 
 
 #
@@ -93,6 +98,23 @@ class LogView(FlaskForm):
     )
 
     log = StringField(lazy_gettext('Log'))
+    level = SelectField(
+        lazy_gettext('Level'),
+        choices=[
+            ('', lazy_gettext('All Levels')),
+            ('DEBUG', 'Debug'),
+            ('INFO', 'Info'),
+            ('WARNING', 'Warning'),
+            ('ERROR', 'Error'),
+            ('CRITICAL', 'Critical')
+        ]
+    )
+    logger = StringField(
+        lazy_gettext('Logger'),
+        render_kw={'placeholder': lazy_gettext('Logger (e.g. mycodo.pid)')})
+    search = StringField(
+        lazy_gettext('Search'),
+        render_kw={'placeholder': lazy_gettext('Search')})
     log_view = SubmitField(lazy_gettext('View Log'))
 
 
@@ -5,19 +5,18 @@ import logging
 import socket
 import subprocess
 import threading
-import zipfile
 from collections import OrderedDict
 
 import flask_login
-import io
 import os
 from flask import Blueprint
+from flask import Response
 from flask import flash
 from flask import make_response
 from flask import redirect
 from flask import render_template
 from flask import request
-from flask import send_file
+from flask import stream_with_context
 from flask import url_for
 from flask_babel import gettext
 from pkg_resources import parse_version
@@ -48,14 +47,22 @@ from mycodo.mycodo_flask.forms import forms_dependencies
 from mycodo.mycodo_flask.forms import forms_misc
 from mycodo.mycodo_flask.routes_static import inject_variables
 from mycodo.mycodo_flask.utils import utils_general
+from mycodo.utils.backup_store import BackupStore
 from mycodo.utils.functions import parse_function_information
 from mycodo.utils.github_release_info import MycodoRelease
 from mycodo.utils.inputs import parse_input_information
+from mycodo.utils.jobs import JobCanceled
+from mycodo.utils.jobs import JobError
+from mycodo.utils.jobs import job_runner
+from mycodo.utils.jobs import job_task
 from mycodo.utils.outputs import parse_output_information
 from mycodo.utils.statistics import return_stat_file_dict
 from mycodo.utils.system_pi import can_perform_backup
 from mycodo.utils.system_pi import get_directory_size
 from mycodo.utils.system_pi import internet
+from mycodo.utils.zip_stream import directory_files
+from mycodo.utils.zip_stream import zip_stream
+from mycodo.utils.zip_stream import zip_stream_entries
 
 logger = logging.getLogger('mycodo.mycodo_flask.admin')
 
@@ -81,21 +88,31 @@ def admin_backup():
         return redirect(url_for('routes_general.home'))
 
     form_backup = forms_misc.Backup()
+    backup_store = BackupStore()
 
     backup_dirs_tmp = []
     if not os.path.isdir('/var/Mycodo-backups'):
         flash("Error: Backup directory doesn't exist.", "error")
     else:
-        backup_dirs_tmp = sorted(next(os.walk(BACKUP_PATH))[1])
-        backup_dirs_tmp.reverse()
-
-    backup_dirs = []
-    full_paths = []
+        backup_dirs_tmp = next(os.walk(BACKUP_PATH))[1]
+
+    # Deduplicated backups, and backups that are full copies of the install
+    backups = []
+    for each_snapshot in backup_store.summaries():
+        backups.append((
+            (each_snapshot['name'],
+             each_snapshot['size'] / 1000000.0,
+             each_snapshot['added'] / 1000000.0),
+            backup_store.snapshot_path(each_snapshot['name'])))
     for each_dir in backup_dirs_tmp:
         if each_dir.startswith("Mycodo-backup-"):
             full_path = os.path.join(BACKUP_PATH, each_dir)
-            backup_dirs.append((each_dir, get_directory_size(full_path) / 1000000.0))
-            full_paths.append(full_path)
+            backups.append((
+                (each_dir, get_directory_size(full_path) / 1000000.0, None),
+                full_path))
+    backups.sort(reverse=True)
+    backup_dirs = [each_backup[0] for each_backup in backups]
+    full_paths = [each_backup[1] for each_backup in backups]
 
     if request.method == 'POST':
         if form_backup.backup.data:
@@ -121,50 +138,43 @@ def admin_backup():
                     'error')
 
         elif form_backup.download.data:
-            def get_all_file_paths(directory):
-                file_paths = []
-                for root, directories, files in os.walk(directory):
-                    for filename in files:
-                        # join the two strings in order to form the full filepath
-                        filepath = os.path.join(root, filename)
-                        file_paths.append(filepath)
-                return file_paths
-
             try:
                 backup_date_version = form_backup.selected_dir.data
-                download_dir = os.path.join(BACKUP_PATH, 'Mycodo-backup-{}'.format(backup_date_version))
+                backup_name = 'Mycodo-backup-{}'.format(backup_date_version)
+                download_dir = os.path.join(BACKUP_PATH, backup_name)
                 save_file = "Mycodo_Backup_{dv}_{host}_.zip".format(
                     dv=backup_date_version, host=socket.gethostname().replace(' ', ''))
-                file_paths = get_all_file_paths(download_dir)
-                string_remove = "{}".format(os.path.join(BACKUP_PATH, download_dir))
 
-                if not os.path.isdir(download_dir):
-                    flash("Directory not found: {}".format(download_dir), "error")
+                if os.path.isfile(backup_store.snapshot_path(backup_name)):
+                    archive = zip_stream_entries(backup_store.archive_entries(backup_name))
+                elif os.path.isdir(download_dir):
+                    # The Mycodo root is the zip root
+                    archive = zip_stream(directory_files(download_dir))
                 else:
-                    # Zip all files in the_backup directory
-                    data = io.BytesIO()
-                    with zipfile.ZipFile(data, 'w') as zip:
-                        # writing each file one by one
-                        for file in file_paths:
-                            # Remove first two directory names from zip file, so the Mycodo root is the zip root
-                            zip.write(file, file.replace(string_remove, ""))
-                    data.seek(0)
-
-                    # Send zip file to user
-                    return send_file(
-                        data,
-                        mimetype='application/zip',
-                        as_attachment=True,
-                        attachment_filename=save_file
-                    )
+                    archive = None
+                    flash("Directory not found: {}".format(download_dir), "error")
+
+                if archive:
+                    # Send zip file to user, created while it's sent
+                    response = Response(stream_with_context(archive), mimetype='application/zip')
+                    response.headers['Content-Disposition'] = \
+                        'attachment; filename={}'.format(save_file)
+                    return response
             except Exception as err:
                 flash("Error: {}".format(err), "error")
 
         elif form_backup.delete.data:
-            cmd = "{pth}/mycodo/scripts/mycodo_wrapper backup-delete {dir}" \
-                  " 2>&1".format(pth=INSTALL_DIRECTORY,
-                                 dir=form_backup.selected_dir.data)
-            subprocess.Popen(cmd, shell=True)
+            backup_name = 'Mycodo-backup-{}'.format(form_backup.selected_dir.data)
+            if os.path.isfile(backup_store.snapshot_path(backup_name)):
+                # Deletes the chunks no other backup contains
+                delete_backup = threading.Thread(
+                    target=backup_store.delete, args=(backup_name,))
+                delete_backup.start()
+            else:
+                cmd = "{pth}/mycodo/scripts/mycodo_wrapper backup-delete {dir}" \
+                      " 2>&1".format(pth=INSTALL_DIRECTORY,
+                                     dir=form_backup.selected_dir.data)
+                subprocess.Popen(cmd, shell=True)
             flash(gettext("Deletion of backup in progress"),
                   "success")
 
@@ -184,7 +194,8 @@ def admin_backup():
                            full_paths=full_paths)
 
 
-def install_dependencies(dependencies):
+@job_task('install_dependencies')
+def install_dependencies(job, dependencies):
     now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     dependency_list = []
     for each_dependency in dependencies:
@@ -194,19 +205,31 @@ def install_dependencies(dependencies):
         f.write("\n[{time}] Dependency installation beginning. Installing: {deps}\n\n".format(
             time=now, deps=",".join(dependency_list)))
 
-    for each_dep in dependencies:
-        cmd = "{pth}/mycodo/scripts/mycodo_wrapper install_dependency {dep}" \
-              " | ts '[%Y-%m-%d %H:%M:%S]' >> {log} 2>&1".format(
-                pth=INSTALL_DIRECTORY,
-                log=DEPENDENCY_LOG_FILE,
-                dep=each_dep[1])
-        dep = subprocess.Popen(cmd, shell=True)
-        dep.wait()
+    # Each dependency, then permissions, the daemon restart and the frontend reload
+    steps = len(dependencies) + 3
+    try:
+        for index, each_dep in enumerate(dependencies):
+            job.progress(index, steps, "Installing {dep}".format(dep=each_dep[0]))
+            cmd = "{pth}/mycodo/scripts/mycodo_wrapper install_dependency {dep}" \
+                  " | ts '[%Y-%m-%d %H:%M:%S]' >> {log} 2>&1".format(
+                    pth=INSTALL_DIRECTORY,
+                    log=DEPENDENCY_LOG_FILE,
+                    dep=each_dep[1])
+            dep = subprocess.Popen(cmd, shell=True)
+            dep.wait()
+            now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with open(DEPENDENCY_LOG_FILE, 'a') as f:
+                f.write("\n[{time}] End install of {dep}\n\n".format(
+                    time=now, dep=each_dep[0]))
+    except JobCanceled:
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         with open(DEPENDENCY_LOG_FILE, 'a') as f:
-            f.write("\n[{time}] End install of {dep}\n\n".format(
-                time=now, dep=each_dep[0]))
+            f.write("\n[{time}] #### Dependency install canceled\n\n".format(time=now))
+        with open(DEPENDENCY_INIT_FILE, 'w') as f:
+            f.write('0')
+        raise
 
+    job.progress(len(dependencies), steps, "Updating permissions")
     cmd = "{pth}/mycodo/scripts/mycodo_wrapper update_permissions" \
           " | ts '[%Y-%m-%d %H:%M:%S]' >> {log}  2>&1".format(
             pth=INSTALL_DIRECTORY,
@@ -221,6 +244,7 @@ def install_dependencies(dependencies):
     with open(DEPENDENCY_INIT_FILE, 'w') as f:
         f.write('0')
 
+    job.progress(len(dependencies) + 1, steps, "Restarting the daemon")
     cmd = "{pth}/mycodo/scripts/mycodo_wrapper daemon_restart" \
           " | ts '[%Y-%m-%d %H:%M:%S]' >> {log}  2>&1".format(
             pth=INSTALL_DIRECTORY,
@@ -228,6 +252,8 @@ def install_dependencies(dependencies):
     init = subprocess.Popen(cmd, shell=True)
     init.wait()
 
+    # The job is done before the reload, which may stop its worker
+    job.progress(steps, steps, "Reloading the frontend")
     cmd = "{pth}/mycodo/scripts/mycodo_wrapper frontend_reload" \
           " | ts '[%Y-%m-%d %H:%M:%S]' >> {log}  2>&1".format(
             pth=INSTALL_DIRECTORY,
@@ -329,12 +355,14 @@ def admin_dependencies(device):
             return redirect(url_for('routes_admin.admin_dependencies', device=device))
 
         if form_dependencies.install.data:
-            with open(DEPENDENCY_INIT_FILE, 'w') as f:
-                f.write('1')
-            install_deps = threading.Thread(
-                target=install_dependencies,
-                args=(device_unmet_dependencies,))
-            install_deps.start()
+            try:
+                job_runner.submit(
+                    'install_dependencies', 'Install Dependencies',
+                    dependencies=device_unmet_dependencies)
+                with open(DEPENDENCY_INIT_FILE, 'w') as f:
+                    f.write('1')
+            except JobError as err:
+                flash(str(err), 'error')
 
         return redirect(url_for('routes_admin.admin_dependencies', device=device))
 
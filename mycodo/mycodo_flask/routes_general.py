@@ -2,6 +2,7 @@
 import calendar
 import datetime
 import logging
+import math
 import subprocess
 import time
 from importlib import import_module
@@ -13,6 +14,7 @@ from flask import Response
 from flask import flash
 from flask import jsonify
 from flask import redirect
+from flask import request
 from flask import send_file
 from flask import send_from_directory
 from flask import url_for
@@ -32,10 +34,11 @@ from mycodo.config import INSTALL_DIRECTORY
 from mycodo.config import LOG_PATH
 from mycodo.config import PATH_CAMERAS
 from mycodo.config import PATH_NOTE_ATTACHMENTS
+from mycodo.config import THERMAL_MAX_FRAMES
+from mycodo.config import USAGE_REPORTS_PATH
 from mycodo.databases.models import Camera
-from mycodo.databases.models import Conversion
-from mycodo.databases.models import DeviceMeasurements
 from mycodo.databases.models import Input
+from mycodo.databases.models import Job
 from mycodo.databases.models import Math
 from mycodo.databases.models import NoteTags
 from mycodo.databases.models import Notes
@@ -47,14 +50,23 @@ from mycodo.mycodo_client import DaemonControl
 from mycodo.mycodo_flask.routes_authentication import clear_cookie_auth
 from mycodo.mycodo_flask.utils import utils_general
 from mycodo.mycodo_flask.utils.utils_general import get_ip_address
+from mycodo.mycodo_flask.utils.utils_measurement import measurement_resolver
 from mycodo.mycodo_flask.utils.utils_output import get_all_output_states
+from mycodo.mycodo_flask.utils.utils_series import series_epoch
+from mycodo.mycodo_flask.utils.utils_series import series_response
 from mycodo.utils.database import db_retrieve_table
-from mycodo.utils.image import generate_thermal_image_from_pixels
+from mycodo.utils.image import render_thermal_image
+from mycodo.utils.influx import downsample_m4
 from mycodo.utils.influx import influx_time_str_to_milliseconds
+from mycodo.utils.influx import parse_frames
 from mycodo.utils.influx import query_string
+from mycodo.utils.influx import query_string_downsample
+from mycodo.utils.influx import query_string_frames
+from mycodo.utils.jobs import JobError
+from mycodo.utils.jobs import job_runner
+from mycodo.utils.jobs import job_status
 from mycodo.utils.system_pi import assure_path_exists
 from mycodo.utils.system_pi import is_int
-from mycodo.utils.system_pi import return_measurement_info
 from mycodo.utils.system_pi import str_is_float
 
 blueprint = Blueprint('routes_general',
@@ -241,6 +253,8 @@ def download_file(dl_type, filename):
     """Serve log file to download"""
     if dl_type == 'log':
         return send_from_directory(LOG_PATH, filename, as_attachment=True)
+    elif dl_type == 'usage_report':
+        return send_from_directory(USAGE_REPORTS_PATH, filename, as_attachment=True)
 
     return '', 204
 
@@ -260,31 +274,13 @@ def last_data(unique_id, measure_type, measurement_id, period):
             INFLUXDB_PASSWORD,
             INFLUXDB_DATABASE)
 
-        if measure_type in ['input', 'math', 'output', 'pid']:
-            measure = DeviceMeasurements.query.filter(
-                DeviceMeasurements.unique_id == measurement_id).first()
-        else:
+        measure = measurement_resolver.get(measurement_id)
+        if not measure:
             return '', 204
 
-        if measure:
-            conversion = Conversion.query.filter(
-                Conversion.unique_id == measure.conversion_id).first()
-        else:
-            conversion = None
-
-        channel, unit, measurement = return_measurement_info(
-            measure, conversion)
-
-        if hasattr(measure, 'measurement_type') and measure.measurement_type == 'setpoint':
-            setpoint_pid = PID.query.filter(PID.unique_id == measure.device_id).first()
-            if setpoint_pid and ',' in setpoint_pid.measurement:
-                pid_measurement = setpoint_pid.measurement.split(',')[1]
-                setpoint_measurement = DeviceMeasurements.query.filter(
-                    DeviceMeasurements.unique_id == pid_measurement).first()
-                if setpoint_measurement:
-                    conversion = Conversion.query.filter(
-                        Conversion.unique_id == setpoint_measurement.conversion_id).first()
-                    _, unit, measurement = return_measurement_info(setpoint_measurement, conversion)
+        channel = measure.channel
+        unit = measure.unit
+        measurement = measure.measurement
 
         try:
             if period != '0':
@@ -355,36 +351,27 @@ def past_data(unique_id, measure_type, measurement_id, past_seconds):
             INFLUXDB_PASSWORD,
             INFLUXDB_DATABASE)
 
-        if measure_type in ['input', 'math', 'output', 'pid']:
-            measure = DeviceMeasurements.query.filter(
-                DeviceMeasurements.unique_id == measurement_id).first()
-        else:
-            measure = None
-
+        measure = measurement_resolver.get(measurement_id)
         if not measure:
             return "Could not find measurement"
 
-        if measure:
-            conversion = Conversion.query.filter(
-                Conversion.unique_id == measure.conversion_id).first()
-        else:
-            conversion = None
-
-        channel, unit, measurement = return_measurement_info(
-            measure, conversion)
-
-        if hasattr(measure, 'measurement_type') and measure.measurement_type == 'setpoint':
-            setpoint_pid = PID.query.filter(PID.unique_id == measure.device_id).first()
-            if setpoint_pid and ',' in setpoint_pid.measurement:
-                pid_measurement = setpoint_pid.measurement.split(',')[1]
-                setpoint_measurement = DeviceMeasurements.query.filter(
-                    DeviceMeasurements.unique_id == pid_measurement).first()
-                if setpoint_measurement:
-                    conversion = Conversion.query.filter(
-                        Conversion.unique_id == setpoint_measurement.conversion_id).first()
-                    _, unit, measurement = return_measurement_info(setpoint_measurement, conversion)
+        channel = measure.channel
+        unit = measure.unit
+        measurement = measure.measurement
 
         try:
+            # Optionally reduce the series to roughly the number of points
+            # the requesting graph can display (e.g. its width in pixels)
+            max_points = request.args.get('points', type=int)
+            if max_points and max_points > 0:
+                downsampled = past_data_downsampled(
+                    dbcon, unit, unique_id, measurement, channel,
+                    int(float(past_seconds)), max_points)
+                if downsampled is not None:
+                    if downsampled:
+                        return series_response(downsampled)
+                    return '', 204
+
             query_str = query_string(
                 unit, unique_id,
                 measure=measurement,
@@ -394,10 +381,10 @@ def past_data(unique_id, measure_type, measurement_id, past_seconds):
             if query_str == 1:
                 return '', 204
 
-            raw_data = dbcon.query(query_str).raw
+            raw_data = dbcon.query(query_str, epoch=series_epoch()).raw
 
             if 'series' in raw_data and raw_data['series']:
-                return jsonify(raw_data['series'][0]['values'])
+                return series_response(raw_data['series'][0]['values'])
             else:
                 return '', 204
         except Exception as e:
@@ -406,20 +393,70 @@ def past_data(unique_id, measure_type, measurement_id, past_seconds):
             return '', 204
 
 
+def past_data_downsampled(dbcon, unit, unique_id, measurement, channel,
+                          past_seconds, max_points):
+    """
+    Return the past_seconds of data reduced to about max_points buckets
+    with M4 (first/min/max/last) aggregation, with epoch millisecond
+    timestamps. Returns None if there are too few points to need it.
+    """
+    query_str = query_string(
+        unit, unique_id,
+        measure=measurement,
+        channel=channel,
+        value='COUNT',
+        past_sec=past_seconds)
+    raw_data = dbcon.query(query_str).raw
+    if 'series' not in raw_data or not raw_data['series']:
+        return []
+
+    # M4 returns up to 4 points per bucket
+    count_points = raw_data['series'][0]['values'][0][1]
+    if count_points <= max_points * 4:
+        return
+
+    group_sec = max(1, int(math.ceil(past_seconds / max_points)))
+    query_str = query_string_downsample(
+        unit, unique_id, group_sec,
+        measure=measurement,
+        channel=channel,
+        past_sec=past_seconds)
+    end_ms = int(time.time() * 1000)
+    raw_data = dbcon.query(query_str, epoch='ms').raw
+    if 'series' not in raw_data or not raw_data['series']:
+        return []
+    return downsample_m4(
+        raw_data['series'][0]['values'], group_sec * 1000, end_ms=end_ms)
+
+
+def read_thermal_frames(dbcon, unique_id, start_str=None, end_str=None):
+    """
+    Return the frames of a thermal camera Input between two times, with one
+    query per unit its pixels are stored with (normally one query)
+
+    :return: (nx, ny, list of [epoch_ms, pixels])
+    """
+    measurements = measurement_resolver.device(unique_id)
+    channels = len(measurements)
+    nx = ny = int(math.sqrt(channels))
+    if not channels or nx * ny != channels:
+        return nx, ny, []
+
+    series = []
+    for each_unit in sorted(set(each.unit for each in measurements)):
+        query_str = query_string_frames(
+            each_unit, unique_id, start_str=start_str, end_str=end_str)
+        raw_data = dbcon.query(query_str, epoch='ms').raw
+        if raw_data and 'series' in raw_data:
+            series.extend(raw_data['series'])
+
+    return nx, ny, parse_frames(series, channels)
+
+
 @blueprint.route('/generate_thermal_image/<unique_id>/<timestamp>')
 @flask_login.login_required
 def generate_thermal_image_from_timestamp(unique_id, timestamp):
-    """Return a file from the note attachment directory"""
-    ts_now = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-    camera_path = assure_path_exists(
-        os.path.join(PATH_CAMERAS, '{uid}'.format(uid=unique_id)))
-    filename = 'Still-{uid}-{ts}.jpg'.format(
-        uid=unique_id,
-        ts=ts_now).replace(" ", "_")
-    save_path = assure_path_exists(os.path.join(camera_path, 'thermal'))
-    assure_path_exists(save_path)
-    path_file = os.path.join(save_path, filename)
-
+    """Return an image of the thermal camera frame nearest an epoch millisecond timestamp"""
     dbcon = InfluxDBClient(
         INFLUXDB_HOST,
         INFLUXDB_PORT,
@@ -427,40 +464,66 @@ def generate_thermal_image_from_timestamp(unique_id, timestamp):
         INFLUXDB_PASSWORD,
         INFLUXDB_DATABASE)
 
-    input_dev = Input.query.filter(Input.unique_id == unique_id).first()
-    pixels = []
-    success = True
-
     start = int(int(timestamp) / 1000.0)  # Round down
     end = start + 1  # Round up
 
     start_timestamp = time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z', time.gmtime(start))
     end_timestamp = time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z', time.gmtime(end))
 
-    for each_channel in range(input_dev.channels):
-        measurement = 'channel_{chan}'.format(
-            chan=each_channel)
-        query_str = query_string(measurement, unique_id,
-                                 start_str=start_timestamp,
-                                 end_str=end_timestamp)
-        if query_str == 1:
-            logger.error('Invalid query string')
-            success = False
-        else:
-            raw_data = dbcon.query(query_str).raw
-            if not raw_data or 'series' not in raw_data or not raw_data['series']:
-                logger.error('No measurements to export in this time period')
-                success = False
-            else:
-                pixels.append(raw_data['series'][0]['values'][0][1])
+    nx, ny, frames = read_thermal_frames(
+        dbcon, unique_id, start_str=start_timestamp, end_str=end_timestamp)
+    if not frames:
+        logger.error('No thermal frames in this time period')
+        return "Could not generate image"
+
+    _, pixels = min(frames, key=lambda frame: abs(frame[0] - int(timestamp)))
+    image = render_thermal_image(pixels, nx, ny)
+    if not image:
+        return "Could not generate image"
+    return Response(image, mimetype='image/jpeg')
 
-    # logger.error("generate_thermal_image_from_timestamp: success: {}, pixels: {}".format(success, pixels))
 
-    if success:
-        generate_thermal_image_from_pixels(pixels, 8, 8, path_file)
-        return send_file(path_file, mimetype='image/jpeg')
+@blueprint.route('/thermal_frames/<unique_id>/<start_seconds>/<end_seconds>')
+@flask_login.login_required
+def thermal_frames(unique_id, start_seconds, end_seconds):
+    """
+    Return the thermal camera frames from start_seconds to end_seconds.
+    At most max_frames (default THERMAL_MAX_FRAMES) evenly-spaced frames are returned.
+    Used to animate thermal camera data.
+    """
+    max_frames = request.args.get('max_frames', THERMAL_MAX_FRAMES, type=int)
+
+    dbcon = InfluxDBClient(
+        INFLUXDB_HOST,
+        INFLUXDB_PORT,
+        INFLUXDB_USER,
+        INFLUXDB_PASSWORD,
+        INFLUXDB_DATABASE)
+
+    start = datetime.datetime.utcfromtimestamp(float(start_seconds))
+    start_str = start.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    if end_seconds == '0':
+        end = datetime.datetime.utcnow()
     else:
-        return "Could not generate image"
+        end = datetime.datetime.utcfromtimestamp(float(end_seconds))
+    end_str = end.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    nx, ny, frames = read_thermal_frames(
+        dbcon, unique_id, start_str=start_str, end_str=end_str)
+    if not frames:
+        return '', 204
+
+    if max_frames and len(frames) > max_frames:
+        step = len(frames) / max_frames
+        frames = [frames[int(index * step)] for index in range(max_frames)]
+
+    return jsonify({
+        'nx': nx,
+        'ny': ny,
+        'temp_min': min(min(pixels) for _, pixels in frames),
+        'temp_max': max(max(pixels) for _, pixels in frames),
+        'frames': frames
+    })
 
 
 @blueprint.route('/export_data/<unique_id>/<measurement_id>/<start_seconds>/<end_seconds>')
@@ -490,15 +553,13 @@ def export_data(unique_id, measurement_id, start_seconds, end_seconds):
     else:
         name = None
 
-    device_measurement = DeviceMeasurements.query.filter(
-        DeviceMeasurements.unique_id == measurement_id).first()
-    if device_measurement:
-        conversion = Conversion.query.filter(
-            Conversion.unique_id == device_measurement.conversion_id).first()
-    else:
-        conversion = None
-    channel, unit, measurement = return_measurement_info(
-        device_measurement, conversion)
+    device_measurement = measurement_resolver.get(measurement_id)
+    if not device_measurement:
+        flash('Could not find measurement', 'error')
+        return redirect(url_for('routes_page.page_export'))
+    channel = device_measurement.channel
+    unit = device_measurement.unit
+    measurement = device_measurement.measurement
 
     utc_offset_timedelta = datetime.datetime.utcnow() - datetime.datetime.now()
     start = datetime.datetime.fromtimestamp(float(start_seconds))
@@ -589,21 +650,16 @@ def async_data(device_id, device_type, measurement_id, start_seconds, end_second
         INFLUXDB_DATABASE)
 
     if device_type in ['input', 'math', 'output', 'pid']:
-        measure = DeviceMeasurements.query.filter(
-            DeviceMeasurements.unique_id == measurement_id).first()
+        measure = measurement_resolver.get(measurement_id)
     else:
         measure = None
 
     if not measure:
         return "Could not find measurement"
 
-    if measure:
-        conversion = Conversion.query.filter(
-            Conversion.unique_id == measure.conversion_id).first()
-    else:
-        conversion = None
-    channel, unit, measurement = return_measurement_info(
-        measure, conversion)
+    channel = measure.channel
+    unit = measure.unit
+    measurement = measure.measurement
 
     # Set the time frame to the past year if start/end not specified
     if start_seconds == '0' and end_seconds == '0':
@@ -739,9 +795,9 @@ def async_data(device_id, device_type, measurement_id, start_seconds, end_second
 
             if query_str == 1:
                 return '', 204
-            raw_data = dbcon.query(query_str).raw
+            raw_data = dbcon.query(query_str, epoch=series_epoch()).raw
 
-            return jsonify(raw_data['series'][0]['values'])
+            return series_response(raw_data['series'][0]['values'])
         except Exception as e:
             logger.error("URL for 'async_data' raised and error: "
                          "{err}".format(err=e))
@@ -757,9 +813,9 @@ def async_data(device_id, device_type, measurement_id, start_seconds, end_second
 
             if query_str == 1:
                 return '', 204
-            raw_data = dbcon.query(query_str).raw
+            raw_data = dbcon.query(query_str, epoch=series_epoch()).raw
 
-            return jsonify(raw_data['series'][0]['values'])
+            return series_response(raw_data['series'][0]['values'])
         except Exception as e:
             logger.error("URL for 'async_data' raised and error: "
                          "{err}".format(err=e))
@@ -1087,28 +1143,15 @@ def last_data_pid(pid_id, input_period):
             device_id = None
             measurement_id = None
 
-        actual_measurement = DeviceMeasurements.query.filter(
-            DeviceMeasurements.unique_id == measurement_id).first()
-        if actual_measurement:
-            actual_conversion = Conversion.query.filter(
-                Conversion.unique_id == actual_measurement.conversion_id).first()
+        # The setpoint is stored in the unit of the measurement the PID regulates
+        actual = measurement_resolver.get(measurement_id)
+        if actual:
+            actual_channel = actual.channel
+            actual_unit = actual.unit
+            actual_measurement = actual.measurement
         else:
-            actual_conversion = None
-
-        (actual_channel,
-         actual_unit,
-         actual_measurement) = return_measurement_info(
-            actual_measurement, actual_conversion)
-
-        setpoint_unit = None
-        if pid and ',' in pid.measurement:
-            pid_measurement = pid.measurement.split(',')[1]
-            setpoint_measurement = DeviceMeasurements.query.filter(
-                DeviceMeasurements.unique_id == pid_measurement).first()
-            if setpoint_measurement:
-                conversion = Conversion.query.filter(
-                    Conversion.unique_id == setpoint_measurement.conversion_id).first()
-                _, setpoint_unit, _ = return_measurement_info(setpoint_measurement, conversion)
+            actual_channel = actual_unit = actual_measurement = None
+        setpoint_unit = actual_unit
 
         p_value = return_point_timestamp(
             pid_id, 'pid_value', input_period, measurement='pid_p_value')
@@ -1218,6 +1261,44 @@ def pid_mod_unique_id(unique_id, state):
         return return_str
 
 
+
+@blueprint.route('/job_status')
+@flask_login.login_required
+def job_status_list():
+    """
+    Return the status of the last background jobs, only of the tasks
+    given with task= (e.g. /job_status?task=import_influxdb) if any are given
+    """
+    tasks = request.args.getlist('task')
+    jobs = Job.query
+    if tasks:
+        jobs = jobs.filter(Job.task.in_(tasks))
+    jobs = jobs.order_by(Job.id.desc()).limit(10).all()
+    return jsonify({'jobs': [job_status(each_job) for each_job in jobs]})
+
+
+@blueprint.route('/job_status/<unique_id>')
+@flask_login.login_required
+def job_status_single(unique_id):
+    """ Return the status of a background job """
+    job = Job.query.filter(Job.unique_id == unique_id).first()
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
+
+@blueprint.route('/job_cancel/<unique_id>', methods=['POST'])
+@flask_login.login_required
+def job_cancel(unique_id):
+    """ Cancel a queued background job, or ask a running job to stop """
+    if not utils_general.user_has_permission('edit_controllers'):
+        return 'Insufficient user permissions to cancel jobs', 403
+    try:
+        job_runner.cancel(unique_id)
+    except JobError as err:
+        return str(err), 400
+    return 'success'
+
 # import flask_login
 # from mycodo.mycodo_flask.api import api
 # @blueprint.route('/export_swagger')
@@ -3,6 +3,7 @@
 import calendar
 import datetime
 import glob
+import json
 import logging
 import os
 import re
@@ -17,6 +18,7 @@ from importlib import import_module
 import flask_login
 from flask import current_app
 from flask import flash
+from flask import jsonify
 from flask import redirect
 from flask import render_template
 from flask import request
@@ -38,14 +40,18 @@ from mycodo.config import FUNCTIONS
 from mycodo.config import FUNCTION_ACTION_INFO
 from mycodo.config import HTTP_ACCESS_LOG_FILE
 from mycodo.config import HTTP_ERROR_LOG_FILE
+from mycodo.config import INFLUXDB_BACKUP_FULL_INTERVAL
+from mycodo.config import INFLUXDB_BACKUP_RETENTION
 from mycodo.config import INSTALL_DIRECTORY
 from mycodo.config import KEEPUP_LOG_FILE
 from mycodo.config import LCD_INFO
 from mycodo.config import LOGIN_LOG_FILE
+from mycodo.config import LOG_LINES_MAX
 from mycodo.config import MATH_INFO
 from mycodo.config import MYCODO_VERSION
 from mycodo.config import PATH_1WIRE
 from mycodo.config import PATH_HTML_USER
+from mycodo.config import PATH_INFLUXDB_BACKUPS
 from mycodo.config import RESTORE_LOG_FILE
 from mycodo.config import UPGRADE_LOG_FILE
 from mycodo.config import USAGE_REPORTS_PATH
@@ -63,6 +69,7 @@ from mycodo.databases.models import DisplayOrder
 from mycodo.databases.models import EnergyUsage
 from mycodo.databases.models import Function
 from mycodo.databases.models import Input
+from mycodo.databases.models import Job
 from mycodo.databases.models import LCD
 from mycodo.databases.models import LCDData
 from mycodo.databases.models import Math
@@ -111,9 +118,14 @@ from mycodo.mycodo_flask.utils import utils_notes
 from mycodo.mycodo_flask.utils import utils_output
 from mycodo.mycodo_flask.utils import utils_pid
 from mycodo.mycodo_flask.utils import utils_trigger
+from mycodo.mycodo_flask.utils.utils_measurement import measurement_resolver
 from mycodo.utils.functions import parse_function_information
 from mycodo.utils.inputs import list_analog_to_digital_converters
 from mycodo.utils.inputs import parse_input_information
+from mycodo.utils.jobs import JobError
+from mycodo.utils.jobs import job_runner
+from mycodo.utils.log_reader import LogFilter
+from mycodo.utils.log_reader import read_log
 from mycodo.utils.outputs import output_types
 from mycodo.utils.outputs import parse_output_information
 from mycodo.utils.sunriseset import Sun
@@ -485,12 +497,9 @@ def page_export():
                 flash('An error occurred during the settingsdatabase import.',
                       'error')
         elif form_export_influxdb.export_influxdb_zip.data:
-            file_send = utils_export.export_influxdb(form_export_influxdb)
-            if file_send:
-                return file_send
-            else:
-                flash('Unknown error creating zipped influxdb database '
-                      'and metastore', 'error')
+            if utils_export.export_influxdb(form_export_influxdb) == 'success':
+                flash('The influxdb database backup has been queued. It can '
+                      'be downloaded when the job has finished.', 'success')
         elif form_import_influxdb.influxdb_import_upload.data:
             restore_influxdb = utils_export.import_influxdb(
                 form_import_influxdb)
@@ -503,6 +512,10 @@ def page_export():
             else:
                 flash('Errors occurred during the influxdb database import.',
                       'error')
+        elif form_import_influxdb.influxdb_import_resume.data:
+            if utils_export.import_influxdb_resume() == 'success':
+                flash('The influxdb database import has been resumed.',
+                      'success')
 
     # Generate start end end times for date/time picker
     end_picker = datetime.datetime.now().strftime('%m/%d/%Y %H:%M')
@@ -510,6 +523,10 @@ def page_export():
     start_picker = start_picker.strftime('%m/%d/%Y %H:%M')
 
     return render_template('tools/export.html',
+                           import_influxdb_status=utils_export.import_influxdb_status(),
+                           influxdb_backup_full_days=INFLUXDB_BACKUP_FULL_INTERVAL // 86400,
+                           influxdb_backup_path=PATH_INFLUXDB_BACKUPS,
+                           influxdb_backup_retention_days=INFLUXDB_BACKUP_RETENTION // 86400,
                            start_picker=start_picker,
                            end_picker=end_picker,
                            form_export_influxdb=form_export_influxdb,
@@ -522,6 +539,30 @@ def page_export():
                            choices_math=choices_math)
 
 
+@blueprint.route('/export/influxdb_backup/<unique_id>')
+@flask_login.login_required
+def page_export_influxdb_backup(unique_id):
+    """Download the measurement backup of a finished export job"""
+    if not utils_general.user_has_permission('edit_controllers'):
+        return redirect(url_for('routes_general.home'))
+
+    job = Job.query.filter(Job.unique_id == unique_id).first()
+    response = None
+    if job and job.task == 'export_influxdb' and job.result:
+        response = utils_export.export_influxdb_download(json.loads(job.result))
+    if not response:
+        flash('Backup not found. It may have been deleted after its retention period.', 'error')
+        return redirect(url_for('routes_page.page_export'))
+    return response
+
+
+@blueprint.route('/export/import_influxdb_status')
+@flask_login.login_required
+def page_export_import_influxdb_status():
+    """Return the progress of the last influxdb import"""
+    return jsonify(utils_export.import_influxdb_status())
+
+
 @blueprint.route('/save_dashboard_layout', methods=['POST'])
 def save_dashboard_layout():
     """Save positions and sizes of widgets of a particular dashboard"""
@@ -728,8 +769,7 @@ def page_dashboard(dashboard_id):
         device_measurements_dict[meas.unique_id] = meas
 
     # Get what each measurement uses for a unit
-    use_unit = utils_general.use_unit_generate(
-        device_measurements, input_dev, output, math)
+    use_unit = utils_general.use_unit_generate(input_dev, output, math)
 
     return render_template('pages/dashboard.html',
                            custom_options_values_widgets=custom_options_values_widgets,
@@ -795,8 +835,7 @@ def page_graph_async():
     dict_units = add_custom_units(Unit.query.all())
 
     # Get what each measurement uses for a unit
-    use_unit = utils_general.use_unit_generate(
-        device_measurements, input_dev, output, math)
+    use_unit = utils_general.use_unit_generate(input_dev, output, math)
 
     choices_input = utils_general.choices_inputs(
         input_dev, dict_units, dict_measurements)
@@ -818,12 +857,9 @@ def page_graph_async():
     dict_measure_measurements = {}
     dict_measure_units = {}
 
-    for each_measurement in device_measurements:
-        conversion = Conversion.query.filter(
-            Conversion.unique_id == each_measurement.conversion_id).first()
-        _, unit, measurement = return_measurement_info(each_measurement, conversion)
-        dict_measure_measurements[each_measurement.unique_id] = measurement
-        dict_measure_units[each_measurement.unique_id] = unit
+    for measurement_id, each_measurement in measurement_resolver.all().items():
+        dict_measure_measurements[measurement_id] = each_measurement.measurement
+        dict_measure_units[measurement_id] = each_measurement.unit
 
     async_height = 600
 
@@ -1125,7 +1161,6 @@ def page_lcd():
 def page_live():
     """ Page of recent and updating input data """
     # Get what each measurement uses for a unit
-    device_measurements = DeviceMeasurements.query.all()
     input_dev = Input.query.all()
     output = Output.query.all()
     math = Math.query.all()
@@ -1133,8 +1168,7 @@ def page_live():
     activated_inputs = Input.query.filter(Input.is_activated).count()
     activated_maths = Math.query.filter(Input.is_activated).count()
 
-    use_unit = utils_general.use_unit_generate(
-        device_measurements, input_dev, output, math)
+    use_unit = utils_general.use_unit_generate(input_dev, output, math)
 
     # Display orders
     display_order_input = csv_to_list_of_str(
@@ -1149,12 +1183,9 @@ def page_live():
     dict_measure_measurements = {}
     dict_measure_units = {}
 
-    for each_measurement in device_measurements:
-        conversion = Conversion.query.filter(
-            Conversion.unique_id == each_measurement.conversion_id).first()
-        _, unit, measurement = return_measurement_info(each_measurement, conversion)
-        dict_measure_measurements[each_measurement.unique_id] = measurement
-        dict_measure_units[each_measurement.unique_id] = unit
+    for measurement_id, each_measurement in measurement_resolver.all().items():
+        dict_measure_measurements[measurement_id] = each_measurement.measurement
+        dict_measure_units[measurement_id] = each_measurement.unit
 
     return render_template('pages/live.html',
                            activated_inputs=activated_inputs,
@@ -1174,6 +1205,52 @@ def page_live():
                            use_unit=use_unit)
 
 
+# Log files of the log viewer, by log
+LOG_FILES = {
+    'log_daemon': DAEMON_LOG_FILE,
+    'log_pid_settings': DAEMON_LOG_FILE,
+    'log_keepup': KEEPUP_LOG_FILE,
+    'log_dependency': DEPENDENCY_LOG_FILE,
+    'log_backup': BACKUP_LOG_FILE,
+    'log_restore': RESTORE_LOG_FILE,
+    'log_upgrade': UPGRADE_LOG_FILE,
+    'log_http_access': HTTP_ACCESS_LOG_FILE,
+    'log_http_error': HTTP_ERROR_LOG_FILE,
+    'log_login': LOGIN_LOG_FILE
+}
+
+# Services of the log viewer logged to the systemd journal, by log
+LOG_JOURNALS = {
+    'log_nginx': 'nginx',
+    'log_flask': 'mycodoflask'
+}
+
+
+def read_logview(log_field, lines, level=None, logger_name=None, search=None,
+                 offset=None, inode=None):
+    """
+    The name and text of a log of the log viewer (see read_log()), or
+    None as the text if the log wasn't found
+    """
+    lines = min(max(lines, 1), LOG_LINES_MAX)
+    if log_field in LOG_JOURNALS:
+        cmd = ['journalctl', '-u', LOG_JOURNALS[log_field], '-n', str(lines), '--no-pager']
+        try:
+            text = subprocess.run(cmd, stdout=subprocess.PIPE).stdout.decode(
+                'utf-8', errors='replace')
+        except OSError:
+            return ' '.join(cmd), None
+        if search:
+            text = ''.join(line for line in text.splitlines(True) if search in line)
+        return ' '.join(cmd), {'text': text, 'offset': None, 'inode': None, 'reset': True}
+
+    logfile = LOG_FILES.get(log_field, '')
+    if log_field == 'log_pid_settings':
+        search = "PID Settings"
+    log_filter = LogFilter(level=level, logger=logger_name, text=search)
+    return logfile, read_log(logfile, lines, log_filter, offset=offset, inode=inode)
+
+
 @blueprint.route('/logview', methods=('GET', 'POST'))
 @flask_login.login_required
 def page_logview():
@@ -1186,79 +1263,58 @@ def page_logview():
     lines = 30
     logfile = ''
     log_field = None
+    log_read = None
     if request.method == 'POST':
         if form_log_view.lines.data:
-            lines = form_log_view.lines.data
+            lines = min(form_log_view.lines.data, LOG_LINES_MAX)
 
-        # Log fie requested
+        # Log file requested
         if form_log_view.log_view.data:
-            command = None
             log_field = form_log_view.log.data
-
-            # Find which log file was requested, generate command to execute
-            if form_log_view.log.data == 'log_pid_settings':
-                logfile = DAEMON_LOG_FILE
-                logrotate_file = logfile + '.1'
-                if (logrotate_file and os.path.exists(logrotate_file) and
-                        logfile and os.path.isfile(logfile)):
-                    command = 'cat {lrlog} {log} | grep -a "PID Settings" | tail -n {lines}'.format(
-                        lrlog=logrotate_file, log=logfile, lines=lines)
-                else:
-                    command = 'grep -a "PID Settings" {log} | tail -n {lines}'.format(
-                        lines=lines, log=logfile)
-            elif form_log_view.log.data == 'log_nginx':
-                command = 'journalctl -u nginx | tail -n {lines}'.format(
-                    lines=lines)
-            elif form_log_view.log.data == 'log_flask':
-                command = 'journalctl -u mycodoflask | tail -n {lines}'.format(
-                    lines=lines)
-            else:
-                if form_log_view.log.data == 'log_login':
-                    logfile = LOGIN_LOG_FILE
-                elif form_log_view.log.data == 'log_http_access':
-                    logfile = HTTP_ACCESS_LOG_FILE
-                elif form_log_view.log.data == 'log_http_error':
-                    logfile = HTTP_ERROR_LOG_FILE
-                elif form_log_view.log.data == 'log_daemon':
-                    logfile = DAEMON_LOG_FILE
-                elif form_log_view.log.data == 'log_dependency':
-                    logfile = DEPENDENCY_LOG_FILE
-                elif form_log_view.log.data == 'log_keepup':
-                    logfile = KEEPUP_LOG_FILE
-                elif form_log_view.log.data == 'log_backup':
-                    logfile = BACKUP_LOG_FILE
-                elif form_log_view.log.data == 'log_restore':
-                    logfile = RESTORE_LOG_FILE
-                elif form_log_view.log.data == 'log_upgrade':
-                    logfile = UPGRADE_LOG_FILE
-
-                logrotate_file = logfile + '.1'
-                if (logrotate_file and os.path.exists(logrotate_file) and
-                        logfile and os.path.isfile(logfile)):
-                    command = 'cat {lrlog} {log} | tail -n {lines}'.format(
-                        lrlog=logrotate_file, log=logfile, lines=lines)
-                elif os.path.isfile(logfile):
-                    command = 'tail -n {lines} {log}'.format(lines=lines,
-                                                             log=logfile)
-
-            # Execute command and generate the output to display to the user
-            if command:
-                log = subprocess.Popen(
-                    command, stdout=subprocess.PIPE, shell=True)
-                (log_output, _) = log.communicate()
-                log.wait()
-                log_output = str(log_output, 'latin-1')
-            else:
-                log_output = 404
+            logfile, log_read = read_logview(
+                log_field, lines,
+                level=form_log_view.level.data,
+                logger_name=form_log_view.logger.data,
+                search=form_log_view.search.data)
+            log_output = 404 if log_read is None else log_read['text']
 
     return render_template('tools/logview.html',
                            form_log_view=form_log_view,
                            lines=lines,
                            log_field=log_field,
+                           log_read=log_read,
                            logfile=logfile,
                            log_output=log_output)
 
 
+@blueprint.route('/logview_lines')
+@flask_login.login_required
+def page_logview_lines():
+    """
+    Return the lines of a log written since the offset and inode of a
+    previous read, or its last (n) lines, for following a log
+    """
+    if not utils_general.user_has_permission('view_logs'):
+        return jsonify({'error': 'Permission denied'}), 403
+
+    def arg_int(name):
+        try:
+            return int(request.args[name])
+        except (KeyError, ValueError):
+            return None
+
+    logfile, log_read = read_logview(
+        request.args.get('log'), arg_int('lines') or 30,
+        level=request.args.get('level'),
+        logger_name=request.args.get('logger'),
+        search=request.args.get('search'),
+        offset=arg_int('offset'),
+        inode=arg_int('inode'))
+    if log_read is None:
+        return jsonify({'error': 'File not found: {}'.format(logfile)}), 404
+    return jsonify(log_read)
+
+
 @blueprint.route('/function', methods=('GET', 'POST'))
 @flask_login.login_required
 def page_function():
@@ -2197,17 +2253,36 @@ def page_usage():
                            timestamp=time.strftime("%c"))
 
 
-@blueprint.route('/usage_reports')
+@blueprint.route('/usage_reports', methods=('GET', 'POST'))
 @flask_login.login_required
 def page_usage_reports():
     """ Display output usage (duration and energy usage/cost) """
     if not utils_general.user_has_permission('view_stats'):
         return redirect(url_for('routes_general.home'))
 
+    form_usage_report = forms_misc.UsageReport()
+
+    if request.method == 'POST':
+        if not utils_general.user_has_permission('edit_controllers'):
+            return redirect(url_for('routes_general.home'))
+
+        if form_usage_report.usage_report_generate.data:
+            try:
+                job_runner.submit('output_usage_report', 'Output Usage Report')
+                flash('The output usage report is being generated.', 'success')
+            except JobError as err:
+                flash(str(err), 'error')
+        return redirect(url_for('routes_page.page_usage_reports'))
+
     report_location = os.path.normpath(USAGE_REPORTS_PATH)
-    reports = [0, 0]
+    if os.path.isdir(report_location):
+        reports = sorted((filename for filename in os.listdir(report_location)
+                          if filename.endswith('.csv')), reverse=True)
+    else:
+        reports = []
 
     return render_template('pages/usage_reports.html',
+                           form_usage_report=form_usage_report,
                            report_location=report_location,
                            reports=reports)
 
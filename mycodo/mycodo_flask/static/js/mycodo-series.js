@@ -0,0 +1,62 @@
+// Retrieve measurement series in the compact columnar format
+// (application/vnd.mycodo.series), falling back to JSON if the endpoint
+// returns JSON (e.g. note tags).
+//
+// Format (little-endian): uint32 count, uint32 reserved,
+// float64[count] epoch millisecond timestamps, float64[count] values (NaN = null)
+
+const seriesLittleEndian = new Uint8Array(new Uint16Array([1]).buffer)[0] === 1;
+
+function decodeSeries(buffer) {
+  const view = new DataView(buffer);
+  const count = view.getUint32(0, true);
+  let timestamps;
+  let values;
+  if (seriesLittleEndian) {
+    timestamps = new Float64Array(buffer, 8, count);
+    values = new Float64Array(buffer, 8 + count * 8, count);
+  }
+  else {
+    timestamps = new Float64Array(count);
+    values = new Float64Array(count);
+    for (let i = 0; i < count; i++) {
+      timestamps[i] = view.getFloat64(8 + i * 8, true);
+      values[i] = view.getFloat64(8 + (count + i) * 8, true);
+    }
+  }
+
+  const data = new Array(count);
+  for (let i = 0; i < count; i++) {
+    data[i] = [timestamps[i], isNaN(values[i]) ? null : values[i]];
+  }
+  return data;
+}
+
+// Request a series and call callback(data, xhr), where data is a list of
+// [epoch_ms, value] (or the parsed JSON response), or null if no data (204)
+function getSeriesData(url, callback) {
+  const xhr = new XMLHttpRequest();
+  xhr.open('GET', url);
+  xhr.responseType = 'arraybuffer';
+  xhr.setRequestHeader('Accept', 'application/vnd.mycodo.series, application/json;q=0.9');
+  xhr.onload = function () {
+    if (xhr.status !== 200) {
+      callback(null, xhr);
+      return;
+    }
+    const content_type = xhr.getResponseHeader('Content-Type') || '';
+    if (content_type.indexOf('application/vnd.mycodo.series') === 0) {
+      callback(decodeSeries(xhr.response), xhr);
+    }
+    else {
+      let data = null;
+      try {
+        data = JSON.parse(new TextDecoder('utf-8').decode(xhr.response));
+      } catch (e) {
+        console.log('Could not parse series from ' + url + ': ' + e);
+      }
+      callback(data, xhr);
+    }
+  };
+  xhr.send();
+}
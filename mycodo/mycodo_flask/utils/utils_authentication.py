@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+#  utils_authentication.py - Cached user and API key resolution for Flask-Login
+#
+import base64
+import logging
+import time
+
+from flask import g
+from sqlalchemy import event
+
+from mycodo.config import AUTH_CACHE_SIZE
+from mycodo.config import AUTH_CACHE_TTL
+from mycodo.databases.models import User
+from mycodo.mycodo_flask.extensions import db
+from mycodo.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Detached User instances, keyed by str(User.id)
+user_cache = TTLCache(max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+# Decoded API key (bytes) -> str(User.id)
+api_key_cache = TTLCache(max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
+def clear_auth_cache():
+    """ Remove all cached users and API keys """
+    user_cache.clear()
+    api_key_cache.clear()
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    """
+    Any change to a user (role, password, API key, deletion) invalidates the
+    cache. Other web server workers only see the change after AUTH_CACHE_TTL.
+    """
+    clear_auth_cache()
+
+
+def _attach(cached_user):
+    """ Attach a copy of the cached, detached user to the current session without a query """
+    return db.session.merge(cached_user, load=False)
+
+
+def _cache_user(user):
+    """ Detach a freshly-queried user, cache it and return an attached copy """
+    db.session.expunge(user)
+    user_cache.set(str(user.id), user)
+    return _attach(user)
+
+
+def _add_auth_time(start, source):
+    g.auth_time = getattr(g, 'auth_time', 0) + (time.perf_counter() - start)
+    g.auth_source = source
+
+
+def get_user_by_id(user_id):
+    """ Return the User with user_id, from the cache if possible """
+    start = time.perf_counter()
+    user_id = str(user_id)
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        _add_auth_time(start, 'cache')
+        return _attach(cached_user)
+
+    user = User.query.filter(User.id == user_id).first()
+    if user:
+        user = _cache_user(user)
+    _add_auth_time(start, 'db')
+    return user
+
+
+def get_user_by_api_key(api_key):
+    """
+    Return the User that owns the base64-encoded api_key, or None.
+    Only successful lookups are cached.
+    """
+    start = time.perf_counter()
+    try:
+        api_key = base64.b64decode(api_key)
+    except Exception:
+        return
+
+    user_id = api_key_cache.get(api_key)
+    if user_id is not None:
+        _add_auth_time(start, 'cache')
+        return get_user_by_id(user_id)
+
+    user = User.query.filter_by(api_key=api_key).first()
+    if user:
+        api_key_cache.set(api_key, str(user.id))
+        user = _cache_user(user)
+    _add_auth_time(start, 'db')
+    return user
+
+
+def api_keys_from_request(req):
+    """ Yield the candidate API keys in a request, in order of precedence """
+    api_key = req.args.get('api_key')  # api_key url arg
+    if api_key:
+        yield api_key.replace(' ', '+')
+
+    api_key = req.headers.get('Authorization')  # Basic Auth
+    if api_key:
+        yield api_key.replace('Basic ', '', 1)
+
+    api_key = req.headers.get('X-API-KEY')  # X-API-KEY header
+    if api_key:
+        yield api_key
+
+
+def add_auth_timing_header(response):
+    """ Report time spent authenticating the request as a Server-Timing header """
+    if hasattr(g, 'auth_time'):
+        response.headers.add(
+            'Server-Timing',
+            'auth;dur={:.3f};desc="{}"'.format(g.auth_time * 1000, g.auth_source))
+    return response
@@ -314,7 +314,6 @@ def graph_y_axes_async(dict_measurements, ids_measures):
 
     y_axes = []
 
-    device_measurements = DeviceMeasurements.query.all()
     input_dev = Input.query.all()
     math = Math.query.all()
     output = Output.query.all()
@@ -379,7 +378,6 @@ def graph_y_axes_async(dict_measurements, ids_measures):
                                                 y_axes,
                                                 measurement,
                                                 dict_measurements,
-                                                device_measurements,
                                                 input_dev,
                                                 output,
                                                 math)
@@ -399,7 +397,6 @@ def graph_y_axes_async(dict_measurements, ids_measures):
                                                 y_axes,
                                                 measurement,
                                                 dict_measurements,
-                                                device_measurements,
                                                 input_dev,
                                                 output,
                                                 math,
@@ -413,7 +410,6 @@ def check_func(all_devices,
                y_axes,
                measurement,
                dict_measurements,
-               device_measurements,
                input_dev,
                output,
                math,
@@ -425,7 +421,6 @@ def check_func(all_devices,
     :param y_axes: empty list to populate
     :param measurement:
     :param dict_measurements:
-    :param device_measurements:
     :param input_dev:
     :param output:
     :param math:
@@ -438,8 +433,7 @@ def check_func(all_devices,
         # If the ID saved to the dashboard element matches the table entry ID
         if each_device.unique_id == unique_id:
 
-            use_unit = use_unit_generate(
-                device_measurements, input_dev, output, math)
+            use_unit = use_unit_generate(input_dev, output, math)
 
             # Add duration
             if measurement == 'duration_time':
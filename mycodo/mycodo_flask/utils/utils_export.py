@@ -3,21 +3,21 @@ import datetime
 import logging
 import socket
 import subprocess
-import threading
 import time
 import zipfile
 
 import io
 import os
 import shutil
+from flask import Response
 from flask import send_file
+from flask import stream_with_context
 from flask import url_for
 from influxdb import InfluxDBClient
 from werkzeug.utils import secure_filename
 
 from mycodo.config import ALEMBIC_VERSION
 from mycodo.config import DEPENDENCY_LOG_FILE
-from mycodo.config import INFLUXDB_DATABASE
 from mycodo.config import INFLUXDB_HOST
 from mycodo.config import INFLUXDB_PASSWORD
 from mycodo.config import INFLUXDB_PORT
@@ -28,8 +28,20 @@ from mycodo.config import SQL_DATABASE_MYCODO
 from mycodo.config_translations import TRANSLATIONS
 from mycodo.mycodo_flask.utils.utils_general import flash_form_errors
 from mycodo.mycodo_flask.utils.utils_general import flash_success_errors
+from mycodo.utils.influx_backup import backup_chains
+from mycodo.utils.influx_backup import backup_sets
+from mycodo.utils.influx_backup import chain_files
+from mycodo.utils.influx_backup import create_backup_set
+from mycodo.utils.influx_import import IMPORT_RUNNING
+from mycodo.utils.influx_import import INFLUXDB_IMPORT_DATABASE
+from mycodo.utils.influx_import import InfluxImport
+from mycodo.utils.jobs import JobCanceled
+from mycodo.utils.jobs import JobError
+from mycodo.utils.jobs import job_runner
+from mycodo.utils.jobs import job_task
 from mycodo.utils.system_pi import assure_path_exists
 from mycodo.utils.system_pi import cmd_output
+from mycodo.utils.zip_stream import zip_stream
 
 logger = logging.getLogger(__name__)
 
@@ -109,8 +121,10 @@ def export_settings(form):
 
 def export_influxdb(form):
     """
-    Save the Mycodo InfluxDB database in the Enterprise-compatible format, zip
-    archive it, and serve it to the user.
+    Queue a job to back up the Mycodo InfluxDB database in the
+    Enterprise-compatible format, only backing up measurements since the
+    last backup if a recent full backup exists. The finished job links to
+    export_influxdb_download().
     """
     action = '{action} {controller}'.format(
         action=TRANSLATIONS['export']['title'],
@@ -118,69 +132,90 @@ def export_influxdb(form):
     error = []
 
     try:
-        influx_backup_dir = os.path.join(INSTALL_DIRECTORY, 'influx_backup')
+        job_runner.submit('export_influxdb', 'Export InfluxDB Database')
+        return "success"
+    except Exception as err:
+        error.append("Error: {}".format(err))
 
-        # Delete influxdb directory if it exists
-        if os.path.isdir(influx_backup_dir):
-            shutil.rmtree(influx_backup_dir)
+    flash_success_errors(error, action, url_for('routes_page.page_export'))
 
-        # Create new directory (make sure it's empty)
-        assure_path_exists(influx_backup_dir)
 
-        cmd = "/usr/bin/influxd backup -database {db} -portable {path}".format(
-            db=INFLUXDB_DATABASE, path=influx_backup_dir)
-        _, _, status = cmd_output(cmd)
+@job_task('export_influxdb')
+def job_export_influxdb(job):
+    """Back up the measurement database, returning where to download it"""
+    job.progress(0, 2, "Determining the InfluxDB version")
+    influxd_version_out, _, _ = cmd_output('/usr/bin/influxd version')
+    if not influxd_version_out:
+        raise Exception("Could not determine Influxdb version")
+    influxd_version = influxd_version_out.decode('utf-8').split(' ')[1]
 
-        influxd_version_out, _, _ = cmd_output(
-            '/usr/bin/influxd version')
-        if influxd_version_out:
-            influxd_version = influxd_version_out.decode('utf-8').split(' ')[1]
-        else:
-            influxd_version = None
-            error.append("Could not determine Influxdb version")
-
-        if not status and influxd_version:
-            # Zip all files in the influx_backup directory
-            data = io.BytesIO()
-            with zipfile.ZipFile(data, mode='w') as z:
-                for _, _, files in os.walk(influx_backup_dir):
-                    for filename in files:
-                        z.write(os.path.join(influx_backup_dir, filename),
-                                filename)
-            data.seek(0)
-
-            # Delete influxdb directory if it exists
-            if os.path.isdir(influx_backup_dir):
-                shutil.rmtree(influx_backup_dir)
-
-            # Send zip file to user
-            return send_file(
-                data,
-                mimetype='application/zip',
-                as_attachment=True,
-                attachment_filename='Mycodo_{mv}_Influxdb_{iv}_{host}_{dt}.zip'.format(
-                     mv=MYCODO_VERSION, iv=influxd_version,
-                     host=socket.gethostname().replace(' ', ''),
-                     dt=datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
-            )
-    except Exception as err:
-        error.append("Error: {}".format(err))
+    job.progress(1, 2, "Backing up measurements")
+    backup_set = create_backup_set()
+    return {
+        'backup': backup_set['name'],
+        'influxd_version': influxd_version,
+        'download': '/export/influxdb_backup/{job}'.format(job=job.unique_id)
+    }
 
-    flash_success_errors(error, action, url_for('routes_page.page_export'))
+
+def export_influxdb_download(result):
+    """
+    Serve a zip archive of the backup of a finished export job, with the
+    full backup and every incremental backup before it, created while it's
+    sent to the user.
+    """
+    chain = [each_chain for each_chain in backup_chains(backup_sets())
+             if result['backup'] in [each_set['name'] for each_set in each_chain]]
+    if not chain:
+        return None
+    names = [each_set['name'] for each_set in chain[0]]
+    chain = chain[0][:names.index(result['backup']) + 1]
+
+    response = Response(
+        stream_with_context(zip_stream(chain_files(chain))),
+        mimetype='application/zip')
+    response.headers['Content-Disposition'] = \
+        'attachment; filename=Mycodo_{mv}_Influxdb_{iv}_{host}_{dt}.zip'.format(
+            mv=MYCODO_VERSION, iv=result['influxd_version'],
+            host=socket.gethostname().replace(' ', ''),
+            dt=datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
+    return response
 
 
 #
 # Import
 #
 
-def thread_import_settings(tmp_folder):
+@job_task('import_settings', cancelable=False)
+def job_import_settings(job, tmp_folder, backup_name):
+    """
+    Replace the settings database with the one extracted to tmp_folder,
+    backing up the current database to backup_name, then upgrade it and
+    install its dependencies.
+    """
+    steps = 6
+
+    # Stop Mycodo daemon (backend)
+    job.progress(0, steps, "Stopping the daemon")
+    cmd = "{pth}/mycodo/scripts/mycodo_wrapper " \
+          "daemon_stop".format(
+        pth=INSTALL_DIRECTORY)
+    _, _, _ = cmd_output(cmd)
+
+    # Backup current database and replace with extracted mycodo.db
+    job.progress(1, steps, "Replacing the settings database")
+    os.rename(SQL_DATABASE_MYCODO, backup_name)
+    os.rename(os.path.join(tmp_folder, 'mycodo.db'), SQL_DATABASE_MYCODO)
+
     # Upgrade database
+    job.progress(2, steps, "Upgrading the settings database")
     cmd = "{pth}/mycodo/scripts/mycodo_wrapper " \
           "upgrade_database".format(
         pth=INSTALL_DIRECTORY)
     _, _, _ = cmd_output(cmd)
 
     # Install/update dependencies (could take a while)
+    job.progress(3, steps, "Installing dependencies")
     cmd = "{pth}/mycodo/scripts/mycodo_wrapper update_dependencies" \
           " | ts '[%Y-%m-%d %H:%M:%S]' >> {log} 2>&1".format(
         pth=INSTALL_DIRECTORY,
@@ -188,12 +223,14 @@ def thread_import_settings(tmp_folder):
     _, _, _ = cmd_output(cmd)
 
     # Initialize
+    job.progress(4, steps, "Initializing")
     cmd = "{pth}/mycodo/scripts/mycodo_wrapper " \
           "initialize".format(
         pth=INSTALL_DIRECTORY)
     _, _, _ = cmd_output(cmd)
 
     # Start Mycodo daemon (backend)
+    job.progress(5, steps, "Starting the daemon")
     cmd = "{pth}/mycodo/scripts/mycodo_wrapper " \
           "daemon_start".format(
         pth=INSTALL_DIRECTORY)
@@ -202,6 +239,7 @@ def thread_import_settings(tmp_folder):
     # Delete tmp directory if it exists
     if os.path.isdir(tmp_folder):
         shutil.rmtree(tmp_folder)
+    job.progress(steps, steps, "Settings imported")
 
 
 def import_settings(form):
@@ -305,31 +343,18 @@ def import_settings(form):
 
         if not error:
             try:
-                # Stop Mycodo daemon (backend)
-                cmd = "{pth}/mycodo/scripts/mycodo_wrapper " \
-                      "daemon_stop".format(
-                    pth=INSTALL_DIRECTORY)
-                _, _, _ = cmd_output(cmd)
-
-                # Backup current database and replace with extracted mycodo.db
-                imported_database = os.path.join(
-                    tmp_folder, mycodo_database_name)
+                # The daemon is stopped and the database replaced by the job
                 backup_name = (
                     SQL_DATABASE_MYCODO + '.backup_' +
                     datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
-                os.rename(SQL_DATABASE_MYCODO, backup_name)
-                os.rename(imported_database, SQL_DATABASE_MYCODO)
-
-                import_settings_db = threading.Thread(
-                    target=thread_import_settings,
-                    args=(tmp_folder,))
-                import_settings_db.start()
+                job_runner.submit(
+                    'import_settings', 'Import Settings Database',
+                    tmp_folder=tmp_folder, backup_name=backup_name)
 
                 return backup_name
             except Exception as err:
                 error.append("Exception while replacing database: "
                              "{err}".format(err=err))
-                return None
 
     except Exception as err:
         error.append("Exception: {}".format(err))
@@ -337,18 +362,20 @@ def import_settings(form):
     flash_success_errors(error, action, url_for('routes_page.page_export'))
 
 
-def thread_import_influxdb(tmp_folder):
-    mycodo_db_backup = 'mycodo_db_bak'
-    client = InfluxDBClient(
-        INFLUXDB_HOST,
-        INFLUXDB_PORT,
-        INFLUXDB_USER,
-        INFLUXDB_PASSWORD,
-        mycodo_db_backup)
+def influxdb_backup_folders(folder):
+    """
+    Return the folders of the backups in an extracted archive, oldest first.
+    Archives of incremental backups have a folder for each backup.
+    """
+    return sorted(root for root, _, files in os.walk(folder)
+                  if any(filename.endswith('.manifest') for filename in files))
+
 
+def restore_influxdb_backup(importer, client, folder):
+    """Restore a backup to the tmp db, returning whether it was restored"""
     # Delete any backup database that may exist (can't copy over a current db)
     try:
-        client.drop_database(mycodo_db_backup)
+        client.drop_database(INFLUXDB_IMPORT_DATABASE)
     except Exception as msg:
         print("Error while deleting db prior to restore: {}".format(msg))
 
@@ -357,7 +384,7 @@ def thread_import_influxdb(tmp_folder):
         logger.info("Creating tmp db with restore data")
         command = "{pth}/mycodo/scripts/mycodo_wrapper " \
                   "influxdb_restore_mycodo_db {dir}".format(
-            pth=INSTALL_DIRECTORY, dir=tmp_folder)
+            pth=INSTALL_DIRECTORY, dir=folder)
         cmd = subprocess.Popen(
             command,
             stdout=subprocess.PIPE,
@@ -366,32 +393,82 @@ def thread_import_influxdb(tmp_folder):
         cmd_status = cmd.wait()
         logger.info("command output: {}\nErrors: {}\nStatus: {}".format(
             cmd_out.decode('utf-8'), cmd_err, cmd_status))
+        if cmd_status:
+            importer.fail("Restore of the backup failed with status {}".format(cmd_status))
+            return False
     except Exception as msg:
         logger.info("Error during restore of data to backup db: {}".format(msg))
+        importer.fail("Restore of the backup failed: {}".format(msg))
+        return False
+    return True
 
-    # Copy all measurements from backup to current database
-    try:
-        logger.info("Beginning restore of data from tmp db to main db. This could take a while...")
-        query_str = "SELECT * INTO {}..:MEASUREMENT FROM /.*/ GROUP BY *".format(
-            INFLUXDB_DATABASE)
-        client.query(query_str)
-        logger.info("Restore of data from tmp db complete.")
-    except Exception as msg:
-        logger.info("Error during copy of measurements from backup db to production db: {}".format(msg))
 
-    # Delete backup database
+@job_task('import_influxdb')
+def job_import_influxdb(job, tmp_folder=None):
+    """
+    Restore each uploaded backup to a temporary database, oldest first, and
+    copy its measurements into the Mycodo database. Without tmp_folder, the
+    import of a previous (interrupted or canceled) upload is resumed.
+    """
+    def backup_message(stage):
+        return "{stage} backup {num} of {total}".format(
+            stage=stage, num=importer.state['folder'] + 1, total=len(importer.state['folders']))
+
+    importer = InfluxImport(on_progress=lambda copied, chunks: job.progress(
+        copied, chunks, backup_message("Copying")))
+    client = InfluxDBClient(
+        INFLUXDB_HOST,
+        INFLUXDB_PORT,
+        INFLUXDB_USER,
+        INFLUXDB_PASSWORD,
+        INFLUXDB_IMPORT_DATABASE)
+
+    if tmp_folder:
+        folders = influxdb_backup_folders(tmp_folder)
+        if not folders:
+            raise JobError("No backup ('.manifest' file) found in the archive")
+        importer.begin(tmp_folder, folders)
+
     try:
-        logger.info("Deleting tmp db")
-        client.drop_database(mycodo_db_backup)
-    except Exception as msg:
-        logger.info("Error while deleting db after restore: {}".format(msg))
+        while True:
+            folder = importer.state['folders'][importer.state['folder']]
+            if importer.state['stage'] == 'restoring':
+                job.progress(0, 0, backup_message("Restoring"))
+                if not restore_influxdb_backup(importer, client, folder):
+                    raise Exception(importer.state['error'])
+
+            # Copy all measurements from backup to current database
+            logger.info("Beginning restore of data from tmp db to main db. This could take a while...")
+            job.progress(message=backup_message("Importing"))
+            if not importer.run():
+                # Keep the tmp db so the copy can be resumed
+                logger.error("Copy of measurements from backup db to production db failed: {}".format(
+                    importer.state['error']))
+                job.check_canceled()
+                raise Exception(importer.state['error'])
+            logger.info("Restore of data from tmp db complete: {}".format(
+                ', '.join('{}: {}'.format(name, counts['stored'])
+                          for name, counts in sorted(importer.state['verified'].items()))))
+
+            # Delete backup database
+            try:
+                logger.info("Deleting tmp db")
+                client.drop_database(INFLUXDB_IMPORT_DATABASE)
+            except Exception as msg:
+                logger.info("Error while deleting db after restore: {}".format(msg))
+
+            if not importer.next_folder():
+                break
+    except JobCanceled:
+        importer.fail("Canceled")  # Resumable
+        raise
 
     # Delete tmp directory if it exists
     try:
         logger.info("Deleting influxdb restore tmp directory...")
         command = "{pth}/mycodo/scripts/mycodo_wrapper " \
                   "influxdb_delete_restore_tmp_dir {dir}".format(
-            pth=INSTALL_DIRECTORY, dir=tmp_folder)
+            pth=INSTALL_DIRECTORY, dir=importer.state['tmp_folder'])
         cmd = subprocess.Popen(
             command,
             stdout=subprocess.PIPE,
@@ -404,6 +481,31 @@ def thread_import_influxdb(tmp_folder):
         logger.info("Error while deleting tmp file directory: {}".format(msg))
 
 
+def import_influxdb_status():
+    """Return the progress of the last influxdb import"""
+    return InfluxImport().status()
+
+
+def import_influxdb_resume():
+    """Resume copying the measurements of an interrupted influxdb import"""
+    action = '{action} {controller}'.format(
+        action=TRANSLATIONS['import']['title'],
+        controller="Influxdb")
+    error = []
+
+    status = import_influxdb_status()
+    if not status['resumable']:
+        error.append("There is no interrupted import to resume")
+    else:
+        try:
+            job_runner.submit('import_influxdb', 'Import InfluxDB Database')
+            return "success"
+        except JobError as err:
+            error.append(str(err))
+
+    flash_success_errors(error, action, url_for('routes_page.page_export'))
+
+
 def import_influxdb(form):
     """
     Receive a zip file contatining influx metastore and database that was
@@ -421,7 +523,9 @@ def import_influxdb(form):
         tmp_folder = os.path.join(upload_folder, 'mycodo_influx_tmp')
         full_path = None
 
-        if not form.influxdb_import_file.data:
+        if import_influxdb_status()['status'] in IMPORT_RUNNING:
+            error.append("An import is already in progress")
+        elif not form.influxdb_import_file.data:
             error.append('No file present')
         elif form.influxdb_import_file.data.filename == '':
             error.append('No file name')
@@ -468,6 +572,8 @@ def import_influxdb(form):
             filename = secure_filename(
                 form.influxdb_import_file.data.filename)
             full_path = os.path.join(tmp_folder, filename)
+            if os.path.isdir(tmp_folder):
+                shutil.rmtree(tmp_folder)  # Backups of a previous import
             assure_path_exists(tmp_folder)
             form.influxdb_import_file.data.save(
                 os.path.join(tmp_folder, filename))
@@ -493,17 +599,17 @@ def import_influxdb(form):
                 error.append("Exception while extracting zip file: "
                              "{err}".format(err=err))
 
+        if not error and not influxdb_backup_folders(tmp_folder):
+            error.append("No backup ('.manifest' file) found in archive")
+
         if not error:
             try:
-                import_settings_db = threading.Thread(
-                    target=thread_import_influxdb,
-                    args=(tmp_folder,))
-                import_settings_db.start()
+                job_runner.submit(
+                    'import_influxdb', 'Import InfluxDB Database', tmp_folder=tmp_folder)
                 return "success"
             except Exception as err:
                 error.append("Exception while importing database: "
                              "{err}".format(err=err))
-                return 'error'
 
     except Exception as err:
         error.append("Exception: {}".format(err))
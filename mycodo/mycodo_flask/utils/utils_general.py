@@ -42,6 +42,7 @@ from mycodo.databases.models import Trigger
 from mycodo.databases.models import User
 from mycodo.databases.models import Widget
 from mycodo.mycodo_flask.extensions import db
+from mycodo.mycodo_flask.utils.utils_measurement import measurement_resolver
 from mycodo.utils.functions import parse_function_information
 from mycodo.utils.inputs import parse_input_information
 from mycodo.utils.outputs import parse_output_information
@@ -1568,7 +1569,7 @@ def return_dependencies(device_type):
     return unmet_deps, met_deps
 
 
-def use_unit_generate(device_measurements, input_dev, output, math):
+def use_unit_generate(input_dev, output, math):
     """Generate dictionary of units to convert to"""
     use_unit = {}
 
@@ -1581,13 +1582,14 @@ def use_unit_generate(device_measurements, input_dev, output, math):
         for each_device in devices:
             use_unit[each_device.unique_id] = {}
 
-            for each_meas in device_measurements:
-                if each_meas.device_id == each_device.unique_id:
-                    if each_meas.measurement not in use_unit[each_device.unique_id]:
-                        use_unit[each_device.unique_id][each_meas.measurement] = {}
-                    if each_meas.unit not in use_unit[each_device.unique_id][each_meas.measurement]:
-                        use_unit[each_device.unique_id][each_meas.measurement][each_meas.unit] = OrderedDict()
-                    use_unit[each_device.unique_id][each_meas.measurement][each_meas.unit][each_meas.channel] = None
+            for each_meas in measurement_resolver.device(each_device.unique_id):
+                measurement = each_meas.device_measurement
+                unit = each_meas.device_unit
+                if measurement not in use_unit[each_device.unique_id]:
+                    use_unit[each_device.unique_id][measurement] = {}
+                if unit not in use_unit[each_device.unique_id][measurement]:
+                    use_unit[each_device.unique_id][measurement][unit] = OrderedDict()
+                use_unit[each_device.unique_id][measurement][unit][each_meas.channel] = None
 
     for each_output in output:
         use_unit[each_output.unique_id] = {}
@@ -22,6 +22,8 @@ from mycodo.mycodo_flask.utils.utils_general import flash_form_errors
 from mycodo.mycodo_flask.utils.utils_general import flash_success_errors
 from mycodo.mycodo_flask.utils.utils_general import reorder
 from mycodo.mycodo_flask.utils.utils_general import return_dependencies
+from mycodo.utils.expression import expression_errors
+from mycodo.utils.expression import math_equation_variables
 from mycodo.utils.system_pi import csv_to_list_of_str
 from mycodo.utils.system_pi import get_measurement
 from mycodo.utils.system_pi import list_to_csv
@@ -120,6 +122,7 @@ def math_mod(form_mod_math, form_mod_type=None):
         mod_math.log_level_debug = form_mod_math.log_level_debug.data
         mod_math.max_measure_age = form_mod_math.max_measure_age.data
         mod_math.start_offset = form_mod_math.start_offset.data
+        mod_math.update_on_input = form_mod_math.update_on_input.data
 
         measurements = DeviceMeasurements.query.filter(
             DeviceMeasurements.device_id == form_mod_math.math_id.data).all()
@@ -219,6 +222,11 @@ def math_mod(form_mod_math, form_mod_type=None):
         elif mod_math.math_type == 'equation':
             mod_math.equation_input = form_mod_type.equation_input.data
             mod_math.equation = form_mod_type.equation.data
+            mod_math.inputs = ';'.join(form_mod_math.inputs.data or [])
+            error.extend(expression_errors(
+                mod_math.equation,
+                [variable for variable, _ in math_equation_variables(
+                    mod_math.equation_input, mod_math.inputs)]))
 
         elif mod_math.math_type == 'humidity':
             mod_math.dry_bulb_t_id = form_mod_type.dry_bulb_temperature.data.split(',')[0]
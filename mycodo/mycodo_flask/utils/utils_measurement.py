@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+#  utils_measurement.py - Cached resolution of device measurements to the
+#                         device, unit, channel and measurement they are stored as
+#
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from mycodo.config import MEASUREMENT_RESOLVER_TTL
+from mycodo.databases.models import Conversion
+from mycodo.databases.models import DeviceMeasurements
+from mycodo.databases.models import PID
+from mycodo.databases.models import Unit
+from mycodo.utils.system_pi import add_custom_units
+from mycodo.utils.system_pi import return_measurement_info
+
+logger = logging.getLogger(__name__)
+
+MeasurementInfo = namedtuple('MeasurementInfo', [
+    'unique_id',           # DeviceMeasurements.unique_id
+    'device_id',           # Unique ID of the Input/Math/Output/PID
+    'device_type',         # DeviceMeasurements.device_type
+    'channel',             # Channel the measurement is stored with
+    'unit',                # Unit the measurement is stored with (after conversion/rescaling)
+    'measurement',         # Measurement the measurement is stored with (after rescaling)
+    'measurement_type',    # DeviceMeasurements.measurement_type (e.g. 'setpoint')
+    'device_unit',         # DeviceMeasurements.unit, before conversion/rescaling
+    'device_measurement',  # DeviceMeasurements.measurement, before rescaling
+])
+
+# Tables that affect how a measurement is resolved
+RESOLVER_TABLES = (Conversion, DeviceMeasurements, PID)
+
+
+class MeasurementResolver:
+    """
+    Resolves DeviceMeasurements IDs to MeasurementInfo from a single bulk
+    load of the DeviceMeasurements, Conversion and PID tables.
+
+    The loaded tables are discarded when any of them are committed to from
+    this process, and after MEASUREMENT_RESOLVER_TTL seconds to pick up
+    changes from other processes.
+    """
+    def __init__(self, ttl=MEASUREMENT_RESOLVER_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._measurements = None
+        self._by_device = None
+        self._expires = 0
+
+    def invalidate(self):
+        """ Discard the loaded measurements, forcing a reload on next use """
+        with self._lock:
+            self._measurements = None
+            self._by_device = None
+
+    def get(self, measurement_id):
+        """ Return the MeasurementInfo of a DeviceMeasurements ID, or None """
+        measurements, _ = self._snapshot()
+        return measurements.get(measurement_id)
+
+    def device(self, device_id):
+        """ Return the list of MeasurementInfo of a device, ordered by channel """
+        _, by_device = self._snapshot()
+        return by_device.get(device_id, [])
+
+    def all(self):
+        """ Return a dict of DeviceMeasurements ID: MeasurementInfo """
+        measurements, _ = self._snapshot()
+        return measurements
+
+    def _snapshot(self):
+        with self._lock:
+            if self._measurements is None or time.monotonic() > self._expires:
+                self._measurements, self._by_device = self._load()
+                self._expires = time.monotonic() + self.ttl
+            return self._measurements, self._by_device
+
+    @staticmethod
+    def _load():
+        device_measurements = DeviceMeasurements.query.order_by(
+            DeviceMeasurements.channel).all()
+        conversions = {each.unique_id: each for each in Conversion.query.all()}
+        pid_measurements = {each.unique_id: each.measurement for each in PID.query.all()}
+        by_unique_id = {each.unique_id: each for each in device_measurements}
+
+        measurements = {}
+        by_device = {}
+        for each_meas in device_measurements:
+            channel, unit, measurement = return_measurement_info(
+                each_meas, conversions.get(each_meas.conversion_id))
+
+            # PID setpoints are stored in the unit of the PID's measurement
+            if each_meas.measurement_type == 'setpoint':
+                pid_measurement = pid_measurements.get(each_meas.device_id)
+                if pid_measurement and ',' in pid_measurement:
+                    setpoint_measurement = by_unique_id.get(pid_measurement.split(',')[1])
+                    if setpoint_measurement:
+                        _, unit, measurement = return_measurement_info(
+                            setpoint_measurement,
+                            conversions.get(setpoint_measurement.conversion_id))
+
+            info = MeasurementInfo(
+                unique_id=each_meas.unique_id,
+                device_id=each_meas.device_id,
+                device_type=each_meas.device_type,
+                channel=channel,
+                unit=unit,
+                measurement=measurement,
+                measurement_type=each_meas.measurement_type,
+                device_unit=each_meas.unit,
+                device_measurement=each_meas.measurement)
+            measurements[each_meas.unique_id] = info
+            by_device.setdefault(each_meas.device_id, []).append(info)
+
+        return measurements, by_device
+
+
+measurement_resolver = MeasurementResolver()
+
+
+class UnitCache:
+    """
+    The built-in and custom units (see add_custom_units()), loaded once and
+    discarded when the Unit table is committed to from this process, and
+    after MEASUREMENT_RESOLVER_TTL seconds to pick up changes from other processes.
+    """
+    def __init__(self, ttl=MEASUREMENT_RESOLVER_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._units = None
+        self._expires = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._units = None
+
+    def all(self):
+        """ Return an OrderedDict of unit ID: {'unit', 'name'} (don't modify) """
+        with self._lock:
+            if self._units is None or time.monotonic() > self._expires:
+                self._units = add_custom_units(Unit.query.all())
+                self._expires = time.monotonic() + self.ttl
+            return self._units
+
+    def __contains__(self, unit):
+        return unit in self.all()
+
+
+unit_cache = UnitCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def _flag_measurement_changes(session, flush_context):
+    for each_obj in session.new | session.dirty | session.deleted:
+        if isinstance(each_obj, RESOLVER_TABLES):
+            session.info['measurement_resolver_dirty'] = True
+        elif isinstance(each_obj, Unit):
+            session.info['unit_cache_dirty'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('measurement_resolver_dirty', False):
+        measurement_resolver.invalidate()
+    if session.info.pop('unit_cache_dirty', False):
+        unit_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('measurement_resolver_dirty', None)
+    session.info.pop('unit_cache_dirty', None)
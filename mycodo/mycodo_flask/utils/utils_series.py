@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+#  utils_series.py - Encoding of measurement series returned to the web UI and API
+#
+import array
+import json
+import logging
+import struct
+import sys
+
+from flask import Response
+from flask import jsonify
+from flask import request
+from flask import stream_with_context
+
+logger = logging.getLogger(__name__)
+
+# Compact columnar series format:
+#   uint32 point count, uint32 reserved (0),
+#   float64[count] epoch millisecond timestamps,
+#   float64[count] values (NaN for null)
+# All fields are little-endian.
+SERIES_MIMETYPE = 'application/vnd.mycodo.series'
+
+# Formats a series may be streamed in, one measurement per line
+NDJSON_MIMETYPE = 'application/x-ndjson'
+CSV_MIMETYPE = 'text/csv'
+STREAM_MIMETYPES = [NDJSON_MIMETYPE, CSV_MIMETYPE]
+
+
+def series_requested():
+    """ Determine if the client asked for the compact columnar series format """
+    return request.accept_mimetypes.best == SERIES_MIMETYPE
+
+
+def series_epoch():
+    """ The InfluxDB epoch precision to query with for the requested format """
+    if series_requested():
+        return 'ms'
+
+
+def encode_series(values):
+    """
+    Encode [[epoch_ms, value], ...] into the compact columnar format
+
+    :param values: list of [epoch milliseconds, float or None]
+    :return: bytes
+    """
+    timestamps = array.array('d', (each[0] for each in values))
+    measurements = array.array(
+        'd', (float('nan') if each[1] is None else each[1] for each in values))
+    if sys.byteorder == 'big':
+        timestamps.byteswap()
+        measurements.byteswap()
+    return (struct.pack('<II', len(timestamps), 0) +
+            timestamps.tobytes() +
+            measurements.tobytes())
+
+
+def decode_series(data):
+    """ Decode the compact columnar format into [[epoch_ms, value], ...] """
+    count, _ = struct.unpack_from('<II', data)
+    timestamps = struct.unpack_from('<{}d'.format(count), data, 8)
+    measurements = struct.unpack_from('<{}d'.format(count), data, 8 + count * 8)
+    return [[ts, None if value != value else value]
+            for ts, value in zip(timestamps, measurements)]
+
+
+def series_response(values, compact=None):
+    """
+    Return a series in the format the client asked for. Timestamps must be
+    epoch milliseconds if the compact format was requested (see series_epoch()).
+
+    :param values: list of [timestamp, value]
+    :param compact: force (True) or prevent (False) the compact format, or
+        negotiate it from the Accept header (None)
+    """
+    if compact is None:
+        compact = series_requested()
+    if compact:
+        try:
+            return Response(encode_series(values), mimetype=SERIES_MIMETYPE)
+        except (TypeError, ValueError):
+            logger.debug("Series contains non-numeric values, returning JSON")
+    return jsonify(values)
+
+
+def stream_lines(chunks, mimetype):
+    """ Generate the lines of each chunk of [timestamp, value] in NDJSON or CSV """
+    if mimetype == CSV_MIMETYPE:
+        yield 'time,value\n'
+    for each_chunk in chunks:
+        if mimetype == CSV_MIMETYPE:
+            lines = ['{},{}\n'.format(ts, '' if value is None else value)
+                     for ts, value in each_chunk]
+        else:
+            lines = [json.dumps({'time': ts, 'value': value}) + '\n'
+                     for ts, value in each_chunk]
+        yield ''.join(lines)
+
+
+def stream_response(chunks, mimetype):
+    """
+    Stream a series, read in chunks of [[timestamp, value], ...], one line per
+    measurement, without holding more than one chunk in memory
+
+    :param chunks: iterable of lists of [timestamp, value]
+    :param mimetype: NDJSON_MIMETYPE or CSV_MIMETYPE
+    """
+    return Response(stream_with_context(stream_lines(chunks, mimetype)), mimetype=mimetype)
@@ -58,6 +58,7 @@ from mycodo.mycodo_flask.utils.utils_general import flash_form_errors
 from mycodo.mycodo_flask.utils.utils_general import flash_success_errors
 from mycodo.mycodo_flask.utils.utils_input import input_deactivate_associated_controllers
 from mycodo.utils.database import db_retrieve_table
+from mycodo.utils.expression import expression_errors
 from mycodo.utils.functions import parse_function_information
 from mycodo.utils.inputs import parse_input_information
 from mycodo.utils.modules import load_module_from_file
@@ -1181,8 +1182,7 @@ def settings_convert_add(form):
         error.append("Conversion '{cs}' already exists.".format(
             cs=conversion_str))
 
-    if 'x' not in form.equation.data:
-        error.append("'x' must appear in the equation.")
+    error.extend(expression_errors(form.equation.data, required=('x',)))
 
     if form.validate():
         new_conversion = Conversion()
@@ -1215,8 +1215,7 @@ def settings_convert_mod(form):
         controller=gettext("Conversion"))
     error = []
 
-    if 'x' not in form.equation.data:
-        error.append("'x' must appear in the equation")
+    error.extend(expression_errors(form.equation.data, required=('x',)))
 
     try:
         mod_conversion = Conversion.query.filter(
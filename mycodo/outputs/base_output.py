@@ -15,19 +15,15 @@ import threading
 import time
 import timeit
 
-from sqlalchemy import and_
-from sqlalchemy import or_
-
 from mycodo.abstract_base_controller import AbstractBaseController
 from mycodo.config import SQL_DATABASE_MYCODO
 from mycodo.databases.models import Output
-from mycodo.databases.models import OutputChannel
-from mycodo.databases.models import Trigger
 from mycodo.databases.utils import session_scope
 from mycodo.mycodo_client import DaemonControl
-from mycodo.utils.database import db_retrieve_table_daemon
 from mycodo.utils.influx import write_influxdb_value
 from mycodo.utils.outputs import output_types
+from mycodo.utils.trigger_dispatch import on_duration_matches
+from mycodo.utils.trigger_dispatch import output_triggers
 
 MYCODO_DB_PATH = 'sqlite:///' + SQL_DATABASE_MYCODO
 
@@ -501,80 +497,27 @@ class AbstractOutput(AbstractBaseController):
         This function is executed whenever an output is turned on or off
         It is responsible for executing Output Triggers
         """
-        output_channel_dev = db_retrieve_table_daemon(OutputChannel).filter(
-            and_(OutputChannel.output_id == output_id, OutputChannel.channel == output_channel)).first()
-        if output_channel_dev is None:
-            self.logger.error("Could nto find channel in database")
+        channel_triggers = output_triggers.get(output_id, output_channel)
+        if not channel_triggers:
             return
 
         #
         # Check On/Off Outputs
         #
-        trigger_output = db_retrieve_table_daemon(Trigger)
-        trigger_output = trigger_output.filter(Trigger.trigger_type == 'trigger_output')
-        trigger_output = trigger_output.filter(Trigger.unique_id_1 == output_id)
-        trigger_output = trigger_output.filter(Trigger.unique_id_2 == output_channel_dev.unique_id)
-        trigger_output = trigger_output.filter(Trigger.is_activated == True)
 
         # Find any Output Triggers with the output_id of the output that
         # just changed its state
         if self.is_on(output_channel):
-            trigger_output = trigger_output.filter(
-                or_(Trigger.output_state == 'on_duration_none',
-                    Trigger.output_state == 'on_duration_any',
-                    Trigger.output_state == 'on_duration_none_any',
-                    Trigger.output_state == 'on_duration_equal',
-                    Trigger.output_state == 'on_duration_greater_than',
-                    Trigger.output_state == 'on_duration_equal_greater_than',
-                    Trigger.output_state == 'on_duration_less_than',
-                    Trigger.output_state == 'on_duration_equal_less_than'))
-
-            on_duration_none = and_(
-                Trigger.output_state == 'on_duration_none',
-                amount == 0.0)
-
-            on_duration_any = and_(
-                Trigger.output_state == 'on_duration_any',
-                bool(amount))
-
-            on_duration_none_any = Trigger.output_state == 'on_duration_none_any'
-
-            on_duration_equal = and_(
-                Trigger.output_state == 'on_duration_equal',
-                Trigger.output_duration == amount)
-
-            on_duration_greater_than = and_(
-                Trigger.output_state == 'on_duration_greater_than',
-                amount > Trigger.output_duration)
-
-            on_duration_equal_greater_than = and_(
-                Trigger.output_state == 'on_duration_equal_greater_than',
-                amount >= Trigger.output_duration)
-
-            on_duration_less_than = and_(
-                Trigger.output_state == 'on_duration_less_than',
-                amount < Trigger.output_duration)
-
-            on_duration_equal_less_than = and_(
-                Trigger.output_state == 'on_duration_equal_less_than',
-                amount <= Trigger.output_duration)
-
-            trigger_output = trigger_output.filter(
-                or_(on_duration_none,
-                    on_duration_any,
-                    on_duration_none_any,
-                    on_duration_equal,
-                    on_duration_greater_than,
-                    on_duration_equal_greater_than,
-                    on_duration_less_than,
-                    on_duration_equal_less_than))
+            trigger_output = [
+                each_trigger for each_trigger in channel_triggers.get('on', [])
+                if on_duration_matches(
+                    each_trigger.output_state, each_trigger.output_duration, amount)]
         else:
-            trigger_output = trigger_output.filter(
-                Trigger.output_state == 'off')
+            trigger_output = channel_triggers.get('off', [])
 
         # Execute the Trigger Actions for each Output Trigger
         # for this particular Output device
-        for each_trigger in trigger_output.all():
+        for each_trigger in trigger_output:
             timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
             message = "{ts}\n[Trigger {cid} ({cname})] Output {oid} CH{ch} ({name}) {state}".format(
                 ts=timestamp,
@@ -591,15 +534,10 @@ class AbstractOutput(AbstractBaseController):
         #
         # Check PWM Outputs
         #
-        trigger_output_pwm = db_retrieve_table_daemon(Trigger)
-        trigger_output_pwm = trigger_output_pwm.filter(Trigger.trigger_type == 'trigger_output_pwm')
-        trigger_output_pwm = trigger_output_pwm.filter(Trigger.unique_id_1 == output_id)
-        trigger_output_pwm = trigger_output_pwm.filter(Trigger.unique_id_2 == output_channel_dev.unique_id)
-        trigger_output_pwm = trigger_output_pwm.filter(Trigger.is_activated == True)
 
         # Execute the Trigger Actions for each Output Trigger
         # for this particular Output device
-        for each_trigger in trigger_output_pwm.all():
+        for each_trigger in channel_triggers.get('pwm', []):
             trigger_trigger = False
             duty_cycle = self.output_state(output_channel)
 
@@ -18,23 +18,15 @@ function error_found {
 
 CURRENT_VERSION=$("${INSTALL_DIRECTORY}"/Mycodo/env/bin/python "${INSTALL_DIRECTORY}"/Mycodo/mycodo/utils/github_release_info.py -c 2>&1)
 NOW=$(date +"%Y-%m-%d_%H-%M-%S")
-TMP_DIR="/var/tmp/Mycodo-backup-${NOW}-${CURRENT_VERSION}"
-BACKUP_DIR="/var/Mycodo-backups/Mycodo-backup-${NOW}-${CURRENT_VERSION}"
 
 printf "\n#### Create backup initiated %s ####\n" "${NOW}"
 
 mkdir -p /var/Mycodo-backups
 
-printf "Backing up current Mycodo from %s/Mycodo to %s..." "${INSTALL_DIRECTORY}" "${TMP_DIR}"
-if ! rsync -avq --exclude=cameras --exclude=env "${INSTALL_DIRECTORY}"/Mycodo "${TMP_DIR}" ; then
-    printf "Failed: Error while trying to back up current Mycodo install from %s/Mycodo to %s.\n" "${INSTALL_DIRECTORY}" "${BACKUP_DIR}"
-    error_found
-fi
-printf "Done.\n"
-
-printf "Moving %s/Mycodo to %s..." "${TMP_DIR}" "${BACKUP_DIR}"
-if ! mv "${TMP_DIR}"/Mycodo "${BACKUP_DIR}" ; then
-    printf "Failed: Error while trying to move %s/Mycodo to %s.\n" "${TMP_DIR}" "${BACKUP_DIR}"
+printf "Backing up current Mycodo from %s/Mycodo to /var/Mycodo-backups (unchanged files are not stored again)...\n" "${INSTALL_DIRECTORY}"
+cd "${INSTALL_DIRECTORY}"/Mycodo || error_found
+if ! "${INSTALL_DIRECTORY}"/Mycodo/env/bin/python -m mycodo.utils.backup_store create "${CURRENT_VERSION}" ; then
+    printf "Failed: Error while trying to back up current Mycodo install from %s/Mycodo.\n" "${INSTALL_DIRECTORY}"
     error_found
 fi
 printf "Done.\n"
@@ -8,10 +8,10 @@ if [ "$EUID" -ne 0 ] ; then
 fi
 
 if [ ! -e "$1" ]; then
-    echo "Directory does not exist"
+    echo "Backup does not exist"
     exit 1
-elif [ ! -d "$1" ]; then
-    echo "Input not a directory"
+elif [ ! -d "$1" ] && [[ "$1" != *.json ]]; then
+    echo "Input not a directory or backup manifest"
     exit 2
 fi
 
@@ -33,6 +33,19 @@ BACKUP_DIR="/var/Mycodo-backups/Mycodo-backup-${NOW}-${CURRENT_VERSION}"
 
 printf "\n#### Restore of backup %s initiated %s ####\n" "$1" "$NOW"
 
+RESTORE_DIR="$1"
+if [ -f "$1" ] ; then
+    RESTORE_DIR="/var/tmp/Mycodo-restore-${NOW}"
+    printf "\nRestoring files of backup %s to %s..." "$1" "${RESTORE_DIR}"
+    cd "${INSTALL_DIRECTORY}"/Mycodo || error_found
+    if ! "${INSTALL_DIRECTORY}"/Mycodo/env/bin/python -m mycodo.utils.backup_store restore "$1" "${RESTORE_DIR}" ; then
+        printf "Failed: Error while trying to restore the files of backup %s.\n" "$1"
+        rm -rf "${RESTORE_DIR}"
+        error_found
+    fi
+    printf "Done.\n"
+fi
+
 printf "#### Stopping Daemon and HTTP server ####\n"
 service mycodo stop
 sleep 2
@@ -49,8 +62,8 @@ if ! mv "${INSTALL_DIRECTORY}"/Mycodo "${BACKUP_DIR}" ; then
 fi
 printf "Done.\n"
 
-printf "\nRestoring Mycodo from %s to %s/Mycodo..." "$1" "${INSTALL_DIRECTORY}"
-if ! mv "$1" "${INSTALL_DIRECTORY}"/Mycodo ; then
+printf "\nRestoring Mycodo from %s to %s/Mycodo..." "${RESTORE_DIR}" "${INSTALL_DIRECTORY}"
+if ! mv "${RESTORE_DIR}" "${INSTALL_DIRECTORY}"/Mycodo ; then
     printf "Failed: Error while trying to restore Mycodo backup from %s/Mycodo to %s.\n" "${INSTALL_DIRECTORY}" "${BACKUP_DIR}"
     error_found
 fi
@@ -0,0 +1,56 @@
+# coding=utf-8
+""" Tests for the Python Code Input """
+import os
+import time
+from collections import namedtuple
+
+import mycodo.inputs.python_code as python_code
+import mycodo.utils.influx as influx
+
+FakeInput = namedtuple('FakeInput', ['unique_id', 'cmd_command'])
+
+
+def test_python_code_compiled_once_and_batched(tmpdir, monkeypatch):
+    """ verify the code is only recompiled when modified and measurements are written together """
+    writes = []
+    monkeypatch.setattr(python_code, 'PATH_PYTHON_CODE_USER', str(tmpdir))
+    monkeypatch.setattr(python_code, 'set_user_grp', lambda *args: None)
+    monkeypatch.setattr(influx, 'write_influxdb_list', lambda data, unique_id: writes.append(data))
+
+    input_dev = FakeInput('0000-python', "self.runs = getattr(self, 'runs', 0) + 1\n"
+                                         "self.store_measurements({0: self.runs, 1: 2.5})")
+    python_code.generate_code(input_dev)
+
+    input_module = python_code.InputModule(input_dev, testing=True)
+    input_module.unique_id = input_dev.unique_id
+    input_module.python_code = input_dev.cmd_command
+    input_module.measure_info = {
+        0: {'measurement': 'temperature', 'unit': 'C'},
+        1: {'measurement': 'humidity', 'unit': 'percent'}}
+    input_module.file_run = os.path.join(str(tmpdir), 'input_python_code_0000-python.py')
+
+    input_module.load_code()
+    input_module.get_measurement()
+    input_module.get_measurement()
+    assert input_module.run.runs == 2
+
+    status = input_module.status()
+    assert status['compilations'] == 1
+    assert status['runs'] == 2
+    assert status['errors'] == 0
+
+    # Modifying the Input regenerates the file, which is then recompiled
+    time.sleep(0.01)
+    python_code.generate_code(input_dev)
+    os.utime(input_module.file_run, (time.time() + 1, time.time() + 1))
+    input_module.get_measurement()
+    assert input_module.run.runs == 1
+    assert input_module.status()['compilations'] == 2
+
+    for _ in range(50):
+        if len(writes) == 3:
+            break
+        time.sleep(0.01)
+    assert len(writes) == 3
+    assert [each['fields']['value'] for each in writes[1]] == [2.0, 2.5]
+    assert writes[1][1]['tags']['measure'] == 'humidity'
@@ -14,6 +14,8 @@ from mycodo.databases.models import Output
 from mycodo.databases.models import User
 from mycodo.mycodo_flask.utils.utils_general import generate_form_input_list
 from mycodo.mycodo_flask.utils.utils_general import generate_form_output_list
+from mycodo.mycodo_flask.utils.utils_measurement import measurement_resolver
+from mycodo.mycodo_flask.utils.utils_series import decode_series
 from mycodo.tests.software_tests.conftest import login_user
 from mycodo.tests.software_tests.factories import UserFactory
 from mycodo.utils.inputs import parse_input_information
@@ -165,6 +167,30 @@ def test_api_with_admin_apikey_in_header(_, testapp):
         assert route[1] in response, "Unexpected HTTP Response: \n{body}".format(body=response.body)
 
 
+@mock.patch('mycodo.mycodo_flask.routes_authentication.login_log')
+def test_api_key_cache_invalidated_on_key_change(_, testapp):
+    """ Verifies a cached API key stops working once the user's key changes """
+    print("\nTest: test_api_key_cache_invalidated_on_key_change")
+    headers = {'Accept': 'application/vnd.mycodo.v1+json',
+               'X-API-KEY': base64.b64encode(b'secret_admin_api_key')}
+
+    response = testapp.get('/api/settings/users', headers=headers)
+    assert response.status_code == 200
+    assert 'auth;dur=' in response.headers['Server-Timing']
+
+    # Second request is served from the cache
+    response = testapp.get('/api/settings/users', headers=headers)
+    assert response.status_code == 200
+    assert 'desc="cache"' in response.headers['Server-Timing']
+
+    user = User.query.filter(User.name == 'admin').first()
+    user.api_key = b'new_secret_admin_api_key'
+    user.save()
+
+    response = testapp.get('/api/settings/users', headers=headers, expect_errors=True)
+    assert response.status_code == 401
+
+
 @mock.patch('mycodo.mycodo_flask.routes_authentication.login_log')
 def test_api_measurement_post_get(_, testapp):
     """ Verifies behavior of these API endpoints with an apikey in the header to post and get a measurement """
@@ -260,6 +286,37 @@ def test_api_measurement_post_get(_, testapp):
         body=response.body)
 
 
+@mock.patch('mycodo.mycodo_flask.api.measurement.read_influxdb_page')
+@mock.patch('mycodo.mycodo_flask.routes_authentication.login_log')
+def test_api_measurement_historical_compact_series(_, mock_read, testapp):
+    """ Verifies the historical measurement API returns the compact series format when requested """
+    print("\nTest: test_api_measurement_historical_compact_series")
+    mock_read.return_value = [[1604000000000, 21.5], [1604000002000, 22.0]]
+    headers = {'Accept': 'application/vnd.mycodo.series',
+               'X-API-KEY': base64.b64encode(b'secret_admin_api_key')}
+
+    response = testapp.get('/api/measurements/historical/testuniqueid/C/0/0/0', headers=headers)
+    assert response.status_code == 200
+    assert response.content_type == 'application/vnd.mycodo.series'
+    assert decode_series(response.body) == mock_read.return_value
+    assert mock_read.call_args[1]['epoch'] == 'ms'
+
+
+@mock.patch('mycodo.mycodo_flask.api.measurement.read_influxdb_list')
+@mock.patch('mycodo.mycodo_flask.routes_authentication.login_log')
+def test_api_measurement_past_compact_series_empty(_, mock_read, testapp):
+    """ Verifies the past measurement API returns an empty compact series if the query can't be built """
+    print("\nTest: test_api_measurement_past_compact_series_empty")
+    headers = {'Accept': 'application/vnd.mycodo.series',
+               'X-API-KEY': base64.b64encode(b'secret_admin_api_key')}
+    for return_value in (('', 204), None):
+        mock_read.return_value = return_value
+        response = testapp.get('/api/measurements/past/testuniqueid/C/0/5', headers=headers)
+        assert response.status_code == 200
+        assert response.content_type == 'application/vnd.mycodo.series'
+        assert decode_series(response.body) == []
+
+
 @mock.patch('mycodo.mycodo_flask.routes_authentication.login_log')
 def test_api_with_guest_apikey_in_header_403_forbidden(_, testapp):
     """ Verifies behavior of these API endpoints with an apikey in the header """
@@ -354,10 +411,12 @@ def test_routes_logged_in_as_admin(_, testapp):
         ('dashboard', '<!-- Route: /dashboard -->'),
         ('data', '<!-- Route: /data -->'),
         ('export', '<!-- Route: /export -->'),
+        ('export/import_influxdb_status', '"resumable"'),
         ('forgot_password', '<!-- Route: /forgot_password -->'),
         ('function', '<!-- Route: /function -->'),
         ('graph-async', '<!-- Route: /graph-async -->'),
         ('info', '<!-- Route: /info -->'),
+        ('job_status?task=export_influxdb', '"jobs"'),
         ('lcd', '<!-- Route: /lcd -->'),
         ('live', '<!-- Route: /live -->'),
         ('logview', '<!-- Route: /logview -->'),
@@ -451,6 +510,151 @@ def test_add_all_data_devices_logged_in_as_admin(_, testapp):
         math_count -= 1
 
 
+@mock.patch('mycodo.mycodo_flask.routes_authentication.login_log')
+def test_api_measurement_bulk(_, testapp):
+    """ Verifies the bulk measurement endpoint queues valid measurements and reports each status """
+    print("\nTest: test_api_measurement_bulk")
+    headers = {'Accept': 'application/vnd.mycodo.v1+json',
+               'X-API-KEY': base64.b64encode(b'secret_admin_api_key')}
+
+    with mock.patch('mycodo.mycodo_flask.api.measurement.influx_writer') as writer:
+        writer.submit.side_effect = lambda points: len(points)
+        response = testapp.post_json('/api/measurements/bulk', {'measurements': [
+            {'unique_id': 'testuniqueid', 'unit': 'C', 'channel': 0, 'value': 21.5,
+             'measure': 'temperature', 'timestamp': '2019-04-15T18:07:00.392Z'},
+            {'unique_id': 'testuniqueid', 'unit': 'not_a_unit', 'channel': 0, 'value': 1},
+            {'unique_id': 'testuniqueid', 'unit': 'C', 'channel': 1, 'value': 'abc'},
+            {'unique_id': 'testuniqueid', 'unit': 'C', 'channel': 2, 'value': 5, 'timestamp': 1555351620},
+        ]}, headers=headers)
+        assert response.status_code == 202
+        body = json.loads(response.text)
+        assert (body['queued'], body['invalid'], body['rejected']) == (2, 2, 0)
+        assert [each['status'] for each in body['measurements']] == ['queued', 'invalid', 'invalid', 'queued']
+        points = writer.submit.call_args[0][0]
+        assert points[0]['time'] == '2019-04-15T18:07:00.392000Z'
+        assert points[1]['time'] == '2019-04-15T18:07:00.000000Z'
+
+        # The write queue only has room for one measurement
+        writer.submit.side_effect = lambda points: min(1, len(points))
+        response = testapp.post(
+            '/api/measurements/bulk?precision=s',
+            'C,device_id=testuniqueid,channel=0 value=1 1555351620\n'
+            'C,device_id=testuniqueid,channel=0 value=2\n',
+            headers=dict(headers, **{'Content-Type': 'text/plain'}))
+        assert response.status_code == 202
+        assert [each['status'] for each in json.loads(response.text)['measurements']] == ['queued', 'rejected']
+
+        # Timestamps out of range and malformed units are invalid, without failing the others
+        writer.submit.side_effect = lambda points: len(points)
+        response = testapp.post_json('/api/measurements/bulk', {'measurements': [
+            {'unique_id': 'testuniqueid', 'unit': 'C', 'channel': 0, 'value': 1, 'timestamp': 1e20},
+            {'unique_id': 'testuniqueid', 'unit': 'C', 'channel': 0, 'value': 2, 'timestamp': float('inf')},
+            {'unique_id': 'testuniqueid', 'unit': 'C', 'channel': 0, 'value': 3, 'timestamp': 32503680000},
+            {'unique_id': 'testuniqueid', 'unit': 'C', 'channel': 0, 'value': 4,
+             'timestamp': '1600-01-01T00:00:00.000Z'},
+            {'unique_id': 'testuniqueid', 'unit': ['C'], 'channel': 0, 'value': 5},
+            {'unique_id': 'testuniqueid', 'unit': {'C': 1}, 'channel': 0, 'value': 6},
+            {'unique_id': 'testuniqueid', 'unit': 'C', 'channel': 0, 'value': 7, 'timestamp': 1555351620},
+        ]}, headers=headers)
+        assert response.status_code == 202
+        assert [each['status'] for each in json.loads(response.text)['measurements']] == [
+            'invalid'] * 6 + ['queued']
+        response = testapp.post(
+            '/api/measurements/bulk',
+            'C,device_id=testuniqueid,channel=0 value=1 {}\n'
+            'C,device_id=testuniqueid,channel=0 value=2\n'.format(10 ** 30),
+            headers=dict(headers, **{'Content-Type': 'text/plain'}))
+        assert [each['status'] for each in json.loads(response.text)['measurements']] == [
+            'invalid', 'queued']
+
+
+@mock.patch('mycodo.mycodo_flask.routes_authentication.login_log')
+def test_api_measurement_historical_pages(_, testapp):
+    """ Verifies the historical measurement endpoint paginates, aggregates and streams """
+    print("\nTest: test_api_measurement_historical_pages")
+    headers = {'Accept': 'application/vnd.mycodo.v1+json',
+               'X-API-KEY': base64.b64encode(b'secret_admin_api_key')}
+    endpoint = '/api/measurements/historical/testuniqueid/C/0/1555351620/0'
+
+    with mock.patch('mycodo.mycodo_flask.api.measurement.read_influxdb_page') as read_page:
+        read_page.return_value = [[1555351620000000000, 1.0], [1555351621500000000, 2.0]]
+        response = testapp.get(endpoint + '?limit=2&cursor=5', headers=headers)
+        assert response.status_code == 200
+        body = json.loads(response.text)
+        assert body['next_cursor'] == 1555351621500000001
+        assert body['measurements'][1] == {'time': '2019-04-15T18:07:01.500000+00:00', 'value': 2.0}
+        assert read_page.call_args[1]['cursor_ns'] == 5
+
+        testapp.get(endpoint + '?group_sec=60', headers=headers)
+        assert read_page.call_args[1]['function'] == 'MEAN'
+        response = testapp.get(endpoint + '?function=drop', headers=headers, expect_errors=True)
+        assert response.status_code == 422
+
+        read_page.return_value = iter([[['2019-04-15T18:07:00Z', 1.0]], [['2019-04-15T18:07:01Z', 2.0]]])
+        response = testapp.get(endpoint, headers=dict(headers, Accept='text/csv'))
+        assert response.content_type == 'text/csv'
+        assert response.text == 'time,value\n2019-04-15T18:07:00Z,1.0\n2019-04-15T18:07:01Z,2.0\n'
+        assert read_page.call_args[1]['chunked']
+
+
+@mock.patch('mycodo.mycodo_flask.routes_authentication.login_log')
+def test_api_backfill(_, testapp):
+    """ Verifies backfills are started with the daemon and their progress shown """
+    print("\nTest: test_api_backfill")
+    headers = {'Accept': 'application/vnd.mycodo.v1+json',
+               'X-API-KEY': base64.b64encode(b'secret_admin_api_key')}
+
+    with mock.patch('mycodo.mycodo_flask.api.backfill.DaemonControl') as daemon_control:
+        control = daemon_control.return_value
+        control.backfill_start.return_value = (0, 'backfill_1')
+        response = testapp.post_json(
+            '/api/backfill/math/math_1', {'start': 1555351620, 'end': 1555438020}, headers=headers)
+        assert response.status_code == 202
+        assert json.loads(response.text) == {'id': 'backfill_1'}
+        assert control.backfill_start.call_args[0] == ('math', 'math_1', 1555351620, 1555438020)
+
+        response = testapp.post_json(
+            '/api/backfill/conversion/conversion_1',
+            {'start': 1555351620, 'end': 1555438020, 'device_id': 'input_1', 'channel': 0},
+            headers=headers)
+        assert response.status_code == 202
+        assert control.backfill_start.call_args[1]['options'] == {
+            'device_id': 'input_1', 'channel': 0, 'measurement': None}
+
+        control.backfill_start.return_value = (1, 'Math math_2 not found')
+        response = testapp.post_json(
+            '/api/backfill/math/math_2', {'start': 1555351620, 'end': 1555438020},
+            headers=headers, expect_errors=True)
+        assert response.status_code == 422
+
+        control.backfill_status.return_value = (0, {
+            'id': 'backfill_1', 'kind': 'math', 'unique_id': 'math_1', 'progress': 50.0,
+            'status': 'running', 'written': 720})
+        response = testapp.get('/api/backfill/backfill_1', headers=headers)
+        assert response.status_code == 200
+        assert json.loads(response.text)['progress'] == 50.0
+
+
+@mock.patch('mycodo.mycodo_flask.routes_authentication.login_log')
+def test_measurement_resolver_follows_input_changes(_, testapp):
+    """ Verifies cached measurements are updated when an Input is added and deleted """
+    print("\nTest: test_measurement_resolver_follows_input_changes")
+    login_user(testapp, 'admin', '53CR3t_p4zZW0rD')
+
+    measurement_resolver.all()  # Load before the Input exists
+    response = add_data(testapp, data_type='input', input_type='RPiCPULoad,Mycodo')
+    assert "successfully added" in response
+
+    input_dev = Input.query.first()
+    measurements = measurement_resolver.device(input_dev.unique_id)
+    assert len(measurements) == 3
+    assert [each.channel for each in measurements] == [0, 1, 2]
+    assert measurement_resolver.get(measurements[0].unique_id) == measurements[0]
+
+    delete_data(testapp, data_type='input', device_dev=input_dev)
+    assert measurement_resolver.device(input_dev.unique_id) == []
+
+
 @mock.patch('mycodo.mycodo_flask.routes_authentication.login_log')
 def test_add_all_output_devices_logged_in_as_admin(_, testapp):
     """ Verifies adding all outputs as a logged in admin user """
@@ -0,0 +1,64 @@
+# coding=utf-8
+""" Tests for the Function Action executor """
+from concurrent.futures import Future
+
+from mycodo.utils.action_executor import ActionExecutor
+from mycodo.utils.action_executor import EmailNotifier
+from mycodo.utils.send_data import SMTPSettings
+
+SETTINGS = SMTPSettings('localhost', 'ssl', 465, 'user', 'pass', 'mycodo@localhost')
+
+
+class FakeSMTPSession:
+    idle_timeout = 60
+    connections = 1
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, settings, recipients, composed):
+        self.sent.append((recipients, composed))
+        return 0
+
+    def close(self):
+        pass
+
+
+def test_executor_runs_actions_and_records_metrics():
+    """ verify actions run in their category's pool and are counted """
+    executor = ActionExecutor(workers={'camera': 1, 'default': 2})
+    assert executor.submit('camera', lambda x: x * 2, 21).result(5) == 42
+
+    failed = executor.submit('command', lambda: 1 / 0)
+    assert isinstance(failed.exception(5), ZeroDivisionError)
+
+    status = executor.status()
+    assert status['camera']['completed'] == 1
+    assert status['camera']['queued'] == 0
+    assert status['command']['failed'] == 1
+
+
+def test_email_notifier_combines_notifications():
+    """ verify notifications to the same recipients are sent as one email and attachments separately """
+    executor = ActionExecutor()
+    notifier = EmailNotifier(executor.metrics, batch_seconds=0.2)
+    notifier.session = FakeSMTPSession()
+    notifier.start()
+
+    attachment = Future()
+    futures = [
+        notifier.notify(SETTINGS, ['a@localhost'], 'First message'),
+        notifier.notify(SETTINGS, ['a@localhost'], 'Second message'),
+        notifier.notify(SETTINGS, ['b@localhost'], 'Photo', attachment_file=attachment),
+    ]
+    attachment.set_result(None)  # Capture failed to produce a file
+
+    assert [each.result(5) for each in futures] == [0, 0, 0]
+    assert len(notifier.session.sent) == 2
+    recipients, composed = notifier.session.sent[0]
+    assert recipients == ['a@localhost']
+    assert 'First message' in composed and 'Second message' in composed
+
+    status = executor.status()
+    assert status['email']['completed'] == 3
+    assert status['email']['queued'] == 0
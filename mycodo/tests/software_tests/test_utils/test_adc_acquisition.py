@@ -0,0 +1,34 @@
+# coding=utf-8
+""" Tests for the oversampled acquisition of ADC channels """
+import pytest
+
+pytest.importorskip('numpy')
+
+from mycodo.utils.adc_acquisition import ADCAcquisition
+
+
+def samples(values):
+    """ Return a read function returning each of values in turn """
+    iterator = iter(values)
+    return lambda: next(iterator)
+
+
+def test_moving_average_spans_measurements():
+    """ verify the moving average of a window larger than one measurement """
+    acquisition = ADCAcquisition([0, 3], samples=2, filter_type='average', window=4)
+    assert acquisition.acquire(samples([[1, 10], [3, 30]])) == {0: 2.0, 3: 20.0}
+    assert acquisition.acquire(samples([[5, 50], [7, 70]])) == {0: 4.0, 3: 40.0}
+    assert acquisition.acquire(samples([[9, 90], [11, 110]])) == {0: 8.0, 3: 80.0}
+
+
+def test_median_ema_and_last():
+    """ verify the median, exponential moving average and last sample filters """
+    values = [[1.0], [100.0], [3.0]]
+    assert ADCAcquisition([1], samples=3, filter_type='median').acquire(samples(values)) == {1: 3.0}
+    assert ADCAcquisition([1], samples=3, filter_type='last').acquire(samples(values)) == {1: 3.0}
+
+    ema = ADCAcquisition([1], samples=3, filter_type='ema')  # alpha 0.5
+    assert ema.acquire(samples(values)) == {1: 26.75}
+
+    with pytest.raises(ValueError):
+        ADCAcquisition([1], filter_type='unknown')
@@ -0,0 +1,94 @@
+# coding=utf-8
+""" Tests for the recalculation of past Math and Conversion measurements """
+import json
+
+from mycodo.utils.backfill import Backfill
+from mycodo.utils.backfill import asof_values
+from mycodo.utils.backfill import evaluate_column
+from mycodo.utils.expression import Expression
+from mycodo.utils.influx import format_influxdb_data
+from mycodo.utils.stream_stats import epoch_to_influx_time
+
+
+class DoubleCalculation:
+    """ Doubles the value of each point of one source """
+    sources = [('input_1', 'C', '0', 'temperature')]
+    lookback = 0
+
+    def points(self, start, end, series):
+        return [format_influxdb_data('math_1', 'C', value * 2, channel=0,
+                                     timestamp=epoch_to_influx_time(timestamp))
+                for timestamp, value in series[0] if start <= timestamp < end]
+
+
+def make_state(start, end, position=None):
+    return {
+        'id': 'backfill_1', 'kind': 'math', 'unique_id': 'math_1', 'options': {},
+        'start': start, 'end': end, 'position': start if position is None else position,
+        'written': 0, 'status': 'queued', 'error': None, 'created': 0, 'updated': 0
+    }
+
+
+def test_asof_values():
+    """ verify each time uses the last value measured within the max age """
+    points = [(10, 1.0), (20, 2.0), (21, 3.0)]
+    assert asof_values([5, 10, 15, 25, 40], points, max_age=10) == [None, 1.0, 1.0, 3.0, None]
+
+
+def test_evaluate_column_missing_and_invalid_values():
+    """ verify rows with missing inputs or invalid results have no value """
+    expression = Expression('x1 / x', ('x', 'x1'))
+    assert evaluate_column(expression, {'x': [2.0, None, 0.0], 'x1': [4.0, 1.0, 1.0]}, 3) == [
+        2.0, None, None]
+
+
+def test_backfill_chunks_and_checkpoints(tmp_path):
+    """ verify chunks are read, written and checkpointed in order """
+    reads = []
+    written = []
+    source = [(float(timestamp), float(timestamp)) for timestamp in range(0, 100, 10)]
+
+    def read_points(key, start, end):
+        reads.append((start, end))
+        return [point for point in source if start <= point[0] <= end]
+
+    backfill = Backfill(make_state(0.0, 100.0), DoubleCalculation(), path=str(tmp_path),
+                        read_points=read_points, write_points=written.extend, chunk_seconds=40)
+    backfill.run()
+
+    assert reads == [(0.0, 40.0), (40.0, 80.0), (80.0, 100.0)]
+    assert [point['fields']['value'] for point in written] == [value * 2 for _, value in source]
+    with open(str(tmp_path / 'backfill_1.json')) as state_file:
+        state = json.load(state_file)
+    assert (state['status'], state['position'], state['written']) == ('finished', 100.0, 10)
+    assert backfill.status()['progress'] == 100.0
+
+
+def test_backfill_resumes_from_position(tmp_path):
+    """ verify a resumed backfill starts after the last chunk written """
+    reads = []
+    backfill = Backfill(make_state(0.0, 100.0, position=80.0), DoubleCalculation(), path=None,
+                        read_points=lambda key, start, end: reads.append(start) or [],
+                        write_points=lambda points: None, chunk_seconds=40)
+    assert backfill.status()['progress'] == 80.0
+    backfill.run()
+    assert reads == [80.0]
+    assert backfill.status()['status'] == 'finished'
+
+
+def test_backfill_cancel_and_failure():
+    """ verify cancelled and failed backfills stop with their status """
+    backfill = Backfill(make_state(0.0, 100.0), DoubleCalculation(), path=None,
+                        read_points=lambda key, start, end: [], write_points=lambda points: None)
+    backfill.cancel()
+    backfill.run()
+    assert backfill.status()['status'] == 'cancelled'
+
+    def read_points(key, start, end):
+        raise ConnectionError('influxdb unreachable')
+
+    backfill = Backfill(make_state(0.0, 100.0), DoubleCalculation(), path=None,
+                        read_points=read_points, write_points=lambda points: None)
+    backfill.run()
+    assert backfill.status()['status'] == 'failed'
+    assert backfill.status()['error'] == 'influxdb unreachable'
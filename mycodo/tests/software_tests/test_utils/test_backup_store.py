@@ -0,0 +1,110 @@
+# coding=utf-8
+""" Tests for deduplicated backups of the Mycodo install directory """
+import datetime
+import io
+import os
+import zipfile
+
+import pytest
+
+from mycodo.utils.backup_store import BackupError
+from mycodo.utils.backup_store import BackupStore
+from mycodo.utils.zip_stream import zip_stream_entries
+
+
+def make_install(path):
+    os.makedirs(os.path.join(path, 'databases'))
+    os.makedirs(os.path.join(path, 'cameras'))
+    os.makedirs(os.path.join(path, 'env', 'bin'))
+    with open(os.path.join(path, 'databases', 'mycodo.db'), 'wb') as database:
+        database.write(os.urandom(2500))
+    with open(os.path.join(path, 'note.txt'), 'w') as note:
+        note.write('note')
+    with open(os.path.join(path, 'cameras', 'image.jpg'), 'wb') as image:
+        image.write(os.urandom(100))
+    with open(os.path.join(path, 'env', 'bin', 'python'), 'wb') as python:
+        python.write(os.urandom(100))
+    os.symlink('note.txt', os.path.join(path, 'link'))
+
+
+def read_tree(path):
+    tree = {}
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            full_path = os.path.join(root, name)
+            if os.path.islink(full_path):
+                tree[os.path.relpath(full_path, path)] = ('link', os.readlink(full_path))
+            elif os.path.isfile(full_path):
+                with open(full_path, 'rb') as each_file:
+                    tree[os.path.relpath(full_path, path)] = each_file.read()
+            else:
+                tree[os.path.relpath(full_path, path)] = 'dir'
+    return tree
+
+
+def test_backups_are_deduplicated_and_restored(tmp_path):
+    """ verify unchanged chunks are stored once and backups restore exactly """
+    source = str(tmp_path / 'Mycodo')
+    make_install(source)
+    store = BackupStore(str(tmp_path / 'backups'), chunk_size=1000)
+
+    first = store.create(source, '8.8.8', now=datetime.datetime(2020, 1, 1))
+    assert first['name'] == 'Mycodo-backup-2020-01-01_00-00-00-8.8.8'
+    assert (first['size'], first['added']) == (2504, 2504)
+    assert 'cameras/image.jpg' not in [entry['path'] for entry in first['entries']]
+
+    # Only the changed chunk of a changed file is added
+    with open(os.path.join(source, 'databases', 'mycodo.db'), 'r+b') as database:
+        database.seek(2100)
+        database.write(b'changed')
+    assert store.changed_size(source) == 2500
+    second = store.create(source, '8.8.8', now=datetime.datetime(2020, 1, 2))
+    assert second['added'] == 500
+    assert store.snapshot_names() == [first['name'], second['name']]
+
+    restored = str(tmp_path / 'restored')
+    store.restore(first['name'], restored)
+    expected = read_tree(source)
+    for path in ['cameras', 'cameras/image.jpg', 'env', 'env/bin', 'env/bin/python']:
+        del expected[path]
+    assert read_tree(restored)['databases/mycodo.db'] != expected['databases/mycodo.db']
+    store.restore(second['name'], str(tmp_path / 'restored_2'))
+    assert read_tree(str(tmp_path / 'restored_2')) == expected
+
+    # Deleting a backup only deletes the chunks of no other backup
+    assert store.delete(first['name']) == 500
+    store.restore(second['name'], str(tmp_path / 'restored_3'))
+    assert read_tree(str(tmp_path / 'restored_3')) == expected
+
+
+def test_backup_excludes_top_level_only(tmp_path):
+    """ verify only the excluded directories of the install directory are excluded """
+    source = str(tmp_path / 'Mycodo')
+    make_install(source)
+    for path in ['mycodo/cameras/camera.py', 'influx_backups/backup.tar']:
+        os.makedirs(os.path.dirname(os.path.join(source, path)), exist_ok=True)
+        with open(os.path.join(source, path), 'w') as each_file:
+            each_file.write(path)
+    store = BackupStore(str(tmp_path / 'backups'))
+    paths = [entry['path'] for entry in store.create(source, '8.8.8')['entries']]
+    assert 'mycodo/cameras/camera.py' in paths
+    assert 'influx_backups/backup.tar' in paths
+    assert 'cameras' not in paths and 'env' not in paths
+
+
+def test_backup_archive_and_corruption(tmp_path):
+    """ verify the streamed archive and that corrupt chunks aren't restored """
+    source = str(tmp_path / 'Mycodo')
+    make_install(source)
+    store = BackupStore(str(tmp_path / 'backups'), chunk_size=1000)
+    name = store.create(source, '8.8.8')['name']
+
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(zip_stream_entries(store.archive_entries(name)))))
+    assert sorted(archive.namelist()) == ['databases/mycodo.db', 'note.txt']
+    assert archive.read('note.txt') == b'note'
+
+    entry = [entry for entry in store.load(name)['entries'] if entry['path'] == 'note.txt'][0]
+    with open(store._object_path(entry['chunks'][0]), 'wb') as object_file:
+        object_file.write(b'corrupt')
+    with pytest.raises(BackupError):
+        store.restore(name, str(tmp_path / 'restored'))
@@ -0,0 +1,108 @@
+# coding=utf-8
+""" Tests for the shared Bluetooth LE broker """
+import threading
+
+from mycodo.utils.ble_broker import BLEBroker
+
+
+class FakeScanner:
+    """ Delivers one advertisement per scan window """
+    def __init__(self, adapter, callback):
+        self.callback = callback
+        self.scanning = False
+        self.windows = 0
+
+    def start(self):
+        self.scanning = True
+
+    def process(self, timeout):
+        self.windows += 1
+        self.callback('AA:BB:CC:DD:EE:FF', {255: '9904{:02x}'.format(self.windows)}, -60)
+        self.callback('11:22:33:44:55:66', {255: '9904ff'}, -70)
+
+    def stop(self):
+        self.scanning = False
+
+
+def decode(data):
+    if data.get(255, '').startswith('9904'):
+        return {'counter': int(data[255][4:], 16)}
+
+
+def test_advertisements_demultiplexed_to_subscribers():
+    """ verify only subscribed devices' advertisements are decoded and cached """
+    broker = BLEBroker('0', scanner_factory=FakeScanner)
+    broker.subscribe('aa:bb:cc:dd:ee:ff', decode)
+    broker.advertisement('AA:BB:CC:DD:EE:FF', {255: '990401'}, -50)
+    broker.advertisement('AA:BB:CC:DD:EE:FF', {9: '4d79636f646f'}, -50)  # No payload
+    broker.advertisement('11:22:33:44:55:66', {255: '990402'}, -50)  # Not subscribed
+
+    assert broker.latest('AA:BB:CC:DD:EE:FF') == {'counter': 1}
+    assert broker.latest('11:22:33:44:55:66') is None
+    status = broker.status()
+    assert status['advertisements']['aa:bb:cc:dd:ee:ff']['advertisements'] == 1
+    assert list(status['advertisements']) == ['aa:bb:cc:dd:ee:ff']
+
+    broker.unsubscribe('AA:BB:CC:DD:EE:FF')
+    assert broker.latest('AA:BB:CC:DD:EE:FF') is None
+
+
+def test_connections_queued_between_scans():
+    """ verify queued connections run one at a time while not scanning """
+    scanners = []
+
+    def scanner_factory(adapter, callback):
+        scanners.append(FakeScanner(adapter, callback))
+        return scanners[-1]
+
+    broker = BLEBroker('0', scanner_factory=scanner_factory, scan_window=0.01)
+    broker.subscribe('AA:BB:CC:DD:EE:FF', decode)
+    broker.start()
+    try:
+        running = []
+        lock = threading.Lock()
+
+        def connect(value):
+            with lock:
+                running.append(value)
+                assert not any(each.scanning for each in scanners)
+            return value * 2
+
+        futures = [broker.gatt('11:22:33:44:55:66', connect, each) for each in range(3)]
+        futures.append(broker.gatt('11:22:33:44:55:66', lambda: 1 / 0))
+        assert [each.result(5) for each in futures[:3]] == [0, 2, 4]
+        assert isinstance(futures[3].exception(5), ZeroDivisionError)
+        assert running == [0, 1, 2]
+        assert broker.latest('AA:BB:CC:DD:EE:FF')['counter'] >= 1
+    finally:
+        broker.stop()
+        broker.join(5)
+
+    connections = broker.status()['connections']['11:22:33:44:55:66']
+    assert connections['completed'] == 3
+    assert connections['failed'] == 1
+    assert connections['queued'] == 0
+
+
+def test_connection_aborted_after_timeout():
+    """ verify a connection running past its timeout fails and is aborted, freeing the adapter """
+    broker = BLEBroker('0', scan_window=0.01)
+    broker.start()
+    try:
+        disconnected = threading.Event()
+        returned = []
+
+        def hung_connect():
+            disconnected.wait(5)  # Until aborted, e.g. the device disconnected
+            returned.append('late')
+            return 'late'
+
+        hung = broker.gatt('11:22:33:44:55:66', hung_connect, timeout=0.1, abort=disconnected.set)
+        after = broker.gatt('AA:BB:CC:DD:EE:FF', lambda: 'next')
+        assert isinstance(hung.exception(5), TimeoutError)
+        assert after.result(5) == 'next'
+        assert disconnected.is_set() and returned == ['late']
+    finally:
+        broker.stop()
+        broker.join(5)
+    assert broker.status()['connections']['11:22:33:44:55:66']['failed'] == 1
@@ -0,0 +1,90 @@
+# coding=utf-8
+""" Tests for the compiled equations of Math and Conversions """
+import pytest
+
+from mycodo.config_devices_units import UNIT_CONVERSIONS
+from mycodo.utils.expression import Expression
+from mycodo.utils.expression import ExpressionError
+from mycodo.utils.expression import expression_errors
+from mycodo.utils.expression import math_equation_variables
+
+
+def test_expression_functions_and_variables():
+    """ verify names containing x aren't replaced and variables are named """
+    expression = Expression('max(x1, x2) - min(x1, x2) + exp(0) * x', ('x', 'x1', 'x2'))
+    assert expression.variables == ('x', 'x1', 'x2')
+    assert expression(x=2, x1=5, x2=3, unused=7) == 4.0
+    assert Expression('round(x, 1) * pi / pi')(1.26) == pytest.approx(1.3)
+    assert Expression('(x*9/5)−459.67')(300) == pytest.approx(80.33)
+
+
+@pytest.mark.parametrize('text', [
+    '__import__("os").system("ls")',
+    '().__class__',
+    'x[0]',
+    'open("/etc/passwd")',
+    'lambda: x',
+    'x is 1',
+    '"text"',
+    'y',
+    'x^2',
+    'sqrt(x, 2)',
+    'max',
+    ''
+])
+def test_expression_rejects_unsafe_and_invalid(text):
+    """ verify anything but arithmetic and conditions of numbers, variables and functions is rejected """
+    with pytest.raises(ExpressionError):
+        Expression(text)
+
+
+def test_expression_conditions():
+    """ verify comparisons and conditional expressions of equations saved before validation """
+    assert Expression('x if x > 0 else 0')(-3) == 0.0
+    assert Expression('x if x > 0 else 0')(3) == 3.0
+    assert Expression('0 < x <= 10')(10) == 1.0
+    assert Expression('x > 100 or x < 0 and not x == -1')(-1) == 0.0
+    assert Expression('x1 or x2', ('x1', 'x2'))(x1=0, x2=7) == 7.0
+
+
+def test_expression_conditions_evaluate_array():
+    """ verify conditions are evaluated for each element of arrays as for single values """
+    pytest.importorskip('numpy')
+    values = [-5.0, -1.0, 0.0, 5.0, 10.0, 150.0]
+    for text in ['x if x > 0 else 0', '0 < x <= 10', 'x > 100 or x < 0 and not x == -1',
+                 'x and 2 or 3']:
+        expression = Expression(text)
+        assert list(expression.evaluate_array(values)) == [expression(each) for each in values]
+
+
+def test_expression_large_powers_overflow():
+    """ verify powers are calculated with floats rather than huge integers """
+    with pytest.raises(OverflowError):
+        Expression('9**9**9')()
+
+
+def test_expression_errors_and_default_conversions():
+    """ verify the errors shown when saving and that all default conversions compile """
+    assert expression_errors('x*10') == []
+    assert expression_errors('10', required=('x',)) == ["'x' must appear in the equation"]
+    assert len(expression_errors('x.real')) == 1
+    for _, _, equation in UNIT_CONVERSIONS:
+        assert expression_errors(equation, required=('x',)) == []
+
+
+def test_math_equation_variables():
+    """ verify x is the Input of an Equation Math and x1, x2 its Inputs """
+    assert math_equation_variables('a,1', 'b,2;c,3') == [('x', 'a,1'), ('x1', 'b,2'), ('x2', 'c,3')]
+    assert math_equation_variables('', None) == []
+
+
+def test_expression_evaluate_array():
+    """ verify vectorized evaluation matches scalar evaluation """
+    numpy = pytest.importorskip('numpy')
+    expression = Expression('max(x, x1) + log(x1, 10) + round(x / 3, 2)', ('x', 'x1'))
+    x = [1.0, 20.0, 3.0]
+    x1 = [10.0, 100.0, 1000.0]
+    assert numpy.allclose(
+        expression.evaluate_array(x=x, x1=x1),
+        [expression(x=a, x1=b) for a, b in zip(x, x1)])
+    assert numpy.isinf(Expression('1 / x').evaluate_array([0.0])[0])
@@ -0,0 +1,176 @@
+# coding=utf-8
+""" Tests for the I2C bus arbitration of Inputs """
+import threading
+import time
+
+from mycodo.utils.i2c_arbiter import FairLock
+from mycodo.utils.i2c_arbiter import I2CArbiter
+from mycodo.utils.i2c_arbiter import I2CDevice
+
+BME280 = I2CDevice(1, 0x76, 'BME280', (0, 1, 2))
+SHT3X = I2CDevice(1, 0x44, 'SHT3X', (0, 1))
+
+
+class MockSMBus:
+    """
+    Stand-in for smbus2.SMBus for testing. Each address in devices has a dict
+    of register: value. Transactions take latency seconds, and transactions
+    that overlap are counted as collisions.
+    """
+    def __init__(self, bus=1, devices=None, latency=0.0):
+        self.bus = bus
+        self.devices = devices or {}
+        self.latency = latency
+        self.transactions = 0
+        self.collisions = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def _transaction(self, address):
+        if address not in self.devices:
+            raise OSError(121, 'Remote I/O error')
+        with self._lock:
+            self._active += 1
+            if self._active > 1:
+                self.collisions += 1
+        time.sleep(self.latency)
+        with self._lock:
+            self._active -= 1
+            self.transactions += 1
+        return self.devices[address]
+
+    def read_byte_data(self, address, register):
+        return self._transaction(address).get(register, 0)
+
+    def write_byte_data(self, address, register, value):
+        self._transaction(address)[register] = value
+
+    def read_i2c_block_data(self, address, register, length):
+        registers = self._transaction(address)
+        return [registers.get(register + index, 0) for index in range(length)]
+
+    def write_i2c_block_data(self, address, register, data):
+        registers = self._transaction(address)
+        for index, value in enumerate(data):
+            registers[register + index] = value
+
+    def close(self):
+        pass
+
+
+def run_threads(targets):
+    threads = [threading.Thread(target=each) for each in targets]
+    for each in threads:
+        each.start()
+    for each in threads:
+        each.join(10)
+
+
+def test_measurements_serialized_on_bus():
+    """ verify measurements of different devices on one bus never overlap """
+    bus = MockSMBus(devices={0x76: {0xD0: 0x60}, 0x44: {}}, latency=0.005)
+    arbiter = I2CArbiter(coalesce=0)
+    results = []
+
+    def measure(device):
+        def read():
+            for _ in range(5):
+                results.append(arbiter.measure(
+                    device, lambda: {0: {'value': bus.read_byte_data(device.address, 0xD0)}}))
+        return read
+
+    run_threads([measure(BME280), measure(SHT3X), measure(BME280._replace(channels=(0,)))])
+
+    assert bus.collisions == 0
+    assert bus.transactions == 15
+    assert len(results) == 15
+    devices = arbiter.status()['devices']
+    assert devices['1:0x76']['completed'] == 10
+    assert devices['1:0x44']['completed'] == 5
+
+
+def test_measurements_coalesced_and_failures_counted():
+    """ verify Inputs of the same device share a measurement and failed reads are counted """
+    arbiter = I2CArbiter(coalesce=60)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_read():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {0: {'value': 21.0}}
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(arbiter.measure(BME280, slow_read)))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=lambda: results.append(arbiter.measure(BME280, slow_read)))
+    second.start()
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert len(calls) == 1
+    assert results == [{0: {'value': 21.0}}, {0: {'value': 21.0}}]
+    results[0][0]['value'] = 0  # Each Input receives its own copy
+    assert results[1][0]['value'] == 21.0
+
+    assert arbiter.measure(SHT3X, lambda: None) is None
+    devices = arbiter.status()['devices']
+    assert devices['1:0x76']['coalesced'] == 1
+    assert devices['1:0x44']['failed'] == 1
+
+
+def test_bus_released_between_samples():
+    """ verify a long burst that releases the bus between samples doesn't time out other Inputs """
+    arbiter = I2CArbiter(coalesce=0, timeout=0.2)
+    bus = MockSMBus(devices={0x76: {}, 0x44: {0x00: 1}})
+    sampling = threading.Event()
+    results = []
+
+    def burst():
+        for _ in range(6):
+            bus.read_byte_data(0x76, 0x00)
+            sampling.set()
+            with arbiter.released():
+                time.sleep(0.1)
+        return {0: {'value': 1.0}}
+
+    def other():
+        sampling.wait(5)
+        results.append(arbiter.measure(SHT3X, lambda: {0: {'value': bus.read_byte_data(0x44, 0x00)}}))
+
+    run_threads([lambda: results.append(arbiter.measure(BME280, burst)), other])
+
+    assert bus.collisions == 0
+    assert results == [{0: {'value': 1}}, {0: {'value': 1.0}}]
+    assert arbiter.status()['devices']['1:0x44']['completed'] == 1
+    with arbiter.released():
+        pass  # Nothing held outside of a measurement
+
+
+def test_register_staggers_inputs():
+    """ verify Inputs on a bus are given distinct offsets, reusing freed slots """
+    arbiter = I2CArbiter(stagger=0.5)
+    assert arbiter.register(BME280, 'a', 30) == 0
+    assert arbiter.register(SHT3X, 'b', 30) == 0.5
+    assert arbiter.register(SHT3X, 'c', 1) == 0
+    arbiter.unregister(SHT3X, 'b')
+    assert arbiter.register(BME280, 'd', 30) == 0.5
+    assert arbiter.register(I2CDevice(2, 0x76, 'BME280', (0,)), 'e', 30) == 0
+    assert arbiter.status()['inputs'] == {'1': 3, '2': 1}
+
+
+def test_fair_lock_timeout_skips_abandoned_ticket():
+    """ verify a timed-out waiter doesn't block later waiters """
+    lock = FairLock()
+    assert lock.acquire()
+    assert not lock.acquire(timeout=0.01)
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(lock.acquire(timeout=5)))
+    waiter.start()
+    lock.release()
+    waiter.join(5)
+    assert acquired == [True]
@@ -0,0 +1,107 @@
+# coding=utf-8
+""" Tests for influxdb helper functions """
+import datetime
+
+import pytest
+
+from mycodo.utils.influx import downsample_m4
+from mycodo.utils.influx import next_page_cursor
+from mycodo.utils.influx import parse_frames
+from mycodo.utils.influx import parse_line_protocol
+from mycodo.utils.influx import query_string_downsample
+from mycodo.utils.influx import query_string_frames
+from mycodo.utils.influx import query_string_page
+
+
+def test_query_string_downsample():
+    """ verify the M4 aggregation query """
+    query = query_string_downsample(
+        'C', 'uid', 60, measure='temperature', channel=0, past_sec=3600)
+    assert query == (
+        "SELECT FIRST(value), MIN(value), MAX(value), LAST(value) "
+        "FROM C WHERE device_id='uid' AND channel='0' AND measure='temperature' "
+        "AND time > now() - 3600s GROUP BY TIME(60s) fill(none)")
+
+
+def test_downsample_m4_preserves_extremes():
+    """ verify each bucket keeps its first, min, max and last values in time order """
+    values = [
+        [0, 5.0, 1.0, 9.0, 6.0],
+        [1000, 6.0, 6.0, 6.0, 6.0],
+        [2000, 8.0, 2.0, 8.0, 2.0],
+    ]
+    points = downsample_m4(values, 1000)
+    assert points == [
+        [0, 5.0], [499, 1.0], [500, 9.0], [999, 6.0],
+        [1000, 6.0],
+        [2000, 8.0], [2500, 2.0]]
+    timestamps = [each[0] for each in points]
+    assert timestamps == sorted(timestamps)
+
+
+def test_downsample_m4_caps_last_bucket():
+    """ verify the last point of a partial bucket is not placed in the future """
+    points = downsample_m4([[0, 1.0, 0.0, 2.0, 1.5]], 60000, end_ms=10000)
+    assert points[-1] == [10000, 1.5]
+
+
+def test_query_string_frames():
+    """ verify all channels are queried at once, grouped by channel """
+    query = query_string_frames(
+        'C', 'uid', start_str='2020-01-01T00:00:00Z', end_str='2020-01-01T01:00:00Z')
+    assert query == (
+        "SELECT value FROM C WHERE device_id='uid' "
+        "AND time >= '2020-01-01T00:00:00Z' AND time <= '2020-01-01T01:00:00Z' "
+        "GROUP BY channel")
+
+
+def test_parse_frames():
+    """ verify per-channel series are packed into complete frames ordered by time """
+    series = [
+        {'tags': {'channel': '1'}, 'values': [[2000, 21.0], [1000, 11.0]]},
+        {'tags': {'channel': '0'}, 'values': [[1000, 10.0], [2000, 20.0], [3000, 30.0]]},
+        {'tags': {'channel': '5'}, 'values': [[1000, 99.0]]},
+    ]
+    assert parse_frames(series, 2) == [
+        [1000, [10.0, 11.0]],
+        [2000, [20.0, 21.0]]]
+
+
+def test_parse_line_protocol():
+    """ verify tags, fields, escapes and timestamp precision of line protocol """
+    assert parse_line_protocol(
+        'C,device_id=uid,channel=0,measure=temperature value=37.5 1555351620392', precision='ms') == {
+        'unique_id': 'uid', 'unit': 'C', 'channel': '0', 'measure': 'temperature',
+        'value': '37.5', 'timestamp': datetime.datetime(2019, 4, 15, 18, 7, 0, 392000)}
+
+    parsed = parse_line_protocol(r'unit\ 1,device_id=a\,b,channel=2 value=3i')
+    assert (parsed['unit'], parsed['unique_id'], parsed['value'], parsed['timestamp']) == (
+        'unit 1', 'a,b', '3', None)
+
+    for invalid in ['C,device_id=uid', 'C,device_id=uid other=1', 'C,device_id value=1',
+                    'C,device_id=uid value=1 {}'.format(10 ** 30)]:
+        with pytest.raises(ValueError):
+            parse_line_protocol(invalid)
+
+
+def test_query_string_page():
+    """ verify the paginated and aggregated queries of historical measurements """
+    assert query_string_page(
+        'C', 'uid', channel=0, start_str='2019-04-15T00:00:00.000000Z',
+        cursor_ns=1555351620392000001, limit=100) == (
+        "SELECT value FROM C WHERE device_id='uid' AND channel='0' "
+        "AND time >= '2019-04-15T00:00:00.000000Z' AND time >= 1555351620392000001 "
+        "ORDER BY time ASC LIMIT 100")
+    assert query_string_page('C', 'uid', function='MAX', group_sec=60) == (
+        "SELECT MAX(value) FROM C WHERE device_id='uid' "
+        "GROUP BY TIME(60s) fill(none) ORDER BY time ASC")
+    assert query_string_page('C', 'uid', function='DROP') == 1
+
+
+def test_next_page_cursor():
+    """ verify the next page starts after the last measurement or bucket of a full page """
+    rows = [[1000, 1.0], [2000, 2.0]]
+    assert next_page_cursor(rows, 2) == 2001
+    assert next_page_cursor(rows, 2, group_sec=60) == 2000 + 60 * 1000000000
+    assert next_page_cursor(rows, 3) is None
+    assert next_page_cursor(rows, None) is None
@@ -0,0 +1,85 @@
+# coding=utf-8
+""" Tests for full and incremental backups of the measurement database """
+import io
+import os
+import re
+import zipfile
+
+import pytest
+
+from mycodo.config import INFLUXDB_BACKUP_FULL_INTERVAL
+from mycodo.config import INFLUXDB_BACKUP_RETENTION
+from mycodo.utils.influx_backup import BackupError
+from mycodo.utils.influx_backup import backup_chains
+from mycodo.utils.influx_backup import backup_sets
+from mycodo.utils.influx_backup import chain_files
+from mycodo.utils.influx_backup import create_backup_set
+from mycodo.utils.zip_stream import zip_stream
+
+DAY = 86400
+
+
+class FakeInfluxd:
+    """ Records the backup commands and creates the backup files """
+    def __init__(self):
+        self.commands = []
+        self.status = 0
+
+    def run(self, command):
+        self.commands.append(command)
+        path = command.split(' ')[-1]
+        os.makedirs(path)
+        with open(os.path.join(path, '20200101T000000Z.manifest'), 'w') as manifest:
+            manifest.write(command)
+        return b'', b'error' if self.status else b'', self.status
+
+
+def test_incremental_backups_and_retention(tmp_path):
+    """ verify backups start after the last one, and old chains are deleted """
+    influxd = FakeInfluxd()
+    path = str(tmp_path)
+    now = 1600000000
+
+    assert create_backup_set(path, now=now, run=influxd.run)['kind'] == 'full'
+    assert '-start' not in influxd.commands[-1]
+    incremental = create_backup_set(path, now=now + DAY, run=influxd.run)
+    assert (incremental['kind'], incremental['start']) == ('incremental', now)
+    assert '-start 2020-09-13T12:26:40Z' in influxd.commands[-1]
+
+    create_backup_set(path, now=now + INFLUXDB_BACKUP_FULL_INTERVAL, run=influxd.run)
+    assert [[each_set['kind'] for each_set in chain] for chain in backup_chains(backup_sets(path))] == [
+        ['full', 'incremental'], ['full']]
+
+    # The first chain is deleted once its last backup is past retention
+    create_backup_set(path, now=now + DAY + INFLUXDB_BACKUP_RETENTION + 1, run=influxd.run)
+    chains = backup_chains(backup_sets(path))
+    assert [[each_set['kind'] for each_set in chain] for chain in chains] == [['full'], ['full']]
+    assert chains[0][0]['created'] == now + INFLUXDB_BACKUP_FULL_INTERVAL
+    assert len(os.listdir(path)) == 2
+
+
+def test_failed_backup_is_removed(tmp_path):
+    """ verify a failed backup isn't used as the base of incremental backups """
+    influxd = FakeInfluxd()
+    influxd.status = 1
+    with pytest.raises(BackupError):
+        create_backup_set(str(tmp_path), now=1600000000, run=influxd.run)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_chain_zip_stream(tmp_path):
+    """ verify the streamed zip has a folder with the files of each backup """
+    influxd = FakeInfluxd()
+    path = str(tmp_path)
+    create_backup_set(path, now=1600000000, run=influxd.run)
+    create_backup_set(path, now=1600000000 + DAY, run=influxd.run)
+
+    chunks = list(zip_stream(chain_files(backup_chains(backup_sets(path))[-1])))
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    assert archive.testzip() is None
+    names = archive.namelist()
+    assert len(names) == 4
+    assert all(re.match(r'\d{8}-\d{6}-(full|incremental)/', name) for name in names)
+    assert sorted(name.split('/')[1] for name in names) == [
+        '20200101T000000Z.manifest', '20200101T000000Z.manifest',
+        'backup_set.json', 'backup_set.json']
@@ -0,0 +1,129 @@
+# coding=utf-8
+""" Tests for copying an imported InfluxDB database into the Mycodo database """
+import re
+import threading
+
+import pytest
+
+from mycodo.mycodo_flask.utils.utils_export import influxdb_backup_folders
+from mycodo.mycodo_flask.utils.utils_export import job_import_influxdb
+from mycodo.utils.influx_import import InfluxImport
+from mycodo.utils.influx_import import copy_windows
+from mycodo.utils.jobs import JobError
+
+
+class Result:
+    def __init__(self, points):
+        self.points = points
+
+    def get_points(self):
+        return self.points
+
+
+class FakeInfluxDB:
+    """ Stores the points of each database and answers the queries of an import """
+    def __init__(self, points, fail_at=None):
+        self.databases = {'mycodo_db_bak': points, 'mycodo_db': {}}
+        self.fail_at = fail_at
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def connect(self, database):
+        return self
+
+    def get_list_measurements(self):
+        return [{'name': name} for name in sorted(self.databases['mycodo_db_bak'])]
+
+    def query(self, query, **kwargs):
+        with self.lock:
+            self.queries.append(query)
+        match = re.match(r'SELECT \* FROM "(.+)".."(.+)" ORDER BY time (\w+) LIMIT 1', query)
+        if match:
+            times = sorted(self.databases[match.group(1)].get(match.group(2), []))
+            if match.group(3) == 'DESC':
+                times.reverse()
+            return Result([{'time': times[0], 'value': 1.0}] if times else [])
+        match = re.match(r'SELECT \* INTO "(.+)".."(.+)" FROM "(.+)".."(.+)" '
+                         r'WHERE time >= (\d+)s AND time < (\d+)s GROUP BY \*', query)
+        if match:
+            start = int(match.group(5))
+            if start == self.fail_at:
+                raise ConnectionError('influxdb unreachable')
+            with self.lock:
+                destination = self.databases[match.group(1)].setdefault(match.group(2), set())
+                destination.update(t for t in self.databases[match.group(3)][match.group(4)]
+                                   if start <= t < int(match.group(6)))
+            return Result([])
+        match = re.match(r'SELECT count\(\*\) FROM "(.+)".."(.+)" WHERE time >= (\d+)s AND time <= (\d+)s',
+                         query)
+        times = [t for t in self.databases[match.group(1)].get(match.group(2), [])
+                 if int(match.group(3)) <= t <= int(match.group(4))]
+        return Result([{'time': 0, 'count_value': len(times)}])
+
+
+def test_copy_windows():
+    """ verify windows are aligned and cover the last point """
+    assert copy_windows(15, 35, 10) == [10, 20, 30]
+    assert copy_windows(20, 20, 10) == [20]
+
+
+def test_import_copies_verifies_and_checkpoints(tmp_path):
+    """ verify every window of every measurement is copied and counted """
+    influxdb = FakeInfluxDB({'C': set(range(0, 100, 5)), 'V': {250, 251}})
+    path = str(tmp_path / 'import.json')
+    importer = InfluxImport(path=path, connect=influxdb.connect, chunk_seconds=30, workers=3)
+    importer.begin(str(tmp_path), [str(tmp_path)])
+    assert importer.run()
+
+    assert influxdb.databases['mycodo_db'] == influxdb.databases['mycodo_db_bak']
+    status = InfluxImport(path=path).status()
+    assert (status['status'], status['chunks'], status['copied'], status['progress']) == (
+        'finished', 5, 5, 100.0)
+    assert status['verified'] == {'C': {'imported': 20, 'stored': 20},
+                                  'V': {'imported': 2, 'stored': 2}}
+
+
+def test_import_resumes_remaining_windows(tmp_path):
+    """ verify a failed copy is resumed without copying finished windows again """
+    influxdb = FakeInfluxDB({'C': set(range(0, 100, 5))}, fail_at=60)
+    path = str(tmp_path / 'import.json')
+    importer = InfluxImport(path=path, connect=influxdb.connect, chunk_seconds=30, workers=1)
+    importer.begin(str(tmp_path), [str(tmp_path)])
+    assert not importer.run()
+    status = importer.status()
+    assert (status['status'], status['error'], status['resumable']) == (
+        'failed', 'influxdb unreachable', True)
+
+    influxdb.fail_at = None
+    influxdb.queries = []
+    importer = InfluxImport(path=path, connect=influxdb.connect, chunk_seconds=30, workers=1)
+    assert importer.run()
+    copies = [query for query in influxdb.queries if 'INTO' in query]
+    resumed = [re.search(r'time >= (\d+)s', query).group(1) for query in copies]
+    assert '60' in resumed and '0' not in resumed and '30' not in resumed
+    assert importer.status()['verified'] == {'C': {'imported': 20, 'stored': 20}}
+
+
+def test_import_of_each_backup(tmp_path):
+    """ verify each backup of an incremental archive is imported in turn """
+    path = str(tmp_path / 'import.json')
+    importer = InfluxImport(path=path, connect=FakeInfluxDB({'C': {0}}).connect)
+    importer.begin(str(tmp_path), ['full', 'incremental'])
+    assert importer.run()
+    assert importer.next_folder()
+    status = importer.status()
+    assert (status['status'], status['folder'], status['backups']) == ('restoring', 1, 2)
+    assert importer.run()
+    assert not importer.next_folder()
+
+
+def test_import_of_archive_without_backup(tmp_path):
+    """ verify an archive without a backup manifest is an error rather than an IndexError """
+    (tmp_path / 'backup').mkdir()
+    (tmp_path / 'backup' / 'meta.00').write_text('')
+    assert influxdb_backup_folders(str(tmp_path)) == []
+    with pytest.raises(JobError):
+        job_import_influxdb(None, tmp_folder=str(tmp_path))
+
+    (tmp_path / 'backup' / '20201019T000000Z.manifest').write_text('{}')
+    assert influxdb_backup_folders(str(tmp_path)) == [str(tmp_path / 'backup')]
@@ -0,0 +1,64 @@
+# coding=utf-8
+""" Tests for the batched influxdb writer """
+from influxdb.exceptions import InfluxDBClientError
+
+from mycodo.utils.influx_writer import InfluxBatchWriter
+
+
+def test_writes_in_batches_and_rejects_when_full():
+    """ verify points are written in batches and rejected beyond the queue limit """
+    batches = []
+    writer = InfluxBatchWriter(
+        batch_size=3, interval=0.01, max_queued=5, write_points=batches.append)
+
+    assert writer.submit(list(range(7))) == 5  # Not started, so the queue fills
+    writer.start()
+    assert writer.flush(timeout=5)
+    assert batches == [[0, 1, 2], [3, 4]]
+    assert writer.submit([5]) == 1
+    assert writer.flush(timeout=5)
+    writer.stop()
+    assert writer.status()['written'] == 6
+
+
+def test_retries_failed_batch_in_order():
+    """ verify a failed batch is retried before the points queued after it """
+    written = []
+    failures = [ConnectionError('influxdb is down')]
+
+    def write_points(points):
+        if failures:
+            raise failures.pop()
+        written.extend(points)
+
+    writer = InfluxBatchWriter(batch_size=2, interval=0.01, write_points=write_points)
+    writer.start()
+    writer.submit(['a', 'b'])
+    writer.submit(['c'])
+    assert writer.flush(timeout=5)
+    writer.stop()
+    assert written == ['a', 'b', 'c']
+    assert writer.status()['failures'] == 1
+    assert writer.status()['last_error'] == 'influxdb is down'
+
+
+def test_drops_points_influxdb_refuses():
+    """ verify a refused batch isn't retried, and only its refused points are dropped """
+    written = []
+    attempts = []
+
+    def write_points(points):
+        attempts.append(list(points))
+        if 'bad' in points:
+            raise InfluxDBClientError('points beyond retention policy dropped', code=400)
+        written.extend(points)
+
+    writer = InfluxBatchWriter(batch_size=3, interval=0.01, write_points=write_points)
+    writer.submit(['a', 'bad', 'b', 'c'])
+    writer.start()
+    assert writer.flush(timeout=5)
+    writer.stop()
+    assert written == ['a', 'b', 'c']
+    assert attempts == [['a', 'bad', 'b'], ['a'], ['bad'], ['b'], ['c']]
+    status = writer.status()
+    assert (status['written'], status['dropped'], status['failures']) == (3, 1, 1)
@@ -0,0 +1,111 @@
+# coding=utf-8
+""" Tests for the background jobs of the web interface """
+import json
+
+import pytest
+from sqlalchemy import create_engine
+
+from mycodo.databases.models import Job
+from mycodo.databases.utils import session_scope
+from mycodo.utils.jobs import JobError
+from mycodo.utils.jobs import JobRunner
+from mycodo.utils.jobs import job_status
+from mycodo.utils.jobs import job_task
+
+
+@job_task('test_count')
+def count(job, to):
+    for number in range(to):
+        job.progress(number, to, "Counting")
+    return {'counted': to}
+
+
+@job_task('test_fail')
+def fail(job):
+    raise Exception("Failed on purpose")
+
+
+@job_task('test_replaced')
+def replaced(job, db_uri):
+    """ The settings database is replaced while the job runs """
+    with session_scope(db_uri) as new_session:
+        new_session.query(Job).delete()
+    job.progress(1, 1, "Imported")
+
+
+@pytest.fixture
+def runner(tmp_path):
+    db_uri = 'sqlite:///{}'.format(tmp_path / 'mycodo.db')
+    Job.__table__.create(create_engine(db_uri))
+    return JobRunner(db_uri, workers=1)
+
+
+def load(runner, unique_id):
+    with session_scope(runner.db_uri) as new_session:
+        return job_status(new_session.query(Job).filter(Job.unique_id == unique_id).one())
+
+
+def test_job_runs_and_saves_result(runner):
+    """ verify a claimed job runs its task and only one job of a task is queued """
+    unique_id = runner.submit('test_count', 'Count', to=3)
+    with pytest.raises(JobError):
+        runner.submit('test_count', 'Count', to=3)
+    assert load(runner, unique_id)['status'] == 'queued'
+
+    runner.run(runner._claim())
+    status = load(runner, unique_id)
+    assert (status['status'], status['progress'], status['result']) == (
+        'finished', 100.0, {'counted': 3})
+    assert runner._claim() is None
+
+    failed = runner.submit('test_fail', 'Fail')
+    runner.run(runner._claim())
+    assert (load(runner, failed)['status'], load(runner, failed)['error']) == (
+        'failed', 'Failed on purpose')
+
+
+def test_cancel(runner):
+    """ verify queued jobs are canceled and running jobs stop at their next progress """
+    queued = runner.submit('test_count', 'Count', to=3)
+    runner.cancel(queued)
+    assert load(runner, queued)['status'] == 'canceled'
+    with pytest.raises(JobError):
+        runner.cancel(queued)
+
+    running = runner.submit('test_count', 'Count', to=3)
+    fields = runner._claim()
+    runner.cancel(running)
+    runner.run(fields)
+    status = load(runner, running)
+    assert (status['status'], status['result']) == ('canceled', None)
+
+
+def test_recover_interrupted_jobs(runner):
+    """ verify jobs running when the frontend stopped are ended """
+    with session_scope(runner.db_uri) as new_session:
+        new_session.add(Job(unique_id='a', task='test_count', status='running',
+                            progress_done=1, progress_total=3))
+        new_session.add(Job(unique_id='b', task='test_count', status='running',
+                            progress_done=3, progress_total=3))
+        new_session.add(Job(unique_id='c', task='test_count', status='queued',
+                            kwargs=json.dumps({'to': 1})))
+    runner._recover()
+    assert load(runner, 'a')['status'] == 'interrupted'
+    assert load(runner, 'b')['status'] == 'finished'
+    assert load(runner, 'c')['status'] == 'queued'
+
+
+def test_job_saved_again_when_database_replaced(runner):
+    """ verify the progress of a job is saved if its row is missing """
+    unique_id = runner.submit('test_replaced', 'Import', db_uri=runner.db_uri)
+    runner.run(runner._claim())
+    status = load(runner, unique_id)
+    assert (status['status'], status['message']) == ('finished', 'Imported')
+
+
+def test_job_status_remaining():
+    """ verify the progress and time remaining of a running job """
+    job = Job(unique_id='a', task='test_count', status='running',
+              progress_done=25, progress_total=100, time_eta=1060.5)
+    status = job_status(job, now=1000)
+    assert (status['progress'], status['remaining'], status['cancelable']) == (25.0, 60, True)
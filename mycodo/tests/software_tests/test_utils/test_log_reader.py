@@ -0,0 +1,109 @@
+# coding=utf-8
+""" Tests for reading the end of logs and what was written since """
+import os
+
+import pytest
+
+from mycodo.utils import log_reader
+from mycodo.utils.log_reader import LogFilter
+from mycodo.utils.log_reader import read_log
+
+
+def record(number, level='INFO', name='mycodo.daemon', message=None):
+    return '2020-10-19 12:00:{:02d},000 - {} - {} - {}\n'.format(
+        number % 60, level, name, message or 'Message {}'.format(number))
+
+
+@pytest.fixture
+def log(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_reader, 'LOG_READ_CHUNK_SIZE', 64)
+    monkeypatch.setattr(log_reader, '_indexes', log_reader.OrderedDict())
+    return str(tmp_path / 'mycodo.log')
+
+
+def write(path, text, mode='a'):
+    with open(path, mode) as log_file:
+        log_file.write(text)
+
+
+def test_tail(log):
+    """ verify the last lines are read back from the end, across the rotated log """
+    assert read_log(log, 5) is None
+    write(log + '.1', ''.join(record(number) for number in range(10)))
+    write(log, ''.join(record(number) for number in range(10, 13)) + 'partial')
+    result = read_log(log, 5)
+    assert result['text'] == ''.join(record(number) for number in range(8, 13))
+    assert result['reset'] and result['offset'] == os.path.getsize(log) - len('partial')
+
+
+def test_filter_groups_tracebacks(log):
+    """ verify filtering by level and logger keeps the lines following a record with it """
+    traceback = 'Traceback (most recent call last):\n  File "x.py"\nValueError\n'
+    write(log, ''.join([
+        record(1, name='mycodo.pid_1'),
+        record(2, 'ERROR', 'mycodo.pid_1') + traceback,
+        record(3, 'ERROR', 'mycodo.pid_12'),
+        record(4, 'WARNING', 'mycodo.inputs.dht22_1'),
+        record(5, 'INFO', 'mycodo.inputs.dht22_1', 'PID Settings: x')]))
+
+    assert read_log(log, 10, LogFilter(level='ERROR', logger='mycodo.pid_1'))['text'] == (
+        record(2, 'ERROR', 'mycodo.pid_1') + traceback)
+    assert read_log(log, 10, LogFilter(logger='mycodo.inputs'))['text'] == (
+        record(4, 'WARNING', 'mycodo.inputs.dht22_1') +
+        record(5, 'INFO', 'mycodo.inputs.dht22_1', 'PID Settings: x'))
+    assert read_log(log, 1, LogFilter(text='Traceback'))['text'] == (
+        'Traceback (most recent call last):\n')
+
+    # The open last record is read again as its traceback is written
+    write(log, record(6, 'CRITICAL') + 'Traceback\n')
+    assert read_log(log, 1, LogFilter(level='ERROR'))['text'] == record(6, 'CRITICAL') + 'Traceback\n'
+    write(log, '  File "y.py"\n')
+    assert read_log(log, 1, LogFilter(level='ERROR'))['text'] == (
+        record(6, 'CRITICAL') + 'Traceback\n  File "y.py"\n')
+
+
+def test_follow(log):
+    """ verify only what was written since a read is read, across rotation """
+    log_filter = LogFilter(level='WARNING')
+    write(log, record(1) + record(2, 'ERROR'))
+    first = read_log(log, 10, log_filter)
+    assert first['text'] == record(2, 'ERROR')
+
+    write(log, '  continued\n' + record(3) + record(4, 'WARNING') + 'partial')
+    since = read_log(log, 10, log_filter, first['offset'], first['inode'])
+    assert (since['text'], since['reset']) == ('  continued\n' + record(4, 'WARNING'), False)
+
+    # Rotated: the rest of the old log, then the new log
+    write(log, ' line\n' + record(5, 'ERROR'))
+    os.rename(log, log + '.1')
+    write(log, record(6, 'ERROR'))
+    rotated = read_log(log, 10, log_filter, since['offset'], since['inode'])
+    assert (rotated['text'], rotated['reset']) == (
+        'partial line\n' + record(5, 'ERROR') + record(6, 'ERROR'), False)
+    assert rotated['inode'] == os.stat(log).st_ino
+
+    # Truncated: the last records are read again
+    write(log, record(7, 'ERROR', message='7'), mode='w')
+    truncated = read_log(log, 10, log_filter, rotated['offset'], rotated['inode'])
+    assert truncated['reset']
+    assert truncated['text'].endswith(record(7, 'ERROR', message='7'))
+
+    # An offset before the start of the log: the last records are read again
+    negative = read_log(log, 10, log_filter, -10, truncated['inode'])
+    assert (negative['text'], negative['reset']) == (truncated['text'], True)
+
+
+def test_index_moves_to_rotated_log(log):
+    """ verify the index of a log is kept for its rotated log """
+    log_filter = LogFilter(text='Settings')
+    write(log, ''.join(record(number, message='Settings {}'.format(number))
+                       for number in range(20)))
+    assert read_log(log, 2, log_filter)['text'] == ''.join(
+        record(number, message='Settings {}'.format(number)) for number in (18, 19))
+    index = log_reader._indexes[(log, log_filter.key)]
+
+    os.rename(log, log + '.1')
+    write(log, record(20))
+    assert read_log(log, 2, log_filter)['text'] == ''.join(
+        record(number, message='Settings {}'.format(number)) for number in (18, 19))
+    assert log_reader._indexes[(log + '.1', log_filter.key)] is index
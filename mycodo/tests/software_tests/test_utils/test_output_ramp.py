@@ -0,0 +1,75 @@
+# coding=utf-8
+""" Tests for the Output controller PWM ramps """
+import threading
+
+from mycodo.utils.output_ramp import PWMRamp
+from mycodo.utils.output_ramp import RampScheduler
+from mycodo.utils.output_ramp import curve_exponential
+from mycodo.utils.output_ramp import curve_from_points
+
+
+def test_ramp_target_linear_with_increment():
+    """ verify linear ramps are rounded to the increment and end at the end duty cycle """
+    ramp = PWMRamp('uid', 0, 0, 100, 10, increment=1.0)
+    assert ramp.target(0) == 0
+    assert ramp.target(2.504) == 25
+    assert ramp.target(10) == 100
+    assert ramp.target(60) == 100
+
+    ramp = PWMRamp('uid', 0, 80, 20, 60)
+    assert ramp.target(30) == 50
+
+
+def test_ramp_curves():
+    """ verify the exponential and point curves start at 0 and end at 1 """
+    assert curve_exponential(0) == 0
+    assert abs(curve_exponential(1) - 1) < 1e-9
+    assert curve_exponential(0.5) < 0.5
+
+    curve = curve_from_points([[0, 0], [0.5, 0.8], [1, 1]])
+    assert curve(0.25) == 0.4
+    assert curve(0.75) == 0.9
+    assert curve(2) == 1
+
+
+def test_ramp_advance_skips_unchanged_duty_cycles():
+    """ verify a duty cycle is only returned when it changes """
+    ramp = PWMRamp('uid', 0, 0, 1, 10, increment=1.0)
+    assert ramp.advance(ramp.started) == 0
+    assert ramp.advance(ramp.started + 1) is None
+    assert ramp.advance(ramp.started + 10) == 1
+    assert ramp.finished
+
+
+def test_ramp_advance_returns_end_reached_early():
+    """ verify the end of a ramp is returned even if the end duty cycle was already reached """
+    ramp = PWMRamp('uid', 0, 0, 100, 10, increment=1.0)
+    assert ramp.advance(ramp.started + 9.96) == 100
+    assert not ramp.finished
+    assert ramp.advance(ramp.started + 10) == 100
+    assert ramp.finished
+
+
+def test_ramp_scheduler_supersedes_ramps():
+    """ verify the scheduler completes a ramp and a new ramp supersedes the previous """
+    applied = []
+    done = threading.Event()
+
+    def set_duty_cycle(output_id, output_channel, duty_cycle, finished):
+        applied.append((output_id, output_channel, duty_cycle, finished))
+        if finished:
+            done.set()
+
+    scheduler = RampScheduler(set_duty_cycle)
+    scheduler.start()
+    try:
+        assert scheduler.add(PWMRamp('uid', 0, 0, 100, 60, period=0.01)) is None
+        superseded = scheduler.add(PWMRamp('uid', 0, 50, 60, 0.1, period=0.01))
+        assert superseded.end_duty_cycle == 100
+        assert done.wait(5)
+    finally:
+        scheduler.stop()
+
+    assert applied[-1] == ('uid', 0, 60, True)
+    assert not scheduler.status()
+    assert all(each[2] <= 60 for each in applied[1:])
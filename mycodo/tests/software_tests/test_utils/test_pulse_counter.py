@@ -0,0 +1,43 @@
+# coding=utf-8
+""" Tests for the shared GPIO pulse counters """
+from mycodo.utils.pulse_counter import PulseCounter
+from mycodo.utils.pulse_counter import PulseReader
+from mycodo.utils.pulse_counter import tick_diff
+
+
+class FakeClock:
+    def __init__(self, tick):
+        self.tick = tick
+
+    def __call__(self):
+        return self.tick
+
+
+def test_tick_diff_wraps():
+    """ verify tick differences across the 32-bit wrap """
+    assert tick_diff(100, 250) == 150
+    assert tick_diff(0xFFFFFF00, 0x10) == 0x110
+
+
+def test_counter_period_and_reader():
+    """ verify the period is averaged over the window, grows when pulses stop and readers count independently """
+    clock = FakeClock(0)
+    counter = PulseCounter(4, clock, ring_size=8)
+    first = PulseReader(counter)
+    assert counter.period(1) is None
+
+    for tick in range(0, 2000000, 100000):  # 10 Hz for 2 seconds, wrapping the ring
+        counter.pulse(4, 1, tick)
+        counter.pulse(4, 0, tick + 50)  # Falling edges aren't counted
+    clock.tick = 1950000
+    second = PulseReader(counter)
+
+    assert counter.count == 20
+    assert counter.period(0.5) == 100000
+    assert first.rate(0.5) == 10.0
+    assert first.pulses() == 20
+    assert second.pulses() == 0
+
+    clock.tick = 4900000  # No pulses for 3 seconds
+    assert counter.period(0.5) == 3000000
+    assert first.pulses() == 0
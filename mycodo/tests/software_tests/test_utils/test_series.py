@@ -0,0 +1,38 @@
+# coding=utf-8
+""" Tests for the compact measurement series format """
+import json
+import math
+import struct
+
+from mycodo.mycodo_flask.utils.utils_series import decode_series
+from mycodo.mycodo_flask.utils.utils_series import CSV_MIMETYPE
+from mycodo.mycodo_flask.utils.utils_series import NDJSON_MIMETYPE
+from mycodo.mycodo_flask.utils.utils_series import encode_series
+from mycodo.mycodo_flask.utils.utils_series import stream_lines
+
+
+def test_encode_series_layout():
+    """ verify the header and column layout of an encoded series """
+    data = encode_series([[1000, 1.5], [2000, None]])
+    assert len(data) == 8 + 2 * 8 * 2
+    assert struct.unpack_from('<II', data) == (2, 0)
+    assert struct.unpack_from('<2d', data, 8) == (1000.0, 2000.0)
+    assert struct.unpack_from('<d', data, 24)[0] == 1.5
+    assert math.isnan(struct.unpack_from('<d', data, 32)[0])
+
+
+def test_encode_decode_series_round_trip():
+    """ verify a series survives encoding and decoding """
+    values = [[1604000000000, 21.25], [1604000002000, None], [1604000004000, -3.0]]
+    assert decode_series(encode_series(values)) == values
+    assert decode_series(encode_series([])) == []
+
+
+def test_stream_lines():
+    """ verify each chunk is streamed as one line per measurement """
+    chunks = [[['2019-04-15T18:07:00Z', 1.5]], [['2019-04-15T18:07:01Z', None]]]
+    assert ''.join(stream_lines(chunks, CSV_MIMETYPE)) == (
+        'time,value\n2019-04-15T18:07:00Z,1.5\n2019-04-15T18:07:01Z,\n')
+    lines = list(stream_lines(iter(chunks), NDJSON_MIMETYPE))
+    assert len(lines) == 2
+    assert json.loads(lines[1]) == {'time': '2019-04-15T18:07:01Z', 'value': None}
@@ -0,0 +1,136 @@
+# coding=utf-8
+""" Tests for the incremental statistics of measurement streams """
+import random
+import statistics
+
+import pytest
+
+from mycodo.utils.influx import format_influxdb_data
+from mycodo.utils.stream_stats import EMA
+from mycodo.utils.stream_stats import LatestValues
+from mycodo.utils.stream_stats import MeasurementStreams
+from mycodo.utils.stream_stats import P2Quantile
+from mycodo.utils.stream_stats import RunningStats
+from mycodo.utils.stream_stats import WindowStats
+from mycodo.utils.stream_stats import influx_time_to_epoch
+from mycodo.utils.stream_stats import stream_key
+
+
+def test_running_stats_add_and_remove():
+    """ verify the mean and standard deviation as values are added and removed """
+    values = [random.uniform(-50, 50) for _ in range(200)]
+    stats = RunningStats(values)
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.stdev() == pytest.approx(statistics.stdev(values))
+
+    for each_value in values[:150]:
+        stats.remove(each_value)
+    assert stats.count == 50
+    assert stats.total == pytest.approx(sum(values[150:]))
+    assert stats.stdev(sample=False) == pytest.approx(statistics.pstdev(values[150:]))
+    assert RunningStats([1.0]).stdev() is None
+
+
+def test_window_stats_sliding_window():
+    """ verify every statistic of a sliding window against recalculating from its values """
+    window = WindowStats(size=25)
+    values = [random.randint(0, 1000) / 10.0 for _ in range(500)]
+    for index, each_value in enumerate(values):
+        window.add(each_value)
+        expected = values[max(0, index - 24):index + 1]
+        summary = window.summary()
+        assert summary['count'] == len(expected)
+        assert summary['mean'] == pytest.approx(statistics.mean(expected))
+        assert summary['median'] == statistics.median(expected)
+        assert summary['minimum'] == min(expected)
+        assert summary['maximum'] == max(expected)
+
+
+def test_window_stats_duration_and_seed():
+    """ verify measurements expire and past points are added before live ones """
+    window = WindowStats(duration=60)
+    window.add(5.0, timestamp=1000)
+    window.seed([(930, 100.0), (950, 1.0), (1001, 7.0)])  # 1001 isn't older than the live value
+    assert window.summary(now=1000)['sum'] == 6.0
+    assert window.summary(now=1011) == {
+        'count': 1, 'sum': 5.0, 'mean': 5.0, 'median': 5.0,
+        'minimum': 5.0, 'maximum': 5.0, 'stdev': None}
+    assert window.summary(now=1061)['count'] == 0
+
+
+def test_ema_and_p2_quantile():
+    """ verify the exponential moving average and the P-Square median estimate """
+    ema = EMA(0.5)
+    assert [ema.add(value) for value in [2, 4, 8]] == [2.0, 3.0, 5.5]
+
+    median = P2Quantile(0.5)
+    values = [random.gauss(20, 2) for _ in range(5000)]
+    for each_value in values:
+        median.add(each_value)
+    assert median.value() == pytest.approx(statistics.median(values), abs=0.2)
+
+
+def test_measurement_streams_updated_on_write():
+    """ verify a window is seeded once, then updated by the points written """
+    streams = MeasurementStreams()
+    fetches = []
+
+    def fetch(since):
+        fetches.append(since)
+        return [(1.0, 10.0), (2.0, 20.0)] if since is None else []
+
+    summary = streams.query('input_1', 'C', 0, 'temperature', 1e10, fetch=fetch)
+    assert summary['mean'] == 15.0
+
+    streams.add_points([
+        format_influxdb_data('input_1', 'C', 60.0, channel=0, measure='temperature'),
+        format_influxdb_data('input_1', 'C', 99.0, channel=1, measure='temperature')])
+    summary = streams.query('input_1', 'C', 0, 'temperature', 1e10, fetch=fetch)
+    assert (summary['count'], summary['sum'], summary['maximum']) == (3, 90.0, 60.0)
+    assert fetches[0] is None and len(fetches) == 2
+
+
+def test_measurement_streams_fetch_points_stored_elsewhere():
+    """ verify points stored outside the stream (e.g. by the API) are added when queried """
+    streams = MeasurementStreams()
+    stored = [(1.0, 10.0), (2.0, 20.0)]
+
+    def fetch(since):
+        return [point for point in stored if since is None or point[0] >= since]
+
+    assert streams.query('input_1', 'C', 0, 'temperature', 1e10, fetch=fetch)['count'] == 2
+
+    stored.extend([(3.0, 30.0), (4.0, 40.0)])  # Written by another process
+    summary = streams.query('input_1', 'C', 0, 'temperature', 1e10, fetch=fetch)
+    assert (summary['count'], summary['sum'], summary['maximum']) == (4, 100.0, 40.0)
+
+    # Points the daemon wrote and are also stored aren't counted twice
+    streams.add_points([format_influxdb_data(
+        'input_1', 'C', 50.0, channel=0, measure='temperature', timestamp='1970-01-01T00:00:05Z')])
+    stored.extend([(5.0, 50.0), (6.0, 60.0)])
+    summary = streams.query('input_1', 'C', 0, 'temperature', 1e10, fetch=fetch)
+    assert (summary['count'], summary['sum']) == (6, 210.0)
+
+
+def test_latest_values_notify_subscribers():
+    """ verify subscribers are notified of newer values and old values expire """
+    latest = LatestValues()
+    key = stream_key('input_1', 'C', 0, 'temperature')
+    notified = []
+    latest.subscribe([key], notified.append)
+
+    latest.add_points([
+        format_influxdb_data('input_1', 'C', 20.0, channel=0, measure='temperature',
+                             timestamp='2020-01-01T00:00:10.5Z'),
+        format_influxdb_data('input_1', 'C', 10.0, channel=0, measure='temperature',
+                             timestamp='2020-01-01T00:00:05Z'),
+        format_influxdb_data('input_2', 'C', 30.0, channel=0, measure='temperature')])
+    assert notified == [key]
+    assert latest.get([key]) == [(influx_time_to_epoch('2020-01-01T00:00:10.5Z'), 20.0)]
+    assert latest.get([key, stream_key('input_3', 'C', 0, 'temperature')], max_age=60) == [None, None]
+
+    latest.unsubscribe([key], notified.append)
+    latest.add_points([format_influxdb_data('input_1', 'C', 25.0, channel=0, measure='temperature')])
+    assert notified == [key]
+    assert latest.get([key], max_age=60)[0][1] == 25.0
+    assert latest.status()['subscribed'] == {}
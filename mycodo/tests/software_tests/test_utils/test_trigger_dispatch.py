@@ -0,0 +1,21 @@
+# coding=utf-8
+""" Tests for the Output Trigger dispatch table """
+from mycodo.utils.trigger_dispatch import on_duration_matches
+
+
+def test_on_duration_matches():
+    """ verify each 'on' Output Trigger state matches the duration the output turned on for """
+    assert on_duration_matches('on_duration_none', 0, 0.0)
+    assert not on_duration_matches('on_duration_none', 0, 5.0)
+    assert on_duration_matches('on_duration_any', 0, 5.0)
+    assert not on_duration_matches('on_duration_any', 0, 0.0)
+    assert on_duration_matches('on_duration_none_any', 0, 0.0)
+    assert on_duration_matches('on_duration_none_any', 0, 5.0)
+    assert on_duration_matches('on_duration_equal', 5.0, 5.0)
+    assert on_duration_matches('on_duration_greater_than', 5.0, 6.0)
+    assert not on_duration_matches('on_duration_greater_than', 5.0, 5.0)
+    assert on_duration_matches('on_duration_equal_greater_than', 5.0, 5.0)
+    assert on_duration_matches('on_duration_less_than', 5.0, 4.0)
+    assert on_duration_matches('on_duration_equal_less_than', 5.0, 5.0)
+    assert not on_duration_matches('on_duration_equal_less_than', 5.0, None)
+    assert not on_duration_matches('off', 5.0, 5.0)
@@ -0,0 +1,90 @@
+# coding=utf-8
+""" Tests for the shared 1-Wire bus conversions """
+import os
+import threading
+
+import pytest
+
+from mycodo.utils.w1_bus import W1Bus
+from mycodo.utils.w1_bus import W1BusManager
+from mycodo.utils.w1_bus import parse_w1_slave
+
+
+def add_sensor(path, bus, sensor, temperature):
+    """ Create the sysfs entries of a sensor on a bus master """
+    os.makedirs(os.path.join(path, bus, sensor))
+    with open(os.path.join(path, bus, sensor, 'temperature'), 'w') as file_write:
+        file_write.write(temperature)
+    os.symlink(os.path.join(path, bus, sensor), os.path.join(path, sensor))
+
+
+def test_parse_w1_slave():
+    """ verify the temperature and CRC check of w1_slave contents """
+    assert parse_w1_slave(
+        "72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n"
+        "72 01 4b 46 7f ff 0e 10 57 t=23125") == 23.125
+    with pytest.raises(ValueError):
+        parse_w1_slave(
+            "72 01 4b 46 7f ff 0e 10 57 : crc=57 NO\n"
+            "72 01 4b 46 7f ff 0e 10 57 t=23125")
+
+
+def test_bus_converts_once_for_all_sensors(tmpdir):
+    """ verify one bulk conversion is served to the Inputs of all sensors on a bus """
+    path = str(tmpdir)
+    os.makedirs(os.path.join(path, 'w1_bus_master1'))
+    with open(os.path.join(path, 'w1_bus_master1', 'therm_bulk_read'), 'w') as file_write:
+        file_write.write('0')
+    add_sensor(path, 'w1_bus_master1', '28-000000000001', '21500')
+    add_sensor(path, 'w1_bus_master1', '3b-000000000002', '-1250')
+    add_sensor(path, 'w1_bus_master1', '28-000000000003', 'invalid')
+
+    manager = W1BusManager(path=path)
+    assert manager.read('DS18B20', '000000000001', max_age=60) == 21.5
+    assert manager.read('MAX31850K', '000000000002', max_age=60) == -1.25
+    assert manager.read('DS18B20', '000000000001', max_age=60) == 21.5
+    with open(os.path.join(path, 'w1_bus_master1', 'therm_bulk_read')) as file_read:
+        assert file_read.read() == 'trigger'
+
+    status = manager.status()['w1_bus_master1']
+    assert status['bulk_read']
+    assert status['conversions'] == 2  # Second sensor was added after the first conversion
+
+    with pytest.raises(ValueError):
+        manager.read('DS18B20', '000000000003', max_age=60)
+    assert manager.read('DS18B20', '000000000001', max_age=0) == 21.5
+    assert manager.status()['w1_bus_master1']['conversions'] == 4
+
+
+def test_sensors_converted_in_turn_without_bulk_read(tmpdir, monkeypatch):
+    """ verify without therm_bulk_read a conversion only holds up Inputs of its own sensor """
+    path = str(tmpdir)
+    add_sensor(path, 'w1_bus_master1', '28-000000000001', '21500')
+    add_sensor(path, 'w1_bus_master1', '28-000000000002', '22500')
+
+    converting = threading.Event()
+    release = threading.Event()
+    read_sensor = W1Bus._read_sensor
+
+    def slow_read_sensor(bus, sensor, bulk):
+        if sensor.endswith('1'):
+            converting.set()
+            release.wait(5)
+        return read_sensor(bus, sensor, bulk)
+
+    monkeypatch.setattr(W1Bus, '_read_sensor', slow_read_sensor)
+    manager = W1BusManager(path=path)
+    results = []
+    slow = threading.Thread(
+        target=lambda: results.append(manager.read('DS18B20', '000000000001', max_age=60)))
+    slow.start()
+    try:
+        assert converting.wait(5)
+        assert manager.read('DS18B20', '000000000002', max_age=60) == 22.5
+    finally:
+        release.set()
+        slow.join(5)
+    assert results == [21.5]
+    assert manager.read('DS18B20', '000000000001', max_age=60) == 21.5
+    status = manager.status()['w1_bus_master1']
+    assert (status['bulk_read'], status['conversions']) == (False, 2)
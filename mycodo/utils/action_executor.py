@@ -0,0 +1,193 @@
+# coding=utf-8
+#
+#  action_executor.py - Run slow Function Actions (camera captures, emails)
+#                       outside of the Trigger and Conditional controllers
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from collections import namedtuple
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
+from mycodo.config import ACTION_EXECUTOR_WORKERS
+from mycodo.config import EMAIL_BATCH_SECONDS
+from mycodo.utils.metrics import ActionMetrics
+from mycodo.utils.send_data import SMTPSession
+from mycodo.utils.send_data import compose_email
+
+logger = logging.getLogger("mycodo.action_executor")
+
+EmailNotification = namedtuple('EmailNotification', [
+    'settings', 'recipients', 'message', 'attachment_file', 'queued', 'future'])
+
+
+class EmailNotifier(threading.Thread):
+    """
+    Sends email notifications from a single thread. Notifications queued
+    within batch_seconds of each other are sent over one SMTP connection, and
+    notifications without attachments to the same recipients are combined
+    into one email.
+    """
+    def __init__(self, metrics, batch_seconds=EMAIL_BATCH_SECONDS):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.metrics = metrics
+        self.batch_seconds = batch_seconds
+        self.session = SMTPSession()
+        self._queue = queue.Queue()
+
+    def notify(self, settings, recipients, message, attachment_file=None):
+        """
+        Queue an email. attachment_file may be a Future of the file path, in which
+        case the email is queued once the file has been created.
+
+        :param settings: SMTPSettings
+        :return: Future of the send result, success (0) or failure (1)
+        """
+        future = Future()
+        self.metrics.queued('email')
+
+        def enqueue(attachment):
+            self._queue.put(EmailNotification(
+                settings, list(recipients), message, attachment, time.monotonic(), future))
+
+        if isinstance(attachment_file, Future):
+            def attachment_done(attachment_future):
+                try:
+                    enqueue(attachment_future.result())
+                except Exception:
+                    logger.exception("Could not create email attachment, sending without it")
+                    enqueue(None)
+            attachment_file.add_done_callback(attachment_done)
+        else:
+            enqueue(attachment_file)
+        return future
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.session.idle_timeout)]
+        except queue.Empty:
+            self.session.close()  # Don't hold an idle connection open
+            batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def combine(batch):
+        """ Group notifications without attachments that go to the same recipients """
+        emails = OrderedDict()
+        for index, each_notification in enumerate(batch):
+            if each_notification.attachment_file:
+                key = index
+            else:
+                key = (each_notification.settings, tuple(sorted(each_notification.recipients)))
+            emails.setdefault(key, []).append(each_notification)
+        return list(emails.values())
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            for each_email in self.combine(batch):
+                first = each_email[0]
+                start_times = [self.metrics.started('email', each.queued) for each in each_email]
+                status = 1
+                try:
+                    composed = compose_email(
+                        first.settings.email_from,
+                        first.recipients,
+                        '\n\n'.join(each.message for each in each_email),
+                        attachment_file=first.attachment_file)
+                    status = self.session.send(first.settings, first.recipients, composed)
+                except Exception:
+                    logger.exception("Could not send email to {}".format(first.recipients))
+                for each, start_time in zip(each_email, start_times):
+                    self.metrics.finished('email', start_time, failed=bool(status))
+                    each.future.set_result(status)
+
+
+class ActionExecutor:
+    """
+    Daemon-wide executor for slow actions, so they don't block the controller
+    that triggered them. Each category of action has its own pool of worker
+    threads, limiting how many of that category run at once.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or ACTION_EXECUTOR_WORKERS
+        self.metrics = ActionMetrics()
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._notifier = None
+
+    def _pool(self, category):
+        with self._lock:
+            if category not in self._pools:
+                self._pools[category] = ThreadPoolExecutor(
+                    max_workers=self.workers.get(category, self.workers['default']),
+                    thread_name_prefix='action_{}'.format(category))
+            return self._pools[category]
+
+    def submit(self, category, function, *args, **kwargs):
+        """ Run function(*args, **kwargs) in the pool of category, returning a Future """
+        queued_time = time.monotonic()
+        self.metrics.queued(category)
+
+        def run():
+            start_time = self.metrics.started(category, queued_time)
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                self.metrics.finished(category, start_time, failed=True)
+                logger.exception("Error executing {} action".format(category))
+                raise
+            self.metrics.finished(category, start_time)
+            return result
+
+        return self._pool(category).submit(run)
+
+    def email(self, settings, recipients, message, attachment_file=None):
+        """ Queue an email notification (see EmailNotifier.notify()) """
+        with self._lock:
+            if self._notifier is None:
+                self._notifier = EmailNotifier(self.metrics)
+                self._notifier.start()
+        return self._notifier.notify(
+            settings, recipients, message, attachment_file=attachment_file)
+
+    def status(self):
+        """ Return the metrics of each category, plus SMTP connections made """
+        status = self.metrics.snapshot()
+        if self._notifier:
+            status.setdefault('email', {})['smtp_connections'] = self._notifier.session.connections
+        return status
+
+
+action_executor = ActionExecutor()
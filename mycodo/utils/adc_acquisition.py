@@ -0,0 +1,170 @@
+# coding=utf-8
+#
+#  adc_acquisition.py - Oversampled, filtered acquisition of ADC channels
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import time
+
+from flask_babel import lazy_gettext
+
+from mycodo.utils.i2c_arbiter import i2c_arbiter
+
+
+def constraints_pass_positive_or_zero_value(mod_input, value):
+    """
+    Check if the user input is acceptable
+    :param mod_input: SQL object with user-saved Input options
+    :param value: float or int
+    :return: tuple: (bool, list of strings)
+    """
+    errors = []
+    all_passed = True
+    # Ensure value is positive or zero
+    if value < 0:
+        all_passed = False
+        errors.append("Must be a positive value or 0")
+    return all_passed, errors, mod_input
+
+
+ADC_SAMPLES_OPTION = {
+    'id': 'adc_samples',
+    'type': 'integer',
+    'default_value': 1,
+    'name': lazy_gettext('Samples'),
+    'phrase': lazy_gettext('The number of times to sample all enabled channels each measurement')
+}
+
+ADC_FILTER_OPTIONS = [
+    {
+        'id': 'adc_sample_rate',
+        'type': 'float',
+        'default_value': 0.0,
+        'constraints_pass': constraints_pass_positive_or_zero_value,
+        'name': lazy_gettext('Sample Rate (Hz)'),
+        'phrase': lazy_gettext('The rate to sample all enabled channels at (0 samples as fast as possible)')
+    },
+    {
+        'id': 'adc_filter',
+        'type': 'select',
+        'default_value': 'average',
+        'options_select': [
+            ('average', 'Moving Average'),
+            ('median', 'Moving Median'),
+            ('ema', 'Exponential Moving Average'),
+            ('last', 'None (Last Sample)')
+        ],
+        'name': lazy_gettext('Filter'),
+        'phrase': lazy_gettext('The filter applied to the samples of each channel')
+    },
+    {
+        'id': 'adc_filter_window',
+        'type': 'integer',
+        'default_value': 0,
+        'constraints_pass': constraints_pass_positive_or_zero_value,
+        'name': lazy_gettext('Filter Window (Samples)'),
+        'phrase': lazy_gettext(
+            'The number of most recent samples filtered, which may span several measurements '
+            '(0 uses the number of samples of one measurement)')
+    }
+]
+
+FILTERS = ['average', 'median', 'ema', 'last']
+
+
+class ADCAcquisition:
+    """
+    Samples all enabled channels of an ADC together, storing each sample in a
+    NumPy ring buffer of window samples by channel. Adding a sample updates the
+    running sum (moving average) and exponential moving average (alpha of
+    2 / (window + 1)) of all channels with single vector operations. The moving
+    median is calculated when the filtered values are requested.
+    """
+    def __init__(self, channels, samples=1, rate=0.0, filter_type='average', window=0):
+        import numpy
+
+        if filter_type not in FILTERS:
+            raise ValueError("Unknown filter '{}'".format(filter_type))
+        self.np = numpy
+        self.channels = list(channels)
+        self.samples = max(1, int(samples or 1))
+        self.rate = rate or 0.0
+        self.filter_type = filter_type
+        self.window = max(self.samples, int(window or 0))
+        self.alpha = 2.0 / (self.window + 1)
+
+        self.buffer = numpy.zeros((self.window, len(self.channels)))
+        self.total = numpy.zeros(len(self.channels))
+        self.ema = None
+        self.index = 0
+        self.count = 0
+
+    def add(self, values):
+        """ Add one sample of every channel """
+        sample = self.np.asarray(values, dtype=float)
+        if self.count == self.window:
+            self.total -= self.buffer[self.index]
+        else:
+            self.count += 1
+        self.buffer[self.index] = sample
+        self.index = (self.index + 1) % self.window
+        if self.index == 0:
+            # Recalculate once per window so rounding errors don't accumulate
+            self.total = self.buffer[:self.count].sum(axis=0)
+        else:
+            self.total += sample
+
+        if self.ema is None:
+            self.ema = sample.copy()
+        else:
+            self.ema += self.alpha * (sample - self.ema)
+
+    def acquire(self, read_channels):
+        """
+        Sample all channels samples times at the sample rate. The I2C bus is
+        released between samples, so other Inputs of the bus can measure
+        during a long burst.
+
+        :param read_channels: function returning a sequence of the values of all channels
+        :return: dict of channel: filtered value
+        """
+        interval = 1.0 / self.rate if self.rate else 0
+        next_sample = time.monotonic()
+        for index in range(self.samples):
+            self.add(read_channels())
+            if index < self.samples - 1:
+                with i2c_arbiter.released():
+                    if interval:
+                        next_sample += interval
+                        time.sleep(max(0.0, next_sample - time.monotonic()))
+        return self.values()
+
+    def values(self):
+        """ Return the filtered value of each channel """
+        if not self.count:
+            return {}
+        if self.filter_type == 'average':
+            filtered = self.total / self.count
+        elif self.filter_type == 'median':
+            filtered = self.np.median(self.buffer[:self.count], axis=0)
+        elif self.filter_type == 'ema':
+            filtered = self.ema
+        else:
+            filtered = self.buffer[(self.index - 1) % self.window]
+        return {channel: float(value) for channel, value in zip(self.channels, filtered)}
@@ -0,0 +1,597 @@
+# coding=utf-8
+#
+#  backfill.py - Recalculate Math and Conversion measurements from past measurements
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import json
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+import uuid
+
+import mycodo.utils.psypy as SI
+from mycodo.config import BACKFILL_CHUNK_SECONDS
+from mycodo.config import INFLUX_WRITE_BATCH_SIZE
+from mycodo.config import PATH_BACKFILL
+from mycodo.databases.models import Conversion
+from mycodo.databases.models import DeviceMeasurements
+from mycodo.databases.models import Math
+from mycodo.inputs.sensorutils import calculate_vapor_pressure_deficit
+from mycodo.utils.database import db_retrieve_table_daemon
+from mycodo.utils.expression import ExpressionError
+from mycodo.utils.expression import compile_expression
+from mycodo.utils.expression import math_equation_variables
+from mycodo.utils.influx import format_influxdb_data
+from mycodo.utils.influx import read_influxdb_page
+from mycodo.utils.influx_writer import influxdb_write_points
+from mycodo.utils.stream_stats import RunningStats
+from mycodo.utils.stream_stats import WindowStats
+from mycodo.utils.stream_stats import epoch_to_influx_time
+from mycodo.utils.stream_stats import stream_key
+from mycodo.utils.system_pi import assure_path_exists
+from mycodo.utils.system_pi import get_measurement
+from mycodo.utils.system_pi import return_measurement_info
+
+logger = logging.getLogger("mycodo.backfill")
+
+BACKFILL_MATH_TYPES = [
+    'average', 'average_single', 'difference', 'equation', 'humidity', 'redundancy',
+    'statistics', 'sum', 'sum_single', 'vapor_pressure_deficit', 'verification'
+]
+
+
+class BackfillError(Exception):
+    """ A backfill that can't be performed with the current settings """
+
+
+def asof_values(times, points, max_age=None):
+    """
+    Return, for each of times (ascending epochs), the value of the last of
+    points ((epoch, value), ascending) measured at or before the time and at
+    most max_age seconds before it, or None if there is none
+    """
+    values = []
+    index = -1
+    for each_time in times:
+        while index + 1 < len(points) and points[index + 1][0] <= each_time:
+            index += 1
+        if index >= 0 and (not max_age or each_time - points[index][0] <= max_age):
+            values.append(points[index][1])
+        else:
+            values.append(None)
+    return values
+
+
+def evaluate_column(expression, columns, length):
+    """
+    Evaluate an Expression for each row of columns (dict of variable: list of
+    values, None where missing), with NumPy arrays if NumPy is installed
+
+    :return: list of length values, None where a value is missing or invalid
+    """
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is not None:
+        arrays = {name: [numpy.nan if value is None else value for value in column]
+                  for name, column in columns.items()}
+        results = numpy.broadcast_to(expression.evaluate_array(**arrays), (length,))
+        return [float(value) if numpy.isfinite(value) else None for value in results]
+
+    results = []
+    for index in range(length):
+        row = {name: column[index] for name, column in columns.items()}
+        if None in row.values():
+            results.append(None)
+            continue
+        try:
+            value = expression(**row)
+            results.append(value if math.isfinite(value) else None)
+        except (ArithmeticError, ValueError):
+            results.append(None)
+    return results
+
+
+def read_source_points(key, start, end):
+    """ Return the (epoch, value) points of a measurement stream from start to end """
+    device_id, unit, channel, measurement = key
+    points = []
+    for each_chunk in read_influxdb_page(
+            device_id, unit, channel, epoch='ms', chunked=True, measure=measurement,
+            start_str=epoch_to_influx_time(start), end_str=epoch_to_influx_time(end)):
+        points.extend((timestamp / 1000.0, value) for timestamp, value in each_chunk
+                      if value is not None)
+    return points
+
+
+def measurement_stream(device_id, measurement_id):
+    """ Return the stream key of the measurement of a device, as stored in influxdb """
+    device_measurement = get_measurement(measurement_id)
+    if not device_measurement:
+        raise BackfillError("Measurement {} not found".format(measurement_id))
+    conversion = db_retrieve_table_daemon(
+        Conversion, unique_id=device_measurement.conversion_id)
+    channel, unit, measurement = return_measurement_info(device_measurement, conversion)
+    return stream_key(device_id, unit, channel, measurement)
+
+
+def unit_conversion(unit_from, unit_to):
+    """ Return the Expression converting unit_from to unit_to, or None if they're the same """
+    if unit_from == unit_to:
+        return
+    for each_conversion in db_retrieve_table_daemon(Conversion, entry='all'):
+        if (each_conversion.convert_unit_from == unit_from and
+                each_conversion.convert_unit_to == unit_to):
+            return compile_expression(each_conversion.equation)
+    raise BackfillError("Could not find conversion for unit {} to {}".format(
+        unit_from, unit_to))
+
+
+class MathBackfill:
+    """
+    Calculates the measurements of a Math controller every Period from
+    origin, using the value of each input measured within Max Age before
+    each time, as the controller does when it runs
+    """
+    def __init__(self, unique_id, origin):
+        math_controller = db_retrieve_table_daemon(Math, unique_id=unique_id)
+        if not math_controller:
+            raise BackfillError("Math {} not found".format(unique_id))
+        if math_controller.math_type not in BACKFILL_MATH_TYPES:
+            raise BackfillError("Math type '{}' can't be backfilled".format(
+                math_controller.math_type))
+
+        self.unique_id = unique_id
+        self.math = math_controller
+        self.math_type = math_controller.math_type
+        self.origin = origin
+        self.period = float(math_controller.period)
+        self.max_age = float(math_controller.max_measure_age or 0)
+        self.lookback = self.max_age  # Seconds of points before each chunk used
+        self.sources = []  # Stream key of each input
+        self.conversions = []  # Expression converting each input to the unit used, or None
+        self.variables = []  # Equation variable of each input
+        self.expression = None
+
+        if self.period <= 0:
+            raise BackfillError("Period must be greater than 0")
+
+        if self.math_type in ['average', 'difference', 'statistics', 'sum', 'verification',
+                              'average_single', 'sum_single']:
+            for each_set in self._id_sets(math_controller.inputs):
+                self._add_source(*each_set)
+        elif self.math_type == 'redundancy':
+            for each_set in self._id_sets(math_controller.order_of_use):
+                self._add_source(*each_set)
+        elif self.math_type == 'equation':
+            variables = math_equation_variables(
+                math_controller.equation_input, math_controller.inputs)
+            try:
+                self.expression = compile_expression(
+                    math_controller.equation, tuple(variable for variable, _ in variables))
+            except ExpressionError as err:
+                raise BackfillError(str(err))
+            for variable, id_set in variables:
+                if variable in self.expression.variables:
+                    self._add_source(*id_set.split(',')[:2])
+                    self.variables.append(variable)
+        elif self.math_type == 'humidity':
+            self._add_source(math_controller.dry_bulb_t_id, math_controller.dry_bulb_t_measure_id, 'K')
+            self._add_source(math_controller.wet_bulb_t_id, math_controller.wet_bulb_t_measure_id, 'K')
+            if math_controller.pressure_pa_id and math_controller.pressure_pa_measure_id:
+                self._add_source(
+                    math_controller.pressure_pa_id, math_controller.pressure_pa_measure_id, 'Pa')
+        elif self.math_type == 'vapor_pressure_deficit':
+            self._add_source(math_controller.unique_id_1, math_controller.unique_measurement_id_1, 'C')
+            self._add_source(math_controller.unique_id_2, math_controller.unique_measurement_id_2, 'percent')
+
+        if not self.sources and self.math_type != 'equation':
+            raise BackfillError("No Inputs selected")
+        if self.math_type == 'difference' and len(self.sources) != 2:
+            raise BackfillError("Two Inputs must be selected")
+
+        self.outputs = self._outputs()
+
+    @staticmethod
+    def _id_sets(ids_str):
+        return [each.split(',')[:2] for each in (ids_str or '').split(';') if ',' in each]
+
+    def _add_source(self, device_id, measurement_id, unit=None):
+        key = measurement_stream(device_id, measurement_id)
+        self.sources.append(key)
+        self.conversions.append(unit_conversion(key[1], unit) if unit else None)
+
+    def _outputs(self):
+        """
+        Return the measurements written, as a list of (index of the
+        calculated value, channel, unit, measurement, Expression converting
+        the value or None)
+        """
+        measurements = db_retrieve_table_daemon(DeviceMeasurements).filter(
+            DeviceMeasurements.device_id == self.unique_id).order_by(
+            DeviceMeasurements.channel).all()
+        if not measurements:
+            raise BackfillError("Math {} has no measurements".format(self.unique_id))
+
+        if self.math_type in ['humidity', 'statistics']:
+            outputs = []
+            for each_measurement in measurements:
+                if each_measurement.is_enabled:
+                    conversion = db_retrieve_table_daemon(
+                        Conversion, unique_id=each_measurement.conversion_id)
+                    channel, unit, measurement = return_measurement_info(
+                        each_measurement, conversion)
+                    outputs.append((channel, channel, unit, measurement, None))
+            return outputs
+
+        math_measurement = measurements[0]
+        conversion = db_retrieve_table_daemon(
+            Conversion, unique_id=math_measurement.conversion_id)
+        if self.math_type in ['average_single', 'sum_single']:
+            # The measurement of the input, converted with the conversion of the Math
+            _, unit, _ = return_measurement_info(math_measurement, conversion)
+            return [(0, math_measurement.channel, unit, self.sources[0][3],
+                     compile_expression(conversion.equation) if conversion else None)]
+        if self.math_type == 'average':
+            conversion = None
+        channel, unit, measurement = return_measurement_info(math_measurement, conversion)
+        return [(0, channel, unit, measurement, None)]
+
+    def times(self, start, end):
+        """ Return the times of the calculations from start to end (exclusive) """
+        first = self.origin + math.ceil(max(0.0, start - self.origin) / self.period) * self.period
+        return [first + index * self.period
+                for index in range(max(0, int(math.ceil((end - first) / self.period))))]
+
+    def points(self, start, end, series):
+        """
+        Calculate the measurements from start to end (exclusive)
+
+        :param series: the (epoch, value) points of each source from lookback
+            seconds before start to end
+        :return: list of influxdb data points
+        """
+        times = self.times(start, end)
+        if self.math_type in ['average_single', 'sum_single']:
+            results = [self._window_values(times, series[0])]
+        else:
+            columns = []
+            for each_points, each_conversion in zip(series, self.conversions):
+                column = asof_values(times, each_points, self.max_age)
+                if each_conversion:
+                    column = evaluate_column(each_conversion, {'x': column}, len(column))
+                columns.append(column)
+            results = self._calculate(times, columns)
+
+        points = []
+        for index, channel, unit, measurement, conversion in self.outputs:
+            if index >= len(results):
+                continue
+            values = results[index]
+            if conversion:
+                values = evaluate_column(conversion, {'x': values}, len(values))
+            for each_time, each_value in zip(times, values):
+                if each_value is not None:
+                    points.append(format_influxdb_data(
+                        self.unique_id, unit, each_value, channel=channel,
+                        measure=measurement, timestamp=epoch_to_influx_time(each_time)))
+        return points
+
+    def _window_values(self, times, points):
+        """ The average or sum of the points of the Max Age before each time """
+        window = WindowStats(duration=self.max_age)
+        values = []
+        index = 0
+        for each_time in times:
+            while index < len(points) and points[index][0] <= each_time:
+                window.add(points[index][1], points[index][0])
+                index += 1
+            window.expire(each_time)
+            if not len(window):
+                values.append(None)
+            elif self.math_type == 'average_single':
+                values.append(window.mean())
+            else:
+                values.append(window.sum())
+        return values
+
+    def _calculate(self, times, columns):
+        """ Return a list of values of each output, calculated from the columns of the inputs """
+        if self.math_type == 'equation':
+            return [evaluate_column(
+                self.expression, dict(zip(self.variables, columns)), len(times))]
+
+        rows = list(zip(*columns))
+        if self.math_type == 'redundancy':
+            return [[next((value for value in row if value is not None), None) for row in rows]]
+        if self.math_type == 'humidity':
+            return self._humidity(rows)
+        if self.math_type == 'vapor_pressure_deficit':
+            return [[calculate_vapor_pressure_deficit(*row) or None if None not in row else None
+                     for row in rows]]
+
+        if self.math_type == 'statistics':
+            results = [[] for _ in range(7)]
+            for row in rows:
+                for column, value in zip(results, self._statistics(row)):
+                    column.append(value)
+            return results
+
+        values = []
+        for row in rows:
+            if not row or None in row:
+                values.append(None)
+            elif self.math_type == 'average':
+                values.append(sum(row) / len(row))
+            elif self.math_type == 'sum':
+                values.append(float(sum(row)))
+            elif self.math_type == 'difference':
+                difference = row[1] - row[0] if self.math.difference_reverse_order else row[0] - row[1]
+                values.append(abs(difference) if self.math.difference_absolute else difference)
+            elif self.math_type == 'verification':
+                difference = max(row) - min(row)
+                values.append(difference if difference < self.math.max_difference else None)
+        return [values]
+
+    @staticmethod
+    def _statistics(row):
+        if not row or None in row:
+            return [None] * 7
+        stats = RunningStats(row)
+        stdev = stats.stdev()
+        return [
+            stats.mean,
+            statistics.median(row),
+            min(row),
+            max(row),
+            stdev,
+            None if stdev is None else stats.mean + stdev,
+            None if stdev is None else stats.mean - stdev
+        ]
+
+    @staticmethod
+    def _humidity(rows):
+        results = [[] for _ in range(4)]
+        for row in rows:
+            dbt_kelvin, wbt_kelvin = row[:2]
+            pressure_pa = int(row[2]) if len(row) > 2 and row[2] is not None else 101325
+            psypi = None
+            if dbt_kelvin is not None and wbt_kelvin is not None:
+                try:
+                    psypi = SI.state("DBT", dbt_kelvin, "WBT", wbt_kelvin, pressure_pa)
+                except (ArithmeticError, TypeError, ValueError):
+                    pass
+            if psypi:
+                values = [
+                    float(min(100, max(0, psypi[2] * 100))),
+                    float(psypi[4]),
+                    float(psypi[1]),
+                    float(psypi[3])
+                ]
+            else:
+                values = [None] * 4
+            for column, value in zip(results, values):
+                column.append(value)
+        return results
+
+
+class ConversionBackfill:
+    """
+    Converts the past measurements of a device stored in the unit a
+    Conversion converts from, storing them in the unit it converts to
+    """
+    def __init__(self, conversion_id, device_id, channel, measurement=None):
+        conversion = db_retrieve_table_daemon(Conversion, unique_id=conversion_id)
+        if not conversion:
+            raise BackfillError("Conversion {} not found".format(conversion_id))
+        try:
+            self.expression = compile_expression(conversion.equation)
+        except ExpressionError as err:
+            raise BackfillError(str(err))
+        self.unique_id = device_id
+        self.unit = conversion.convert_unit_to
+        self.channel = channel
+        self.measurement = measurement
+        self.lookback = 0
+        self.sources = [stream_key(device_id, conversion.convert_unit_from, channel, measurement)]
+
+    def points(self, start, end, series):
+        source_points = [(timestamp, value) for timestamp, value in series[0]
+                         if start <= timestamp < end]
+        values = evaluate_column(
+            self.expression, {'x': [value for _, value in source_points]}, len(source_points))
+        return [
+            format_influxdb_data(
+                self.unique_id, self.unit, value, channel=self.channel,
+                measure=self.measurement, timestamp=epoch_to_influx_time(timestamp))
+            for (timestamp, _), value in zip(source_points, values) if value is not None
+        ]
+
+
+def backfill_calculation(state):
+    """ Return the calculation of a backfill """
+    if state['kind'] == 'math':
+        return MathBackfill(state['unique_id'], state['start'])
+    elif state['kind'] == 'conversion':
+        return ConversionBackfill(state['unique_id'], **state['options'])
+    raise BackfillError("Unknown backfill '{}'".format(state['kind']))
+
+
+class Backfill(threading.Thread):
+    """
+    Recalculates measurements from start to end, chunk_seconds at a time:
+    the points of the sources of each chunk (and lookback seconds before it)
+    are read, then the results are calculated and written to influxdb. The
+    state is saved after each chunk, so a backfill interrupted by a restart
+    resumes after the last chunk written. Recalculated measurements replace
+    measurements stored with the same timestamps.
+    """
+    def __init__(self, state, calculation, semaphore=None, path=PATH_BACKFILL,
+                 read_points=read_source_points, write_points=influxdb_write_points,
+                 chunk_seconds=BACKFILL_CHUNK_SECONDS):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.state = state
+        self.calculation = calculation
+        self.semaphore = semaphore
+        self.path = path
+        self.read_points = read_points
+        self.write_points = write_points
+        self.chunk_seconds = chunk_seconds
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def status(self):
+        with self._lock:
+            state = dict(self.state)
+        span = state['end'] - state['start']
+        state['progress'] = round(
+            100.0 * (state['position'] - state['start']) / span if span > 0 else 100.0, 1)
+        return state
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _update(self, **values):
+        with self._lock:
+            self.state.update(values, updated=time.time())
+            state = dict(self.state)
+        if self.path:
+            assure_path_exists(self.path)
+            file_path = os.path.join(self.path, '{}.json'.format(state['id']))
+            with open(file_path + '.tmp', 'w') as state_file:
+                json.dump(state, state_file)
+            os.replace(file_path + '.tmp', file_path)
+
+    def run(self):
+        if self.semaphore:
+            self.semaphore.acquire()
+        try:
+            if self.cancelled.is_set():
+                self._update(status='cancelled')
+                return
+            self._update(status='running')
+            while self.state['position'] < self.state['end']:
+                if self.cancelled.is_set():
+                    self._update(status='cancelled')
+                    return
+                start = self.state['position']
+                end = min(self.state['end'], start + self.chunk_seconds)
+                series = [self.read_points(key, start - self.calculation.lookback, end)
+                          for key in self.calculation.sources]
+                points = self.calculation.points(start, end, series)
+                for index in range(0, len(points), INFLUX_WRITE_BATCH_SIZE):
+                    self.write_points(points[index:index + INFLUX_WRITE_BATCH_SIZE])
+                self._update(position=end, written=self.state['written'] + len(points))
+            self._update(status='finished')
+            logger.info("Backfill {} finished: {} measurements written".format(
+                self.state['id'], self.state['written']))
+        except Exception as err:
+            logger.exception("Backfill {}".format(self.state['id']))
+            self._update(status='failed', error=str(err))
+        finally:
+            if self.semaphore:
+                self.semaphore.release()
+
+
+class BackfillManager:
+    """ The backfills of the daemon, run one at a time """
+    def __init__(self, path=PATH_BACKFILL):
+        self.path = path
+        self._lock = threading.Lock()
+        self._semaphore = threading.Semaphore(1)
+        self._backfills = {}
+
+    def start(self, kind, unique_id, start, end, **options):
+        """
+        Queue a backfill of the measurements of a Math ('math') or Conversion
+        ('conversion', with the options device_id, channel and measurement)
+
+        :return: the ID of the backfill
+        """
+        start = float(start)
+        end = min(float(end), time.time())
+        if start >= end:
+            raise BackfillError("The start must be before the end (and now)")
+        state = {
+            'id': str(uuid.uuid4()),
+            'kind': kind,
+            'unique_id': unique_id,
+            'options': options,
+            'start': start,
+            'end': end,
+            'position': start,
+            'written': 0,
+            'status': 'queued',
+            'error': None,
+            'created': time.time(),
+            'updated': time.time()
+        }
+        self._start(state)
+        return state['id']
+
+    def _start(self, state):
+        backfill = Backfill(
+            state, backfill_calculation(state), semaphore=self._semaphore, path=self.path)
+        with self._lock:
+            self._backfills[state['id']] = backfill
+        backfill.start()
+
+    def resume(self):
+        """ Restart the backfills that were queued or running when the daemon stopped """
+        if not os.path.isdir(self.path):
+            return
+        for each_file in sorted(os.listdir(self.path)):
+            if not each_file.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.path, each_file)) as state_file:
+                    state = json.load(state_file)
+                if state['status'] in ['queued', 'running'] and state['id'] not in self._backfills:
+                    logger.info("Resuming backfill {} from {}".format(
+                        state['id'], epoch_to_influx_time(state['position'])))
+                    self._start(state)
+            except Exception:
+                logger.exception("Resuming backfill {}".format(each_file))
+
+    def cancel(self, backfill_id):
+        with self._lock:
+            backfill = self._backfills.get(backfill_id)
+        if not backfill:
+            raise BackfillError("Backfill {} not found".format(backfill_id))
+        backfill.cancel()
+
+    def status(self, backfill_id=None):
+        """ Return the state of a backfill, or of all backfills since the daemon started """
+        with self._lock:
+            backfills = dict(self._backfills)
+        if backfill_id:
+            if backfill_id not in backfills:
+                raise BackfillError("Backfill {} not found".format(backfill_id))
+            return backfills[backfill_id].status()
+        return [each.status() for each in backfills.values()]
+
+
+backfills = BackfillManager()
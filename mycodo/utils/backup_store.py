@@ -0,0 +1,308 @@
+# coding=utf-8
+#
+#  backup_store.py - Deduplicated backups of the Mycodo install directory
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import argparse
+import datetime
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import stat
+import sys
+import zipfile
+from contextlib import contextmanager
+
+from mycodo.config import BACKUP_CHUNK_SIZE
+from mycodo.config import BACKUP_EXCLUDE
+from mycodo.config import BACKUP_PATH
+from mycodo.config import INSTALL_DIRECTORY
+from mycodo.config import MYCODO_VERSION
+
+logger = logging.getLogger("mycodo.backup_store")
+
+BACKUP_PREFIX = 'Mycodo-backup-'
+
+# Summaries of snapshots (manifests without their entries), by path and modification time
+_summaries = {}
+
+
+class BackupError(Exception):
+    pass
+
+
+def snapshot_name(backup):
+    """ The name of a snapshot, given its name or the path of its manifest """
+    name = os.path.basename(backup.rstrip('/'))
+    return name[:-5] if name.endswith('.json') else name
+
+
+class BackupStore:
+    """
+    Backups stored as snapshots of the install directory. Each snapshot is a
+    manifest of the directories, links and files backed up, and files are
+    stored as chunks named by their SHA-256 hash, so a chunk of a file is
+    only stored once however many snapshots (or files) contain it. Files
+    that haven't changed (size and modification time) since the last
+    snapshot aren't read again.
+    """
+    def __init__(self, path=BACKUP_PATH, chunk_size=BACKUP_CHUNK_SIZE, exclude=BACKUP_EXCLUDE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.exclude = set(exclude)
+        self.objects_path = os.path.join(path, 'objects')
+        self.snapshots_path = os.path.join(path, 'snapshots')
+
+    @contextmanager
+    def _locked(self):
+        """ Don't delete chunks while a snapshot that may use them is created """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def snapshot_path(self, name):
+        return os.path.join(self.snapshots_path, '{}.json'.format(name))
+
+    def snapshot_names(self):
+        """ Names of the snapshots, oldest first """
+        if not os.path.isdir(self.snapshots_path):
+            return []
+        return sorted(filename[:-5] for filename in os.listdir(self.snapshots_path)
+                      if filename.startswith(BACKUP_PREFIX) and filename.endswith('.json'))
+
+    def summaries(self):
+        """ Name, version, creation time, size and bytes added of each snapshot, oldest first """
+        summaries = []
+        for name in self.snapshot_names():
+            path = self.snapshot_path(name)
+            key = (path, os.path.getmtime(path))
+            if key not in _summaries:
+                _summaries[key] = {field: value for field, value in self.load(name).items()
+                                   if field != 'entries'}
+            summaries.append(_summaries[key])
+        return summaries
+
+    def load(self, name):
+        try:
+            with open(self.snapshot_path(name)) as snapshot_file:
+                return json.load(snapshot_file)
+        except (OSError, ValueError) as err:
+            raise BackupError("Backup {} not found: {}".format(name, err))
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_path, digest[:2], digest[2:])
+
+    def _store_chunk(self, data):
+        """ Store a chunk unless it's already stored, returning its hash and bytes added """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as object_file:
+            object_file.write(data)
+        os.replace(path + '.tmp', path)
+        return digest, len(data)
+
+    def _scan(self, source):
+        """ (path relative to source, stat) of everything backed up, parents first """
+        for root, dirs, files in os.walk(source):
+            exclude = self.exclude if root == source else ()
+            dirs[:] = sorted(name for name in dirs if name not in exclude)
+            for name in dirs + sorted(name for name in files if name not in exclude):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, source), os.lstat(path)
+
+    def _unchanged(self, entry, st):
+        return (entry is not None and entry['type'] == 'file' and
+                entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns)
+
+    def _latest_files(self):
+        names = self.snapshot_names()
+        if not names:
+            return {}
+        return {entry['path']: entry for entry in self.load(names[-1])['entries']}
+
+    def changed_size(self, source=INSTALL_DIRECTORY):
+        """ Bytes of the files changed since the last snapshot (at most what a backup adds) """
+        previous = self._latest_files()
+        return sum(st.st_size for path, st in self._scan(source)
+                   if stat.S_ISREG(st.st_mode) and not self._unchanged(previous.get(path), st))
+
+    def create(self, source=INSTALL_DIRECTORY, version=MYCODO_VERSION, now=None):
+        """ Back up the source directory, returning the manifest of the snapshot """
+        now = now or datetime.datetime.now()
+        name = '{prefix}{dt}-{ver}'.format(
+            prefix=BACKUP_PREFIX, dt=now.strftime("%Y-%m-%d_%H-%M-%S"), ver=version)
+        with self._locked():
+            previous = self._latest_files()
+            entries = []
+            size = added = reused = 0
+            for path, st in self._scan(source):
+                entry = {'path': path, 'mode': stat.S_IMODE(st.st_mode),
+                         'uid': st.st_uid, 'gid': st.st_gid}
+                if stat.S_ISDIR(st.st_mode):
+                    entry['type'] = 'dir'
+                elif stat.S_ISLNK(st.st_mode):
+                    entry.update(type='link', target=os.readlink(os.path.join(source, path)))
+                elif stat.S_ISREG(st.st_mode):
+                    entry.update(type='file', size=st.st_size, mtime_ns=st.st_mtime_ns)
+                    if self._unchanged(previous.get(path), st):
+                        entry['chunks'] = previous[path]['chunks']
+                        reused += 1
+                    else:
+                        entry['chunks'] = []
+                        with open(os.path.join(source, path), 'rb') as each_file:
+                            while True:
+                                data = each_file.read(self.chunk_size)
+                                if not data:
+                                    break
+                                digest, chunk_added = self._store_chunk(data)
+                                entry['chunks'].append(digest)
+                                added += chunk_added
+                    size += st.st_size
+                else:
+                    continue  # Sockets, fifos, devices
+                entries.append(entry)
+
+            manifest = {
+                'name': name, 'version': version, 'created': now.timestamp(),
+                'source': source, 'size': size, 'added': added, 'entries': entries
+            }
+            os.makedirs(self.snapshots_path, exist_ok=True)
+            path = self.snapshot_path(name)
+            with open(path + '.tmp', 'w') as snapshot_file:
+                json.dump(manifest, snapshot_file)
+            os.replace(path + '.tmp', path)
+        logger.info("Created backup {}: {} files ({} unchanged), {:.1f} MB, {:.1f} MB added".format(
+            name, sum(1 for entry in entries if entry['type'] == 'file'), reused,
+            size / 1000000.0, added / 1000000.0))
+        return manifest
+
+    def read_chunks(self, entry):
+        """ Generate the bytes of a backed up file, verifying each chunk """
+        for digest in entry['chunks']:
+            try:
+                with open(self._object_path(digest), 'rb') as object_file:
+                    data = object_file.read()
+            except OSError:
+                raise BackupError("Missing chunk {} of {}".format(digest, entry['path']))
+            if hashlib.sha256(data).hexdigest() != digest:
+                raise BackupError("Corrupt chunk {} of {}".format(digest, entry['path']))
+            yield data
+
+    def restore(self, name, destination):
+        """ Restore a snapshot to a new directory, a chunk at a time """
+        manifest = self.load(name)
+        if os.path.exists(destination):
+            raise BackupError("Restore destination exists: {}".format(destination))
+        os.makedirs(destination)
+        chown = os.geteuid() == 0
+        dirs = []
+        for entry in manifest['entries']:
+            path = os.path.join(destination, entry['path'])
+            if entry['type'] == 'dir':
+                os.makedirs(path, exist_ok=True)
+                dirs.append((path, entry))
+            elif entry['type'] == 'link':
+                os.symlink(entry['target'], path)
+                if chown:
+                    os.lchown(path, entry['uid'], entry['gid'])
+            else:
+                with open(path, 'wb') as each_file:
+                    for data in self.read_chunks(entry):
+                        each_file.write(data)
+                os.chmod(path, entry['mode'])
+                os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+                if chown:
+                    os.chown(path, entry['uid'], entry['gid'])
+        # Directory permissions last, in case they don't allow writing
+        for path, entry in dirs:
+            os.chmod(path, entry['mode'])
+            if chown:
+                os.chown(path, entry['uid'], entry['gid'])
+        logger.info("Restored backup {} to {}".format(name, destination))
+
+    def archive_entries(self, name):
+        """ (ZipInfo, bytes) of each file of a snapshot, for zip_stream_entries() """
+        for entry in self.load(name)['entries']:
+            if entry['type'] != 'file':
+                continue
+            date_time = datetime.datetime.fromtimestamp(entry['mtime_ns'] / 1e9).timetuple()[:6]
+            info = zipfile.ZipInfo(entry['path'], max(date_time, (1980, 1, 1, 0, 0, 0)))
+            info.external_attr = (stat.S_IFREG | entry['mode']) << 16
+            yield info, self.read_chunks(entry)
+
+    def delete(self, name):
+        """ Delete a snapshot and the chunks no other snapshot contains """
+        with self._locked():
+            os.remove(self.snapshot_path(name))
+            freed = self._collect_garbage()
+        logger.info("Deleted backup {}: {:.1f} MB freed".format(name, freed / 1000000.0))
+        return freed
+
+    def _collect_garbage(self):
+        referenced = set()
+        for name in self.snapshot_names():
+            for entry in self.load(name)['entries']:
+                referenced.update(entry.get('chunks', ()))
+        freed = 0
+        for root, _, files in os.walk(self.objects_path):
+            for filename in files:
+                if os.path.basename(root) + filename not in referenced:
+                    path = os.path.join(root, filename)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        return freed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Deduplicated Mycodo backups.')
+    subparsers = parser.add_subparsers(dest='command')
+    parser_create = subparsers.add_parser('create', help='Back up the Mycodo install directory')
+    parser_create.add_argument('version', nargs='?', default=MYCODO_VERSION,
+                               help='The Mycodo version of the backup')
+    parser_restore = subparsers.add_parser('restore', help='Restore a backup to a new directory')
+    parser_restore.add_argument('backup', help='The backup name or path of its manifest')
+    parser_restore.add_argument('destination', help='The directory to create')
+    parser_delete = subparsers.add_parser('delete', help='Delete a backup')
+    parser_delete.add_argument('backup', help='The backup name or path of its manifest')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    store = BackupStore()
+    try:
+        if args.command == 'create':
+            store.create(version=args.version)
+        elif args.command == 'restore':
+            store.restore(snapshot_name(args.backup), args.destination)
+        elif args.command == 'delete':
+            store.delete(snapshot_name(args.backup))
+        else:
+            parser.print_help()
+    except BackupError as err:
+        logger.error(err)
+        sys.exit(1)
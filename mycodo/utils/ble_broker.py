@@ -0,0 +1,301 @@
+# coding=utf-8
+#
+#  ble_broker.py - Shared Bluetooth LE scanning and connections of each adapter
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from mycodo.config import BLE_GATT_ABORT_WAIT
+from mycodo.config import BLE_GATT_TIMEOUT
+from mycodo.config import BLE_SCAN_WINDOW
+from mycodo.utils.metrics import ActionMetrics
+
+logger = logging.getLogger("mycodo.ble_broker")
+
+GATTJob = namedtuple(
+    'GATTJob', ['mac', 'function', 'args', 'kwargs', 'timeout', 'abort', 'queued', 'future'])
+
+
+class BluepyScanner:
+    """
+    Passive bluepy scanner, calling callback(mac, data, rssi) for each
+    advertisement, where data is a dict of AD type: value (hex string)
+    """
+    def __init__(self, adapter, callback):
+        from bluepy import btle
+
+        class ScanDelegate(btle.DefaultDelegate):
+            def handleDiscovery(self, dev, is_new_dev, is_new_data):
+                callback(dev.addr, {
+                    ad_type: value for ad_type, _, value in dev.getScanData()
+                }, dev.rssi)
+
+        self.scanner = btle.Scanner(int(adapter)).withDelegate(ScanDelegate())
+
+    def start(self):
+        self.scanner.clear()
+        self.scanner.start(passive=True)
+
+    def process(self, timeout):
+        self.scanner.process(timeout)
+
+    def stop(self):
+        self.scanner.stop()
+
+
+class BLEBroker(threading.Thread):
+    """
+    Owns one Bluetooth adapter. While any Input is subscribed to
+    advertisements, the adapter continuously scans and the latest decoded
+    advertisement of each subscribed device is cached. Inputs that must
+    connect to their device queue the connection, which is made between
+    scan windows, one connection at a time.
+
+    :param scanner_factory: function(adapter, callback) returning an object with
+        start(), process(timeout) and stop() (default: BluepyScanner)
+    """
+    def __init__(self, adapter, scanner_factory=BluepyScanner, scan_window=BLE_SCAN_WINDOW):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.adapter = str(adapter)
+        self.scanner_factory = scanner_factory
+        self.scan_window = scan_window
+        self.running = True
+        self.metrics = ActionMetrics()
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._scanner = None
+        self._subscribers = {}
+        self._latest = {}
+        self._advertisements = {}
+
+    def subscribe(self, mac, decoder):
+        """
+        Cache the advertisements of a device
+
+        :param decoder: function(data) returning the decoded payload of the
+            advertisement data (dict of AD type: hex string), or None if the
+            advertisement doesn't contain a payload
+        """
+        mac = mac.lower()
+        with self._lock:
+            if mac in self._subscribers:
+                self._subscribers[mac][1] += 1
+            else:
+                self._subscribers[mac] = [decoder, 1]
+
+    def unsubscribe(self, mac):
+        mac = mac.lower()
+        with self._lock:
+            if mac not in self._subscribers:
+                return
+            self._subscribers[mac][1] -= 1
+            if not self._subscribers[mac][1]:
+                del self._subscribers[mac]
+                self._latest.pop(mac, None)
+
+    def latest(self, mac, max_age=None):
+        """ Return the latest decoded payload of a device, if no older than max_age seconds """
+        with self._lock:
+            latest = self._latest.get(mac.lower())
+        if latest and (max_age is None or time.time() - latest[0] <= max_age):
+            return latest[1]
+
+    def advertisement(self, mac, data, rssi=None):
+        """ Decode an advertisement, if from a subscribed device """
+        mac = mac.lower()
+        with self._lock:
+            subscriber = self._subscribers.get(mac)
+        if not subscriber:
+            return
+        try:
+            payload = subscriber[0](data)
+        except Exception as err:
+            logger.debug("Could not decode advertisement from {}: {}".format(mac, err))
+            return
+        if payload is None:
+            return
+
+        now = time.time()
+        with self._lock:
+            previous = self._latest.get(mac)
+            self._latest[mac] = (now, payload)
+            metrics = self._advertisements.setdefault(mac, {
+                'advertisements': 0,
+                'interval_sec_total': 0.0,
+                'interval_sec_max': 0.0,
+                'last_seen': None,
+                'rssi': None
+            })
+            metrics['advertisements'] += 1
+            if previous:
+                interval = now - previous[0]
+                metrics['interval_sec_total'] += interval
+                metrics['interval_sec_max'] = max(metrics['interval_sec_max'], interval)
+            metrics['last_seen'] = now
+            metrics['rssi'] = rssi
+
+    def gatt(self, mac, function, *args, timeout=BLE_GATT_TIMEOUT, abort=None, **kwargs):
+        """
+        Queue function(*args, **kwargs), which connects to a device, to run
+        while the adapter isn't scanning or connected to another device.
+        Cancelling the returned Future before it starts skips the connection.
+
+        A function still running after timeout seconds fails with TimeoutError
+        and its return value is discarded. abort() is then called (e.g. to
+        disconnect from the device) so the adapter is free for the next
+        connection, as a running function can't be stopped.
+
+        :return: Future of the function's return value
+        """
+        mac = mac.lower()
+        future = Future()
+        self.metrics.queued(mac)
+        self._jobs.put(GATTJob(mac, function, args, kwargs, timeout, abort, time.monotonic(), future))
+        return future
+
+    def status(self):
+        """ Return the advertisement and connection metrics of each device """
+        with self._lock:
+            return {
+                'scanning': self._scanner is not None,
+                'subscribed': sorted(self._subscribers),
+                'advertisements': {
+                    mac: dict(metrics) for mac, metrics in self._advertisements.items()},
+                'connections': self.metrics.snapshot()
+            }
+
+    def stop(self):
+        self.running = False
+
+    def _connect(self, job):
+        start_time = self.metrics.started(job.mac, job.queued)
+        if not job.future.set_running_or_notify_cancel():
+            self.metrics.finished(job.mac, start_time, failed=True)
+            return
+        outcome = {}
+
+        def run():
+            try:
+                outcome['result'] = job.function(*job.args, **job.kwargs)
+            except Exception as err:
+                outcome['error'] = err
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        worker.join(job.timeout)
+        if worker.is_alive():
+            self.metrics.finished(job.mac, start_time, failed=True)
+            job.future.set_exception(TimeoutError(
+                "Connection to {} took longer than {} seconds".format(job.mac, job.timeout)))
+            self._abort(job, worker)
+        elif 'error' in outcome:
+            self.metrics.finished(job.mac, start_time, failed=True)
+            job.future.set_exception(outcome['error'])
+        else:
+            self.metrics.finished(job.mac, start_time)
+            job.future.set_result(outcome['result'])
+
+    def _abort(self, job, worker):
+        """ Abort a connection that took too long, waiting for it to end before the next """
+        logger.error("Aborting connection to {} with adapter hci{}: took longer than {} seconds".format(
+            job.mac, self.adapter, job.timeout))
+        if job.abort:
+            try:
+                job.abort()
+            except Exception:
+                logger.exception("Aborting connection to {}".format(job.mac))
+        worker.join(BLE_GATT_ABORT_WAIT)
+        if worker.is_alive():
+            logger.error("Connection to {} didn't end after being aborted".format(job.mac))
+
+    def _scan(self):
+        try:
+            if self._scanner is None:
+                scanner = self.scanner_factory(self.adapter, self.advertisement)
+                scanner.start()
+                with self._lock:
+                    self._scanner = scanner
+            self._scanner.process(self.scan_window)
+        except Exception:
+            logger.exception("Scanning with adapter hci{}".format(self.adapter))
+            self._stop_scanner()
+            time.sleep(self.scan_window)
+
+    def _stop_scanner(self):
+        with self._lock:
+            scanner, self._scanner = self._scanner, None
+        if scanner is not None:
+            try:
+                scanner.stop()
+            except Exception:
+                logger.debug("Could not stop scanner of adapter hci{}".format(self.adapter))
+
+    def run(self):
+        while self.running:
+            jobs = []
+            while True:
+                try:
+                    jobs.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            if jobs:
+                self._stop_scanner()  # The adapter can't scan while connected
+                for each_job in jobs:
+                    self._connect(each_job)
+
+            if self._subscribers:
+                self._scan()
+            else:
+                self._stop_scanner()
+                try:
+                    self._connect(self._jobs.get(timeout=self.scan_window))
+                except queue.Empty:
+                    pass
+        self._stop_scanner()
+
+
+class BLEBrokers:
+    """ The broker of each Bluetooth adapter, started when first used """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._brokers = {}
+
+    def get(self, adapter):
+        adapter = str(adapter)
+        with self._lock:
+            if adapter not in self._brokers or not self._brokers[adapter].is_alive():
+                self._brokers[adapter] = BLEBroker(adapter)
+                self._brokers[adapter].start()
+            return self._brokers[adapter]
+
+    def status(self):
+        """ Return the status of each adapter's broker """
+        with self._lock:
+            brokers = dict(self._brokers)
+        return {'hci{}'.format(adapter): broker.status() for adapter, broker in brokers.items()}
+
+
+ble_brokers = BLEBrokers()
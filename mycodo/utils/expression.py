@@ -0,0 +1,351 @@
+# coding=utf-8
+#
+#  expression.py - Parse, validate and compile the equations of Math and Conversions
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import ast
+import copy
+import functools
+import keyword
+import math
+
+MAX_EXPRESSION_LENGTH = 1000
+
+# name: (function, minimum arguments, maximum arguments (None for any))
+FUNCTIONS = {
+    'abs': (abs, 1, 1),
+    'acos': (math.acos, 1, 1),
+    'asin': (math.asin, 1, 1),
+    'atan': (math.atan, 1, 1),
+    'atan2': (math.atan2, 2, 2),
+    'ceil': (math.ceil, 1, 1),
+    'cos': (math.cos, 1, 1),
+    'cosh': (math.cosh, 1, 1),
+    'degrees': (math.degrees, 1, 1),
+    'exp': (math.exp, 1, 1),
+    'floor': (math.floor, 1, 1),
+    'hypot': (math.hypot, 2, 2),
+    'log': (math.log, 1, 2),
+    'log10': (math.log10, 1, 1),
+    'log2': (math.log2, 1, 1),
+    'max': (max, 2, None),
+    'min': (min, 2, None),
+    'pow': (math.pow, 2, 2),
+    'radians': (math.radians, 1, 1),
+    'round': (lambda value, digits=0: round(value, int(digits)), 1, 2),
+    'sin': (math.sin, 1, 1),
+    'sinh': (math.sinh, 1, 1),
+    'sqrt': (math.sqrt, 1, 1),
+    'tan': (math.tan, 1, 1),
+    'tanh': (math.tanh, 1, 1)
+}
+
+CONSTANTS = {
+    'e': math.e,
+    'pi': math.pi
+}
+
+OPERATORS = (
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub, ast.Not)
+
+COMPARISONS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+# Characters commonly pasted into equations
+REPLACEMENTS = {
+    '−': '-',  # Minus sign
+    '×': '*',  # Multiplication sign
+    '÷': '/'   # Division sign
+}
+
+
+class ExpressionError(ValueError):
+    """ An expression that can't be parsed or isn't allowed """
+
+
+def _array_functions():
+    """ The functions of FUNCTIONS, operating on NumPy arrays """
+    import numpy
+
+    def log(value, base=None):
+        return numpy.log(value) if base is None else numpy.log(value) / numpy.log(base)
+
+    return {
+        'abs': numpy.absolute,
+        'acos': numpy.arccos,
+        'asin': numpy.arcsin,
+        'atan': numpy.arctan,
+        'atan2': numpy.arctan2,
+        'ceil': numpy.ceil,
+        'cos': numpy.cos,
+        'cosh': numpy.cosh,
+        'degrees': numpy.degrees,
+        'exp': numpy.exp,
+        'floor': numpy.floor,
+        'hypot': numpy.hypot,
+        'log': log,
+        'log10': numpy.log10,
+        'log2': numpy.log2,
+        'max': lambda *values: functools.reduce(numpy.maximum, values),
+        'min': lambda *values: functools.reduce(numpy.minimum, values),
+        'pow': numpy.power,
+        'radians': numpy.radians,
+        'round': lambda value, digits=0: numpy.round(value, int(digits)),
+        'sin': numpy.sin,
+        'sinh': numpy.sinh,
+        'sqrt': numpy.sqrt,
+        'tan': numpy.tan,
+        'tanh': numpy.tanh,
+        '_where': numpy.where
+    }
+
+
+def _where(test, body, orelse):
+    return ast.Call(func=ast.Name(id='_where', ctx=ast.Load()),
+                    args=[test, body, orelse], keywords=[])
+
+
+class _ArrayTransformer(ast.NodeTransformer):
+    """
+    Rewrite the conditions of an expression (and, or, not, chained comparisons
+    and conditional expressions) to numpy.where() calls, which evaluate them
+    for each element of arrays with the same results as for single values
+    """
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return _where(node.test, node.body, node.orelse)
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        result = node.values[-1]
+        for each_value in reversed(node.values[:-1]):
+            if isinstance(node.op, ast.And):
+                result = _where(each_value, result, copy.deepcopy(each_value))
+            else:
+                result = _where(each_value, copy.deepcopy(each_value), result)
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return _where(node.operand, ast.Constant(value=0.0), ast.Constant(value=1.0))
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        operands = [node.left] + node.comparators
+        comparisons = [
+            ast.Compare(left=copy.deepcopy(operands[index]), ops=[operator],
+                        comparators=[copy.deepcopy(operands[index + 1])])
+            for index, operator in enumerate(node.ops)]
+        if len(comparisons) == 1:
+            return comparisons[0]
+        return self.visit_BoolOp(ast.BoolOp(op=ast.And(), values=comparisons))
+
+
+class Expression:
+    """
+    An arithmetic expression of numbers, variables, the constants of
+    CONSTANTS and the functions of FUNCTIONS, with comparisons, and, or, not
+    and conditional expressions, such as 'x*(9/5)+32', 'max(x1, x2) -
+    min(x1, x2)' or 'x if x > 0 else 0'. The expression is parsed and
+    validated once (anything else, such as attributes, subscripts or other
+    names, raises ExpressionError), then compiled to a function of the
+    variables it uses. Numbers are evaluated as floats, so powers of large
+    numbers overflow rather than calculating huge integers.
+
+    :param text: the expression
+    :param variables: the names of the variables the expression may use
+    """
+    def __init__(self, text, variables=('x',)):
+        self.text = text
+        self.variables = ()  # The variables used, in the order of the variables parameter
+
+        for each_variable in variables:
+            if (not each_variable.isidentifier() or keyword.iskeyword(each_variable) or
+                    each_variable.startswith('_') or
+                    each_variable in FUNCTIONS or each_variable in CONSTANTS):
+                raise ValueError("Invalid variable name '{}'".format(each_variable))
+
+        if not text or not text.strip():
+            raise ExpressionError("The equation is empty")
+        if len(text) > MAX_EXPRESSION_LENGTH:
+            raise ExpressionError("The equation is longer than {} characters".format(
+                MAX_EXPRESSION_LENGTH))
+        for character, replacement in REPLACEMENTS.items():
+            text = text.replace(character, replacement)
+
+        try:
+            tree = ast.parse(text.strip(), mode='eval')
+        except SyntaxError as err:
+            raise ExpressionError("Invalid equation: {}".format(err.msg))
+        except (ValueError, RecursionError, MemoryError):
+            raise ExpressionError("Invalid equation")
+
+        used = set()
+        try:
+            self._validate(tree.body, variables, used)
+        except RecursionError:
+            raise ExpressionError("The equation is nested too deeply")
+        self.variables = tuple(each for each in variables if each in used)
+
+        self._body = tree.body
+        self._function = eval(self._compile(self._body), self._namespace(
+            {name: function for name, (function, _, _) in FUNCTIONS.items()}))
+        self._array_function = None
+
+    def _compile(self, body):
+        """
+        Compile a function of the variables used. Other keyword arguments are
+        ignored, so callers may pass all values they have.
+        """
+        function_tree = ast.parse('lambda {}: 0'.format(
+            ', '.join(self.variables + ('**__unused',))), mode='eval')
+        function_tree.body.body = body
+        return compile(ast.fix_missing_locations(function_tree), '<equation>', 'eval')
+
+    def _validate(self, node, variables, used):
+        if isinstance(node, ast.BinOp):
+            if not isinstance(node.op, OPERATORS):
+                if isinstance(node.op, ast.BitXor):
+                    raise ExpressionError("Use ** rather than ^ for powers")
+                raise ExpressionError("Unsupported operator")
+            self._validate(node.left, variables, used)
+            self._validate(node.right, variables, used)
+
+        elif isinstance(node, ast.UnaryOp):
+            if not isinstance(node.op, OPERATORS):
+                raise ExpressionError("Unsupported operator")
+            self._validate(node.operand, variables, used)
+
+        elif isinstance(node, ast.Compare):
+            if not all(isinstance(each, COMPARISONS) for each in node.ops):
+                raise ExpressionError("Unsupported comparison")
+            for each_operand in [node.left] + node.comparators:
+                self._validate(each_operand, variables, used)
+
+        elif isinstance(node, ast.BoolOp):
+            for each_value in node.values:
+                self._validate(each_value, variables, used)
+
+        elif isinstance(node, ast.IfExp):
+            for each_node in (node.test, node.body, node.orelse):
+                self._validate(each_node, variables, used)
+
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+                raise ExpressionError("Unknown function{}".format(
+                    " '{}'".format(node.func.id) if isinstance(node.func, ast.Name) else ''))
+            if node.keywords or any(isinstance(each, ast.Starred) for each in node.args):
+                raise ExpressionError("Function arguments must be values")
+            _, minimum, maximum = FUNCTIONS[node.func.id]
+            if len(node.args) < minimum or (maximum is not None and len(node.args) > maximum):
+                raise ExpressionError("Wrong number of arguments for '{}'".format(node.func.id))
+            for each_arg in node.args:
+                self._validate(each_arg, variables, used)
+
+        elif isinstance(node, ast.Name):
+            if node.id in variables:
+                used.add(node.id)
+            elif node.id in FUNCTIONS:
+                raise ExpressionError("Function '{}' must be called".format(node.id))
+            elif node.id not in CONSTANTS:
+                raise ExpressionError("Unknown name '{}' (variables: {})".format(
+                    node.id, ', '.join(variables) or 'none'))
+
+        elif type(node).__name__ in ('Constant', 'Num'):
+            value = node.value if hasattr(node, 'value') else node.n
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ExpressionError("Only numbers are allowed")
+            if hasattr(node, 'value'):
+                node.value = float(value)
+            else:
+                node.n = float(value)
+
+        else:
+            raise ExpressionError("Unsupported syntax: {}".format(type(node).__name__))
+
+    @staticmethod
+    def _namespace(functions):
+        namespace = {'__builtins__': {}}
+        namespace.update(functions)
+        namespace.update(CONSTANTS)
+        return namespace
+
+    def __call__(self, *args, **values):
+        """ Evaluate with the values of the variables, by position or name """
+        return float(self._function(*args, **values))
+
+    def evaluate_array(self, *args, **arrays):
+        """
+        Evaluate with sequences of values of the variables (of equal length),
+        returning a NumPy array. Invalid results are NaN or infinite rather
+        than raising exceptions.
+        """
+        import numpy
+
+        if self._array_function is None:
+            body = _ArrayTransformer().visit(copy.deepcopy(self._body))
+            self._array_function = eval(self._compile(body), self._namespace(_array_functions()))
+        args = [numpy.asarray(each, dtype=float) for each in args]
+        arrays = {name: numpy.asarray(each, dtype=float) for name, each in arrays.items()}
+        with numpy.errstate(all='ignore'):
+            return numpy.asarray(self._array_function(*args, **arrays), dtype=float)
+
+    def __repr__(self):
+        return 'Expression({!r}, variables={!r})'.format(self.text, self.variables)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_expression(text, variables=('x',)):
+    """ Return the (cached) Expression of text, raising ExpressionError if invalid """
+    return Expression(text, tuple(variables))
+
+
+def expression_errors(text, variables=('x',), required=()):
+    """
+    Check an expression before saving it
+
+    :param required: variables the expression must use
+    :return: list of error strings
+    """
+    try:
+        expression = compile_expression(text, tuple(variables))
+    except ExpressionError as err:
+        return ["Equation '{}': {}".format(text, err)]
+    return ["'{}' must appear in the equation".format(each)
+            for each in required if each not in expression.variables]
+
+
+def math_equation_variables(equation_input, inputs):
+    """
+    Return the variables of an Equation Math: 'x' for its Input, and
+    'x1', 'x2', ... for each of its Inputs, if any
+
+    :param equation_input: 'device_id,measurement_id' or '' if not selected
+    :param inputs: 'device_id,measurement_id;...' or '' if none selected
+    :return: list of (variable, 'device_id,measurement_id')
+    """
+    variables = []
+    if equation_input and ',' in equation_input:
+        variables.append(('x', equation_input))
+    for index, each_set in enumerate(each for each in (inputs or '').split(';') if ',' in each):
+        variables.append(('x{}'.format(index + 1), each_set))
+    return variables
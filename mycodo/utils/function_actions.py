@@ -29,10 +29,14 @@ from mycodo.databases.models import Trigger
 from mycodo.databases.utils import session_scope
 from mycodo.devices.camera import camera_record
 from mycodo.mycodo_client import DaemonControl
+from mycodo.utils.action_executor import action_executor
 from mycodo.utils.database import db_retrieve_table_daemon
+from mycodo.utils.influx import read_influxdb_list
 from mycodo.utils.influx import read_last_influxdb
 from mycodo.utils.influx import read_past_influxdb
-from mycodo.utils.send_data import send_email
+from mycodo.utils.send_data import SMTPSettings
+from mycodo.utils.stream_stats import epoch_to_influx_time
+from mycodo.utils.stream_stats import measurement_streams
 from mycodo.utils.system_pi import cmd_output
 from mycodo.utils.system_pi import return_measurement_info
 
@@ -67,6 +71,28 @@ def check_allowed_to_email():
     return smtp_wait_timer, allowed_to_send_notice
 
 
+def notify_email(recipients, message, attachment_file=None):
+    """
+    Queue an email to be sent by the action executor
+
+    :param recipients: list of email addresses
+    :param message: body of the email
+    :param attachment_file: path (or Future of the path) of a file to attach
+    """
+    smtp = db_retrieve_table_daemon(SMTP, entry='first')
+    settings = SMTPSettings(smtp.host, smtp.protocol, smtp.port,
+                            smtp.user, smtp.passw, smtp.email_from)
+    return action_executor.email(
+        settings, recipients, message, attachment_file=attachment_file)
+
+
+def camera_capture(record_type, unique_id, duration_sec=None):
+    """ Capture a photo or video and return the path to the file """
+    attachment_path_file = camera_record(
+        record_type, unique_id, duration_sec=duration_sec)
+    return os.path.join(attachment_path_file[0], attachment_path_file[1])
+
+
 def get_condition_value(condition_id):
     """
     Returns condition measurements for Conditional controllers
@@ -108,20 +134,16 @@ def get_condition_value(condition_id):
         if sql_condition.condition_type == 'measurement':
             return_measurement = get_last_measurement(
                 device_id, unit, measurement, channel, max_age)
-        elif sql_condition.condition_type == 'measurement_past_average':
-            measurement_list = []
-            measurements_str = get_past_measurements(
-                device_id, unit, measurement, channel, max_age)
-            for each_set in measurements_str.split(';'):
-                measurement_list.append(float(each_set.split(',')[1]))
-            return_measurement = sum(measurement_list) / len(measurement_list)
-        elif sql_condition.condition_type == 'measurement_past_sum':
-            measurement_list = []
-            measurements_str = get_past_measurements(
+        elif sql_condition.condition_type in ['measurement_past_average',
+                                              'measurement_past_sum']:
+            summary = get_past_statistics(
                 device_id, unit, measurement, channel, max_age)
-            for each_set in measurements_str.split(';'):
-                measurement_list.append(float(each_set.split(',')[1]))
-            return_measurement = sum(measurement_list)
+            if not summary['count']:
+                return
+            if sql_condition.condition_type == 'measurement_past_average':
+                return_measurement = summary['mean']
+            else:
+                return_measurement = summary['sum']
         else:
             return
 
@@ -202,6 +224,27 @@ def get_condition_value_dict(condition_id):
         return past_measurements
 
 
+def get_past_statistics(unique_id, unit, measurement, channel, duration_sec):
+    """
+    Retrieve the statistics of the past input measurements from a window kept
+    up to date as measurements are stored (see measurement_streams)
+
+    :return: count, sum, mean, median, minimum, maximum and stdev of the measurements
+    :rtype: dict
+    """
+    def fetch(since):
+        past_measurements = read_influxdb_list(
+            unique_id, unit, channel,
+            measure=measurement, duration_sec=duration_sec, epoch='ms',
+            start_str=epoch_to_influx_time(since) if since is not None else None)
+        if not isinstance(past_measurements, list):
+            return []
+        return [(each_set[0] / 1000.0, each_set[1]) for each_set in past_measurements]
+
+    return measurement_streams.query(
+        unique_id, unit, channel, measurement, duration_sec, fetch=fetch)
+
+
 def get_last_measurement(unique_id, unit, measurement, channel, duration_sec):
     """
     Retrieve the latest input measurement
@@ -423,49 +466,16 @@ def action_output_ramp_pwm(cond_action, message):
     else:
         increment = float(cond_action.do_action_string)
 
-    change_in_duty_cycle = abs(cond_action.do_output_pwm - cond_action.do_output_pwm2)
-    steps = change_in_duty_cycle * 1 / increment
-    seconds_per_step = cond_action.do_output_duration / steps
-
-    start_duty_cycle = cond_action.do_output_pwm
-    end_duty_cycle = cond_action.do_output_pwm2
-    current_duty_cycle = start_duty_cycle
-
-    output_on = threading.Thread(
-        target=control.output_on,
-        args=(output_id,),
-        kwargs={'output_type': 'pwm',
-                'amount': start_duty_cycle,
-                'output_channel': output_channel.channel})
-    output_on.start()
-
-    loop_running = True
-    timer = time.time() + seconds_per_step
-    while True:
-        if timer < time.time():
-            while timer < time.time():
-                timer += seconds_per_step
-                if start_duty_cycle < end_duty_cycle:
-                    current_duty_cycle += increment
-                    if current_duty_cycle > end_duty_cycle:
-                        current_duty_cycle = end_duty_cycle
-                        loop_running = False
-                else:
-                    current_duty_cycle -= increment
-                    if current_duty_cycle < end_duty_cycle:
-                        current_duty_cycle = end_duty_cycle
-                        loop_running = False
-
-            output_on = threading.Thread(
-                target=control.output_on,
-                args=(output_id,),
-                kwargs={'output_type': 'pwm',
-                        'amount': current_duty_cycle,
-                        'output_channel': output_channel.channel})
-            output_on.start()
-
-            if not loop_running:
-                break
+    # The output controller steps the duty cycle until the ramp completes
+    output_ramp = threading.Thread(
+        target=control.output_ramp,
+        args=(output_id,
+              output_channel.channel,
+              cond_action.do_output_pwm,
+              cond_action.do_output_pwm2,
+              cond_action.do_output_duration,),
+        kwargs={'increment': increment})
+    output_ramp.start()
     return message
 
 
@@ -599,10 +609,9 @@ def action_photo(cond_action, message):
         unique_id=cond_action.do_unique_id,
         id=this_camera.id,
         name=this_camera.name)
-    camera_still = db_retrieve_table_daemon(
-        Camera, unique_id=cond_action.do_unique_id)
-    attachment_path_file = camera_record('photo', camera_still.unique_id)
-    attachment_file = os.path.join(attachment_path_file[0], attachment_path_file[1])
+    # Captured by the action executor, attachment_file is a Future of the path
+    attachment_file = action_executor.submit(
+        'camera', camera_capture, 'photo', this_camera.unique_id)
     return message, attachment_file
 
 
@@ -613,12 +622,10 @@ def action_video(cond_action, message):
         unique_id=cond_action.do_unique_id,
         id=this_camera.id,
         name=this_camera.name)
-    camera_stream = db_retrieve_table_daemon(
-        Camera, unique_id=cond_action.do_unique_id)
-    attachment_path_file = camera_record(
-        'video', camera_stream.unique_id,
+    # Captured by the action executor, attachment_file is a Future of the path
+    attachment_file = action_executor.submit(
+        'camera', camera_capture, 'video', this_camera.unique_id,
         duration_sec=cond_action.do_camera_duration)
-    attachment_file = os.path.join(attachment_path_file[0], attachment_path_file[1])
     return message, attachment_file
 
 
@@ -644,11 +651,8 @@ def action_email(logger_actions,
         # If the emails per hour limit has not been exceeded
         smtp_wait_timer, allowed_to_send_notice = check_allowed_to_email()
         if allowed_to_send_notice and cond_action.do_action_string:
-            smtp = db_retrieve_table_daemon(SMTP, entry='first')
-            send_email(smtp.host, smtp.protocol, smtp.port,
-                       smtp.user, smtp.passw, smtp.email_from,
-                       [cond_action.do_action_string], message,
-                       attachment_file, attachment_type)
+            notify_email([cond_action.do_action_string], message,
+                         attachment_file=attachment_file)
         else:
             logger_actions.error(
                 "Wait {sec:.0f} seconds to email again.".format(
@@ -675,11 +679,8 @@ def action_email(logger_actions,
             # If the emails per hour limit has not been exceeded
             smtp_wait_timer, allowed_to_send_notice = check_allowed_to_email()
             if allowed_to_send_notice and cond_action.do_action_string:
-                smtp = db_retrieve_table_daemon(SMTP, entry='first')
-                send_email(smtp.host, smtp.protocol, smtp.port,
-                           smtp.user, smtp.passw, smtp.email_from,
-                           cond_action.do_action_string.split(','), message,
-                           attachment_file, attachment_type)
+                notify_email(cond_action.do_action_string.split(','), message,
+                             attachment_file=attachment_file)
             else:
                 logger.error(
                     "Wait {sec:.0f} seconds to email again.".format(
@@ -1084,13 +1085,17 @@ def trigger_action(
             message = action_clear_flow_meter_total_volume(cond_action, message)
         elif cond_action.action_type == 'input_force_measurements':
             message = action_input_force_measurements(cond_action, message)
-        elif cond_action.action_type in ['photo', 'photo_email']:
+        elif cond_action.action_type == 'photo':
             message, attachment_file = action_photo(cond_action, message)
-        elif cond_action.action_type in ['video', 'video_email']:
+        elif cond_action.action_type == 'video':
             message, attachment_file = action_video(cond_action, message)
         elif cond_action.action_type in ['email',
                                          'photo_email',
                                          'video_email']:
+            if cond_action.action_type == 'photo_email':
+                message, attachment_file = action_photo(cond_action, message)
+            elif cond_action.action_type == 'video_email':
+                message, attachment_file = action_video(cond_action, message)
             message, email_recipients, attachment_type = action_email(
                 logger_actions,
                 cond_action,
@@ -1196,18 +1201,16 @@ def trigger_function_actions(function_id, message='', debug=False):
             attachment_type=attachment_type,
             debug=debug)
 
-    # Send email after all conditional actions have been checked
-    # In order to append all action messages to send in the email
-    # send_email_at_end will be None or the TO email address
+    # Queue email after all conditional actions have been checked
+    # In order to append all action messages to send in the email.
+    # The email is sent by the action executor so a slow or unreachable
+    # SMTP server doesn't block the controller that triggered the actions.
     if email_recipients:
         # If the emails per hour limit has not been exceeded
         smtp_wait_timer, allowed_to_send_notice = check_allowed_to_email()
         if allowed_to_send_notice:
-            smtp = db_retrieve_table_daemon(SMTP, entry='first')
-            send_email(smtp.host, smtp.protocol, smtp.port,
-                       smtp.user, smtp.passw, smtp.email_from,
-                       email_recipients, message,
-                       attachment_file, attachment_type)
+            notify_email(email_recipients, message,
+                         attachment_file=attachment_file)
         else:
             logger_actions.error("Wait {sec:.0f} seconds to email again.".format(
                 sec=smtp_wait_timer - time.time()))
@@ -0,0 +1,217 @@
+# coding=utf-8
+#
+#  i2c_arbiter.py - Serialize and coalesce the I2C measurements of Inputs
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import copy
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from mycodo.config import I2C_BUS_TIMEOUT
+from mycodo.config import I2C_COALESCE_SECONDS
+from mycodo.config import I2C_STAGGER_SECONDS
+from mycodo.utils.metrics import ActionMetrics
+
+logger = logging.getLogger("mycodo.i2c_arbiter")
+
+# An Input's device: Inputs with equal I2CDevices share measurements
+I2CDevice = namedtuple('I2CDevice', ['bus', 'address', 'device', 'channels'])
+
+
+def device_key(device):
+    """ Name of a device in the metrics, e.g. '1:0x76' """
+    return '{}:{}'.format(device.bus, hex(device.address))
+
+
+class FairLock:
+    """ Lock granted in the order it was requested """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._abandoned = set()
+
+    def acquire(self, timeout=None):
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            end = None if timeout is None else time.monotonic() + timeout
+            while ticket != self._serving:
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._abandoned.add(ticket)
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def release(self):
+        with self._condition:
+            self._serving += 1
+            while self._serving in self._abandoned:
+                self._abandoned.remove(self._serving)
+                self._serving += 1
+            self._condition.notify_all()
+
+
+class SharedMeasurement:
+    """ A measurement of a device, waited on by the other Inputs of the device """
+    def __init__(self):
+        self.done = threading.Event()
+        self.finished = None
+        self.value = None
+        self.error = None
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return copy.deepcopy(self.value)
+
+
+class I2CArbiter:
+    """
+    Each I2C bus is used by one Input measurement at a time, in the order the
+    measurements were requested. Inputs of the same device (bus, address, Input
+    type and enabled channels) share one measurement made within
+    coalesce seconds, and Inputs on the same bus are given start offsets
+    stagger seconds apart so their measurements don't coincide.
+    """
+    def __init__(self, stagger=I2C_STAGGER_SECONDS, coalesce=I2C_COALESCE_SECONDS,
+                 timeout=I2C_BUS_TIMEOUT):
+        self.stagger = stagger
+        self.coalesce = coalesce
+        self.timeout = timeout
+        self.metrics = ActionMetrics()
+        self._lock = threading.Lock()
+        self._bus_locks = {}
+        self._slots = {}
+        self._measurements = {}
+        self._coalesced = {}
+        self._held = threading.local()  # Bus lock held by the measurement of a thread
+
+    def register(self, device, unique_id, period):
+        """
+        Add an Input to its bus
+
+        :return: seconds to offset the Input's measurements by
+        """
+        with self._lock:
+            slots = self._slots.setdefault(device.bus, {})
+            if unique_id not in slots:
+                used = set(slots.values())
+                slots[unique_id] = min(set(range(len(slots) + 1)) - used)
+            offset = slots[unique_id] * self.stagger
+        return offset % period if period else offset
+
+    def unregister(self, device, unique_id):
+        with self._lock:
+            self._slots.get(device.bus, {}).pop(unique_id, None)
+
+    def measure(self, device, function):
+        """
+        Return function() (an Input's measurement), run while holding the bus,
+        or the result of a measurement of the same device by another Input
+        """
+        with self._lock:
+            shared = self._measurements.get(device)
+            if shared and (not shared.done.is_set() or
+                           time.monotonic() - shared.finished <= self.coalesce):
+                key = device_key(device)
+                self._coalesced[key] = self._coalesced.get(key, 0) + 1
+                owner = False
+            else:
+                shared = SharedMeasurement()
+                self._measurements[device] = shared
+                owner = True
+
+        if owner:
+            try:
+                shared.value = self._transaction(device, function)
+            except Exception as err:
+                shared.error = err
+            finally:
+                shared.finished = time.monotonic()
+                shared.done.set()
+        return shared.result()
+
+    def _transaction(self, device, function):
+        key = device_key(device)
+        with self._lock:
+            bus_lock = self._bus_locks.setdefault(device.bus, FairLock())
+
+        queued = time.monotonic()
+        self.metrics.queued(key)
+        if not bus_lock.acquire(timeout=self.timeout):
+            self.metrics.finished(key, self.metrics.started(key, queued), failed=True)
+            raise TimeoutError("I2C bus {} busy for more than {} seconds".format(
+                device.bus, self.timeout))
+
+        start_time = self.metrics.started(key, queued)
+        self._held.lock = bus_lock
+        self._held.bus = device.bus
+        try:
+            result = function()
+        except Exception:
+            self.metrics.finished(key, start_time, failed=True)
+            raise
+        else:
+            self.metrics.finished(key, start_time, failed=result is None)
+        finally:
+            if self._held.lock is bus_lock:
+                bus_lock.release()
+            self._held.lock = None
+        return result
+
+    @contextmanager
+    def released(self):
+        """
+        Release the bus held by the measurement of this thread (if any) for
+        the block, and wait for it again afterward, so e.g. the samples of an
+        oversampled ADC don't hold up the other Inputs of the bus for the
+        whole burst. Raises TimeoutError if the bus isn't regained in time.
+        """
+        bus_lock = getattr(self._held, 'lock', None)
+        if bus_lock is None:
+            yield
+            return
+        self._held.lock = None
+        bus_lock.release()
+        try:
+            yield
+        finally:
+            if not bus_lock.acquire(timeout=self.timeout):
+                raise TimeoutError("I2C bus {} busy for more than {} seconds".format(
+                    self._held.bus, self.timeout))
+            self._held.lock = bus_lock
+
+    def status(self):
+        """ Return the Inputs of each bus and the latencies and errors of each device """
+        devices = self.metrics.snapshot()
+        with self._lock:
+            for key, coalesced in self._coalesced.items():
+                devices.setdefault(key, {})['coalesced'] = coalesced
+            inputs = {str(bus): len(slots) for bus, slots in self._slots.items()}
+        return {'inputs': inputs, 'devices': devices}
+
+
+i2c_arbiter = I2CArbiter()
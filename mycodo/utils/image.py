@@ -21,51 +21,74 @@
 #
 #  Contact at kylegabriel.com
 
+import io
 import logging
+from functools import lru_cache
 
 logger = logging.getLogger("mycodo.utils.image")
 
+COLORDEPTH = 256
 
-def generate_thermal_image_from_pixels(
-        pixels, nx, ny, path_file, rotate_ccw=270, scale=25, temp_min=None, temp_max=None):
-    """ Generate and save image from list of pixels """
+
+@lru_cache(maxsize=1)
+def thermal_palette():
+    """ Flat [r, g, b, r, g, b, ...] color map from cold (indigo) to hot (red) """
     from colour import Color
+
+    palette = []
+    for each_color in Color("indigo").range_to(Color("red"), COLORDEPTH):
+        palette.extend([int(each_color.red * 255),
+                        int(each_color.green * 255),
+                        int(each_color.blue * 255)])
+    return palette
+
+
+def render_thermal_image(
+        pixels, nx, ny, rotate_ccw=270, scale=25, temp_min=None, temp_max=None,
+        image_format='JPEG'):
+    """
+    Render a list of pixel temperatures (row-major) to an image, in memory
+
+    :return: encoded image (bytes), or None if the pixels don't fit nx * ny
+    """
     from PIL import Image
-    from PIL import ImageDraw
 
     if len(pixels) != nx * ny:
         logger.error("{nx} * {ny} does not equal {px}".format(
             nx=nx, ny=ny, px=len(pixels)))
         return
 
-    # output image buffer
-    image = Image.new("RGB", (nx, ny), "white")
-    draw = ImageDraw.Draw(image)
-
-    # color map
-    COLORDEPTH = 256
-    colors = list(Color("indigo").range_to(Color("red"), COLORDEPTH))
-    colors = [(int(c.red * 255), int(c.green * 255), int(c.blue * 255)) for c in colors]
+    # map sensor readings to color map indexes
+    min_temp = min(pixels) if temp_min is None else temp_min
+    max_temp = max(pixels) if temp_max is None else temp_max
+    span = (max_temp - min_temp) or 1
+    indexes = bytes(
+        min(COLORDEPTH - 1, max(0, int((p - min_temp) * (COLORDEPTH - 1) / span)))
+        for p in pixels)
 
-    # some utility functions
-    def constrain(val, min_val, max_val):
-        return min(max_val, max(min_val, val))
-
-    def map_it(x, in_min, in_max, out_min, out_max):
-        return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
-
-    # map sensor readings to color map
-    MINTEMP = min(pixels) if temp_min is None else temp_min
-    MAXTEMP = max(pixels) if temp_max is None else temp_max
-    pixels = [map_it(p, MINTEMP, MAXTEMP, 0, COLORDEPTH - 1) for p in pixels]
-
-    # create the image
-    for ix in range(nx):
-        for iy in range(ny):
-            draw.point([(ix, iy % nx)], fill=colors[constrain(int(pixels[ix + nx * iy]), 0, COLORDEPTH - 1)])
+    image = Image.frombytes("P", (nx, ny), indexes)
+    image.putpalette(thermal_palette())
+    image = image.convert("RGB")
 
     if rotate_ccw:
         image = image.rotate(rotate_ccw)
 
-    # scale and save
-    image.resize((nx * scale, ny * scale), Image.BICUBIC).save(path_file)
+    image = image.resize((nx * scale, ny * scale), Image.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def generate_thermal_image_from_pixels(
+        pixels, nx, ny, path_file, rotate_ccw=270, scale=25, temp_min=None, temp_max=None):
+    """ Generate and save image from list of pixels """
+    image = render_thermal_image(
+        pixels, nx, ny,
+        rotate_ccw=rotate_ccw,
+        scale=scale,
+        temp_min=temp_min,
+        temp_max=temp_max,
+        image_format='JPEG')
+    if image:
+        with open(path_file, 'wb') as image_file:
+            image_file.write(image)
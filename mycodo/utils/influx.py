@@ -1,6 +1,7 @@
 # coding=utf-8
 import datetime
 import logging
+import re
 import threading
 import time
 from uuid import UUID
@@ -8,6 +9,7 @@ from uuid import UUID
 import requests
 from influxdb import InfluxDBClient
 
+from mycodo.config import INFLUXDB_CHUNK_SIZE
 from mycodo.config import INFLUXDB_DATABASE
 from mycodo.config import INFLUXDB_HOST
 from mycodo.config import INFLUXDB_PASSWORD
@@ -18,6 +20,8 @@ from mycodo.inputs.sensorutils import convert_units
 from mycodo.mycodo_client import DaemonControl
 from mycodo.utils.database import db_retrieve_table_daemon
 from mycodo.utils.logging_utils import set_log_level
+from mycodo.utils.stream_stats import latest_values
+from mycodo.utils.stream_stats import measurement_streams
 
 logger = logging.getLogger("mycodo.influxdb")
 logger.setLevel(set_log_level(logging))
@@ -113,6 +117,96 @@ def format_influxdb_data(unique_id, unit, value, channel=None, measure=None, tim
     return influx_dict
 
 
+# Timestamp units of influxdb line protocol precisions, per second
+LINE_PROTOCOL_PRECISION = {
+    'ns': 1000000000,
+    'u': 1000000,
+    'us': 1000000,
+    'ms': 1000,
+    's': 1
+}
+
+# Range of the timestamps influxdb can store (int64 nanoseconds since the epoch)
+INFLUXDB_TIME_MIN = datetime.datetime(1677, 9, 21, 0, 12, 43, 145225)
+INFLUXDB_TIME_MAX = datetime.datetime(2262, 4, 11, 23, 47, 16, 854775)
+
+
+def split_line_protocol(text, separator):
+    """ Split text on separators not escaped with a backslash or within double quotes """
+    parts = []
+    current = []
+    escaped = False
+    quoted = False
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == separator and not quoted:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append(''.join(current))
+    return parts
+
+
+def unescape_line_protocol(text):
+    return re.sub(r'\\(.)', r'\1', text)
+
+
+def parse_line_protocol(line, precision='ns'):
+    """
+    Parse a line of influxdb line protocol in the schema Mycodo stores measurements with
+
+    example:
+        parse_line_protocol('C,device_id=00000001,channel=0,measure=temperature value=37.5 1555351620392000000')
+
+    :return: dict of unique_id, unit, channel, measure, value and timestamp
+        (datetime object or None), with the channel and value as strings
+    :rtype: dict
+
+    :param line: Line of line protocol
+    :type line: str
+    :param precision: Precision of the timestamp (ns, u, us, ms or s)
+    :type precision: str
+    """
+    parts = [each for each in split_line_protocol(line.strip(), ' ') if each]
+    if len(parts) not in [2, 3]:
+        raise ValueError("Line must contain a measurement and tags, fields, and optionally a timestamp")
+
+    series = split_line_protocol(parts[0], ',')
+    key_values = {}
+    for each_pair in series[1:] + split_line_protocol(parts[1], ','):
+        key, separator, value = each_pair.partition('=')
+        if not separator:
+            raise ValueError("Invalid tag or field: '{}'".format(each_pair))
+        key_values[unescape_line_protocol(key)] = unescape_line_protocol(value)
+    if 'value' not in key_values:
+        raise ValueError("Missing field: value")
+
+    timestamp = None
+    if len(parts) == 3:
+        if precision not in LINE_PROTOCOL_PRECISION:
+            raise ValueError("Invalid precision: '{}'".format(precision))
+        try:
+            timestamp = datetime.datetime.utcfromtimestamp(
+                int(parts[2]) / LINE_PROTOCOL_PRECISION[precision])
+        except (OverflowError, OSError, ValueError):
+            raise ValueError("Invalid timestamp: '{}'".format(parts[2]))
+
+    return {
+        'unique_id': key_values.get('device_id'),
+        'unit': unescape_line_protocol(series[0]),
+        'channel': key_values.get('channel'),
+        'measure': key_values.get('measure'),
+        'value': key_values['value'].rstrip('i'),  # Integer fields end with i
+        'timestamp': timestamp
+    }
+
+
 def parse_measurement(
         conversion,
         measurement,
@@ -243,6 +337,203 @@ def query_string(unit, unique_id,
     return query
 
 
+def query_string_downsample(unit, unique_id, group_sec,
+                            measure=None, channel=None, past_sec=None,
+                            start_str=None, end_str=None):
+    """
+    Generate an influxdb query string that aggregates each group_sec bucket
+    into its first, minimum, maximum and last values (M4 aggregation)
+    """
+    query = "SELECT FIRST(value), MIN(value), MAX(value), LAST(value)"
+    query += " FROM {unit} WHERE device_id='{id}'".format(
+        unit=unit, id=unique_id)
+
+    if channel is not None:
+        query += " AND channel='{channel}'".format(channel=channel)
+    if measure:
+        query += " AND measure='{measure}'".format(measure=measure)
+    if start_str:
+        query += " AND time >= '{start}'".format(start=start_str)
+    if end_str:
+        query += " AND time <= '{end}'".format(end=end_str)
+    if past_sec:
+        query += " AND time > now() - {sec}s".format(sec=int(past_sec))
+    query += " GROUP BY TIME({sec}s) fill(none)".format(sec=int(group_sec))
+    return query
+
+
+# InfluxQL functions the measurements of a query may be aggregated with
+AGGREGATE_FUNCTIONS = [
+    'COUNT', 'FIRST', 'INTEGRAL', 'LAST', 'MAX', 'MEAN', 'MEDIAN', 'MIN',
+    'MODE', 'SPREAD', 'STDDEV', 'SUM'
+]
+
+
+def query_string_page(unit, unique_id, measure=None, channel=None,
+                      start_str=None, end_str=None, cursor_ns=None,
+                      function=None, group_sec=None, limit=None):
+    """
+    Generate an influxdb query string of measurements in time order, optionally
+    aggregated with function into group_sec buckets, from cursor_ns (epoch
+    nanoseconds, inclusive) and with at most limit rows
+    """
+    if function and function not in AGGREGATE_FUNCTIONS:
+        return 1
+
+    query = "SELECT {select} FROM {unit} WHERE device_id='{id}'".format(
+        select='{}(value)'.format(function) if function else 'value',
+        unit=unit, id=unique_id)
+
+    if channel is not None:
+        query += " AND channel='{channel}'".format(channel=channel)
+    if measure:
+        query += " AND measure='{measure}'".format(measure=measure)
+    if start_str:
+        query += " AND time >= '{start}'".format(start=start_str)
+    if end_str:
+        query += " AND time <= '{end}'".format(end=end_str)
+    if cursor_ns is not None:
+        query += " AND time >= {cursor}".format(cursor=int(cursor_ns))
+    if function and group_sec:
+        query += " GROUP BY TIME({sec}s) fill(none)".format(sec=int(group_sec))
+    query += " ORDER BY time ASC"
+    if limit:
+        query += " LIMIT {lim}".format(lim=int(limit))
+    return query
+
+
+def next_page_cursor(rows, limit, group_sec=None):
+    """
+    Return the cursor (epoch nanoseconds) of the page following rows of a
+    query_string_page() query made with epoch='ns', or None if it was the last page
+    """
+    if not rows or not limit or len(rows) < limit:
+        return
+    if group_sec:
+        return rows[-1][0] + int(group_sec) * 1000000000
+    return rows[-1][0] + 1
+
+
+def read_influxdb_page(unique_id, unit, channel, epoch='ns', chunked=False, **kwargs):
+    """
+    Query Influxdb for measurements (see query_string_page() for the arguments)
+
+    :return: list of [timestamp, value], or, if chunked, a generator of lists
+        of [timestamp, value] read from the response as influxdb sends them
+    """
+    client = InfluxDBClient(
+        INFLUXDB_HOST, INFLUXDB_PORT, INFLUXDB_USER, INFLUXDB_PASSWORD,
+        INFLUXDB_DATABASE, timeout=5)
+
+    query = query_string_page(unit, unique_id, channel=channel, **kwargs)
+    if query == 1:
+        raise ValueError("Invalid function: {}".format(kwargs.get('function')))
+
+    if chunked:
+        return (
+            [row for each_series in result.raw.get('series', []) for row in each_series['values']]
+            for result in client.query(
+                query, epoch=epoch, chunked=True, chunk_size=INFLUXDB_CHUNK_SIZE))
+
+    raw_data = client.query(query, epoch=epoch).raw
+    if raw_data and raw_data.get('series'):
+        return raw_data['series'][0]['values']
+    return []
+
+
+def query_string_frames(unit, unique_id, measure=None,
+                        start_str=None, end_str=None, past_sec=None):
+    """
+    Generate an influxdb query string that returns every channel of a device
+    in one query, as one series per channel (e.g. the pixels of a thermal camera)
+    """
+    query = "SELECT value FROM {unit} WHERE device_id='{id}'".format(
+        unit=unit, id=unique_id)
+
+    if measure:
+        query += " AND measure='{measure}'".format(measure=measure)
+    if start_str:
+        query += " AND time >= '{start}'".format(start=start_str)
+    if end_str:
+        query += " AND time <= '{end}'".format(end=end_str)
+    if past_sec:
+        query += " AND time > now() - {sec}s".format(sec=int(past_sec))
+    query += " GROUP BY channel"
+    return query
+
+
+def parse_frames(series, channels):
+    """
+    Pack the per-channel series of a query_string_frames() query into frames.
+
+    All channels of a frame are stored with the same timestamp, so each
+    timestamp that has a value for every channel becomes one frame.
+
+    :param series: list of series from the raw query response, each with a
+        'channel' tag and rows of [timestamp, value]
+    :param channels: number of channels (pixels) in a frame
+    :return: list of [timestamp, [value of channel 0, ..., channel n-1]], ordered by timestamp
+    """
+    frames = {}
+    for each_series in series:
+        try:
+            channel = int(each_series['tags']['channel'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if not 0 <= channel < channels:
+            continue
+        for timestamp, value in each_series['values']:
+            if timestamp not in frames:
+                frames[timestamp] = [None] * channels
+            frames[timestamp][channel] = value
+
+    return [[timestamp, pixels]
+            for timestamp, pixels in sorted(frames.items())
+            if None not in pixels]
+
+
+def downsample_m4(values, group_ms, end_ms=None):
+    """
+    Convert the rows of an M4 query into a list of [timestamp, value] points.
+
+    Each bucket produces at most four points (first, min, max, last) that
+    preserve the visual shape of the series when one bucket spans one pixel.
+    The bucket's first point is placed at the start of the bucket and the
+    last point at the end of the bucket (capped at end_ms).
+
+    :param values: rows of [epoch_ms, first, min, max, last]
+    :param group_ms: bucket width, in milliseconds
+    :param end_ms: latest timestamp allowed, in milliseconds
+    :return: list of [epoch_ms, value]
+    """
+    points = []
+    for ts, first, minimum, maximum, last in values:
+        if first is None:
+            continue
+        ts_last = ts + group_ms - 1
+        if end_ms is not None:
+            ts_last = max(ts + 2, min(ts_last, end_ms))
+        ts_mid = ts + (ts_last - ts) // 2
+
+        # Order the extremes in the direction the bucket is trending
+        if first <= last:
+            middle = [minimum, maximum]
+        else:
+            middle = [maximum, minimum]
+
+        bucket = [[ts, first]]
+        for index, value in enumerate(middle):
+            bucket.append([ts_mid + index, value])
+        bucket.append([ts_last, last])
+
+        # Drop repeated values that would only add redundant points
+        for point in bucket:
+            if len(points) and points[-1][1] == point[1] and points[-1][0] >= ts:
+                continue
+            points.append(point)
+    return points
+
+
 def read_influxdb_function(
         unique_id, unit, channel, function,
         measure=None,
@@ -322,7 +613,8 @@ def read_influxdb_list(unique_id, unit, channel,
                        measure=None,
                        duration_sec=None,
                        start_str=None,
-                       end_str=None):
+                       end_str=None,
+                       epoch=None):
     """
     Query Influxdb for a list of entries
 
@@ -349,6 +641,8 @@ def read_influxdb_list(unique_id, unit, channel,
     :type start_str: str
     :param end_str: End time, in influxdb format
     :type end_str: str
+    :param epoch: Timestamp precision to return (e.g. 'ms'), or None for RFC3339 strings
+    :type epoch: str or None
     """
     raw_data = None
 
@@ -368,14 +662,14 @@ def read_influxdb_list(unique_id, unit, channel,
         return '', 204
 
     try:
-        raw_data = client.query(query).raw
+        raw_data = client.query(query, epoch=epoch).raw
     except:
         logger.debug(
             "Could not read form influxdb for ID {}, channel {}. "
             "waiting 15 seconds and trying again.".format(unique_id, channel))
         time.sleep(15)
         try:
-            raw_data = client.query(query).raw
+            raw_data = client.query(query, epoch=epoch).raw
         except:
             logger.debug("Could not read form influxdb after waiting 15 seconds.")
 
@@ -640,6 +934,8 @@ def write_influxdb_value(
             measure=measure,
             timestamp=timestamp)
     ]
+    measurement_streams.add_points(data)
+    latest_values.add_points(data)
 
     try:
         client.write_points(data)
@@ -684,6 +980,8 @@ def write_influxdb_list(data, unique_id):
     client = InfluxDBClient(
         INFLUXDB_HOST, INFLUXDB_PORT, INFLUXDB_USER, INFLUXDB_PASSWORD,
         INFLUXDB_DATABASE, timeout=5)
+    measurement_streams.add_points(data)
+    latest_values.add_points(data)
 
     try:
         client.write_points(data)
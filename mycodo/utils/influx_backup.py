@@ -0,0 +1,139 @@
+# coding=utf-8
+#
+#  influx_backup.py - Full and incremental backups of the measurement database
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import json
+import logging
+import os
+import shutil
+import time
+
+from mycodo.config import INFLUXDB_BACKUP_FULL_INTERVAL
+from mycodo.config import INFLUXDB_BACKUP_RETENTION
+from mycodo.config import INFLUXDB_DATABASE
+from mycodo.config import PATH_INFLUXDB_BACKUPS
+from mycodo.utils.system_pi import assure_path_exists
+from mycodo.utils.system_pi import cmd_output
+from mycodo.utils.zip_stream import directory_files
+
+logger = logging.getLogger("mycodo.influx_backup")
+
+# Written to a backup set once influxd has finished backing it up
+BACKUP_SET_FILE = 'backup_set.json'
+
+
+class BackupError(Exception):
+    pass
+
+
+def rfc3339(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+
+def backup_sets(path=PATH_INFLUXDB_BACKUPS):
+    """ The completed backup sets, oldest first """
+    sets = []
+    if not os.path.isdir(path):
+        return sets
+    for name in os.listdir(path):
+        try:
+            with open(os.path.join(path, name, BACKUP_SET_FILE)) as set_file:
+                backup_set = json.load(set_file)
+        except (OSError, ValueError):
+            continue  # Incomplete or not a backup set
+        backup_set.update(name=name, path=os.path.join(path, name))
+        sets.append(backup_set)
+    return sorted(sets, key=lambda each_set: each_set['created'])
+
+
+def backup_chains(sets):
+    """
+    Group backup sets into chains of a full backup and the incremental
+    backups that followed it. Restoring a chain in order restores all
+    measurements up to its last backup.
+    """
+    chains = []
+    for each_set in sets:
+        if each_set['kind'] == 'full' or not chains:
+            chains.append([each_set])
+        else:
+            chains[-1].append(each_set)
+    return chains
+
+
+def chain_files(chain):
+    """ (path, name in archive) of the files of each set of a chain """
+    files = []
+    for each_set in chain:
+        files.extend(directory_files(each_set['path'], prefix=each_set['name']))
+    return files
+
+
+def create_backup_set(path=PATH_INFLUXDB_BACKUPS, database=INFLUXDB_DATABASE,
+                      now=None, run=cmd_output):
+    """
+    Back up the measurements stored since the last backup set, or every
+    measurement if the last full backup is older than the full backup
+    interval. Backup sets past their retention are then deleted.
+    """
+    now = now or time.time()
+    assure_path_exists(path)
+    chains = backup_chains(backup_sets(path))
+    if chains and now - chains[-1][0]['created'] < INFLUXDB_BACKUP_FULL_INTERVAL:
+        # Overlap the last backup rather than risk missing points
+        kind, start = 'incremental', chains[-1][-1]['created']
+    else:
+        kind, start = 'full', None
+
+    name = '{}-{}'.format(time.strftime('%Y%m%d-%H%M%S', time.gmtime(now)), kind)
+    set_path = os.path.join(path, name)
+    cmd = "/usr/bin/influxd backup -portable -database {db}{start} {path}".format(
+        db=database, start=' -start {}'.format(rfc3339(start)) if start else '', path=set_path)
+    _, err, status = run(cmd)
+    if status:
+        shutil.rmtree(set_path, ignore_errors=True)
+        raise BackupError("influxd backup failed ({}): {}".format(status, err))
+
+    backup_set = {'kind': kind, 'created': now, 'start': start, 'database': database}
+    with open(os.path.join(set_path, BACKUP_SET_FILE), 'w') as set_file:
+        json.dump(backup_set, set_file)
+    logger.info("Created {} measurement backup {}".format(kind, name))
+
+    prune_backup_sets(path, now)
+    backup_set.update(name=name, path=set_path)
+    return backup_set
+
+
+def prune_backup_sets(path=PATH_INFLUXDB_BACKUPS, now=None):
+    """
+    Delete the chains of backup sets whose last backup is older than the
+    retention period. The latest chain is always kept.
+    """
+    now = now or time.time()
+    deleted = []
+    for chain in backup_chains(backup_sets(path))[:-1]:
+        if now - chain[-1]['created'] > INFLUXDB_BACKUP_RETENTION:
+            for each_set in chain:
+                shutil.rmtree(each_set['path'], ignore_errors=True)
+                deleted.append(each_set['name'])
+    if deleted:
+        logger.info("Deleted measurement backups past retention: {}".format(', '.join(deleted)))
+    return deleted
@@ -0,0 +1,288 @@
+# coding=utf-8
+#
+#  influx_import.py - Copy an imported InfluxDB database into the Mycodo database
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+
+from influxdb import InfluxDBClient
+
+from mycodo.config import INFLUXDB_DATABASE
+from mycodo.config import INFLUXDB_HOST
+from mycodo.config import INFLUXDB_IMPORT_CHUNK_SECONDS
+from mycodo.config import INFLUXDB_IMPORT_WORKERS
+from mycodo.config import INFLUXDB_PASSWORD
+from mycodo.config import INFLUXDB_PORT
+from mycodo.config import INFLUXDB_USER
+from mycodo.config import PATH_INFLUXDB_IMPORT
+
+logger = logging.getLogger("mycodo.influx_import")
+
+# Database the uploaded backup is restored to before being copied
+INFLUXDB_IMPORT_DATABASE = 'mycodo_db_bak'
+
+# Seconds between checkpoints while copying
+CHECKPOINT_INTERVAL = 1.0
+
+IMPORT_RUNNING = ('restoring', 'planning', 'copying', 'verifying')
+
+
+def influxdb_client(database=INFLUXDB_IMPORT_DATABASE):
+    return InfluxDBClient(
+        INFLUXDB_HOST, INFLUXDB_PORT, INFLUXDB_USER, INFLUXDB_PASSWORD, database)
+
+
+def quote_identifier(name):
+    return '"{}"'.format(name.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def copy_windows(first, last, window):
+    """ Start of each window of seconds from the first to the last point """
+    start = int(first) - int(first) % window
+    windows = []
+    while start <= last:
+        windows.append(start)
+        start += window
+    return windows
+
+
+def pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class InfluxImport:
+    """
+    Copies every measurement of the database a backup was restored to into
+    the Mycodo database, one window of time per query. Windows are copied by
+    a pool of workers and checkpointed as they complete, so an interrupted
+    copy resumes with the windows that remain. Copying a window again only
+    overwrites the same points.
+    """
+    def __init__(self, path=PATH_INFLUXDB_IMPORT, connect=influxdb_client,
+                 source=INFLUXDB_IMPORT_DATABASE, destination=INFLUXDB_DATABASE,
+                 chunk_seconds=INFLUXDB_IMPORT_CHUNK_SECONDS, workers=INFLUXDB_IMPORT_WORKERS,
+                 on_progress=None):
+        self.path = path
+        self.connect = connect
+        self.source = source
+        self.destination = destination
+        self.chunk_seconds = chunk_seconds
+        self.workers = workers
+        self.on_progress = on_progress  # Called with (copied, chunks), raises to stop the copy
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._checkpointed = 0
+        self.state = self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {'status': None}
+
+    def status(self):
+        """ The state of the last import, with its progress in percent """
+        with self._lock:
+            state = dict(self.state)
+        state.pop('measurements', None)
+        if state.get('chunks'):
+            state['progress'] = round(100.0 * state['copied'] / state['chunks'], 1)
+        else:
+            state['progress'] = 100.0 if state['status'] == 'finished' else 0.0
+        if state['status'] in IMPORT_RUNNING and not pid_running(state.get('pid', 0)):
+            state['status'] = 'interrupted'
+        state.pop('tmp_folder', None)
+        folders = state.pop('folders', [])
+        state['resumable'] = (
+            state['status'] in ('failed', 'interrupted') and
+            (state.get('stage') != 'restoring' or os.path.isdir(folders[state['folder']])))
+        state['backups'] = len(folders)
+        return state
+
+    def _update(self, checkpoint=True, **values):
+        with self._lock:
+            self.state.update(values, pid=os.getpid(), updated=time.time())
+            if not checkpoint and time.time() - self._checkpointed < CHECKPOINT_INTERVAL:
+                return
+            self._checkpointed = time.time()
+            state = json.dumps(self.state)
+        if self.path:
+            with open(self.path + '.tmp', 'w') as state_file:
+                state_file.write(state)
+            os.replace(self.path + '.tmp', self.path)
+
+    def _client(self):
+        """ Each worker queries with its own client (connection) """
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.connect(self.source)
+        return self._local.client
+
+    def _query(self, query, **kwargs):
+        return list(self._client().query(query, **kwargs).get_points())
+
+    def begin(self, tmp_folder, folders):
+        """ Start a new import of backups, before the first is restored """
+        self.state = {
+            'tmp_folder': tmp_folder, 'folders': folders, 'folder': 0, 'started': time.time()
+        }
+        self._begin_folder()
+
+    def next_folder(self):
+        """ Start importing the next backup, if there is one """
+        if self.state['folder'] + 1 >= len(self.state['folders']):
+            return False
+        self.state['folder'] += 1
+        self._begin_folder()
+        return True
+
+    def _begin_folder(self):
+        self.state.update({
+            'status': 'restoring', 'stage': 'restoring', 'measurements': {},
+            'chunks': 0, 'copied': 0, 'verified': {}, 'error': None
+        })
+        self._update()
+
+    def fail(self, error):
+        self._update(status='failed', error=error)
+
+    def run(self):
+        """ Copy (or finish copying) the restored database """
+        try:
+            if self.state.get('stage') in (None, 'restoring', 'planning'):
+                self._update(status='planning', stage='planning', error=None)
+                self.plan()
+            if self.state['stage'] == 'copying':
+                self._update(status='copying', error=None)
+                self.copy()
+            if self.state['stage'] == 'verifying':
+                self._update(status='verifying', error=None)
+                self.verify()
+            self._update(status='finished', stage='finished')
+            return True
+        except Exception as err:
+            logger.exception("InfluxDB import")
+            self.fail(str(err))
+            return False
+
+    def plan(self):
+        """ Find the windows of time of each measurement to copy """
+        measurements = {}
+        chunks = 0
+        for each_measurement in self._client().get_list_measurements():
+            name = each_measurement['name']
+            query = 'SELECT * FROM {db}..{m} ORDER BY time {order} LIMIT 1'
+            first = self._query(query.format(
+                db=quote_identifier(self.source), m=quote_identifier(name), order='ASC'), epoch='s')
+            last = self._query(query.format(
+                db=quote_identifier(self.source), m=quote_identifier(name), order='DESC'), epoch='s')
+            if not first or not last:
+                continue
+            windows = copy_windows(first[0]['time'], last[0]['time'], self.chunk_seconds)
+            measurements[name] = {
+                'first': first[0]['time'], 'last': last[0]['time'],
+                'windows': windows, 'copied': []
+            }
+            chunks += len(windows)
+        logger.info("Copying {} measurements in {} queries".format(len(measurements), chunks))
+        self._update(stage='copying', measurements=measurements, chunks=chunks, copied=0)
+
+    def copy_window(self, measurement, start):
+        self._client().query(
+            'SELECT * INTO {dest}..{m} FROM {src}..{m} '
+            'WHERE time >= {start}s AND time < {end}s GROUP BY *'.format(
+                dest=quote_identifier(self.destination), src=quote_identifier(self.source),
+                m=quote_identifier(measurement), start=start, end=start + self.chunk_seconds))
+        return measurement, start
+
+    def copy(self):
+        remaining = [
+            (name, start)
+            for name, info in self.state['measurements'].items()
+            for start in sorted(set(info['windows']) - set(info['copied']))]
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.copy_window, name, start)
+                       for name, start in remaining]
+            for future in as_completed(futures):
+                try:
+                    name, start = future.result()
+                    with self._lock:
+                        self.state['measurements'][name]['copied'].append(start)
+                        self.state['copied'] += 1
+                    self._update(checkpoint=False)
+                    if self.on_progress and not errors:
+                        self.on_progress(self.state['copied'], self.state['chunks'])
+                except Exception as err:
+                    if not errors:
+                        # Stop copying, keeping the windows already copied
+                        for each_future in futures:
+                            each_future.cancel()
+                    errors.append(err)
+        self._update()
+        if errors:
+            raise errors[0]
+        self._update(stage='verifying')
+
+    def count(self, database, measurement, first, last):
+        """ Number of points of a measurement (the count of its most counted field) """
+        points = self._query(
+            'SELECT count(*) FROM {db}..{m} WHERE time >= {first}s AND time <= {last}s'.format(
+                db=quote_identifier(database), m=quote_identifier(measurement),
+                first=first, last=last))
+        if not points:
+            return 0
+        return max([value for key, value in points[0].items() if key.startswith('count')] or [0])
+
+    def verify(self):
+        """
+        Count the points of each measurement in both databases. The Mycodo
+        database may have more points than were imported, but not fewer.
+        Measurements missing points are copied again if the import is resumed.
+        """
+        verified = {}
+        for name, info in self.state['measurements'].items():
+            imported = self.count(self.source, name, info['first'], info['last'])
+            stored = self.count(self.destination, name, info['first'], info['last'])
+            verified[name] = {'imported': imported, 'stored': stored}
+            if stored < imported:
+                logger.error("Import of {}: {} points imported, only {} stored".format(
+                    name, imported, stored))
+        missing = [name for name, counts in verified.items()
+                   if counts['stored'] < counts['imported']]
+        with self._lock:
+            for name in missing:
+                self.state['copied'] -= len(self.state['measurements'][name]['copied'])
+                self.state['measurements'][name]['copied'] = []
+        self._update(verified=verified, stage='copying' if missing else 'verifying')
+        if missing:
+            raise Exception("Measurements missing points after copy: {}".format(
+                ', '.join(sorted(missing))))
+        self._update(stage='finished')
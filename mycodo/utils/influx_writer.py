@@ -0,0 +1,215 @@
+# coding=utf-8
+#
+#  influx_writer.py - Batched, non-blocking writing of measurements to influxdb
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import logging
+import threading
+import time
+from collections import deque
+
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
+
+from mycodo.config import INFLUXDB_DATABASE
+from mycodo.config import INFLUXDB_HOST
+from mycodo.config import INFLUXDB_PASSWORD
+from mycodo.config import INFLUXDB_PORT
+from mycodo.config import INFLUXDB_USER
+from mycodo.config import INFLUX_WRITE_BATCH_SIZE
+from mycodo.config import INFLUX_WRITE_INTERVAL
+from mycodo.config import INFLUX_WRITE_QUEUE_MAX
+
+logger = logging.getLogger("mycodo.influx_writer")
+
+
+def influxdb_write_points(points):
+    client = InfluxDBClient(
+        INFLUXDB_HOST, INFLUXDB_PORT, INFLUXDB_USER, INFLUXDB_PASSWORD,
+        INFLUXDB_DATABASE, timeout=5)
+    client.write_points(points)
+
+
+def rejected(err):
+    """ Whether influxdb refused the points, so writing them again would fail again """
+    return isinstance(err, InfluxDBClientError) and 400 <= (err.code or 0) < 500
+
+
+class InfluxBatchWriter(threading.Thread):
+    """
+    Queues influxdb data points (see format_influxdb_data()) and writes them
+    in batches of up to batch_size points, at least every interval seconds.
+    A failed batch is retried, waiting twice as long after each failure (up to
+    a minute), while new points continue to queue. A batch influxdb refuses
+    (a 4xx response) isn't retried: its points are written one at a time and
+    those refused are dropped. Points are rejected rather than queued when
+    max_queued points are already waiting.
+
+    :param write_points: function writing a list of points (default: to influxdb)
+    """
+    def __init__(self, batch_size=INFLUX_WRITE_BATCH_SIZE, interval=INFLUX_WRITE_INTERVAL,
+                 max_queued=INFLUX_WRITE_QUEUE_MAX, write_points=influxdb_write_points):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_queued = max_queued
+        self.write_points = write_points
+        self.running = True
+        self._condition = threading.Condition()
+        self._queue = deque()
+        self._writing = False
+        self._written = 0
+        self._dropped = 0
+        self._batches = 0
+        self._failures = 0
+        self._last_error = None
+        self._last_write = None
+
+    def submit(self, points):
+        """
+        Queue points to be written
+
+        :return: the number of points queued, from the start of points (the
+            rest were rejected because the queue is full)
+        """
+        with self._condition:
+            accepted = max(0, min(len(points), self.max_queued - len(self._queue)))
+            self._queue.extend(points[:accepted])
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+        return accepted
+
+    def flush(self, timeout=None):
+        """ Wait until all queued points are written (for testing and shutdown) """
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._condition.notify_all()
+            while self._queue or self._writing:
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def status(self):
+        with self._condition:
+            return {
+                'queued': len(self._queue),
+                'written': self._written,
+                'dropped': self._dropped,
+                'batches': self._batches,
+                'failures': self._failures,
+                'last_error': self._last_error,
+                'last_write': self._last_write
+            }
+
+    def stop(self):
+        with self._condition:
+            self.running = False
+            self._condition.notify()
+
+    def run(self):
+        retry_wait = self.interval
+        while self.running:
+            with self._condition:
+                if len(self._queue) < self.batch_size:
+                    self._condition.wait(self.interval)
+                batch = [self._queue.popleft()
+                         for _ in range(min(self.batch_size, len(self._queue)))]
+                self._writing = bool(batch)
+            if not batch:
+                continue
+
+            written, dropped, retry, error = self._write(batch)
+            with self._condition:
+                self._queue.extendleft(reversed(retry))  # Keep the order of the points
+                self._written += written
+                self._dropped += dropped
+                if written:
+                    self._batches += 1
+                    self._last_write = time.time()
+                if error:
+                    self._failures += 1
+                    self._last_error = str(error)
+                self._writing = False
+                self._condition.notify_all()
+
+            if retry:
+                logger.debug("Failed to write {} points to influxdb, retrying in {} seconds: {}".format(
+                    len(retry), retry_wait, error))
+                time.sleep(retry_wait)
+                retry_wait = min(60, retry_wait * 2)
+            else:
+                retry_wait = self.interval
+
+    def _write(self, batch):
+        """
+        Write a batch, or if influxdb refuses it, each of its points to find
+        those it refuses
+
+        :return: the number of points written and dropped, the points to
+            retry and the last error
+        """
+        try:
+            self.write_points(batch)
+            return len(batch), 0, [], None
+        except Exception as err:
+            if not rejected(err):
+                return 0, 0, batch, err
+            error = err
+
+        written = dropped = 0
+        for index, point in enumerate(batch):
+            try:
+                self.write_points([point])
+                written += 1
+            except Exception as err:
+                error = err
+                if not rejected(err):
+                    return written, dropped, batch[index:], err
+                dropped += 1
+                logger.error("InfluxDB refused point, dropping it: {}: {}".format(point, err))
+        return written, dropped, [], error
+
+
+class InfluxWriterService:
+    """ The batch writer of this process, started when first used """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def get(self):
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = InfluxBatchWriter()
+                self._writer.start()
+            return self._writer
+
+    def submit(self, points):
+        return self.get().submit(points)
+
+    def status(self):
+        with self._lock:
+            writer = self._writer
+        return writer.status() if writer else {}
+
+
+influx_writer = InfluxWriterService()
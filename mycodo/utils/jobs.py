@@ -0,0 +1,289 @@
+# coding=utf-8
+#
+#  jobs.py - Run long operations of the web interface in the background
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import json
+import logging
+import threading
+import time
+from contextlib import nullcontext
+
+from mycodo.config import JOB_HISTORY
+from mycodo.config import JOB_POLL_INTERVAL
+from mycodo.config import JOB_PROGRESS_INTERVAL
+from mycodo.config import JOB_WORKERS
+from mycodo.config import MYCODO_DB_PATH
+from mycodo.databases import set_uuid
+from mycodo.databases.models import Job
+from mycodo.databases.utils import session_scope
+
+logger = logging.getLogger("mycodo.jobs")
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+JOB_CANCELED = 'canceled'
+JOB_INTERRUPTED = 'interrupted'
+JOB_ACTIVE = (JOB_QUEUED, JOB_RUNNING)
+
+# Saved again if the row of a running job is missing (the settings database was replaced)
+JOB_FIELDS = ('unique_id', 'task', 'name', 'kwargs', 'status', 'progress_done',
+              'progress_total', 'message', 'time_created', 'time_started', 'time_eta')
+
+# Functions jobs can run, by task name
+_tasks = {}
+
+
+class JobError(Exception):
+    pass
+
+
+class JobCanceled(Exception):
+    def __init__(self):
+        super().__init__("Canceled")
+
+
+def job_task(name, cancelable=True):
+    """
+    Register a function as a task jobs can run. The function is called with
+    the JobProgress of the job and the keyword arguments the job was
+    submitted with, and what it returns (JSON) is saved as the job's result.
+    """
+    def register(function):
+        _tasks[name] = {'function': function, 'cancelable': cancelable}
+        return function
+    return register
+
+
+def job_status(job, now=None):
+    """ A job as a dict, with its progress in percent and seconds remaining """
+    now = now or time.time()
+    status = {field: getattr(job, field) for field in (
+        'unique_id', 'task', 'name', 'status', 'progress_done', 'progress_total', 'message',
+        'error', 'cancel_requested', 'time_created', 'time_started', 'time_finished')}
+    status['result'] = json.loads(job.result) if job.result else None
+    status['cancelable'] = (job.status in JOB_ACTIVE and
+                            _tasks.get(job.task, {}).get('cancelable', True))
+    if job.status == JOB_FINISHED:
+        status['progress'] = 100.0
+    elif job.progress_total:
+        status['progress'] = round(100.0 * min(job.progress_done / job.progress_total, 1.0), 1)
+    else:
+        status['progress'] = None
+    if job.status == JOB_RUNNING and job.time_eta:
+        status['remaining'] = max(int(job.time_eta - now), 0)
+    else:
+        status['remaining'] = None
+    return status
+
+
+class JobProgress:
+    """ Passed to the task of a running job to report its progress """
+    def __init__(self, runner, fields, cancelable):
+        self.runner = runner
+        self.fields = fields
+        self.unique_id = fields['unique_id']
+        self.cancelable = cancelable
+        self._first = None
+        self._saved = 0
+
+    def progress(self, done=None, total=None, message=None):
+        """
+        Save the progress of the job, at most every JOB_PROGRESS_INTERVAL
+        seconds unless the message changes or the job is done. The time the
+        job finishes is estimated from the rate of progress since this run
+        (or stage) of the job began. Raises JobCanceled if the job is to be
+        canceled.
+        """
+        now = time.time()
+        values = {}
+        if done is not None:
+            values['progress_done'] = done
+        if total is not None:
+            values['progress_total'] = total
+        if message is not None and message != self.fields['message']:
+            values['message'] = message
+        done = self.fields['progress_done'] if done is None else done
+        total = self.fields['progress_total'] if total is None else total
+        if (self._first is None or done < self._first[1] or
+                total != self.fields['progress_total']):
+            self._first = (now, done)  # Began, or began another stage
+        elif total and done > self._first[1]:
+            rate = (done - self._first[1]) / (now - self._first[0])
+            values['time_eta'] = now + (total - done) / rate
+
+        if ('message' in values or (total and done >= total) or
+                now - self._saved >= JOB_PROGRESS_INTERVAL):
+            self._saved = now
+            if self.runner.save(self, **values) and self.cancelable:
+                raise JobCanceled()
+        else:
+            self.fields.update(values)
+
+    def check_canceled(self):
+        """ Raise JobCanceled if the job is to be canceled """
+        if self.cancelable and self.runner.save(self):
+            raise JobCanceled()
+
+
+class JobRunner:
+    """
+    Runs jobs saved in the job table with a pool of worker threads. Any
+    process may submit a job, but only the process the runner was started
+    in (the frontend) runs them, one job of a task at a time. Workers are
+    woken when a job is submitted in the same process, and otherwise check
+    for queued jobs every JOB_POLL_INTERVAL seconds.
+    """
+    def __init__(self, db_uri=MYCODO_DB_PATH, workers=JOB_WORKERS):
+        self.db_uri = db_uri
+        self.workers = workers
+        self.app = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def start(self, app=None):
+        """ Start the workers, running tasks in the app context of app """
+        with self._lock:
+            if self._threads:
+                return
+            self.app = app
+            if app:
+                self.db_uri = app.config['SQLALCHEMY_DATABASE_URI']
+            self._recover()
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name='job_worker_{}'.format(index), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _recover(self):
+        """ End the jobs that were running when the frontend last stopped """
+        now = time.time()
+        with session_scope(self.db_uri) as new_session:
+            for job in new_session.query(Job).filter(Job.status == JOB_RUNNING).all():
+                if job.progress_total and job.progress_done >= job.progress_total:
+                    job.status = JOB_FINISHED  # e.g. the frontend was reloaded by the job
+                else:
+                    job.status = JOB_INTERRUPTED
+                    job.error = "Interrupted by a restart of the frontend"
+                job.time_finished = now
+            for job in new_session.query(Job).filter(
+                    Job.status.notin_(JOB_ACTIVE)).order_by(
+                    Job.id.desc()).offset(JOB_HISTORY).all():
+                new_session.delete(job)
+
+    def submit(self, task, name, **kwargs):
+        """ Queue a job, returning its unique ID """
+        unique_id = set_uuid()
+        with session_scope(self.db_uri) as new_session:
+            if new_session.query(Job).filter(
+                    Job.task == task, Job.status.in_(JOB_ACTIVE)).count():
+                raise JobError("{} is already queued or running".format(name))
+            new_session.add(Job(
+                unique_id=unique_id, task=task, name=name, kwargs=json.dumps(kwargs),
+                status=JOB_QUEUED, time_created=time.time()))
+        self._wake.set()
+        logger.info("Queued job {}: {}".format(unique_id, name))
+        return unique_id
+
+    def cancel(self, unique_id):
+        """ Cancel a queued job, or ask a running job to stop """
+        with session_scope(self.db_uri) as new_session:
+            job = new_session.query(Job).filter(Job.unique_id == unique_id).first()
+            if not job:
+                raise JobError("Job not found: {}".format(unique_id))
+            if job.status == JOB_QUEUED:
+                job.status = JOB_CANCELED
+                job.time_finished = time.time()
+            elif job.status == JOB_RUNNING:
+                if not _tasks.get(job.task, {}).get('cancelable', True):
+                    raise JobError("{} can't be canceled".format(job.name))
+                job.cancel_requested = True
+            else:
+                raise JobError("{} isn't queued or running".format(job.name))
+
+    def save(self, job, **values):
+        """ Save values of a running job, returning whether it's to be canceled """
+        job.fields.update(values)
+        try:
+            with session_scope(self.db_uri) as new_session:
+                row = new_session.query(Job).filter(Job.unique_id == job.unique_id).first()
+                if row is None:
+                    row = Job(**job.fields)
+                    new_session.add(row)
+                else:
+                    for field, value in values.items():
+                        setattr(row, field, value)
+                return bool(row.cancel_requested)
+        except Exception:
+            logger.exception("Saving job {}".format(job.unique_id))
+            return False
+
+    def _claim(self):
+        """ Mark the oldest queued job of a task this process runs as running """
+        with session_scope(self.db_uri) as new_session:
+            for job in new_session.query(Job).filter(
+                    Job.status == JOB_QUEUED, Job.task.in_(list(_tasks))).order_by(Job.id).all():
+                fields = {field: getattr(job, field) for field in JOB_FIELDS}
+                fields.update(status=JOB_RUNNING, time_started=time.time(), time_eta=None)
+                if new_session.query(Job).filter(
+                        Job.id == job.id, Job.status == JOB_QUEUED).update(
+                        {'status': JOB_RUNNING, 'time_started': fields['time_started']},
+                        synchronize_session=False):
+                    return fields
+        return None
+
+    def _work(self):
+        while True:
+            try:
+                fields = self._claim()
+            except Exception:
+                logger.exception("Claiming a job")
+                fields = None
+            if fields is None:
+                self._wake.wait(JOB_POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            self.run(fields)
+
+    def run(self, fields):
+        """ Run a claimed job and save how it ended """
+        task = _tasks[fields['task']]
+        job = JobProgress(self, fields, task['cancelable'])
+        logger.info("Running job {}: {}".format(job.unique_id, fields['name']))
+        try:
+            with self.app.app_context() if self.app else nullcontext():
+                result = task['function'](job, **json.loads(fields['kwargs'] or '{}'))
+        except JobCanceled:
+            logger.info("Canceled job {}: {}".format(job.unique_id, fields['name']))
+            self.save(job, status=JOB_CANCELED, time_finished=time.time(), time_eta=None)
+        except Exception as err:
+            logger.exception("Job {}: {}".format(job.unique_id, fields['name']))
+            self.save(job, status=JOB_FAILED, error=str(err),
+                      time_finished=time.time(), time_eta=None)
+        else:
+            self.save(job, status=JOB_FINISHED, result=json.dumps(result),
+                      time_finished=time.time(), time_eta=None)
+
+
+job_runner = JobRunner()
@@ -0,0 +1,261 @@
+# coding=utf-8
+#
+#  log_reader.py - Read the end of logs, and what was written since
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import os
+import re
+import threading
+from collections import OrderedDict
+from collections import deque
+
+from mycodo.config import LOG_FOLLOW_MAX_BYTES
+from mycodo.config import LOG_INDEX_RECORDS
+from mycodo.config import LOG_READ_CHUNK_SIZE
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+# Start of the lines of the daemon log: "2020-01-01 00:00:00,000 - INFO - mycodo.daemon - "
+RECORD_HEADER = re.compile(rb'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} - ([A-Z]+) - (\S+) - ')
+
+# Indexes of the logs, by path and filter, least recently used first
+LOG_INDEXES_MAX = 16
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+class LogFilter:
+    """
+    The records of a log to show: those at or above a level, of a logger
+    (or its children) and containing text. Filtering by level or logger
+    groups the lines that follow a line with a logging header (such as a
+    traceback) with it.
+    """
+    def __init__(self, level=None, logger=None, text=None):
+        self.level = LOG_LEVELS.get(level) if level else None
+        self.logger = logger.encode('utf-8') if logger else None
+        self.text = text.encode('utf-8') if text else None
+        self.grouped = bool(self.level or self.logger)
+        self.key = (self.level, self.logger, self.text)
+
+    def __bool__(self):
+        return any(self.key)
+
+    def matches(self, record):
+        if self.grouped:
+            header = RECORD_HEADER.match(record)
+            if not header:
+                return False
+            if self.level and LOG_LEVELS.get(header.group(1).decode(), 0) < self.level:
+                return False
+            if self.logger and not (header.group(2) == self.logger or
+                                    header.group(2).startswith(self.logger + b'.')):
+                return False
+        return self.text is None or self.text in record
+
+
+def records(data, start, grouped=False):
+    """ (offset, bytes) of each record of complete lines read from offset start """
+    found = []
+    offset = start
+    for line in data.split(b'\n')[:-1]:
+        line += b'\n'
+        if grouped and found and not RECORD_HEADER.match(line):
+            found[-1] = (found[-1][0], found[-1][1] + line)
+        else:
+            found.append((offset, line))
+        offset += len(line)
+    return found
+
+
+def read_range(log_file, start, end):
+    log_file.seek(start)
+    return log_file.read(end - start)
+
+
+def complete_end(log_file, size):
+    """ Offset after the last complete line (the last line may be being written) """
+    position = size
+    while position > 0:
+        read = min(LOG_READ_CHUNK_SIZE, position)
+        newline = read_range(log_file, position - read, position).rfind(b'\n')
+        if newline != -1:
+            return position - read + newline + 1
+        position -= read
+    return 0
+
+
+def tail_lines(log_file, end, lines):
+    """ The last lines before end, reading back from end a chunk at a time """
+    position = end
+    data = b''
+    while position > 0 and data.count(b'\n') <= lines:
+        read = min(LOG_READ_CHUNK_SIZE, position)
+        position -= read
+        data = read_range(log_file, position, position + read) + data
+    split = data.split(b'\n')[:-1]
+    if position > 0:
+        split = split[1:]  # Partial line
+    return [line + b'\n' for line in split[-lines:]] if lines else []
+
+
+class LogIndex:
+    """
+    Offsets of the records of a log file matching a filter. The file is only
+    read from where it was last indexed, up to its last record, which is
+    read again as it may still be written to (e.g. a traceback).
+    """
+    def __init__(self, log_filter):
+        self.filter = log_filter
+        self.inode = None
+        self.indexed = 0
+        self.offsets = deque(maxlen=LOG_INDEX_RECORDS)
+
+    def update(self, log_file, inode, end):
+        """ Index the file up to end, returning the last (open) record if it matches """
+        if inode != self.inode or end < self.indexed:
+            self.inode = inode
+            self.indexed = 0
+            self.offsets.clear()
+        size = LOG_READ_CHUNK_SIZE
+        while True:
+            stop = min(self.indexed + size, end)
+            data = read_range(log_file, self.indexed, stop)
+            found = records(data[:data.rfind(b'\n') + 1], self.indexed, self.filter.grouped)
+            if stop < end and len(found) < 2:
+                size *= 2  # A record longer than the read
+                continue
+            for offset, record in found[:-1]:
+                if self.filter.matches(record):
+                    self.offsets.append((offset, offset + len(record)))
+            if found:
+                self.indexed = found[-1][0]
+            if stop == end:
+                return [(offset, offset + len(record)) for offset, record in found[-1:]
+                        if self.filter.matches(record)]
+            size = LOG_READ_CHUNK_SIZE
+
+
+def _index(path, log_filter, inode):
+    """ The index of a log file, moving the index of a log to its rotated log """
+    key = (path, log_filter.key)
+    if path.endswith('.1'):
+        current = (path[:-2], log_filter.key)
+        if current in _indexes and _indexes[current].inode == inode:
+            _indexes[key] = _indexes.pop(current)
+    if key not in _indexes:
+        _indexes[key] = LogIndex(log_filter)
+    _indexes.move_to_end(key)
+    while len(_indexes) > LOG_INDEXES_MAX:
+        _indexes.popitem(last=False)
+    return _indexes[key]
+
+
+def _open_log(path):
+    """ The open log file, its inode and the end of its complete lines """
+    try:
+        log_file = open(path, 'rb')
+    except OSError:
+        return None
+    st = os.fstat(log_file.fileno())
+    return log_file, st.st_ino, complete_end(log_file, st.st_size)
+
+
+def _tail(logs, lines, log_filter):
+    """ The last lines (or records matching the filter) of logs, oldest log first """
+    if not log_filter:
+        text = []
+        for log_file, _, end in reversed(logs):
+            text[:0] = tail_lines(log_file, end, lines - len(text))
+        return text
+
+    matched = []
+    with _lock:
+        for log_file, inode, end in logs:
+            index = _index(log_file.name, log_filter, inode)
+            open_record = index.update(log_file, inode, end)
+            matched.extend((log_file, start, stop) for start, stop in list(index.offsets) + open_record)
+    return [read_range(log_file, start, stop) for log_file, start, stop in matched[-lines:]]
+
+
+def _since(logs, offset, inode, log_filter):
+    """
+    The records written since offset of the log file inode, or None if the
+    offset isn't in the file (e.g. it was truncated), the file is no longer
+    the log or its rotated log, or too much was written since.
+    """
+    if offset < 0:
+        return None
+    log_file, current_inode, end = logs[-1]
+    if inode == current_inode and offset <= end:
+        parts = [(log_file, offset, end)]
+    elif len(logs) == 2 and inode == logs[0][1] and offset <= logs[0][2]:
+        parts = [(logs[0][0], offset, logs[0][2]), (log_file, 0, end)]
+    else:
+        return None
+    if sum(stop - start for _, start, stop in parts) > LOG_FOLLOW_MAX_BYTES:
+        return None
+
+    text = []
+    for index, (each_file, start, stop) in enumerate(parts):
+        found = records(read_range(each_file, start, stop), start, log_filter.grouped)
+        if (index == 0 and found and log_filter.grouped and
+                not RECORD_HEADER.match(found[0][1])):
+            # The rest of a record written before offset (e.g. a traceback)
+            header = [line for line in tail_lines(each_file, start, 100)
+                      if RECORD_HEADER.match(line)]
+            if header and log_filter.matches(header[-1]):
+                text.append(found[0][1])
+            found = found[1:]
+        text.extend(record for _, record in found if log_filter.matches(record))
+    return text
+
+
+def read_log(path, lines, log_filter=None, offset=None, inode=None):
+    """
+    Read the last lines of a log and its rotated log (path.1), or the last
+    records matching a filter. Given the offset and inode of a previous read,
+    only what was written since is read, following the log across rotation.
+    Returns None if the log doesn't exist, otherwise the text, the offset and
+    inode to read from next, and whether the text replaces the text of
+    previous reads (rather than following it).
+    """
+    log_filter = log_filter or LogFilter()
+    logs = [log for log in (_open_log(path + '.1'), _open_log(path)) if log]
+    if not logs or logs[-1][0].name != path:
+        for log_file, _, _ in logs:
+            log_file.close()
+        return None
+    try:
+        text = None
+        if offset is not None and inode is not None:
+            text = _since(logs, offset, inode, log_filter)
+        reset = text is None
+        if reset:
+            text = _tail(logs, lines, log_filter)
+        return {
+            'text': b''.join(text).decode('utf-8', errors='replace'),
+            'offset': logs[-1][2],
+            'inode': logs[-1][1],
+            'reset': reset
+        }
+    finally:
+        for log_file, _, _ in logs:
+            log_file.close()
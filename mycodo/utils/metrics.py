@@ -0,0 +1,74 @@
+# coding=utf-8
+#
+#  metrics.py - Counts and latencies of queued work, for daemon status
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import threading
+import time
+
+
+class ActionMetrics:
+    """ Thread-safe counts and queue/run latencies of each category of action """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _category(self, category):
+        if category not in self._metrics:
+            self._metrics[category] = {
+                'queued': 0,
+                'running': 0,
+                'completed': 0,
+                'failed': 0,
+                'wait_sec_total': 0.0,
+                'wait_sec_max': 0.0,
+                'run_sec_total': 0.0,
+                'run_sec_max': 0.0
+            }
+        return self._metrics[category]
+
+    def queued(self, category):
+        with self._lock:
+            self._category(category)['queued'] += 1
+
+    def started(self, category, queued_time):
+        """ Record the start of an action that was queued at queued_time (monotonic) """
+        wait = time.monotonic() - queued_time
+        with self._lock:
+            metrics = self._category(category)
+            metrics['queued'] -= 1
+            metrics['running'] += 1
+            metrics['wait_sec_total'] += wait
+            metrics['wait_sec_max'] = max(metrics['wait_sec_max'], wait)
+        return time.monotonic()
+
+    def finished(self, category, start_time, failed=False):
+        run = time.monotonic() - start_time
+        with self._lock:
+            metrics = self._category(category)
+            metrics['running'] -= 1
+            metrics['failed' if failed else 'completed'] += 1
+            metrics['run_sec_total'] += run
+            metrics['run_sec_max'] = max(metrics['run_sec_max'], run)
+
+    def snapshot(self):
+        """ Return a copy of the metrics of each category """
+        with self._lock:
+            return {category: dict(metrics) for category, metrics in self._metrics.items()}
@@ -0,0 +1,234 @@
+# coding=utf-8
+#
+#  output_ramp.py - Scheduled PWM duty cycle ramps for the Output controller
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import bisect
+import logging
+import math
+import threading
+import time
+
+from mycodo.config import OUTPUT_RAMP_PERIOD
+
+logger = logging.getLogger("mycodo.output_ramp")
+
+# Steepness of the exponential curve (larger is slower to start, faster to end)
+EXPONENTIAL_RATE = 4.0
+
+
+def curve_linear(fraction):
+    return fraction
+
+
+def curve_exponential(fraction):
+    return math.expm1(EXPONENTIAL_RATE * fraction) / math.expm1(EXPONENTIAL_RATE)
+
+
+RAMP_CURVES = {
+    'linear': curve_linear,
+    'exponential': curve_exponential
+}
+
+
+def curve_from_points(points):
+    """
+    Create a curve that linearly interpolates between points
+
+    :param points: list of [fraction of duration, fraction of duty cycle change],
+        each from 0 to 1 (e.g. [[0, 0], [0.5, 0.8], [1, 1]])
+    :return: function of fraction of duration
+    """
+    points = sorted((float(t), float(v)) for t, v in points)
+    if len(points) < 2:
+        raise ValueError("A ramp curve requires at least two points")
+    times = [each[0] for each in points]
+
+    def curve(fraction):
+        index = bisect.bisect_right(times, fraction)
+        if index == 0:
+            return points[0][1]
+        if index == len(points):
+            return points[-1][1]
+        (t0, v0), (t1, v1) = points[index - 1], points[index]
+        if t1 == t0:
+            return v1
+        return v0 + (v1 - v0) * (fraction - t0) / (t1 - t0)
+
+    return curve
+
+
+class PWMRamp:
+    """ Change of an output channel's duty cycle over a duration, following a curve """
+    def __init__(self, output_id, output_channel, start_duty_cycle, end_duty_cycle,
+                 duration, curve='linear', points=None, increment=None,
+                 period=OUTPUT_RAMP_PERIOD):
+        if duration <= 0:
+            raise ValueError("Ramp duration must be greater than 0")
+        if points:
+            self.curve = 'points'
+            self._curve = curve_from_points(points)
+        elif curve in RAMP_CURVES:
+            self.curve = curve
+            self._curve = RAMP_CURVES[curve]
+        else:
+            raise ValueError("Unknown ramp curve '{}'".format(curve))
+
+        self.output_id = output_id
+        self.output_channel = output_channel
+        self.start_duty_cycle = float(start_duty_cycle)
+        self.end_duty_cycle = float(end_duty_cycle)
+        self.duration = float(duration)
+        self.increment = float(increment) if increment else None
+        self.period = period
+
+        self.started = time.monotonic()
+        self.started_epoch = time.time()
+        self.next_update = self.started
+        self.duty_cycle = None
+        self.finished = False
+
+    @property
+    def key(self):
+        return self.output_id, self.output_channel
+
+    def target(self, elapsed):
+        """ Duty cycle the ramp should be at after elapsed seconds """
+        if elapsed >= self.duration:
+            return self.end_duty_cycle
+        fraction = self._curve(max(0.0, elapsed / self.duration))
+        duty_cycle = self.start_duty_cycle + (self.end_duty_cycle - self.start_duty_cycle) * fraction
+        if self.increment:
+            duty_cycle = round(duty_cycle / self.increment) * self.increment
+        return round(min(100.0, max(0.0, duty_cycle)), 3)
+
+    def advance(self, now):
+        """
+        Move the ramp to time now and schedule the next update
+
+        :return: the new duty cycle, or None if it hasn't changed since the last
+            update and the ramp hasn't finished (the end of a ramp is always returned)
+        """
+        elapsed = now - self.started
+        self.finished = elapsed >= self.duration
+        self.next_update = min(now + self.period, self.started + self.duration)
+        duty_cycle = self.target(elapsed)
+        if duty_cycle == self.duty_cycle and not self.finished:
+            return
+        self.duty_cycle = duty_cycle
+        return duty_cycle
+
+    def status(self):
+        return {
+            'output_id': self.output_id,
+            'output_channel': self.output_channel,
+            'start_duty_cycle': self.start_duty_cycle,
+            'end_duty_cycle': self.end_duty_cycle,
+            'duration': self.duration,
+            'curve': self.curve,
+            'started': self.started_epoch,
+            'duty_cycle': self.duty_cycle,
+            'remaining': max(0.0, self.started + self.duration - time.monotonic())
+        }
+
+
+class RampScheduler(threading.Thread):
+    """
+    Applies the duty cycles of all active ramps from a single thread that
+    sleeps until the next ramp is due. There is at most one ramp per output
+    channel; starting a new ramp on a channel supersedes the previous one.
+
+    :param set_duty_cycle: function(output_id, output_channel, duty_cycle, finished)
+    """
+    def __init__(self, set_duty_cycle):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.set_duty_cycle = set_duty_cycle
+        self.running = True
+        self._ramps = {}
+        self._condition = threading.Condition()
+
+    def add(self, ramp):
+        """ Start a ramp, returning the ramp it superseded (or None) """
+        with self._condition:
+            superseded = self._ramps.get(ramp.key)
+            self._ramps[ramp.key] = ramp
+            self._condition.notify()
+        return superseded
+
+    def cancel(self, output_id, output_channel=None):
+        """ Cancel the ramp on an output channel (or all channels if None), returning the cancelled ramps """
+        with self._condition:
+            keys = [key for key in self._ramps
+                    if key[0] == output_id and output_channel in (None, key[1])]
+            return [self._ramps.pop(key) for key in keys]
+
+    def status(self):
+        """ Return the status of all active ramps """
+        with self._condition:
+            return [each.status() for each in self._ramps.values()]
+
+    def stop(self):
+        with self._condition:
+            self.running = False
+            self._ramps.clear()
+            self._condition.notify()
+
+    def _due(self):
+        """ Wait until at least one ramp is due and return the due ramps """
+        with self._condition:
+            while self.running:
+                now = time.monotonic()
+                due = [each for each in self._ramps.values() if each.next_update <= now]
+                if due:
+                    return now, due
+                timeout = None
+                if self._ramps:
+                    timeout = min(each.next_update for each in self._ramps.values()) - now
+                self._condition.wait(timeout)
+            return None, []
+
+    def _is_active(self, ramp):
+        with self._condition:
+            return self._ramps.get(ramp.key) is ramp
+
+    def _remove(self, ramp):
+        with self._condition:
+            if self._ramps.get(ramp.key) is ramp:
+                del self._ramps[ramp.key]
+
+    def run(self):
+        while self.running:
+            now, due = self._due()
+            for each_ramp in due:
+                duty_cycle = each_ramp.advance(now)
+                try:
+                    if duty_cycle is not None and self._is_active(each_ramp):
+                        self.set_duty_cycle(
+                            each_ramp.output_id,
+                            each_ramp.output_channel,
+                            duty_cycle,
+                            each_ramp.finished)
+                except Exception:
+                    logger.exception("Could not set duty cycle of ramp on output {} CH{}".format(
+                        each_ramp.output_id, each_ramp.output_channel))
+                    each_ramp.finished = True
+                if each_ramp.finished:
+                    self._remove(each_ramp)
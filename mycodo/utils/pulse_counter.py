@@ -0,0 +1,193 @@
+# coding=utf-8
+#
+#  pulse_counter.py - Continuous pigpio pulse counting shared by pulse Inputs
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import logging
+import threading
+
+from mycodo.config import PULSE_RING_SIZE
+
+logger = logging.getLogger("mycodo.pulse_counter")
+
+
+def tick_diff(tick_1, tick_2):
+    """ Microseconds from tick_1 to tick_2, allowing for the 32-bit pigpio tick wrapping """
+    return (tick_2 - tick_1) & 0xFFFFFFFF
+
+
+class PulseCounter:
+    """
+    Counts the rising edges of a GPIO and keeps the ticks of the most recent
+    pulses in a ring. The pigpio callback thread is the only writer: it stores
+    the tick before incrementing count, so readers never need a lock and only
+    ever see slots that have been written.
+
+    :param current_tick: function returning the current pigpio tick
+    """
+    def __init__(self, gpio, current_tick, ring_size=PULSE_RING_SIZE):
+        self.gpio = gpio
+        self.current_tick = current_tick
+        self.count = 0
+        self.callback = None
+        self._size = ring_size
+        self._ticks = [0] * ring_size
+
+    def pulse(self, gpio, level, tick):
+        """ pigpio callback """
+        if level != 1:  # Rising edge
+            return
+        self._ticks[self.count % self._size] = tick
+        self.count += 1
+
+    def period(self, window):
+        """
+        Mean microseconds between the pulses of the last window seconds. If fewer
+        than two pulses occurred in the window, the last period is used. The time
+        since the last pulse is a lower bound, so the period grows (and the rate
+        falls) when the pulses slow down or stop.
+
+        :return: period (microseconds) or None if fewer than two pulses were counted
+        """
+        count = self.count
+        if count < 2:
+            return
+        now = self.current_tick()
+        window_us = window * 1000000
+        newest = self._ticks[(count - 1) % self._size]
+
+        pulses = 1
+        oldest = newest
+        for index in range(2, min(count, self._size) + 1):
+            tick = self._ticks[(count - index) % self._size]
+            if tick_diff(tick, now) > window_us:
+                break
+            pulses = index
+            oldest = tick
+
+        if pulses > 1:
+            period = tick_diff(oldest, newest) / (pulses - 1)
+        else:
+            period = tick_diff(self._ticks[(count - 2) % self._size], newest)
+        return max(period, tick_diff(newest, now))
+
+
+class PulseReader:
+    """
+    An Input's view of a shared PulseCounter: the pulses since its previous
+    read and the pulse rate, smoothed by weighting (0 to 0.99, how much the
+    previous rate affects the new rate).
+    """
+    def __init__(self, counter, weighting=0.0):
+        self.counter = counter
+        self.weighting = min(0.99, max(0.0, weighting or 0.0))
+        self.last_count = counter.count
+        self.last_rate = None
+
+    @property
+    def gpio(self):
+        return self.counter.gpio
+
+    def pulses(self):
+        """ Pulses counted since the previous call """
+        count = self.counter.count
+        pulses = count - self.last_count
+        self.last_count = count
+        return pulses
+
+    def rate(self, window):
+        """ Pulses per second over the last window seconds """
+        period = self.counter.period(window)
+        rate = 1000000.0 / period if period else 0.0
+        if self.last_rate is not None:
+            rate = (self.weighting * self.last_rate) + ((1.0 - self.weighting) * rate)
+        self.last_rate = rate
+        return rate
+
+
+class PulseCounterService:
+    """
+    One pigpiod connection and one continuously registered callback per GPIO,
+    shared by all Inputs that count pulses. Callbacks are registered by the
+    first subscriber of a GPIO and cancelled when its last subscriber leaves.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pigpio = None
+        self._pi = None
+        self._counters = {}
+        self._subscribers = {}
+
+    def _connect(self):
+        if self._pi is None:
+            import pigpio
+            pi = pigpio.pi()
+            if not pi.connected:
+                raise ConnectionError(
+                    "Could not connect to pigpiod. Ensure it is running and try again.")
+            self._pigpio = pigpio
+            self._pi = pi
+        return self._pi
+
+    def subscribe(self, gpio, weighting=0.0):
+        """ Start counting the pulses of gpio (if not already), returning a PulseReader """
+        gpio = int(gpio)
+        with self._lock:
+            if gpio not in self._counters:
+                pi = self._connect()
+                counter = PulseCounter(gpio, pi.get_current_tick)
+                pi.set_mode(gpio, self._pigpio.INPUT)
+                counter.callback = pi.callback(gpio, self._pigpio.RISING_EDGE, counter.pulse)
+                self._counters[gpio] = counter
+                self._subscribers[gpio] = 0
+                logger.debug("Counting pulses on GPIO {}".format(gpio))
+            self._subscribers[gpio] += 1
+            return PulseReader(self._counters[gpio], weighting)
+
+    def unsubscribe(self, reader):
+        """ Stop counting the pulses of a reader's GPIO if it has no other readers """
+        with self._lock:
+            gpio = reader.gpio
+            if gpio not in self._subscribers:
+                return
+            self._subscribers[gpio] -= 1
+            if self._subscribers[gpio] > 0:
+                return
+            counter = self._counters.pop(gpio)
+            del self._subscribers[gpio]
+            try:
+                counter.callback.cancel()
+            except Exception:
+                logger.exception("Could not cancel callback of GPIO {}".format(gpio))
+            logger.debug("Stopped counting pulses on GPIO {}".format(gpio))
+            if not self._counters and self._pi is not None:
+                self._pi.stop()
+                self._pi = None
+
+    def status(self):
+        """ Return the total pulses and subscribers of each counted GPIO """
+        with self._lock:
+            return {
+                gpio: {'pulses': counter.count, 'subscribers': self._subscribers[gpio]}
+                for gpio, counter in self._counters.items()
+            }
+
+
+pulse_counters = PulseCounterService()
@@ -3,6 +3,8 @@ import logging
 import smtplib
 import socket
 import sys
+import time
+from collections import namedtuple
 from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
@@ -10,6 +12,9 @@ from email.mime.text import MIMEText
 
 import os
 
+from mycodo.config import SMTP_IDLE_TIMEOUT
+from mycodo.config import SMTP_TIMEOUT
+
 # from mycodo.utils.system_pi import cmd_output
 # from mycodo.utils.system_pi import set_user_grp
 
@@ -20,6 +25,148 @@ logger = logging.getLogger("mycodo.notification")
 # Email notification
 #
 
+
+SMTPSettings = namedtuple('SMTPSettings', [
+    'host', 'protocol', 'port', 'user', 'passw', 'email_from'])
+
+
+def compose_email(smtp_email_from, recipients, message_body,
+                  subject=None, attachment_file=None):
+    """ Create the email (as a string) with an optional file attachment """
+    # Create the enclosing (outer) message
+    outer = MIMEMultipart()
+    if subject:
+        outer['Subject'] = subject
+    else:
+        outer['Subject'] = "Mycodo Notification ({})".format(
+            socket.gethostname())
+    outer['To'] = ', '.join(recipients)
+    outer['From'] = smtp_email_from
+    outer.preamble = 'You will not see this in a MIME-aware mail reader.\n'
+
+    # Add message body
+    outer.attach(MIMEText(message_body, 'plain'))  # or 'html'
+
+    # Add the attachments to the message
+    if attachment_file:
+        attachments = [attachment_file]
+        for file in attachments:
+            try:
+                with open(file, 'rb') as fp:
+                    msg = MIMEBase('application', "octet-stream")
+                    msg.set_payload(fp.read())
+                encoders.encode_base64(msg)
+                msg.add_header(
+                    'Content-Disposition',
+                    'attachment',
+                    filename=os.path.basename(file))
+                outer.attach(msg)
+            except Exception:
+                logger.error("Unable to open one of the attachments. "
+                             "Error: {}".format(sys.exc_info()[0]))
+
+    return outer.as_string()
+
+
+def smtp_connect(smtp_host, smtp_protocol, smtp_port, smtp_user, smtp_pass):
+    """ Connect and log in to an SMTP server, returning the connection or None """
+    # determine port
+    port = None
+    if smtp_port:
+        port = smtp_port
+    elif smtp_protocol == 'ssl':
+        port = 465
+    elif smtp_protocol == 'tls':
+        port = 587
+    elif smtp_protocol in ['unencrypted', 'unencrypted_no_login']:
+        port = 25
+    else:
+        logger.error("Could not determine port to use to send email. Not sending.")
+        return
+
+    # select encryption protocol
+    response_login = None
+    if smtp_protocol == 'ssl':
+        server = smtplib.SMTP_SSL(smtp_host, port, timeout=SMTP_TIMEOUT)
+        response_login = server.login(smtp_user, smtp_pass)
+    elif smtp_protocol == 'tls':
+        server = smtplib.SMTP(smtp_host, port, timeout=SMTP_TIMEOUT)
+        server.starttls()
+        response_login = server.login(smtp_user, smtp_pass)
+    elif smtp_protocol == 'unencrypted':
+        server = smtplib.SMTP(smtp_host, port, timeout=SMTP_TIMEOUT)
+        response_login = server.login(smtp_user, smtp_pass)
+    elif smtp_protocol == 'unencrypted_no_login':
+        server = smtplib.SMTP(smtp_host, port, timeout=SMTP_TIMEOUT)
+    else:
+        logger.error("Unrecognized protocol: {}".format(smtp_protocol))
+        return
+
+    if response_login:
+        logger.debug("Email login response: {}".format(response_login))
+
+    return server
+
+
+class SMTPSession:
+    """
+    An SMTP connection that is kept open between emails and reused while it
+    stays connected, for up to idle_timeout seconds between emails.
+    """
+    def __init__(self, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.connections = 0
+        self._server = None
+        self._settings = None
+        self._last_used = 0
+
+    def _connection(self, settings):
+        if self._server and (settings != self._settings or
+                             time.monotonic() - self._last_used > self.idle_timeout):
+            self.close()
+        if self._server:
+            try:
+                self._server.noop()
+            except (smtplib.SMTPException, OSError):
+                self.close()
+        if not self._server:
+            self._server = smtp_connect(
+                settings.host, settings.protocol, settings.port,
+                settings.user, settings.passw)
+            self._settings = settings
+            if self._server:
+                self.connections += 1
+        return self._server
+
+    def send(self, settings, recipients, composed):
+        """
+        Send a composed email, reconnecting once if the server dropped the connection
+
+        :param settings: SMTPSettings
+        :return: success (0) or failure (1)
+        """
+        for _ in range(2):
+            server = self._connection(settings)
+            if not server:
+                return 1
+            try:
+                response_send = server.sendmail(settings.user, recipients, composed)
+                self._last_used = time.monotonic()
+                logger.debug("Email send response: {}".format(response_send))
+                return 0
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self.close()
+        return 1
+
+    def close(self):
+        if self._server:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+        self._server = None
+
+
 def send_email(smtp_host, smtp_protocol, smtp_port, smtp_user, smtp_pass,
                smtp_email_from, email_to, message_body, subject=None,
                attachment_file=None, attachment_type=False):
@@ -55,75 +202,14 @@ def send_email(smtp_host, smtp_protocol, smtp_port, smtp_user, smtp_pass,
     try:
         recipients = email_to if isinstance(email_to, list) else [email_to]
 
-        # Create the enclosing (outer) message
-        outer = MIMEMultipart()
-        if subject:
-            outer['Subject'] = subject
-        else:
-            outer['Subject'] = "Mycodo Notification ({})".format(
-                socket.gethostname())
-        outer['To'] = ', '.join(recipients)
-        outer['From'] = smtp_email_from
-        outer.preamble = 'You will not see this in a MIME-aware mail reader.\n'
-
-        # Add message body
-        outer.attach(MIMEText(message_body, 'plain'))  # or 'html'
-
-        # Add the attachments to the message
-        if attachment_file:
-            attachments = [attachment_file]
-            for file in attachments:
-                try:
-                    with open(file, 'rb') as fp:
-                        msg = MIMEBase('application', "octet-stream")
-                        msg.set_payload(fp.read())
-                    encoders.encode_base64(msg)
-                    msg.add_header(
-                        'Content-Disposition',
-                        'attachment',
-                        filename=os.path.basename(file))
-                    outer.attach(msg)
-                except Exception:
-                    logger.error("Unable to open one of the attachments. "
-                                 "Error: {}".format(sys.exc_info()[0]))
-
-        composed = outer.as_string()
-
-        # determine port
-        port = None
-        if smtp_port:
-            port = smtp_port
-        elif smtp_protocol == 'ssl':
-            port = 465
-        elif smtp_protocol == 'tls':
-            port = 587
-        elif smtp_protocol in ['unencrypted', 'unencrypted_no_login']:
-            port = 25
-        else:
-            logger.error("Could not determine port to use to send email. Not sending.")
-            return 1
+        composed = compose_email(
+            smtp_email_from, recipients, message_body,
+            subject=subject, attachment_file=attachment_file)
 
-        # select encryption protocol
-        response_login = None
-        if smtp_protocol == 'ssl':
-            server = smtplib.SMTP_SSL(smtp_host, port)
-            response_login = server.login(smtp_user, smtp_pass)
-        elif smtp_protocol == 'tls':
-            server = smtplib.SMTP(smtp_host, port)
-            server.starttls()
-            response_login = server.login(smtp_user, smtp_pass)
-        elif smtp_protocol == 'unencrypted':
-            server = smtplib.SMTP(smtp_host, port)
-            response_login = server.login(smtp_user, smtp_pass)
-        elif smtp_protocol == 'unencrypted_no_login':
-            server = smtplib.SMTP(smtp_host, port)
-        else:
-            logger.error("Unrecognized protocol: {}".format(smtp_protocol))
+        server = smtp_connect(smtp_host, smtp_protocol, smtp_port, smtp_user, smtp_pass)
+        if not server:
             return 1
 
-        if response_login:
-            logger.debug("Email login response: {}".format(response_login))
-
         # Send the email
         response_send = server.sendmail(smtp_user, recipients, composed)
         server.close()
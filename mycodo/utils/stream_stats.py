@@ -0,0 +1,498 @@
+# coding=utf-8
+#
+#  stream_stats.py - Incremental statistics of measurement streams
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import datetime
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from bisect import insort
+from collections import deque
+
+from mycodo.config import STATS_STREAM_IDLE
+
+logger = logging.getLogger("mycodo.stream_stats")
+
+
+class RunningStats:
+    """
+    Count, sum, mean and variance of values, updated with Welford's algorithm
+    as values are added or removed
+    """
+    def __init__(self, values=()):
+        self.count = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self._m2 = 0.0
+        for each_value in values:
+            self.add(each_value)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        """ Remove a value that was previously added """
+        if self.count <= 1:
+            self.__init__()
+            return
+        self.count -= 1
+        self.total -= value
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self._m2 = max(0.0, self._m2 - delta * (value - self.mean))
+
+    def variance(self, sample=True):
+        """ Sample (or population) variance, or None if there are too few values """
+        if self.count < (2 if sample else 1):
+            return
+        return self._m2 / (self.count - 1 if sample else self.count)
+
+    def stdev(self, sample=True):
+        variance = self.variance(sample=sample)
+        if variance is not None:
+            return variance ** 0.5
+
+
+class EMA:
+    """ Exponential moving average, where alpha (0 to 1) is the weight of each new value """
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.value = None
+
+    def add(self, value):
+        if self.value is None:
+            self.value = float(value)
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class P2Quantile:
+    """
+    Estimate of a quantile (e.g. 0.5 for the median) of all values added,
+    using the P-Square algorithm of Jain and Chlamtac, which keeps five markers
+    instead of the values
+    """
+    def __init__(self, quantile=0.5):
+        self.quantile = quantile
+        self.count = 0
+        self._heights = []
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * quantile, 1 + 4 * quantile, 3 + 2 * quantile, 5]
+        self._increments = [0, quantile / 2, quantile, (1 + quantile) / 2, 1]
+
+    def add(self, value):
+        self.count += 1
+        heights = self._heights
+        if len(heights) < 5:
+            insort(heights, value)
+            return
+
+        positions = self._positions
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+
+        for index in range(cell + 1, 5):
+            positions[index] += 1
+        for index in range(5):
+            self._desired[index] += self._increments[index]
+
+        for index in range(1, 4):
+            offset = self._desired[index] - positions[index]
+            if ((offset >= 1 and positions[index + 1] - positions[index] > 1) or
+                    (offset <= -1 and positions[index - 1] - positions[index] < -1)):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(index, step)
+                if not heights[index - 1] < height < heights[index + 1]:
+                    height = heights[index] + step * (
+                        (heights[index + step] - heights[index]) /
+                        (positions[index + step] - positions[index]))
+                heights[index] = height
+                positions[index] += step
+
+    def _parabolic(self, index, step):
+        heights = self._heights
+        positions = self._positions
+        return heights[index] + step / (positions[index + 1] - positions[index - 1]) * (
+            (positions[index] - positions[index - 1] + step) *
+            (heights[index + 1] - heights[index]) / (positions[index + 1] - positions[index]) +
+            (positions[index + 1] - positions[index] - step) *
+            (heights[index] - heights[index - 1]) / (positions[index] - positions[index - 1]))
+
+    def value(self):
+        if not self.count:
+            return
+        if self.count <= 5:
+            return self._heights[int(round(self.quantile * (self.count - 1)))]
+        return self._heights[2]
+
+
+class WindowStats:
+    """
+    Statistics of the values of a sliding window, limited to the last size values
+    and/or the values of the last duration seconds. The count, sum, mean and
+    standard deviation are updated as values enter and leave the window, the
+    minimum and maximum are kept in monotonic queues and the median in a
+    sorted list, so no statistic is recalculated from all values of the window.
+    """
+    def __init__(self, duration=None, size=None):
+        self.duration = duration
+        self.size = size
+        self.stats = RunningStats()
+        self._values = deque()  # (timestamp, value)
+        self._sorted = []
+        self._minimum = deque()  # (sequence, value), increasing
+        self._maximum = deque()  # (sequence, value), decreasing
+        self._next_sequence = 0
+        self._first_sequence = 0
+        self._removed = 0
+
+    def add(self, value, timestamp=None):
+        value = float(value)
+        timestamp = time.time() if timestamp is None else timestamp
+        sequence = self._next_sequence
+        self._next_sequence += 1
+
+        self._values.append((timestamp, value))
+        self.stats.add(value)
+        insort(self._sorted, value)
+        while self._minimum and self._minimum[-1][1] >= value:
+            self._minimum.pop()
+        self._minimum.append((sequence, value))
+        while self._maximum and self._maximum[-1][1] <= value:
+            self._maximum.pop()
+        self._maximum.append((sequence, value))
+
+        while self.size and len(self._values) > self.size:
+            self._pop()
+
+    def expire(self, now=None):
+        """ Remove the values older than duration seconds """
+        if not self.duration:
+            return
+        oldest = (time.time() if now is None else now) - self.duration
+        while self._values and self._values[0][0] < oldest:
+            self._pop()
+
+    def seed(self, points):
+        """
+        Add past (timestamp, value) points, older than the values already added,
+        e.g. the measurements stored before the window was created
+        """
+        current = list(self._values)
+        first = current[0][0] if current else None
+        self.__init__(duration=self.duration, size=self.size)
+        for timestamp, value in sorted(points):
+            if value is not None and (first is None or timestamp < first):
+                self.add(value, timestamp)
+        for timestamp, value in current:
+            self.add(value, timestamp)
+
+    def extend(self, points):
+        """
+        Add (timestamp, value) points newer than the newest value, e.g. the
+        measurements stored since by another process
+        """
+        newest = self.newest()
+        for timestamp, value in sorted(points):
+            if value is not None and (newest is None or timestamp > newest):
+                self.add(value, timestamp)
+                newest = timestamp
+
+    def newest(self):
+        """ Timestamp of the newest value, or None """
+        if self._values:
+            return self._values[-1][0]
+
+    def _pop(self):
+        _, value = self._values.popleft()
+        self.stats.remove(value)
+        del self._sorted[bisect_left(self._sorted, value)]
+        if self._minimum[0][0] == self._first_sequence:
+            self._minimum.popleft()
+        if self._maximum[0][0] == self._first_sequence:
+            self._maximum.popleft()
+        self._first_sequence += 1
+
+        # Recalculate once per window so rounding errors don't accumulate
+        self._removed += 1
+        if self._removed >= len(self._values):
+            self.stats = RunningStats(value for _, value in self._values)
+            self._removed = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def mean(self):
+        if self._values:
+            return self.stats.mean
+
+    def sum(self):
+        return self.stats.total
+
+    def stdev(self, sample=True):
+        return self.stats.stdev(sample=sample)
+
+    def minimum(self):
+        if self._minimum:
+            return self._minimum[0][1]
+
+    def maximum(self):
+        if self._maximum:
+            return self._maximum[0][1]
+
+    def median(self):
+        count = len(self._sorted)
+        if not count:
+            return
+        middle = count // 2
+        if count % 2:
+            return self._sorted[middle]
+        return (self._sorted[middle - 1] + self._sorted[middle]) / 2.0
+
+    def summary(self, now=None):
+        """ Return the statistics of the values of the window """
+        self.expire(now)
+        return {
+            'count': len(self._values),
+            'sum': self.sum(),
+            'mean': self.mean(),
+            'median': self.median(),
+            'minimum': self.minimum(),
+            'maximum': self.maximum(),
+            'stdev': self.stdev()
+        }
+
+
+def influx_time_to_epoch(time_str):
+    """ Epoch of an influxdb time string (e.g. 2019-04-15T18:07:00.392123456Z), or None """
+    match = re.match(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?Z$', time_str or '')
+    if not match:
+        return
+    epoch = datetime.datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S').replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+    return epoch + float(match.group(2)) if match.group(2) else epoch
+
+
+def epoch_to_influx_time(epoch):
+    """ Influxdb time string (e.g. 2019-04-15T18:07:00.392123Z) of an epoch """
+    return datetime.datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def influx_timestamp(point):
+    """ Epoch of an influxdb data point, or now if it has no time """
+    if 'time' in point:
+        epoch = influx_time_to_epoch(point['time'])
+        if epoch is not None:
+            return epoch
+    return time.time()
+
+
+def stream_key(unique_id, unit, channel, measure):
+    """ The stream of measurements of a device, unit, channel and measurement """
+    return unique_id, unit, str(channel) if channel is not None else None, measure or None
+
+
+def point_stream_key(point):
+    """ The stream of an influxdb data point (see format_influxdb_data()) """
+    tags = point['tags']
+    return stream_key(tags['device_id'], point['measurement'], tags.get('channel'), tags.get('measure'))
+
+
+class LatestValues:
+    """
+    The latest value of each measurement stream, updated as measurements are
+    written to influxdb. Functions subscribed to streams are called with the
+    stream key after each new value, from the thread that wrote it, so they
+    must return quickly.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}  # stream key: (timestamp, value)
+        self._subscribers = {}  # stream key: set of functions
+
+    def add_points(self, data):
+        """ Store the influxdb data points (see format_influxdb_data()) newer than the stored values """
+        notify = []
+        with self._lock:
+            for each_point in data:
+                key = point_stream_key(each_point)
+                timestamp = influx_timestamp(each_point)
+                stored = self._values.get(key)
+                if stored is None or timestamp >= stored[0]:
+                    self._values[key] = (timestamp, each_point['fields']['value'])
+                    notify.extend((function, key) for function in self._subscribers.get(key, ()))
+        for function, key in notify:
+            try:
+                function(key)
+            except Exception:
+                logger.exception("Notifying subscriber of {}".format(key))
+
+    def set(self, key, timestamp, value):
+        """ Store a value read from influxdb, if newer than the stored value """
+        with self._lock:
+            stored = self._values.get(key)
+            if stored is None or timestamp >= stored[0]:
+                self._values[key] = (timestamp, value)
+
+    def get(self, keys, max_age=None):
+        """
+        Return the latest (timestamp, value) of each stream, or None for the
+        streams without a value from the last max_age seconds
+        """
+        oldest = time.time() - max_age if max_age else None
+        with self._lock:
+            values = [self._values.get(each_key) for each_key in keys]
+        return [value if value and (oldest is None or value[0] >= oldest) else None
+                for value in values]
+
+    def subscribe(self, keys, function):
+        with self._lock:
+            for each_key in keys:
+                self._subscribers.setdefault(each_key, set()).add(function)
+
+    def unsubscribe(self, keys, function):
+        with self._lock:
+            for each_key in keys:
+                self._subscribers.get(each_key, set()).discard(function)
+                if not self._subscribers.get(each_key, True):
+                    del self._subscribers[each_key]
+
+    def status(self):
+        """ Return the number of stored streams and the subscribers of each stream """
+        with self._lock:
+            return {
+                'streams': len(self._values),
+                'subscribed': {
+                    ','.join(str(each) for each in key): len(functions)
+                    for key, functions in self._subscribers.items()
+                }
+            }
+
+
+class MeasurementStreams:
+    """
+    Sliding windows of the measurements of devices, updated as measurements
+    are written to influxdb by the daemon. A window is created (and seeded
+    with the stored measurements) when first queried, and removed when it
+    hasn't been queried for idle seconds. As measurements are also stored by
+    other processes (e.g. the API), each query adds the stored measurements
+    newer than the newest of the window.
+    """
+    def __init__(self, idle=STATS_STREAM_IDLE):
+        self.idle = idle
+        self._lock = threading.Lock()
+        self._windows = {}  # stream key: {duration: [WindowStats, last query, seeded Event]}
+
+    def add_points(self, data):
+        """ Add influxdb data points (see format_influxdb_data()) to the windows of their streams """
+        if not self._windows:
+            return
+        with self._lock:
+            for each_point in data:
+                windows = self._windows.get(point_stream_key(each_point))
+                if not windows:
+                    continue
+                timestamp = influx_timestamp(each_point)
+                for each_window in windows.values():
+                    each_window[0].add(each_point['fields']['value'], timestamp)
+
+    def query(self, unique_id, unit, channel, measure, duration, fetch=None):
+        """
+        Return the statistics (see WindowStats.summary()) of the last duration
+        seconds of measurements of a stream
+
+        :param fetch: function(since) returning the stored (timestamp, value)
+            points of the last duration seconds, since an epoch if not None.
+            It's called with None to seed the window when it's created, then
+            with the timestamp of the newest point of the window.
+        """
+        key = stream_key(unique_id, unit, channel, measure)
+        now = time.time()
+        with self._lock:
+            self._remove_idle(now)
+            windows = self._windows.setdefault(key, {})
+            created = duration not in windows
+            if created:
+                windows[duration] = [WindowStats(duration=duration), now, threading.Event()]
+            window = windows[duration]
+            window[1] = now
+
+        if created:
+            points = self._fetch(key, fetch, None)
+            with self._lock:
+                window[0].seed(points)
+            window[2].set()
+        else:
+            window[2].wait()
+            with self._lock:
+                since = window[0].newest()
+            points = self._fetch(key, fetch, since)
+            with self._lock:
+                window[0].extend(points)
+
+        with self._lock:
+            return window[0].summary(now)
+
+    @staticmethod
+    def _fetch(key, fetch, since):
+        if not fetch:
+            return []
+        try:
+            return fetch(since) or []
+        except Exception:
+            logger.exception("Could not fetch stored measurements of {}".format(key))
+            return []
+
+    def _remove_idle(self, now):
+        for key, windows in list(self._windows.items()):
+            for duration, window in list(windows.items()):
+                if now - window[1] > self.idle + (duration or 0):
+                    del windows[duration]
+            if not windows:
+                del self._windows[key]
+
+    def status(self):
+        """ Return the number of measurements in each window """
+        with self._lock:
+            return {
+                ','.join(str(each) for each in key): {
+                    duration: len(window[0]) for duration, window in windows.items()
+                } for key, windows in self._windows.items()
+            }
+
+
+measurement_streams = MeasurementStreams()
+latest_values = LatestValues()
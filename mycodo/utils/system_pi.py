@@ -21,6 +21,7 @@ from mycodo.config_devices_units import UNITS
 from mycodo.config_devices_units import UNIT_CONVERSIONS
 from mycodo.databases.models import DeviceMeasurements
 from mycodo.databases.models import Output
+from mycodo.utils.backup_store import BackupStore
 from mycodo.utils.database import db_retrieve_table
 from mycodo.utils.database import db_retrieve_table_daemon
 from mycodo.utils.logging_utils import set_log_level
@@ -518,7 +519,8 @@ def can_perform_backup():
     Returns value sin bytes
     """
     free_before = get_directory_free_space('/var/Mycodo-backups')
-    backup_size = get_directory_size(INSTALL_DIRECTORY, exclude=['env', 'cameras'])
+    # Only files changed since the last backup are stored
+    backup_size = BackupStore().changed_size(INSTALL_DIRECTORY)
     free_after = free_before - backup_size
     return backup_size, free_before, free_after
 
@@ -14,12 +14,15 @@ from mycodo.databases.models import DeviceMeasurements
 from mycodo.databases.models import EnergyUsage
 from mycodo.databases.models import Misc
 from mycodo.databases.models import Output
-from mycodo.utils.database import db_retrieve_table_daemon
+from mycodo.databases.models import OutputChannel
 from mycodo.utils.influx import average_past_seconds
 from mycodo.utils.influx import average_start_end_seconds
 from mycodo.utils.influx import output_sec_on
+from mycodo.utils.jobs import job_task
 from mycodo.utils.logging_utils import set_log_level
+from mycodo.utils.outputs import parse_output_information
 from mycodo.utils.system_pi import assure_path_exists
+from mycodo.utils.system_pi import parse_custom_option_values_channels_json
 from mycodo.utils.system_pi import return_measurement_info
 from mycodo.utils.system_pi import set_user_grp
 
@@ -333,78 +336,69 @@ def return_output_usage(
     return output_stats
 
 
-def generate_output_usage_report():
+@job_task('output_usage_report')
+def generate_output_usage_report(job):
     """
-    Generate output usage report in a csv file
+    Generate output usage report in a csv file, run as a job of the
+    frontend (the output information is queried in its app context)
 
     """
     logger.debug("Generating output usage report...")
-    try:
-        assure_path_exists(USAGE_REPORTS_PATH)
-
-        misc = db_retrieve_table_daemon(Misc, entry='first')
-        output = db_retrieve_table_daemon(Output)
-        output_usage = return_output_usage(misc, output.all())
-
-        timestamp = time.strftime("%Y-%m-%d_%H-%M")
-        file_name = 'output_usage_report_{ts}.csv'.format(ts=timestamp)
-        report_path_file = os.path.join(USAGE_REPORTS_PATH, file_name)
-
-        with open(report_path_file, 'wb') as f:
-            w = csv.writer(f)
-            # Header row
-            w.writerow([
-                 'Relay ID',
-                 'Relay Unique ID',
-                 'Relay Name',
-                 'Type',
-                 'Past Day',
-                 'Past Week',
-                 'Past Month',
-                 'Past Month (from {})'.format(misc.output_usage_dayofmonth),
-                 'Past Year'
-            ])
-            for key, value in output_usage.items():
-                if key in ['total_duration', 'total_cost', 'total_kwh']:
-                    # Totals rows
-                    w.writerow(['', '', '',
-                                key,
-                                value['1d'],
-                                value['1w'],
-                                value['1m'],
-                                value['1m_date'],
-                                value['1y']])
-                else:
-                    # Each output rows
-                    each_output = output.filter(Output.unique_id == key).first()
-                    w.writerow([each_output.unique_id,
-                                each_output.unique_id,
-                                str(each_output.name).encode("utf-8"),
-                                'hours_on',
-                                value['1d']['hours_on'],
-                                value['1w']['hours_on'],
-                                value['1m']['hours_on'],
-                                value['1m_date']['hours_on'],
-                                value['1y']['hours_on']])
-                    w.writerow([each_output.unique_id,
-                                each_output.unique_id,
-                                str(each_output.name).encode("utf-8"),
-                                'kwh',
-                                value['1d']['kwh'],
-                                value['1w']['kwh'],
-                                value['1m']['kwh'],
-                                value['1m_date']['kwh'],
-                                value['1y']['kwh']])
-                    w.writerow([each_output.unique_id,
-                                each_output.unique_id,
-                                str(each_output.name).encode("utf-8"),
-                                'cost',
-                                value['1d']['cost'],
-                                value['1w']['cost'],
-                                value['1m']['cost'],
-                                value['1m_date']['cost'],
-                                value['1y']['cost']])
-
-        set_user_grp(report_path_file, 'mycodo', 'mycodo')
-    except Exception:
-        logger.exception("Energy Usage Report Generation ERROR")
+    job.progress(0, 2, "Calculating output usage")
+    assure_path_exists(USAGE_REPORTS_PATH)
+
+    misc = Misc.query.first()
+    output = Output.query.all()
+    dict_outputs = parse_output_information()
+    custom_options_values_output_channels = parse_custom_option_values_channels_json(
+        OutputChannel.query.all(), dict_controller=dict_outputs, key_name='custom_channel_options')
+    output_usage = return_output_usage(
+        dict_outputs, misc, output, OutputChannel, custom_options_values_output_channels)
+
+    job.progress(1, 2, "Writing the report")
+    timestamp = time.strftime("%Y-%m-%d_%H-%M")
+    file_name = 'output_usage_report_{ts}.csv'.format(ts=timestamp)
+    report_path_file = os.path.join(USAGE_REPORTS_PATH, file_name)
+
+    with open(report_path_file, 'w', newline='') as f:
+        w = csv.writer(f)
+        # Header row
+        w.writerow([
+             'Output Unique ID',
+             'Output Channel Unique ID',
+             'Output Name',
+             'Type',
+             'Past Day',
+             'Past Week',
+             'Past Month',
+             'Past Month (from {})'.format(misc.output_usage_dayofmonth),
+             'Past Year'
+        ])
+        for key, value in output_usage.items():
+            if key in ['total_duration', 'total_cost', 'total_kwh']:
+                # Totals rows
+                w.writerow(['', '', '',
+                            key,
+                            value['1d'],
+                            value['1w'],
+                            value['1m'],
+                            value['1m_date'],
+                            value['1y']])
+            else:
+                # Rows of each output channel
+                each_output = [out for out in output if out.unique_id == key][0]
+                for channel_id, channel_usage in value.items():
+                    for each_type in ['hours_on', 'kwh', 'cost']:
+                        w.writerow([each_output.unique_id,
+                                    channel_id,
+                                    each_output.name,
+                                    each_type,
+                                    channel_usage['1d'][each_type],
+                                    channel_usage['1w'][each_type],
+                                    channel_usage['1m'][each_type],
+                                    channel_usage['1m_date'][each_type],
+                                    channel_usage['1y'][each_type]])
+
+    set_user_grp(report_path_file, 'mycodo', 'mycodo')
+    job.progress(2, 2, "Report saved")
+    return {'report': file_name}
@@ -0,0 +1,124 @@
+# coding=utf-8
+#
+#  trigger_dispatch.py - In-memory index of activated Output Triggers
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import logging
+import threading
+from collections import namedtuple
+
+from mycodo.databases.models import OutputChannel
+from mycodo.databases.models import Trigger
+from mycodo.utils.database import db_retrieve_table_daemon
+
+logger = logging.getLogger("mycodo.trigger_dispatch")
+
+OutputTrigger = namedtuple('OutputTrigger', [
+    'unique_id', 'name', 'output_state', 'output_duration', 'output_duty_cycle'])
+
+OUTPUT_TRIGGER_TYPES = ['trigger_output', 'trigger_output_pwm']
+
+
+def on_duration_matches(output_state, output_duration, amount):
+    """ Determine if an 'on' Output Trigger matches the amount the output turned on for """
+    if output_state == 'on_duration_none_any':
+        return True
+    elif output_state == 'on_duration_none':
+        return amount == 0.0
+    elif output_state == 'on_duration_any':
+        return bool(amount)
+    elif amount is None or output_duration is None:
+        return False
+    elif output_state == 'on_duration_equal':
+        return output_duration == amount
+    elif output_state == 'on_duration_greater_than':
+        return amount > output_duration
+    elif output_state == 'on_duration_equal_greater_than':
+        return amount >= output_duration
+    elif output_state == 'on_duration_less_than':
+        return amount < output_duration
+    elif output_state == 'on_duration_equal_less_than':
+        return amount <= output_duration
+    return False
+
+
+class OutputTriggerTable:
+    """
+    Activated Output Triggers indexed by (output ID, channel number), so an
+    output changing state doesn't need to query the database.
+
+    The table is loaded on first use and reloaded after invalidate(), which
+    is called whenever a Trigger is activated, deactivated or its settings are
+    refreshed, and when an Output is added, modified or deleted.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._table = None
+
+    def invalidate(self):
+        with self._lock:
+            self._table = None
+
+    def get(self, output_id, output_channel):
+        """
+        Return the activated Output Triggers of an output channel
+
+        :return: dict of 'on', 'off' and 'pwm': list of OutputTrigger
+        """
+        with self._lock:
+            if self._table is None:
+                self._table = self._load()
+            return self._table.get((output_id, output_channel), {})
+
+    @staticmethod
+    def _load():
+        channels = {
+            each.unique_id: each.channel
+            for each in db_retrieve_table_daemon(OutputChannel, entry='all')
+        }
+        triggers = db_retrieve_table_daemon(Trigger).filter(
+            Trigger.trigger_type.in_(OUTPUT_TRIGGER_TYPES)).filter(
+            Trigger.is_activated.is_(True)).all()
+
+        table = {}
+        for each_trigger in triggers:
+            if each_trigger.unique_id_2 not in channels:
+                continue
+            if each_trigger.trigger_type == 'trigger_output_pwm':
+                state = 'pwm'
+            elif each_trigger.output_state == 'off':
+                state = 'off'
+            elif (each_trigger.output_state or '').startswith('on_duration'):
+                state = 'on'
+            else:
+                continue
+            key = (each_trigger.unique_id_1, channels[each_trigger.unique_id_2])
+            table.setdefault(key, {}).setdefault(state, []).append(OutputTrigger(
+                each_trigger.unique_id,
+                each_trigger.name,
+                each_trigger.output_state,
+                each_trigger.output_duration,
+                each_trigger.output_duty_cycle))
+
+        logger.debug("Loaded {} Output Triggers".format(len(triggers)))
+        return table
+
+
+output_triggers = OutputTriggerTable()
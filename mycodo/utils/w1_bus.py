@@ -0,0 +1,199 @@
+# coding=utf-8
+#
+#  w1_bus.py - Shared temperature conversions of 1-Wire buses
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import logging
+import os
+import threading
+import time
+
+from mycodo.config import PATH_1WIRE
+from mycodo.config import W1_CONVERSION_TIMEOUT
+
+logger = logging.getLogger("mycodo.w1_bus")
+
+# 1-Wire family codes of the temperature sensors
+W1_FAMILY = {
+    'DS18S20': '10',
+    'DS1822': '22',
+    'DS18B20': '28',
+    'DS1825': '3b',
+    'MAX31850K': '3b'
+}
+
+
+def read_file(path):
+    with open(path) as file_read:
+        return file_read.read().strip()
+
+
+def parse_w1_slave(text):
+    """ Parse the temperature (Celsius) from the contents of a w1_slave file """
+    lines = text.splitlines()
+    if len(lines) < 2 or not lines[0].endswith('YES'):
+        raise ValueError("CRC check failed: {}".format(text))
+    position = lines[1].find('t=')
+    if position == -1:
+        raise ValueError("No temperature found: {}".format(text))
+    return int(lines[1][position + 2:]) / 1000.0
+
+
+class W1Bus:
+    """
+    The temperature sensors of one 1-Wire bus master. A conversion is started on
+    all sensors at once by writing to the bus master's therm_bulk_read (Linux
+    5.10+), then each sensor's temperature is read without a conversion of its
+    own. The readings of the last conversion are served to all Inputs of the
+    bus. Without therm_bulk_read (or if it fails), each sensor is converted
+    when it's read, which takes up to 750 ms, holding only the lock of that
+    sensor so the Inputs of the other sensors of the bus aren't kept waiting.
+    """
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.lock = threading.Lock()
+        self.sensors = set()
+        self.readings = {}
+        self.read_times = {}
+        self.sensor_locks = {}
+        self.conversions = 0
+        self.bulk_read = None
+        if name:
+            bulk_read = os.path.join(path, name, 'therm_bulk_read')
+            if os.path.exists(bulk_read):
+                self.bulk_read = bulk_read
+
+    def read(self, sensor, max_age):
+        """
+        Return the temperature of sensor (e.g. '28-0316a2797e8f') from a conversion
+        no older than max_age seconds, converting all sensors of the bus if needed.
+        A failed reading is never reused.
+        """
+        with self.lock:
+            self.sensors.add(sensor)
+            sensor_lock = self.sensor_locks.setdefault(sensor, threading.Lock())
+            if self.bulk_read and self._stale(sensor, max_age) and self._convert_bulk():
+                return self._reading(sensor)
+
+        with sensor_lock:
+            if self._stale(sensor, max_age):
+                reading = self._read_sensor(sensor, False)
+                with self.lock:
+                    self.readings[sensor] = reading
+                    self.read_times[sensor] = time.monotonic()
+                    self.conversions += 1
+            return self._reading(sensor)
+
+    def _stale(self, sensor, max_age):
+        return (isinstance(self.readings.get(sensor, KeyError()), Exception) or
+                time.monotonic() - self.read_times[sensor] > max_age)
+
+    def _reading(self, sensor):
+        reading = self.readings[sensor]
+        if isinstance(reading, Exception):
+            raise reading
+        return reading
+
+    def _convert_bulk(self):
+        """ Convert all sensors of the bus at once, returning whether it succeeded """
+        try:
+            with open(self.bulk_read, 'w') as file_write:
+                file_write.write('trigger')
+            self._wait_conversion()
+        except Exception:
+            logger.exception("Bulk conversion of {} failed, converting sensors in turn".format(
+                self.name))
+            return False
+        read_time = time.monotonic()
+        for each in self.sensors:
+            self.readings[each] = self._read_sensor(each, True)
+            self.read_times[each] = read_time
+        self.conversions += 1
+        return True
+
+    def _wait_conversion(self):
+        """ therm_bulk_read is -1 while at least one sensor is converting """
+        timeout = time.monotonic() + W1_CONVERSION_TIMEOUT
+        while read_file(self.bulk_read) == '-1':
+            if time.monotonic() > timeout:
+                raise TimeoutError("Conversion didn't complete within {} seconds".format(
+                    W1_CONVERSION_TIMEOUT))
+            time.sleep(0.05)
+
+    def _read_sensor(self, sensor, bulk):
+        try:
+            path_temperature = os.path.join(self.path, sensor, 'temperature')
+            if bulk or os.path.exists(path_temperature):
+                return int(read_file(path_temperature)) / 1000.0
+            return parse_w1_slave(read_file(os.path.join(self.path, sensor, 'w1_slave')))
+        except Exception as err:
+            logger.debug("Could not read {}: {}".format(sensor, err))
+            return err
+
+
+class W1BusManager:
+    """ The 1-Wire buses with temperature sensors used by Inputs """
+    def __init__(self, path=PATH_1WIRE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._buses = {}
+        self._sensor_bus = {}
+
+    def bus_name(self, sensor):
+        """ The bus master of a sensor, from where its sysfs entry links to """
+        real_path = os.path.realpath(os.path.join(self.path, sensor))
+        name = os.path.basename(os.path.dirname(real_path))
+        if name.startswith('w1_bus_master'):
+            return name
+
+    def bus(self, sensor):
+        with self._lock:
+            if sensor not in self._sensor_bus:
+                name = self.bus_name(sensor)
+                if name not in self._buses:
+                    self._buses[name] = W1Bus(self.path, name)
+                self._sensor_bus[sensor] = self._buses[name]
+            return self._sensor_bus[sensor]
+
+    def read(self, sensor_type, location, max_age=0.0):
+        """
+        Return the temperature (Celsius) of a 1-Wire sensor
+
+        :param sensor_type: key of W1_FAMILY (e.g. 'DS18B20')
+        :param location: sensor ID without the family code
+        :param max_age: seconds a reading from another Input's conversion may be reused
+        """
+        sensor = '{}-{}'.format(W1_FAMILY[sensor_type], location)
+        return self.bus(sensor).read(sensor, max_age)
+
+    def status(self):
+        """ Return the sensors and conversions of each bus """
+        with self._lock:
+            return {
+                name: {
+                    'bulk_read': bool(bus.bulk_read),
+                    'sensors': sorted(bus.sensors),
+                    'conversions': bus.conversions
+                } for name, bus in self._buses.items()
+            }
+
+
+w1_buses = W1BusManager()
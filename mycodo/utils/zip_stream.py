@@ -0,0 +1,96 @@
+# coding=utf-8
+#
+#  zip_stream.py - Create zip archives while they're being sent
+#
+#  Copyright (C) 2015-2020 Kyle T. Gabriel <mycodo@kylegabriel.com>
+#
+#  This file is part of Mycodo
+#
+#  Mycodo is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Mycodo is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Contact at kylegabriel.com
+import io
+import os
+import zipfile
+
+# Bytes read from each file at a time
+ZIP_STREAM_CHUNK_SIZE = 65536
+
+
+class _ZipBuffer(io.RawIOBase):
+    """ Unseekable file the zip is written to, emptied as it's sent """
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def directory_files(directory, prefix=''):
+    """ (path, name in archive) of every file in a directory """
+    files = []
+    for root, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            path = os.path.join(root, filename)
+            files.append((path, os.path.join(prefix, os.path.relpath(path, directory))))
+    return sorted(files, key=lambda each_file: each_file[1])
+
+
+def file_chunks(path):
+    """ Read a file a chunk at a time """
+    with open(path, 'rb') as each_file:
+        while True:
+            data = each_file.read(ZIP_STREAM_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+
+def zip_stream(files, compression=zipfile.ZIP_DEFLATED):
+    """
+    Generate the bytes of a zip archive of files, given as (path, name in
+    archive), reading each file a chunk at a time.
+    """
+    return zip_stream_entries(
+        ((zipfile.ZipInfo.from_file(path, name), file_chunks(path)) for path, name in files),
+        compression=compression)
+
+
+def zip_stream_entries(entries, compression=zipfile.ZIP_DEFLATED):
+    """
+    Generate the bytes of a zip archive of entries, given as (ZipInfo,
+    iterable of the bytes of the entry). Only about one chunk of the archive
+    is held in memory, so archives of any size may be sent with a streamed
+    response or written to disk.
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=compression) as archive:
+        for info, chunks in entries:
+            info.compress_type = compression
+            with archive.open(info, mode='w', force_zip64=True) as entry:
+                for data in chunks:
+                    entry.write(data)
+                    yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
@@ -38,6 +38,7 @@ from mycodo.databases.models import NoteTags
 from mycodo.databases.models import Output
 from mycodo.databases.models import PID
 from mycodo.mycodo_flask.utils.utils_general import use_unit_generate
+from mycodo.mycodo_flask.utils.utils_measurement import measurement_resolver
 from mycodo.utils.system_pi import add_custom_measurements
 from mycodo.utils.system_pi import return_measurement_info
 
@@ -451,14 +452,17 @@ WIDGET_INFORMATION = {
                        unique_id,
                        measure_type,
                        measurement_id,
-                       past_seconds) {
+                       past_seconds,
+                       max_points) {
     const epoch_mil = new Date().getTime();
-    const url = '/past/' + unique_id + '/' + measure_type + '/' + measurement_id + '/' + past_seconds;
+    let url = '/past/' + unique_id + '/' + measure_type + '/' + measurement_id + '/' + past_seconds;
+    // Only request as many points as the graph is pixels wide
+    if (measure_type !== 'tag' && max_points) url += '?points=' + Math.round(max_points);
     const update_id = chart_number + "-" + series + "-" + unique_id + "-" + measure_type + '-' + measurement_id;
 
-    $.getJSON(url,
-      function(data, responseText, jqXHR) {
-        if (jqXHR.status !== 204) {
+    getSeriesData(url,
+      function(data) {
+        if (data !== null) {
           let new_time;
           let past_data = [];
 
@@ -521,9 +525,9 @@ WIDGET_INFORMATION = {
       url = '/past/' + unique_id + '/' + measure_type + '/' + measurement_id + '/' + refresh_seconds;
     }
 
-    $.getJSON(url,
-      function(data, responseText, jqXHR) {
-        if (jqXHR.status !== 204) {
+    getSeriesData(url,
+      function(data) {
+        if (data !== null) {
 
           let time_point;
           let graph_shift = false;
@@ -623,7 +627,7 @@ WIDGET_INFORMATION = {
             {%- set all_input = table_input.query.filter(table_input.unique_id == input_id).all() -%}
             {%- if all_input -%}
               {% for each_input in all_input %}
-          getPastDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_input.unique_id}}', 'input', '{{measurement_id}}', {{widget_options['x_axis_minutes']*60}});
+          getPastDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_input.unique_id}}', 'input', '{{measurement_id}}', {{widget_options['x_axis_minutes']*60}}, this.plotWidth);
                 {% if widget_options['enable_auto_refresh'] -%}
           getLiveDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_input.unique_id}}', 'input', '{{measurement_id}}', {{widget_options['x_axis_minutes']}}, {{widget_options['enable_xaxis_reset']|int}}, {{widget_options['refresh_seconds']}});
                 {%- endif -%}
@@ -638,7 +642,7 @@ WIDGET_INFORMATION = {
             {%- set all_math = table_math.query.filter(table_math.unique_id == math_id).all() -%}
             {%- if all_math -%}
               {% for each_math in all_math %}
-          getPastDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_math.unique_id}}', 'math', '{{measurement_id}}', {{widget_options['x_axis_minutes']*60}});
+          getPastDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_math.unique_id}}', 'math', '{{measurement_id}}', {{widget_options['x_axis_minutes']*60}}, this.plotWidth);
                 {% if widget_options['enable_auto_refresh'] %}
           getLiveDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_math.unique_id}}', 'math', '{{measurement_id}}', {{widget_options['x_axis_minutes']}}, {{widget_options['enable_xaxis_reset']|int}}, {{widget_options['refresh_seconds']}});
                 {% endif %}
@@ -653,7 +657,7 @@ WIDGET_INFORMATION = {
             {%- set all_output = table_output.query.filter(table_output.unique_id == output_id).all() -%}
             {%- if all_output -%}
               {% for each_output in all_output %}
-          getPastDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_output.unique_id}}', 'output', '{{measurement_id}}', {{widget_options['x_axis_minutes']*60}});
+          getPastDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_output.unique_id}}', 'output', '{{measurement_id}}', {{widget_options['x_axis_minutes']*60}}, this.plotWidth);
                 {% if widget_options['enable_auto_refresh'] -%}
           getLiveDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_output.unique_id}}', 'output', '{{measurement_id}}', {{widget_options['x_axis_minutes']}}, {{widget_options['enable_xaxis_reset']|int}}, {{widget_options['refresh_seconds']}});
                 {%- endif -%}
@@ -665,7 +669,7 @@ WIDGET_INFORMATION = {
           {%- for each_pid in pid -%}
             {%- for pid_and_measurement_id in graph_pid_ids if each_pid.unique_id == pid_and_measurement_id.split(',')[0] %}
               {%- set measurement_id = pid_and_measurement_id.split(',')[1] -%}
-          getPastDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_pid.unique_id}}', 'pid', '{{measurement_id}}', {{widget_options['x_axis_minutes']*60}});
+          getPastDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_pid.unique_id}}', 'pid', '{{measurement_id}}', {{widget_options['x_axis_minutes']*60}}, this.plotWidth);
           {% if widget_options['enable_auto_refresh'] %}
           getLiveDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_pid.unique_id}}', 'pid', '{{measurement_id}}', {{widget_options['x_axis_minutes']}}, {{widget_options['enable_xaxis_reset']|int}}, {{widget_options['refresh_seconds']}});
           {% endif %}
@@ -676,7 +680,7 @@ WIDGET_INFORMATION = {
           {%- for each_tag in tags -%}
             {%- for tag_and_measurement_id in graph_note_tag_ids if each_tag.unique_id == tag_and_measurement_id.split(',')[0] %}
               {%- set measurement_id = tag_and_measurement_id.split(',')[1] -%}
-          getPastDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_tag.unique_id}}', 'tag', '{{measurement_id}}', {{widget_options['x_axis_minutes']*60}});
+          getPastDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_tag.unique_id}}', 'tag', '{{measurement_id}}', {{widget_options['x_axis_minutes']*60}}, this.plotWidth);
           {% if widget_options['enable_auto_refresh'] %}
           getLiveDataSynchronousGraph({{chart_number}}, {{count_series|count}}, '{{each_tag.unique_id}}', 'tag', '{{measurement_id}}', {{widget_options['x_axis_minutes']}}, {{widget_options['enable_xaxis_reset']|int}}, {{widget_options['refresh_seconds']}});
           {% endif %}
@@ -1574,7 +1578,6 @@ def check_func(all_devices,
                y_axes,
                measurement,
                dict_measurements,
-               device_measurements,
                input_dev,
                output,
                math,
@@ -1586,7 +1589,6 @@ def check_func(all_devices,
     :param y_axes: empty list to populate
     :param measurement:
     :param dict_measurements:
-    :param device_measurements:
     :param input_dev:
     :param output:
     :param math:
@@ -1599,7 +1601,7 @@ def check_func(all_devices,
         # If the ID saved to the dashboard element matches the table entry ID
         if each_device.unique_id == unique_id:
 
-            use_unit = use_unit_generate(device_measurements, input_dev, output, math)
+            use_unit = use_unit_generate(input_dev, output, math)
 
             # Add duration
             if measurement == 'duration_time':
@@ -1658,7 +1660,6 @@ def graph_y_axes(dict_measurements, widget_options):
     """ Determine which y-axes to use for each Graph """
     y_axes = []
 
-    device_measurements = DeviceMeasurements.query.all()
     input_dev = Input.query.all()
     math = Math.query.all()
     output = Output.query.all()
@@ -1688,30 +1689,13 @@ def graph_y_axes(dict_measurements, widget_options):
 
                 measure_id = each_id_measure.split(',')[1]
 
-                for each_measurement in device_measurements:
-                    if each_measurement.unique_id == measure_id:
-
-                        unit = None
-                        if each_measurement.measurement_type == 'setpoint':
-                            setpoint_pid = PID.query.filter(PID.unique_id == each_measurement.device_id).first()
-                            if setpoint_pid and ',' in setpoint_pid.measurement:
-                                pid_measurement = setpoint_pid.measurement.split(',')[1]
-                                setpoint_measurement = DeviceMeasurements.query.filter(
-                                    DeviceMeasurements.unique_id == pid_measurement).first()
-                                if setpoint_measurement:
-                                    conversion = Conversion.query.filter(
-                                        Conversion.unique_id == setpoint_measurement.conversion_id).first()
-                                    _, unit, measurement = return_measurement_info(setpoint_measurement, conversion)
-                        else:
-                            conversion = Conversion.query.filter(
-                                Conversion.unique_id == each_measurement.conversion_id).first()
-                            _, unit, _ = return_measurement_info(each_measurement, conversion)
-
-                        if unit:
-                            if not y_axes:
-                                y_axes = [unit]
-                            elif y_axes and unit not in y_axes:
-                                y_axes.append(unit)
+                each_measurement = measurement_resolver.get(measure_id)
+                if each_measurement and each_measurement.unit:
+                    unit = each_measurement.unit
+                    if not y_axes:
+                        y_axes = [unit]
+                    elif y_axes and unit not in y_axes:
+                        y_axes.append(unit)
 
             elif len(each_id_measure.split(',')) == 4:
 
@@ -1733,7 +1717,6 @@ def graph_y_axes(dict_measurements, widget_options):
                     y_axes,
                     measurement,
                     dict_measurements,
-                    device_measurements,
                     input_dev,
                     output,
                     math)
@@ -1750,7 +1733,6 @@ def graph_y_axes(dict_measurements, widget_options):
                     y_axes,
                     measurement,
                     dict_measurements,
-                    device_measurements,
                     input_dev,
                     output,
                     math,